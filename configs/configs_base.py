@@ -28,6 +28,9 @@ basic_configs = {
     "eval_interval": RequiredValue(int),
     "log_interval": RequiredValue(int),
     "checkpoint_interval": -1,
+    # Each rank writes a shard of the optimizer state, the checkpoint keeps the full
+    # optimizer state if a shard is not written or not visible to rank 0
+    "shard_optimizer_checkpoint": True,
     "eval_first": False,  # run evaluate() before training steps
     "iters_to_accumulate": 1,
     "eval_only": False,
@@ -46,6 +49,27 @@ basic_configs = {
     "ema_decay": -1.0,
     "eval_ema_only": False,  # whether wandb only tracking ema checkpoint metrics
     "ema_mutable_param_keywords": [""],
+    # Per-phase and per-submodule time and memory of training steps, logged with the train metrics
+    "profiler": {
+        "enable": False,
+        # Qualified names of submodules, or class names to aggregate all their instances
+        "module_names": ListValue(
+            [
+                "input_embedder",
+                "template_embedder",
+                "msa_module",
+                "pairformer_stack",
+                "diffusion_module",
+                "distogram_head",
+                "confidence_head",
+                "TriangleMultiplicationOutgoing",
+                "TriangleMultiplicationIncoming",
+                "TriangleAttention",
+            ]
+        ),
+        # Number of steps to record a torch.profiler trace of, 0 to disable
+        "trace_steps": 0,
+    },
 }
 data_configs = {
     # Data
@@ -255,6 +279,8 @@ perm_configs = {
             "accept_it_as_it_is": False,
             "enumerate_all_anchor_pairs": False,
             "selection_metric": "aligned_rmsd",
+            "batched_match": True,
+            "match_algorithm": "greedy",  # or "hungarian", only with batched_match
         },
     },
     "atom_permutation": {
@@ -276,6 +302,10 @@ loss_configs = {
         "diffusion_chunk_size_outer": ValueMaybeNone(-1),
         "diffusion_sparse_loss_enable": GlobalConfigValue("loss_metrics_sparse_enable"),
         "diffusion_lddt_loss_dense": True,  # only set true in initial training for training speed
+        "diffusion_pair_loss_fused": True,  # sparse smooth lddt/bond loss of all samples at once, without chunks
+        # Host memory (GB) for the lddt pairs of evaluated structures, reused between
+        # evaluations if loss_metrics_sparse_enable, 0 to disable
+        "lddt_pair_cache_gb": 4.0,
         "resolution": {"min": 0.1, "max": 4.0},
         "weight": {
             "alpha_confidence": 1e-4,
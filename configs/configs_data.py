@@ -61,6 +61,8 @@ default_weighted_pdb_configs = {
 }
 
 DATA_ROOT_DIR = os.environ.get("PROTENIX_DATA_ROOT_DIR", "/af3-dev/release_data/")
+# Results of online MSA searching are cached here by the hash of the query if set.
+MSA_SEARCH_CACHE_DIR = os.environ.get("PROTENIX_MSA_SEARCH_CACHE_DIR", "")
 
 # Use CCD cache created by scripts/gen_ccd_cache.py priority. (without date in filename)
 # See: docs/prepare_data.md
@@ -117,12 +119,30 @@ data_configs = {
     "epoch_size": 10000,
     "train_ref_pos_augment": True,
     "test_ref_pos_augment": True,
+    # Directory to cache the indices lists after filtering by pdb_list, max_n_token and exclusion, "" to disable
+    "indices_cache_dir": "",
+    # Directory to cache the processed test samples, "" to disable. The samples of the first
+    # evaluation pass are reused, including its ref_pos augmentation if test_ref_pos_augment.
+    # Samples are kept under a hash of the data configs and the code version they depend on
+    "eval_feature_cache_dir": "",
     "train_sets": ListValue(["weightedPDB_before2109_wopb_nometalc_0925"]),
     "train_sampler": {
         "train_sample_weights": ListValue([1.0]),
         "sampler_type": "weighted",
+        # Put samples of similar cost (num_tokens ** token_cost_exponent) into the same step
+        # across ranks, regrouping within windows of token_balance_window_size steps
+        "token_balanced": False,
+        "token_balance_window_size": 32,
+        "token_cost_exponent": 3.0,
     },
     "test_sets": ListValue(["recentPDB_1536_sample384_0925"]),
+    "test_sampler": {
+        # Cost of balancing test samples across ranks: "num_tokens_sq", "num_tokens_sq_msa" or "timing"
+        "cost_model": "num_tokens_sq",
+        # Directory of the "{test_name}.json" sample costs dumped by a previous evaluation,
+        # for the "num_tokens_sq_msa" and "timing" cost models
+        "cost_dir": "",
+    },
     "weightedPDB_before2109_wopb_nometalc_0925": {
         "base_info": {
             "mmcif_dir": os.path.join(DATA_ROOT_DIR, "mmcif"),
@@ -213,4 +233,5 @@ data_configs = {
     },
     "ccd_components_file": CCD_COMPONENTS_FILE_PATH,
     "ccd_components_rdkit_mol_file": CCD_COMPONENTS_RDKIT_MOL_FILE_PATH,
+    "msa_search_cache_dir": MSA_SEARCH_CACHE_DIR,
 }
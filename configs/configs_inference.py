@@ -27,10 +27,18 @@ inference_configs = {
     "dump_dir": "./output",
     "need_atom_confidence": False,
     "sorted_by_ranking_score": True,
+    # Only dump the top k samples by ranking score as CIF/JSON, -1 for all samples.
+    # The files are named by rank if sorted_by_ranking_score, else by sample index
+    "top_k_samples": -1,
+    # Save the coordinates and tensor summary confidence scores of the samples
+    # outside the top k into a compressed NPZ file, sorted by ranking score
+    "save_remaining_npz": False,
     "input_json_path": RequiredValue(str),
     "load_checkpoint_path": os.path.join(
         code_directory, "./release_data/checkpoint/model_v0.2.0.pt"
     ),
     "num_workers": 16,
     "use_msa": True,
+    # Featurize the shared receptor once for jobs that only differ in their last ligand entity
+    "use_receptor_template": False,
 }
@@ -0,0 +1,347 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A columnar bioassembly store.
+
+The bioassembly dicts of a dataset are written to a few shard files. Each entry is a
+pickled header followed by the raw bytes of the columns: the per-atom annotations,
+coordinates and bond list of the AtomArray and the CSR columns of the TokenArray.
+Other items of the dict are kept in the header. "index.json" maps each pdb_id to its
+entry. Entries are read as copy-on-write memory-mapped views, so only the pages that
+are touched are read from disk, and the page cache is shared by all data-loader workers.
+
+Layout of a store directory:
+    index.json: {pdb_id: [shard_name, entry_offset, header_nbytes]}
+    shard_<uuid>.bin: concatenated entries
+"""
+
+import json
+import os
+import pickle
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+import numpy as np
+from biotite.structure import AtomArray, BondList
+
+from protenix.data.tokenizer import TokenArray
+
+INDEX_FNAME = "index.json"
+# Column offsets are aligned to this number of bytes
+ALIGNMENT = 64
+
+
+def _as_column(array: np.ndarray) -> np.ndarray:
+    array = np.ascontiguousarray(array)
+    if array.dtype == object:
+        # Variable-length strings are stored as fixed-width unicode
+        array = array.astype(str)
+    return array
+
+
+class ShardWriter(object):
+    """
+    Append entries of a pickled header and aligned array columns to shard files.
+    Each writer owns its shard files, so one writer per process can be used to
+    write a store in parallel.
+    """
+
+    def __init__(
+        self, store_dir: Union[str, Path], max_shard_bytes: int = 1 << 32
+    ) -> None:
+        """
+        Args:
+            store_dir (Union[str, Path]): directory of the store.
+            max_shard_bytes (int): a new shard is started when the current one exceeds this size.
+        """
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.max_shard_bytes = max_shard_bytes
+        self._file = None
+        self._shard_name = None
+
+    def _open_shard(self) -> None:
+        self.close()
+        self._shard_name = f"shard_{uuid.uuid4().hex}.bin"
+        self._file = open(self.store_dir / self._shard_name, "wb")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def write_entry(self, header: dict, columns: list[np.ndarray]) -> list:
+        """
+        Append an entry to the current shard.
+
+        Args:
+            header (dict): the header, in which columns are referred to by their indices.
+            columns (list[np.ndarray]): the columns.
+
+        Returns:
+            list: the index entry [shard_name, entry_offset, header_nbytes].
+        """
+        if self._file is None or self._file.tell() > self.max_shard_bytes:
+            self._open_shard()
+
+        layout = []
+        column_offset = 0
+        for array in columns:
+            column_offset = -(-column_offset // ALIGNMENT) * ALIGNMENT
+            layout.append((column_offset, array.dtype.str, array.shape))
+            column_offset += array.nbytes
+        header["columns"] = layout
+        header_bytes = pickle.dumps(header)
+        # Keep the columns aligned in the shard
+        header_bytes += b"\0" * (-len(header_bytes) % ALIGNMENT)
+
+        entry_offset = self._file.tell()
+        assert entry_offset % ALIGNMENT == 0
+        self._file.write(header_bytes)
+        data_offset = self._file.tell()
+        for (offset, _dtype, _shape), array in zip(layout, columns):
+            self._file.write(b"\0" * (data_offset + offset - self._file.tell()))
+            self._file.write(array.tobytes())
+        self._file.write(b"\0" * (-self._file.tell() % ALIGNMENT))
+        self._file.flush()
+        return [self._shard_name, entry_offset, len(header_bytes)]
+
+
+class BioassemblyStoreWriter(ShardWriter):
+    """
+    Append bioassembly dicts to a shard file of a store.
+    The index entries returned by `add` are collected and written with `write_index`.
+    """
+
+    @staticmethod
+    def encode(bioassembly_dict: dict[str, Any]) -> tuple[dict, list[np.ndarray]]:
+        """
+        Split a bioassembly dict into a header and the columns to be stored.
+
+        Args:
+            bioassembly_dict (dict[str, Any]): the bioassembly dict with atom_array and token_array.
+
+        Returns:
+            tuple[dict, list[np.ndarray]]: the header, in which each column is referred to by
+                its index in the list of columns, and the list of columns.
+        """
+        columns = []
+
+        def add_column(array: np.ndarray) -> int:
+            columns.append(_as_column(array))
+            return len(columns) - 1
+
+        header = {
+            "meta": {
+                k: v
+                for k, v in bioassembly_dict.items()
+                if k not in ["atom_array", "token_array"]
+            }
+        }
+        atom_array = bioassembly_dict.get("atom_array", None)
+        if atom_array is not None:
+            header["atom_array"] = {
+                "length": len(atom_array),
+                "coord": add_column(atom_array.coord),
+                "annotations": {
+                    category: add_column(atom_array.get_annotation(category))
+                    for category in atom_array.get_annotation_categories()
+                },
+                "bonds": (
+                    add_column(atom_array.bonds.as_array())
+                    if atom_array.bonds is not None
+                    else None
+                ),
+                "box": atom_array.box,
+            }
+        token_array = bioassembly_dict.get("token_array", None)
+        if token_array is not None:
+            header["token_array"] = {
+                "values": add_column(token_array.get_values()),
+                "atom_offsets": add_column(token_array.atom_offsets),
+                "ragged_annotations": {
+                    category: add_column(token_array.get_flat_annotation(category))
+                    for category in token_array._ragged_annot
+                },
+                "annotations": {
+                    category: add_column(token_array.get_annotation(category))
+                    for category in token_array._annot
+                },
+            }
+        return header, columns
+
+    def add(self, bioassembly_dict: dict[str, Any]) -> tuple[str, list]:
+        """
+        Append a bioassembly dict to the current shard.
+
+        Args:
+            bioassembly_dict (dict[str, Any]): the bioassembly dict with "pdb_id".
+
+        Returns:
+            tuple[str, list]: pdb_id and its index entry [shard_name, entry_offset, header_nbytes].
+        """
+        header, columns = self.encode(bioassembly_dict)
+        return bioassembly_dict["pdb_id"], self.write_entry(header, columns)
+
+    @staticmethod
+    def write_index(
+        store_dir: Union[str, Path], index_entries: dict[str, list]
+    ) -> None:
+        """
+        Merge index entries into the index of a store.
+
+        Args:
+            store_dir (Union[str, Path]): directory of the store.
+            index_entries (dict[str, list]): pdb_id to index entry returned by `add`.
+        """
+        index_fpath = Path(store_dir) / INDEX_FNAME
+        index = {}
+        if index_fpath.exists():
+            with open(index_fpath, "r") as f:
+                index = json.load(f)
+        index.update(index_entries)
+        tmp_index_fpath = index_fpath.with_suffix(f".{uuid.uuid4().hex}")
+        with open(tmp_index_fpath, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_index_fpath, index_fpath)
+
+
+class ShardReader(object):
+    """
+    Read entries written by ShardWriter as views of the memory-mapped shards.
+    Each entry is mapped copy-on-write when it is read, so in-place modification of
+    its arrays is private to the returned entry.
+    """
+
+    def __init__(self, store_dir: Union[str, Path]) -> None:
+        """
+        Args:
+            store_dir (Union[str, Path]): directory of the store.
+        """
+        self.store_dir = Path(store_dir)
+
+    def read_entry(
+        self, shard_name: str, entry_offset: int, header_nbytes: int
+    ) -> tuple[dict, Callable[[int], np.ndarray]]:
+        """
+        Read the header of an entry and map its columns.
+
+        Args:
+            shard_name (str): the shard of the entry.
+            entry_offset (int): the offset of the entry in the shard.
+            header_nbytes (int): the size of the header.
+
+        Returns:
+            tuple[dict, Callable[[int], np.ndarray]]: the header, and a function getting
+                a column by its index as a view of the shard.
+        """
+        fpath = self.store_dir / shard_name
+        with open(fpath, "rb") as f:
+            f.seek(entry_offset)
+            header = pickle.loads(f.read(header_nbytes))
+        data_nbytes = max(
+            [
+                offset + np.dtype(dtype).itemsize * int(np.prod(shape))
+                for offset, dtype, shape in header["columns"]
+            ],
+            default=0,
+        )
+        if data_nbytes > 0:
+            data = np.memmap(
+                fpath,
+                dtype=np.uint8,
+                mode="c",
+                offset=entry_offset + header_nbytes,
+                shape=(data_nbytes,),
+            )
+        else:
+            data = np.empty(0, dtype=np.uint8)
+
+        def get_column(column_idx: int) -> np.ndarray:
+            offset, dtype, shape = header["columns"][column_idx]
+            return np.ndarray(shape, dtype=np.dtype(dtype), buffer=data, offset=offset)
+
+        return header, get_column
+
+
+class BioassemblyStore(ShardReader):
+    """
+    Read bioassembly dicts from a store written by BioassemblyStoreWriter.
+    """
+
+    def __init__(self, store_dir: Union[str, Path]) -> None:
+        """
+        Args:
+            store_dir (Union[str, Path]): directory of the store.
+        """
+        super().__init__(store_dir)
+        with open(self.store_dir / INDEX_FNAME, "r") as f:
+            self.index = json.load(f)
+
+    @staticmethod
+    def is_store(store_dir: Optional[Union[str, Path]]) -> bool:
+        """Whether a directory is a bioassembly store."""
+        return store_dir is not None and (Path(store_dir) / INDEX_FNAME).exists()
+
+    def __contains__(self, pdb_id: str) -> bool:
+        return pdb_id in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get(self, pdb_id: str) -> dict[str, Any]:
+        """
+        Get a bioassembly dict whose arrays are views of the memory-mapped shard.
+
+        Args:
+            pdb_id (str): the PDB ID.
+
+        Returns:
+            dict[str, Any]: the bioassembly dict with atom_array and token_array.
+        """
+        assert pdb_id in self.index, f"{pdb_id} not in {self.store_dir}"
+        header, get_column = self.read_entry(*self.index[pdb_id])
+        bioassembly_dict = dict(header["meta"])
+        if (atom_info := header.get("atom_array")) is not None:
+            atom_array = AtomArray(atom_info["length"])
+            atom_array.coord = get_column(atom_info["coord"])
+            for category, column_idx in atom_info["annotations"].items():
+                if category in atom_array.get_annotation_categories():
+                    # Replace the default annotation, not to copy to its dtype
+                    atom_array.del_annotation(category)
+                atom_array.set_annotation(category, get_column(column_idx))
+            if atom_info["bonds"] is not None:
+                atom_array.bonds = BondList(
+                    atom_info["length"], get_column(atom_info["bonds"])
+                )
+            atom_array.box = atom_info["box"]
+            bioassembly_dict["atom_array"] = atom_array
+
+        if (token_info := header.get("token_array")) is not None:
+            ragged_annotations = {
+                category: get_column(column_idx)
+                for category, column_idx in token_info["ragged_annotations"].items()
+            }
+            bioassembly_dict["token_array"] = TokenArray.from_arrays(
+                values=get_column(token_info["values"]),
+                atom_offsets=get_column(token_info["atom_offsets"]),
+                **ragged_annotations,
+                **{
+                    category: get_column(column_idx)
+                    for category, column_idx in token_info["annotations"].items()
+                },
+            )
+        return bioassembly_dict
@@ -83,6 +83,11 @@ class DataPipeline(object):
 
             tokenizer = AtomArrayTokenizer(atom_array)
             token_array = tokenizer.get_token_array()
+            # Precomputed for spatial interface cropping
+            atom_array = CropData.add_interface_token_annotation(
+                token_array=token_array, atom_array=atom_array
+            )
+            bioassembly_dict["atom_array"] = atom_array
             bioassembly_dict["msa_features"] = None
             bioassembly_dict["template_features"] = None
 
@@ -12,15 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import heapq
+import json
 import math
+import os
 from typing import Iterator, Optional, Sequence
 
+import numpy as np
 import torch
 import torch.distributed as dist
 from ml_collections.config_dict import ConfigDict
 from torch.utils.data import DataLoader, DistributedSampler, Sampler
 
-from protenix.data.dataset import Dataset, get_datasets
+from protenix.data.dataset import (
+    Dataset,
+    GroupedIndices,
+    WeightedMultiDataset,
+    get_datasets,
+)
 from protenix.utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -138,7 +147,166 @@ class DistributedWeightedSampler(DistributedSampler):
         self.epoch = epoch
 
 
+class TokenBalancedDistributedSampler(DistributedWeightedSampler):
+    """
+    A distributed weighted sampler balancing the cost of each step across ranks.
+    Samples are drawn the same way as DistributedWeightedSampler. Within a window of
+    steps, samples of similar cost are put into the same step, so ranks wait less for
+    the slowest one at each all-reduce.
+    """
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        weights: Sequence[float],
+        num_samples: int,
+        num_tokens: Sequence[int],
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        replacement: bool = True,
+        seed: int = 0,
+        window_size: int = 32,
+        cost_exponent: float = 3.0,
+    ):
+        """
+        Args:
+            dataset (Dataset): The dataset to be loaded.
+            weights (list): The weights associated with the dataset.
+            num_samples (int): The total number of samples to be drawn.
+            num_tokens (list): The number of tokens of each sample after cropping.
+            num_replicas (int, optional): The number of replicas to use for distributed sampling. Defaults to None.
+            rank (int, optional): The rank of the current process in a distributed environment. Defaults to None.
+            replacement (bool, optional): Whether to sample with replacement. Defaults to True.
+            seed (int, optional): The random seed for reproducibility. Defaults to 0.
+            window_size (int, optional): The number of steps whose samples are regrouped. Defaults to 32.
+            cost_exponent (float, optional): The cost of a sample is num_tokens ** cost_exponent. Defaults to 3.0,
+                as the triangular updates of the pair representation are cubic in the number of tokens.
+        """
+        super().__init__(
+            dataset,
+            weights,
+            num_samples,
+            num_replicas=num_replicas,
+            rank=rank,
+            replacement=replacement,
+            seed=seed,
+        )
+        assert len(num_tokens) == len(self.weights)
+        self.costs = torch.as_tensor(num_tokens, dtype=torch.double) ** cost_exponent
+        self.window_size = window_size
+        self.imbalance_stats = {}
+
+    def get_imbalance_stats(self, step_costs: torch.Tensor) -> dict[str, float]:
+        """
+        Get the load imbalance of the ranks.
+
+        Args:
+            step_costs (torch.Tensor): The cost of each rank at each step. Shape: [N_step, N_rank]
+
+        Returns:
+            dict[str, float]: The mean over steps of the max/mean cost ratio across ranks,
+                the fraction of rank time spent waiting at the all-reduce, and the max/mean
+                ratio of the total cost of ranks.
+        """
+        step_max = step_costs.max(dim=-1).values
+        rank_costs = step_costs.sum(dim=0)
+        return {
+            "step_imbalance": (step_max / step_costs.mean(dim=-1)).mean().item(),
+            "idle_fraction": 1
+            - (step_costs.sum() / (step_max.sum() * len(rank_costs))).item(),
+            "rank_imbalance": (rank_costs.max() / rank_costs.mean()).item(),
+        }
+
+    def balance(
+        self, indices: torch.Tensor, generator: torch.Generator
+    ) -> torch.Tensor:
+        """
+        Regroup the sampled indices into steps of similar cost.
+
+        Args:
+            indices (torch.Tensor): The sampled indices, a multiple of num_replicas.
+            generator (torch.Generator): The random number generator to shuffle the steps.
+
+        Returns:
+            torch.Tensor: The indices of each step and rank. Shape: [N_step, N_rank]
+        """
+        steps = []
+        window = self.window_size * self.num_replicas
+        for start in range(0, len(indices), window):
+            window_indices = indices[start : start + window]
+            order = torch.argsort(
+                self.costs[window_indices], descending=True, stable=True
+            )
+            window_steps = window_indices[order].view(-1, self.num_replicas)
+            steps.append(
+                window_steps[torch.randperm(len(window_steps), generator=generator)]
+            )
+        steps = torch.cat(steps)
+        # Rotate the ranks, so the most costly sample of each step goes to every rank in turn
+        rank_indices = (
+            torch.arange(self.num_replicas)[None, :] - torch.arange(len(steps))[:, None]
+        ) % self.num_replicas
+        return torch.gather(steps, 1, rank_indices)
+
+    def __iter__(self) -> Iterator[int]:
+        """
+        Generates an iterator over the sampled indices for the current process in a distributed environment.
+        Every process draws the same samples and balances them in the same way.
+
+        Returns:
+            iter: An iterator over the sampled indices for the current process.
+        """
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        indices = torch.multinomial(
+            self.weights, self.num_samples, self.replacement, generator=g
+        )
+        indices = indices[: len(self) * self.num_replicas]
+        steps = self.balance(indices, generator=g)
+
+        self.imbalance_stats = {
+            **{
+                f"unbalanced_{k}": v
+                for k, v in self.get_imbalance_stats(
+                    self.costs[indices].view(-1, self.num_replicas)
+                ).items()
+            },
+            **self.get_imbalance_stats(self.costs[steps]),
+        }
+        if self.rank == 0:
+            logger.info(
+                f"Token balanced sampling of epoch {self.epoch}: "
+                + ", ".join(f"{k}: {v:.4f}" for k, v in self.imbalance_stats.items())
+            )
+        return iter(steps[:, self.rank].tolist())
+
+
+def get_num_tokens_after_crop(dataset: WeightedMultiDataset) -> np.ndarray:
+    """
+    Get the number of tokens of each datapoint after cropping, from the "num_tokens"
+    of the indices lists and the crop size of each dataset.
+
+    Args:
+        dataset (WeightedMultiDataset): The training dataset.
+
+    Returns:
+        np.ndarray: The number of tokens of each datapoint.
+    """
+    num_tokens = []
+    for single_dataset in dataset.datasets:
+        dataset_num_tokens = (
+            single_dataset.indices_list["num_tokens"].astype(int).to_numpy()
+        )
+        crop_size = single_dataset.cropping_configs.get("crop_size", -1)
+        if crop_size > 0:
+            dataset_num_tokens = np.minimum(dataset_num_tokens, crop_size)
+        num_tokens.append(dataset_num_tokens)
+    return np.concatenate(num_tokens)
+
+
 class KeySumBalancedSampler(Sampler):
+    COST_MODELS = ["num_tokens_sq", "num_tokens_sq_msa", "timing"]
+
     def __init__(
         self,
         dataset: Dataset,
@@ -147,6 +315,8 @@ class KeySumBalancedSampler(Sampler):
         seed: Optional[int] = None,
         num_replicas: Optional[int] = None,
         rank: Optional[int] = None,
+        cost_model: str = "num_tokens_sq",
+        sample_costs: Optional[dict[str, dict[str, float]]] = None,
     ):
         """
         This method initializes the KeySumBalancedSampler.
@@ -158,22 +328,87 @@ class KeySumBalancedSampler(Sampler):
             value_scale (float): The multiplier of key value when computing the worker assignment weight
             num_replicas (int, optional): Number of processes participating in distributed training.
             rank (int, optional): Rank of the current process within num_replicas.
+            cost_model (str): How the cost of a sample is estimated, one of
+                "num_tokens_sq": the squared key value.
+                "num_tokens_sq_msa": the squared key value times the MSA depth in sample_costs.
+                "timing": the time measured in a previous evaluation, in sample_costs.
+            sample_costs (dict[str, dict[str, float]], optional): The "time" and "N_msa" of each pdb_id
+                recorded by a previous evaluation. Samples not in it are estimated from the others.
         """
+        assert cost_model in self.COST_MODELS, f"Unknown cost model: {cost_model}"
         self.dataset = dataset
         self.key = key
         self.value_scale = value_scale
         self.seed = seed
         self.num_replicas = num_replicas or dist.get_world_size()
-        self.rank = rank or dist.get_rank()
+        self.rank = rank if rank is not None else dist.get_rank()
+        self.cost_model = cost_model
+        self.sample_costs = sample_costs or {}
 
         # Get indices for this process after balancing by key sum
         worker_assignments = self.get_balanced_assignments()
         self.indices = worker_assignments[self.rank]
+        if self.rank == 0:
+            logger.info(
+                f"{getattr(dataset, 'name', '')} balanced by {self.cost_model}, "
+                + f"max/mean cost: {max(self.worker_costs) / (np.mean(self.worker_costs) or 1):.4f}, "
+                + f"cost of each rank: {[round(c, 4) for c in self.worker_costs]}"
+            )
+
+    def get_dataset_column(self, column: str) -> np.ndarray:
+        if isinstance(self.dataset.indices_list, GroupedIndices):
+            # e.g. recentPDB test set
+            return self.dataset.indices_list.first_rows()[column].to_numpy()
+        elif isinstance(self.dataset.indices_list, list):
+            return np.array([x[column].iloc[0] for x in self.dataset.indices_list])
+        else:
+            # e.g. posebuster test set
+            return self.dataset.indices_list[column].to_numpy()
+
+    def get_costs(self) -> np.ndarray:
+        """
+        Estimate the cost of each sample in the dataset by the cost model.
+
+        Returns:
+            np.ndarray: The cost of each sample.
+        """
+        num_tokens_sq = np.square(
+            self.get_dataset_column(self.key).astype(int) * self.value_scale
+        )
+        if self.cost_model == "num_tokens_sq":
+            return num_tokens_sq
+
+        field = "N_msa" if self.cost_model == "num_tokens_sq_msa" else "time"
+        pdb_ids = self.get_dataset_column("pdb_id")
+        measured = np.array(
+            [
+                self.sample_costs.get(pdb_id, {}).get(field, np.nan)
+                for pdb_id in pdb_ids
+            ],
+            dtype=float,
+        )
+        is_measured = ~np.isnan(measured)
+        if self.cost_model == "num_tokens_sq_msa":
+            # Samples without MSA depth are assumed to have the median depth
+            n_msa = np.where(
+                is_measured,
+                measured,
+                np.median(measured[is_measured]) if is_measured.any() else 1.0,
+            )
+            return num_tokens_sq * np.maximum(n_msa, 1.0)
+        # Samples without timing are estimated from the median time per squared token
+        time_per_cost = (
+            np.median(measured[is_measured] / np.maximum(num_tokens_sq[is_measured], 1))
+            if is_measured.any()
+            else 1.0
+        )
+        return np.where(is_measured, measured, num_tokens_sq * time_per_cost)
 
     def get_balanced_assignments(self):
         """
-        Distribute dataset indices across workers such that the sum of key values
-        assigned to each worker is as balanced as possible.
+        Distribute dataset indices across workers such that the sum of costs
+        assigned to each worker is as balanced as possible, by longest processing time
+        first scheduling: samples in descending order of cost go to the least loaded worker.
         """
         if self.seed is not None:
             # deterministically shuffle based on seed
@@ -187,52 +422,23 @@ class KeySumBalancedSampler(Sampler):
         while len(indices) < self.num_replicas:
             indices += indices[: (self.num_replicas - len(indices))]
 
-        if isinstance(self.dataset.indices_list, list):
-            # e.g. recentPDB test set
-            dataset_values = [
-                x[self.key].astype(int)[0] for x in self.dataset.indices_list
-            ]
-        else:
-            # e.g. posebuster test set
-            dataset_values = self.dataset.indices_list[self.key].astype(int).to_numpy()
-
-        # Sort indices by key value
-        key_value_pairs = [(idx, dataset_values[idx]) for idx in indices]
-        key_value_pairs.sort(key=lambda x: x[1], reverse=True)
+        costs = self.get_costs()
+        # Sort indices by cost, ties are kept in the shuffled order
+        indices = sorted(indices, key=lambda idx: costs[idx], reverse=True)
 
-        # Calculate the target number of samples per worker
-        num_samples_per_worker = len(self.dataset) // self.num_replicas
-
-        # Initialize containers for worker assignments and their current key sum
+        # Heap of (cost sum, number of samples, worker), so that every worker gets a sample
+        worker_heap = [(0.0, 0, worker) for worker in range(self.num_replicas)]
         worker_assignments = [[] for _ in range(self.num_replicas)]
-        worker_sums = [0] * self.num_replicas
-        total_samples = num_samples_per_worker * self.num_replicas
-
-        # Distribute samples using a greedy strategy to balance the key sum
-        for idx, key_value in key_value_pairs[:total_samples]:
-            # Find the worker with the smallest sum that hasn't exceeded its target sample count
-            min_worker = min(
-                range(self.num_replicas),
-                key=lambda i: (
-                    worker_sums[i]
-                    if len(worker_assignments[i]) < num_samples_per_worker
-                    else float("inf")
-                ),
+        for idx in indices:
+            worker_cost, num_samples, worker = heapq.heappop(worker_heap)
+            worker_assignments[worker].append(idx)
+            heapq.heappush(
+                worker_heap, (worker_cost + costs[idx], num_samples + 1, worker)
             )
-            worker_assignments[min_worker].append(idx)
-            worker_sums[min_worker] += key_value**2
-
-        # Fix any discrepancies in the number of samples
-        all_indices = [idx for idx, _ in key_value_pairs]
 
-        # Assign remaining samples if the dataset isn't divisible perfectly
-        if len(all_indices) > total_samples:
-            for i in range(len(all_indices) - total_samples):
-                worker_assignments[i % self.num_replicas].append(
-                    all_indices[total_samples + i]
-                )
-
-        # Return the indices assigned to the current worker
+        self.worker_costs = [0.0] * self.num_replicas
+        for worker_cost, _, worker in worker_heap:
+            self.worker_costs[worker] = float(worker_cost)
         return worker_assignments
 
     def __iter__(self):
@@ -242,6 +448,29 @@ class KeySumBalancedSampler(Sampler):
         return len(self.indices)
 
 
+def load_sample_costs(
+    cost_dir: Optional[str], dataset_name: str
+) -> Optional[dict[str, dict[str, float]]]:
+    """
+    Load the sample costs recorded by a previous evaluation of a dataset.
+
+    Args:
+        cost_dir (str, optional): The directory of "{dataset_name}.json" files.
+        dataset_name (str): The name of the dataset.
+
+    Returns:
+        dict[str, dict[str, float]], optional: The "time" and "N_msa" of each pdb_id.
+    """
+    if not cost_dir:
+        return None
+    cost_fpath = os.path.join(cost_dir, f"{dataset_name}.json")
+    if not os.path.exists(cost_fpath):
+        logger.warning(f"Sample costs of {dataset_name} not found in {cost_dir}")
+        return None
+    with open(cost_fpath, "r") as f:
+        return json.load(f)
+
+
 class IterDataLoader(DataLoader):
     """
     Iterative dataloader for single node.
@@ -316,7 +545,18 @@ def get_dataloaders(
 
     """
     train_dataset, test_datasets = get_datasets(configs, error_dir)
-    if world_size > 1:
+    if world_size > 1 and configs.data.train_sampler.get("token_balanced", False):
+        train_sampler = TokenBalancedDistributedSampler(
+            train_dataset,
+            train_dataset.merged_datapoint_weights,
+            num_samples=configs.data.epoch_size,
+            num_tokens=get_num_tokens_after_crop(train_dataset),
+            replacement=True,
+            seed=seed,
+            window_size=configs.data.train_sampler.token_balance_window_size,
+            cost_exponent=configs.data.train_sampler.token_cost_exponent,
+        )
+    elif world_size > 1:
         train_sampler = DistributedWeightedSampler(
             train_dataset,
             train_dataset.merged_datapoint_weights,
@@ -324,6 +564,7 @@ def get_dataloaders(
             replacement=True,
             seed=seed,
         )
+    if world_size > 1:
         train_dl = DistributedDataLoader(
             dataset=train_dataset,
             batch_size=1,
@@ -354,7 +595,15 @@ def get_dataloaders(
     for test_name, test_dataset in test_datasets.items():
         test_dataset_sizes[test_name] = len(test_dataset)
         test_sampler = (
-            KeySumBalancedSampler(test_dataset, key="num_tokens", seed=configs.seed)
+            KeySumBalancedSampler(
+                test_dataset,
+                key="num_tokens",
+                seed=configs.seed,
+                cost_model=configs.data.test_sampler.cost_model,
+                sample_costs=load_sample_costs(
+                    configs.data.test_sampler.cost_dir, test_name
+                ),
+            )
             if world_size > 1
             else None
         )
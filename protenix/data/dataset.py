@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import json
 import os
 import random
@@ -27,8 +28,10 @@ from biotite.structure.atoms import AtomArray
 from ml_collections.config_dict import ConfigDict
 from torch.utils.data import Dataset
 
+from protenix.data.bioassembly_store import BioassemblyStore
 from protenix.data.constants import EvaluationChainInterface
 from protenix.data.data_pipeline import DataPipeline
+from protenix.data.eval_feature_cache import EvalFeatureCache, get_code_version
 from protenix.data.featurizer import Featurizer
 from protenix.data.msa_featurizer import MSAFeaturizer
 from protenix.data.tokenizer import TokenArray
@@ -41,6 +44,100 @@ from protenix.utils.torch_utils import dict_to_tensor
 logger = get_logger(__name__)
 
 
+class GroupedIndices(object):
+    """
+    An indices list grouped by a key column, stored as one DataFrame sorted by the key
+    with the row offsets of each group. Indexing by an integer returns the DataFrame
+    of one group, the same as a list of the groups' DataFrames.
+    """
+
+    def __init__(self, frame: pd.DataFrame, group_offsets: np.ndarray) -> None:
+        """
+        Args:
+            frame (pd.DataFrame): Rows of all groups, the rows of each group are contiguous.
+            group_offsets (np.ndarray): Offsets of the groups in frame. Size=[N_group + 1]
+        """
+        self.frame = frame
+        self.group_offsets = np.asarray(group_offsets, dtype=int)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, key: str = "pdb_id") -> "GroupedIndices":
+        """
+        Group the rows of a DataFrame by a column, with groups sorted by the column.
+
+        Args:
+            df (pd.DataFrame): The indices list.
+            key (str): The column to group by.
+
+        Returns:
+            GroupedIndices: The grouped indices list.
+        """
+        frame = df.sort_values(by=key, kind="stable")
+        keys = frame[key].to_numpy()
+        is_group_start = np.ones(len(keys), dtype=bool)
+        is_group_start[1:] = keys[1:] != keys[:-1]
+        group_offsets = np.append(np.flatnonzero(is_group_start), len(keys))
+        return cls(frame, group_offsets)
+
+    def __len__(self) -> int:
+        return len(self.group_offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            start, stop = self.group_offsets[index], self.group_offsets[index + 1]
+            return self.frame.iloc[start:stop].reset_index()
+        return self.take(np.arange(len(self))[index])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_group_sizes(self) -> np.ndarray:
+        return np.diff(self.group_offsets)
+
+    def first_rows(self) -> pd.DataFrame:
+        """
+        Get the first row of each group.
+
+        Returns:
+            pd.DataFrame: One row per group.
+        """
+        return self.frame.iloc[self.group_offsets[:-1]]
+
+    def reduce_any(self, row_mask: np.ndarray) -> np.ndarray:
+        """
+        Whether any row of each group is True in the row mask.
+
+        Args:
+            row_mask (np.ndarray): A boolean mask of the rows in frame.
+
+        Returns:
+            np.ndarray: A boolean mask of the groups.
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=bool)
+        return np.logical_or.reduceat(row_mask, self.group_offsets[:-1])
+
+    def take(self, group_indices: np.ndarray) -> "GroupedIndices":
+        """
+        Select groups in the given order.
+
+        Args:
+            group_indices (np.ndarray): Indices of the selected groups.
+
+        Returns:
+            GroupedIndices: The selected groups.
+        """
+        group_indices = np.asarray(group_indices, dtype=int)
+        group_sizes = self.get_group_sizes()[group_indices]
+        new_offsets = np.zeros(len(group_indices) + 1, dtype=int)
+        new_offsets[1:] = np.cumsum(group_sizes)
+        row_indices = np.repeat(
+            self.group_offsets[group_indices] - new_offsets[:-1], group_sizes
+        ) + np.arange(new_offsets[-1])
+        return GroupedIndices(self.frame.iloc[row_indices], new_offsets)
+
+
 class BaseSingleDataset(Dataset):
     """
     dataset for a single data source
@@ -64,6 +161,12 @@ class BaseSingleDataset(Dataset):
         # Configs
         self.mmcif_dir = mmcif_dir
         self.bioassembly_dict_dir = bioassembly_dict_dir
+        # A columnar store written by prepare_training_data.py, or per-PDB gzip pickles
+        self.bioassembly_store = (
+            BioassemblyStore(bioassembly_dict_dir)
+            if BioassemblyStore.is_store(bioassembly_dict_dir)
+            else None
+        )
         self.indices_fpath = indices_fpath
         self.cropping_configs = cropping_configs
         self.name = name
@@ -98,6 +201,18 @@ class BaseSingleDataset(Dataset):
         self.limits = kwargs.get(
             "limits", -1
         )  # Limit number of indices rows, mainly for test
+        # Directory to cache the filtered indices list, "" to disable
+        self.indices_cache_dir = kwargs.get("indices_cache_dir", "")
+        # Directory to cache the processed samples, "" to disable. Only for test sets,
+        # whose samples are not randomly cropped
+        eval_feature_cache_dir = kwargs.get("eval_feature_cache_dir", "")
+        # Other configs the processed samples depend on, e.g. the featurizer and MSA configs
+        self.eval_feature_configs = kwargs.get("eval_feature_configs", {})
+        self.eval_feature_cache = (
+            EvalFeatureCache(self.get_eval_feature_cache_dir(eval_feature_cache_dir))
+            if eval_feature_cache_dir
+            else None
+        )
 
         self.error_dir = kwargs.get("error_dir", None)
         if self.error_dir is not None:
@@ -134,19 +249,85 @@ class BaseSingleDataset(Dataset):
                     pdb_filter_list.append(l)
         return pdb_filter_list
 
-    def read_indices_list(self, indices_fpath: Union[str, Path]) -> pd.DataFrame:
+    def get_indices_cache_fpath(self, indices_fpath: Union[str, Path]) -> Optional[str]:
         """
-        Reads and processes a list of indices from a CSV file.
+        Get the cache file of the filtered indices list, keyed by the indices file and the filter configs.
 
         Args:
             indices_fpath: Path to the CSV file containing the indices.
 
         Returns:
-            A DataFrame containing the processed indices.
+            The cache file path, or None if caching is disabled.
+        """
+        if not self.indices_cache_dir:
+            return None
+        indices_stat = os.stat(indices_fpath)
+        pdb_list = self.read_pdb_list(pdb_list=self.pdb_list)
+        filter_configs = {
+            "indices_fpath": os.path.abspath(indices_fpath),
+            "indices_mtime": indices_stat.st_mtime_ns,
+            "indices_size": indices_stat.st_size,
+            "pdb_list": sorted(set(pdb_list)) if pdb_list is not None else None,
+            "max_n_token": self.max_n_token,
+            "exclusion": {k: sorted(v) for k, v in self.exclusion_dict.items()},
+        }
+        key = hashlib.sha256(
+            json.dumps(filter_configs, sort_keys=True).encode()
+        ).hexdigest()
+        return os.path.join(self.indices_cache_dir, f"indices_{key}.pkl")
+
+    def get_eval_feature_cache_dir(
+        self, eval_feature_cache_dir: Union[str, Path]
+    ) -> str:
+        """
+        Get the directory of the eval feature cache, keyed by the configs the processed samples
+        depend on and the version of the processing code, so that stale samples are not reused.
+
+        Args:
+            eval_feature_cache_dir: The root directory of the eval feature cache.
+
+        Returns:
+            The cache directory of the current configs.
+        """
+        pdb_list = self.read_pdb_list(pdb_list=self.pdb_list)
+        feature_configs = {
+            "code_version": get_code_version(),
+            "mmcif_dir": str(self.mmcif_dir),
+            "bioassembly_dict_dir": str(self.bioassembly_dict_dir),
+            "indices_fpath": os.path.abspath(self.indices_fpath),
+            "pdb_list": sorted(set(pdb_list)) if pdb_list is not None else None,
+            "max_n_token": self.max_n_token,
+            "exclusion": {k: sorted(v) for k, v in self.exclusion_dict.items()},
+            "limits": self.limits,
+            "group_by_pdb_id": self.group_by_pdb_id,
+            "sort_by_n_token": self.sort_by_n_token,
+            "cropping_configs": self.cropping_configs,
+            "ref_pos_augment": self.ref_pos_augment,
+            "lig_atom_rename": self.lig_atom_rename,
+            "reassign_continuous_chain_ids": self.reassign_continuous_chain_ids,
+            "shuffle_mols": self.shuffle_mols,
+            "shuffle_sym_ids": self.shuffle_sym_ids,
+            "find_pocket": self.find_pocket,
+            "find_all_pockets": self.find_all_pockets,
+            "find_eval_chain_interface": self.find_eval_chain_interface,
+            "use_reference_chains_only": self.use_reference_chains_only,
+            "eval_feature_configs": self.eval_feature_configs,
+        }
+        key = hashlib.sha256(
+            json.dumps(feature_configs, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        return os.path.join(eval_feature_cache_dir, f"features_{key}")
+
+    def filter_indices_list(self, indices_list: pd.DataFrame) -> pd.DataFrame:
+        """
+        Filter the indices list by pdb_list, max_n_token and exclusion_dict.
+
+        Args:
+            indices_list: The indices list read from the CSV file.
+
+        Returns:
+            The filtered indices list.
         """
-        indices_list = read_indices_csv(indices_fpath)
-        num_data = len(indices_list)
-        logger.info(f"#Rows in indices list: {num_data}")
         # Filter by pdb_list
         if self.pdb_list is not None:
             pdb_filter_list = set(self.read_pdb_list(pdb_list=self.pdb_list))
@@ -168,31 +349,57 @@ class BaseSingleDataset(Dataset):
         for col_name, exclusion_list in self.exclusion_dict.items():
             cols = col_name.split("|")
             exclusion_set = {tuple(excl.split("|")) for excl in exclusion_list}
-
-            def is_valid(row):
-                return tuple(row[col] for col in cols) not in exclusion_set
-
-            valid_mask = indices_list.apply(is_valid, axis=1)
+            # Match the tuple of column values against the excluded tuples
+            row_keys = pd.MultiIndex.from_frame(indices_list[cols])
+            valid_mask = ~row_keys.isin(list(exclusion_set))
             indices_list = indices_list[valid_mask].reset_index(drop=True)
             logger.info(
                 f"[Excluded by {col_name} -- {exclusion_list}] #Rows: {len(indices_list)}"
             )
+        return indices_list
+
+    def read_indices_list(
+        self, indices_fpath: Union[str, Path]
+    ) -> Union[pd.DataFrame, "GroupedIndices"]:
+        """
+        Reads and processes a list of indices from a CSV file.
+
+        Args:
+            indices_fpath: Path to the CSV file containing the indices.
+
+        Returns:
+            A DataFrame containing the processed indices, or GroupedIndices if grouped by pdb_id.
+        """
+        cache_fpath = self.get_indices_cache_fpath(indices_fpath)
+        if cache_fpath is not None and os.path.exists(cache_fpath):
+            indices_list = pd.read_pickle(cache_fpath)
+            logger.info(
+                f"Load filtered indices list from {cache_fpath}, #Rows: {len(indices_list)}"
+            )
+        else:
+            indices_list = read_indices_csv(indices_fpath)
+            num_data = len(indices_list)
+            logger.info(f"#Rows in indices list: {num_data}")
+            indices_list = self.filter_indices_list(indices_list)
+            if cache_fpath is not None:
+                os.makedirs(self.indices_cache_dir, exist_ok=True)
+                # Write to a temporary file first, other ranks may be reading the cache
+                tmp_fpath = f"{cache_fpath}.{os.getpid()}"
+                indices_list.to_pickle(tmp_fpath)
+                os.replace(tmp_fpath, cache_fpath)
         self.print_data_stats(indices_list)
 
         # Group by pdb_id
-        # A list of dataframe. Each contains one pdb with multiple rows.
+        # One sorted DataFrame with the row offsets of each pdb.
         if self.group_by_pdb_id:
-            indices_list = [
-                df.reset_index() for _, df in indices_list.groupby("pdb_id", sort=True)
-            ]
+            indices_list = GroupedIndices.from_frame(indices_list, key="pdb_id")
 
         if self.sort_by_n_token:
             # Sort the dataset in a descending order, so that if OOM it will raise Error at an early stage.
             if self.group_by_pdb_id:
-                indices_list = sorted(
-                    indices_list,
-                    key=lambda df: int(df["num_tokens"].iloc[0]),
-                    reverse=True,
+                num_tokens = indices_list.first_rows()["num_tokens"].astype(int)
+                indices_list = indices_list.take(
+                    np.argsort(-num_tokens.to_numpy(), kind="stable")
                 )
             else:
                 indices_list = indices_list.sort_values(
@@ -202,21 +409,17 @@ class BaseSingleDataset(Dataset):
         if self.find_eval_chain_interface:
             # Remove data that does not contain eval_type in the EvaluationChainInterface list
             if self.group_by_pdb_id:
-                indices_list = [
-                    df
-                    for df in indices_list
-                    if len(
-                        set(df["eval_type"].to_list()).intersection(
-                            set(EvaluationChainInterface)
-                        )
-                    )
-                    > 0
-                ]
+                is_eval_row = (
+                    indices_list.frame["eval_type"]
+                    .isin(list(EvaluationChainInterface))
+                    .to_numpy()
+                )
+                indices_list = indices_list.take(
+                    np.flatnonzero(indices_list.reduce_any(is_eval_row))
+                )
             else:
                 indices_list = indices_list[
-                    indices_list["eval_type"].apply(
-                        lambda x: x in EvaluationChainInterface
-                    )
+                    indices_list["eval_type"].isin(list(EvaluationChainInterface))
                 ]
         if self.limits > 0 and len(indices_list) > self.limits:
             logger.info(
@@ -234,16 +437,14 @@ class BaseSingleDataset(Dataset):
         """
         if self.name:
             logger.info("-" * 10 + f" Dataset {self.name}" + "-" * 10)
-        df["mol_group_type"] = df.apply(
-            lambda row: "_".join(
-                sorted(
-                    [
-                        str(row["mol_1_type"]),
-                        str(row["mol_2_type"]).replace("nan", "intra"),
-                    ]
-                )
-            ),
-            axis=1,
+        mol_1_type = df["mol_1_type"].fillna("nan").astype(str)
+        mol_2_type = (
+            df["mol_2_type"].fillna("nan").astype(str).str.replace("nan", "intra")
+        )
+        df["mol_group_type"] = np.where(
+            mol_1_type <= mol_2_type,
+            mol_1_type + "_" + mol_2_type,
+            mol_2_type + "_" + mol_1_type,
         )
 
         group_size_dict = dict(df["mol_group_type"].value_counts())
@@ -258,7 +459,7 @@ class BaseSingleDataset(Dataset):
                 logger.info(f"{i}: {n_i}/{n_cluster}({round(n_i*100/n_cluster, 2)}%)")
             logger.info("-" * 30)
 
-        logger.info(f"Final pdb ids: {len(set(df.pdb_id.tolist()))}")
+        logger.info(f"Final pdb ids: {df['pdb_id'].nunique()}")
         logger.info("-" * 30)
 
     def __len__(self) -> int:
@@ -294,6 +495,8 @@ class BaseSingleDataset(Dataset):
         Returns:
             A dictionary containing the processed data sample.
         """
+        if self.eval_feature_cache is not None:
+            return self._get_cached_item(idx)
         # Try at most 10 times
         for _ in range(10):
             try:
@@ -312,20 +515,50 @@ class BaseSingleDataset(Dataset):
                     raise Exception(e)
         return data
 
+    def _get_cached_item(self, idx: int) -> dict[str, dict]:
+        """
+        Retrieves a data sample from the eval feature cache, processing and caching it on a miss.
+
+        Args:
+            idx: The index of the data sample to retrieve.
+
+        Returns:
+            A dictionary containing the processed data sample.
+        """
+        key = str(idx)
+        pdb_id = self._get_sample_indice(idx).pdb_id
+        cached = self.eval_feature_cache.get(key)
+        if cached is not None and cached[0] == pdb_id:
+            return cached[1]
+        try:
+            data = self.process_one(idx)
+        except Exception as e:
+            error_message = f"{e} at idx {idx}:\n{traceback.format_exc()}"
+            self.save_error_data(idx, error_message)
+            raise Exception(e)
+        self.eval_feature_cache.add(key, data, meta=pdb_id)
+        return data
+
     def _get_bioassembly_data(
         self, idx: int
     ) -> tuple[list[dict[str, Any]], dict[str, Any]]:
         sample_indice = self._get_sample_indice(idx=idx)
-        if self.bioassembly_dict_dir is not None:
+        if self.bioassembly_store is not None:
             bioassembly_dict_fpath = os.path.join(
-                self.bioassembly_dict_dir, sample_indice.pdb_id + ".pkl.gz"
+                self.bioassembly_dict_dir, sample_indice.pdb_id
             )
+            bioassembly_dict = self.bioassembly_store.get(sample_indice.pdb_id)
         else:
-            bioassembly_dict_fpath = None
+            if self.bioassembly_dict_dir is not None:
+                bioassembly_dict_fpath = os.path.join(
+                    self.bioassembly_dict_dir, sample_indice.pdb_id + ".pkl.gz"
+                )
+            else:
+                bioassembly_dict_fpath = None
 
-        bioassembly_dict = DataPipeline.get_data_bioassembly(
-            bioassembly_dict_fpath=bioassembly_dict_fpath
-        )
+            bioassembly_dict = DataPipeline.get_data_bioassembly(
+                bioassembly_dict_fpath=bioassembly_dict_fpath
+            )
         bioassembly_dict["pdb_id"] = sample_indice.pdb_id
         return sample_indice, bioassembly_dict, bioassembly_dict_fpath
 
@@ -440,6 +673,13 @@ class BaseSingleDataset(Dataset):
                 token_centre_atom_indices
             ].chain_id
             is_ref_chain = np.isin(token_chain_id, ref_chain_ids)
+            if (
+                not is_ref_chain.all()
+                and "is_interface_token"
+                in bioassembly_dict["atom_array"].get_annotation_categories()
+            ):
+                # Interface tokens of the removed chains are found again when cropping
+                bioassembly_dict["atom_array"].del_annotation("is_interface_token")
             bioassembly_dict["token_array"], bioassembly_dict["atom_array"], _, _ = (
                 CropData.select_by_token_indices(
                     token_array=bioassembly_dict["token_array"],
@@ -1063,6 +1303,7 @@ def get_datasets(
             "lig_atom_rename": config_dict.get("lig_atom_rename", False),
             "shuffle_mols": config_dict.get("shuffle_mols", False),
             "shuffle_sym_ids": config_dict.get("shuffle_sym_ids", False),
+            "indices_cache_dir": configs.data.get("indices_cache_dir", ""),
         }
 
     data_config = configs.data
@@ -1104,6 +1345,26 @@ def get_datasets(
             config_dict, dataset_name=test_name, stage="test"
         )
         dataset_param["ref_pos_augment"] = data_config.get("test_ref_pos_augment", True)
+        if eval_feature_cache_dir := data_config.get("eval_feature_cache_dir", ""):
+            dataset_param["eval_feature_cache_dir"] = os.path.join(
+                eval_feature_cache_dir, test_name
+            )
+            # The dataset, MSA, template and CCD configs the test samples depend on
+            dataset_param["eval_feature_configs"] = {
+                key: (
+                    data_config[key].to_dict()
+                    if isinstance(data_config.get(key), ConfigDict)
+                    else data_config.get(key)
+                )
+                for key in [
+                    test_name,
+                    "test_ref_pos_augment",
+                    "msa",
+                    "template",
+                    "ccd_components_file",
+                    "ccd_components_rdkit_mol_file",
+                ]
+            }
         test_dataset = BaseSingleDataset(**dataset_param)
         test_datasets[test_name] = test_dataset
     return train_dataset, test_datasets
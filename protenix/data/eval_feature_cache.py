@@ -0,0 +1,173 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A cache of the processed samples of an evaluation dataset.
+
+No random crop is applied at evaluation, so the features and labels of a test sample
+are the same in every evaluation pass. The first pass writes each processed sample to
+the shards of the cache directory, later passes read it back as copy-on-write views of
+the memory-mapped shards. Tensors and numeric arrays are stored as columns, the other
+items are kept in the pickled header of the entry.
+
+Every process writes its own shard, so data-loader workers and ranks can fill the
+cache concurrently. The index entries of a shard are appended to "<shard>.idx" as json
+lines: [key, shard_name, entry_offset, header_nbytes].
+"""
+
+import json
+import os
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+import numpy as np
+import torch
+
+from protenix.data.bioassembly_store import ShardReader, ShardWriter, _as_column
+
+INDEX_SUFFIX = ".idx"
+# Bump when a change of the data pipeline changes the processed samples
+CACHE_VERSION = 1
+
+
+def get_code_version() -> str:
+    """
+    The version of the processing code that the cached samples depend on.
+    """
+    try:
+        package_version = metadata.version("protenix")
+    except metadata.PackageNotFoundError:
+        package_version = "unknown"
+    return f"{CACHE_VERSION}-{package_version}"
+
+
+class _Column(object):
+    """A reference to a column in the header of an entry."""
+
+    def __init__(self, column_idx: int, is_tensor: bool) -> None:
+        self.column_idx = column_idx
+        self.is_tensor = is_tensor
+
+
+def _encode(obj: Any, columns: list[np.ndarray]) -> Any:
+    # Replace tensors and numeric arrays in the nested containers by column references
+    if isinstance(obj, dict):
+        return {k: _encode(v, columns) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_encode(v, columns) for v in obj)
+    if isinstance(obj, torch.Tensor) and obj.layout == torch.strided:
+        try:
+            array = obj.detach().cpu().numpy()
+        except TypeError:
+            # Dtypes without a numpy counterpart, e.g. bfloat16
+            return obj
+        columns.append(_as_column(array))
+        return _Column(len(columns) - 1, is_tensor=True)
+    if isinstance(obj, np.ndarray) and obj.dtype != object:
+        columns.append(_as_column(obj))
+        return _Column(len(columns) - 1, is_tensor=False)
+    return obj
+
+
+def _decode(obj: Any, get_column: Callable[[int], np.ndarray]) -> Any:
+    if isinstance(obj, dict):
+        return {k: _decode(v, get_column) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_decode(v, get_column) for v in obj)
+    if isinstance(obj, _Column):
+        array = get_column(obj.column_idx)
+        return torch.from_numpy(array) if obj.is_tensor else array
+    return obj
+
+
+class EvalFeatureCache(ShardReader):
+    """
+    Read and write processed samples of an evaluation dataset, keyed by the sample index.
+    """
+
+    def __init__(
+        self, cache_dir: Union[str, Path], max_shard_bytes: int = 1 << 32
+    ) -> None:
+        """
+        Args:
+            cache_dir (Union[str, Path]): directory of the cache.
+            max_shard_bytes (int): a new shard is started when the current one exceeds this size.
+        """
+        super().__init__(cache_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.max_shard_bytes = max_shard_bytes
+        self.index = {}
+        # The number of bytes read from each index file
+        self._index_offsets = {}
+        self._writer = None
+        self._writer_pid = None
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_writer"] = None
+        state["_writer_pid"] = None
+        return state
+
+    def _update_index(self) -> None:
+        # Read the entries appended by any process since the last update
+        for fpath in self.store_dir.glob(f"*{INDEX_SUFFIX}"):
+            offset = self._index_offsets.get(fpath.name, 0)
+            with open(fpath, "rb") as f:
+                f.seek(offset)
+                lines = f.read()
+            # Skip a partially written line
+            end = lines.rfind(b"\n") + 1
+            for line in lines[:end].splitlines():
+                key, *entry = json.loads(line)
+                self.index[key] = entry
+            self._index_offsets[fpath.name] = offset + end
+
+    def get(self, key: str) -> Optional[tuple[Any, dict[str, Any]]]:
+        """
+        Get a cached sample.
+
+        Args:
+            key (str): the key of the sample.
+
+        Returns:
+            Optional[tuple[Any, dict[str, Any]]]: the meta info given to `add` and the sample,
+                or None if the sample is not cached.
+        """
+        if key not in self.index:
+            self._update_index()
+            if key not in self.index:
+                return None
+        header, get_column = self.read_entry(*self.index[key])
+        return header["meta"], _decode(header["data"], get_column)
+
+    def add(self, key: str, data: dict[str, Any], meta: Any = None) -> None:
+        """
+        Write a sample to the shard of the current process.
+
+        Args:
+            key (str): the key of the sample.
+            data (dict[str, Any]): the sample, nested containers of tensors, arrays and picklable items.
+            meta (Any): info to check the cached sample against, e.g. the pdb_id.
+        """
+        if self._writer is None or self._writer_pid != os.getpid():
+            self._writer = ShardWriter(self.store_dir, self.max_shard_bytes)
+            self._writer_pid = os.getpid()
+        columns = []
+        header = {"meta": meta, "data": _encode(data, columns)}
+        entry = self._writer.write_entry(header, columns)
+        # The shard is flushed before the entry is indexed
+        with open(self.store_dir / f"{entry[0]}{INDEX_SUFFIX}", "a") as f:
+            f.write(json.dumps([key, *entry]) + "\n")
+        self.index[key] = entry
@@ -18,11 +18,11 @@ from typing import Union
 
 import numpy as np
 import torch
-from biotite.structure import Atom, AtomArray, get_residue_starts
+from biotite.structure import AtomArray, get_residue_starts
 from sklearn.neighbors import KDTree
 
 from protenix.data.constants import STD_RESIDUES, get_all_elems
-from protenix.data.tokenizer import Token, TokenArray
+from protenix.data.tokenizer import TokenArray
 from protenix.data.utils import get_ligand_polymer_bond_mask
 from protenix.utils.geometry import angle_3p, random_transform
 
@@ -134,83 +134,111 @@ class Featurizer(object):
         return onehot_tensor
 
     @staticmethod
-    def get_prot_nuc_frame(token: Token, centre_atom: Atom) -> tuple[int, list[int]]:
+    def get_prot_nuc_frame(
+        token_array: TokenArray, atom_array: AtomArray
+    ) -> tuple[np.ndarray, np.ndarray]:
         """
         Ref: AlphaFold3 SI Chapter 4.3.2
         For proteins/DNA/RNA, we use the three atoms [N, CA, C] / [C1', C3', C4']
 
         Args:
-            token (Token): Token object.
-            centre_atom (Atom): Biotite Atom object of Token centre atom.
+            token_array (TokenArray): Protein/DNA/RNA tokens of standard residues.
+            atom_array (AtomArray): An atom array.
 
         Returns:
-            has_frame (int): 1 if the token has frame, 0 otherwise.
-            frame_atom_index (List[int]): The index of the atoms used to construct the frame.
-        """
-        if centre_atom.mol_type == "protein":
-            # For protein
-            abc_atom_name = ["N", "CA", "C"]
-        else:
-            # For DNA and RNA
-            abc_atom_name = [r"C1'", r"C3'", r"C4'"]
-
-        idx_in_atom_indices = []
-        for i in abc_atom_name:
-            if centre_atom.mol_type == "protein" and "N" not in token.atom_names:
-                return 0, [-1, -1, -1]
-            elif centre_atom.mol_type != "protein" and "C1'" not in token.atom_names:
-                return 0, [-1, -1, -1]
-            idx_in_atom_indices.append(token.atom_names.index(i))
-        # Protein/DNA/RNA always has frame
-        has_frame = 1
-        frame_atom_index = [token.atom_indices[i] for i in idx_in_atom_indices]
-        return has_frame, frame_atom_index
+            tuple[np.ndarray, np.ndarray]:
+                has_frame (np.ndarray): 1 if the token has frame, 0 otherwise. Size=[N_token]
+                frame_atom_index (np.ndarray): The index of the atoms used to construct the frame.
+                                               Size=[N_token, 3]
+        """
+        atom_indices = token_array.get_flat_annotation("atom_indices")
+        atom_names = token_array.get_flat_annotation("atom_names")
+        atom_token_index = np.repeat(
+            np.arange(len(token_array)), token_array.get_atom_nums()
+        )
+        is_protein_atom = (
+            atom_array.mol_type[token_array.get_annotation("centre_atom_index")]
+            == "protein"
+        )[atom_token_index]
+
+        frame_atom_index = np.full((len(token_array), 3), -1, dtype=int)
+        for i, (prot_atom_name, nuc_atom_name) in enumerate(
+            zip(["N", "CA", "C"], [r"C1'", r"C3'", r"C4'"])
+        ):
+            matched = np.flatnonzero(
+                atom_names == np.where(is_protein_atom, prot_atom_name, nuc_atom_name)
+            )
+            # Use the first matched atom in each token
+            matched_tokens, first_matched = np.unique(
+                atom_token_index[matched], return_index=True
+            )
+            frame_atom_index[matched_tokens, i] = atom_indices[matched[first_matched]]
+
+        # Protein/DNA/RNA has frame if all the three atoms exist
+        has_frame = np.all(frame_atom_index >= 0, axis=-1)
+        frame_atom_index[~has_frame] = -1
+        return has_frame.astype(int), frame_atom_index
 
     @staticmethod
     def get_lig_frame(
-        token: Token,
-        centre_atom: Atom,
-        lig_res_ref_conf_kdtree: dict[str, tuple[KDTree, list[int]]],
+        centre_atom_index: np.ndarray,
+        atom_array: AtomArray,
         ref_pos: torch.Tensor,
         ref_mask: torch.Tensor,
-    ) -> tuple[int, list[int]]:
+    ) -> tuple[np.ndarray, np.ndarray]:
         """
         Ref: AlphaFold3 SI Chapter 4.3.2
         For ligands, we use the reference conformer of the ligand to construct the frame.
+        One KDTree is built for each ref_space_uid and queried by all its tokens at once.
 
         Args:
-            token (Token): Token object.
-            centre_atom (Atom): Biotite Atom object of Token centre atom.
-            lig_res_ref_conf_kdtree (Dict[str, Tuple[KDTree, List[int]]]): A dictionary of KDTree objects and atom indices.
+            centre_atom_index (np.ndarray): Centre atom indices of the ligand and non-standard residue tokens.
+            atom_array (AtomArray): An atom array.
             ref_pos (torch.Tensor): Atom positions in the reference conformer. Size=[N_atom, 3]
             ref_mask (torch.Tensor): Mask indicating which atom slots are used in the reference conformer. Size=[N_atom]
 
         Returns:
-            tuple[int, List[int]]:
-                has_frame (int): 1 if the token has frame, 0 otherwise.
-                frame_atom_index (List[int]): The index of the atoms used to construct the frame.
-        """
-        kdtree, atom_ids = lig_res_ref_conf_kdtree[centre_atom.ref_space_uid]
-        b_ref_pos = ref_pos[token.centre_atom_index]
-        b_idx = token.centre_atom_index
-        if kdtree is None:
-            # Atom num < 3
-            frame_atom_index = [-1, b_idx, -1]
-            has_frame = 0
-        else:
-            _dist, ind = kdtree.query([b_ref_pos], k=3)
-            a_idx, c_idx = atom_ids[ind[0][1]], atom_ids[ind[0][2]]
-            frame_atom_index = [a_idx, b_idx, c_idx]
-
-            # Check if reference confomrer vaild
-            has_frame = all([ref_mask[idx] for idx in frame_atom_index])
-
-            # Colinear check
-            if has_frame:
-                theta_degrees = angle_3p(*[ref_pos[idx] for idx in frame_atom_index])
-                if theta_degrees <= 25 or theta_degrees >= 155:
-                    has_frame = 0
-        return has_frame, frame_atom_index
+            tuple[np.ndarray, np.ndarray]:
+                has_frame (np.ndarray): 1 if the token has frame, 0 otherwise. Size=[N_token]
+                frame_atom_index (np.ndarray): The index of the atoms used to construct the frame.
+                                               Size=[N_token, 3]
+        """
+        ref_pos = np.asarray(ref_pos)
+        ref_mask = np.asarray(ref_mask)
+        frame_atom_index = np.full((len(centre_atom_index), 3), -1, dtype=int)
+        frame_atom_index[:, 1] = centre_atom_index
+
+        # The ref_space_uid is the unique identifier ID for each residue.
+        uid_sorted_atoms = np.argsort(atom_array.ref_space_uid, kind="stable")
+        uids, uid_starts, uid_counts = np.unique(
+            atom_array.ref_space_uid[uid_sorted_atoms],
+            return_index=True,
+            return_counts=True,
+        )
+        token_uid = atom_array.ref_space_uid[centre_atom_index]
+        token_uid_index = np.searchsorted(uids, token_uid)
+        # Atom num < 3, invalid frame
+        has_kdtree = uid_counts[token_uid_index] >= 3
+
+        for uid_index in np.unique(token_uid_index[has_kdtree]):
+            start = uid_starts[uid_index]
+            atom_ids = uid_sorted_atoms[start : start + uid_counts[uid_index]]
+            token_mask = token_uid_index == uid_index
+            kdtree = KDTree(ref_pos[atom_ids], metric="euclidean")
+            _dist, ind = kdtree.query(ref_pos[centre_atom_index[token_mask]], k=3)
+            frame_atom_index[token_mask, 0] = atom_ids[ind[:, 1]]
+            frame_atom_index[token_mask, 2] = atom_ids[ind[:, 2]]
+
+        # Check if reference confomrer vaild
+        has_frame = has_kdtree.copy()
+        has_frame[has_kdtree] = np.all(ref_mask[frame_atom_index[has_kdtree]], axis=-1)
+
+        # Colinear check
+        theta_degrees = angle_3p(
+            *ref_pos[frame_atom_index[has_frame]].transpose(1, 0, 2)
+        )
+        has_frame[has_frame] = (theta_degrees > 25) & (theta_degrees < 155)
+        return has_frame.astype(int), frame_atom_index
 
     @staticmethod
     def get_token_frame(
@@ -246,41 +274,31 @@ class Featurizer(object):
         """
         token_array_w_frame = copy.deepcopy(token_array)
 
-        # Construct a KDTree for queries to avoid redundant distance calculations
-        lig_res_ref_conf_kdtree = {}
+        centre_atom_index = token_array.get_annotation("centre_atom_index")
+        is_std_res_token = (atom_array.mol_type[centre_atom_index] != "ligand") & (
+            np.isin(atom_array.res_name[centre_atom_index], list(STD_RESIDUES.keys()))
+        )
+        std_res_token_indices = np.flatnonzero(is_std_res_token)
         # Ligand and non-standard residues need to use ref to identify frames
-        lig_atom_array = atom_array[
-            (atom_array.mol_type == "ligand")
-            | (~np.isin(atom_array.res_name, list(STD_RESIDUES.keys())))
-        ]
-        for ref_space_uid in np.unique(lig_atom_array.ref_space_uid):
-            # The ref_space_uid is the unique identifier ID for each residue.
-            atom_ids = np.where(atom_array.ref_space_uid == ref_space_uid)[0]
-            if len(atom_ids) >= 3:
-                kdtree = KDTree(ref_pos[atom_ids], metric="euclidean")
-            else:
-                # Invalid frame
-                kdtree = None
-            lig_res_ref_conf_kdtree[ref_space_uid] = (kdtree, atom_ids)
-
-        has_frame = []
-        for token in token_array_w_frame:
-            centre_atom = atom_array[token.centre_atom_index]
-            if (
-                centre_atom.mol_type != "ligand"
-                and centre_atom.res_name in STD_RESIDUES
-            ):
-                has_frame, frame_atom_index = Featurizer.get_prot_nuc_frame(
-                    token, centre_atom
-                )
-
-            else:
-                has_frame, frame_atom_index = Featurizer.get_lig_frame(
-                    token, centre_atom, lig_res_ref_conf_kdtree, ref_pos, ref_mask
-                )
+        lig_token_indices = np.flatnonzero(~is_std_res_token)
+
+        has_frame = np.zeros(len(token_array), dtype=int)
+        frame_atom_index = np.full((len(token_array), 3), -1, dtype=int)
+        (
+            has_frame[std_res_token_indices],
+            frame_atom_index[std_res_token_indices],
+        ) = Featurizer.get_prot_nuc_frame(
+            token_array[std_res_token_indices], atom_array
+        )
+        (
+            has_frame[lig_token_indices],
+            frame_atom_index[lig_token_indices],
+        ) = Featurizer.get_lig_frame(
+            centre_atom_index[lig_token_indices], atom_array, ref_pos, ref_mask
+        )
 
-            token.has_frame = has_frame
-            token.frame_atom_index = frame_atom_index
+        token_array_w_frame.set_annotation("has_frame", has_frame)
+        token_array_w_frame.set_annotation("frame_atom_index", frame_atom_index)
         return token_array_w_frame
 
     def get_token_features(self) -> dict[str, torch.Tensor]:
@@ -361,6 +379,32 @@ class Featurizer(object):
             new_atom_names[start:stop] = new_res_atom_names
         return new_atom_names
 
+    @staticmethod
+    def get_ref_pos(atom_array: AtomArray, ref_pos_augment: bool = True) -> np.ndarray:
+        """
+        Centralize the reference conformer of each ref_space_uid and optionally
+        apply a random rotation and translation on it.
+        The conformers are transformed and concatenated in ascending ref_space_uid order.
+
+        Args:
+            atom_array (AtomArray): AtomArray with "ref_pos" and "ref_space_uid" annotations.
+            ref_pos_augment (bool): Boolean indicating whether apply random rotation and translation on ref_pos
+
+        Returns:
+            np.ndarray: reference positions of shape [N_atom, 3].
+        """
+        order = np.argsort(atom_array.ref_space_uid, kind="stable")
+        _uids, starts = np.unique(atom_array.ref_space_uid[order], return_index=True)
+        ref_pos = [
+            random_transform(
+                res_ref_pos,
+                apply_augmentation=ref_pos_augment,
+                centralize=True,
+            )
+            for res_ref_pos in np.split(atom_array.ref_pos[order], starts[1:])
+        ]
+        return np.concatenate(ref_pos)
+
     def get_reference_features(self) -> dict[str, torch.Tensor]:
         """
         Ref: AlphaFold3 SI Chapter 2.8
@@ -371,17 +415,9 @@ class Featurizer(object):
         Returns:
             Dict[str, torch.Tensor]: a dict of reference features.
         """
-        ref_pos = []
-        for ref_space_uid in np.unique(self.cropped_atom_array.ref_space_uid):
-            res_ref_pos = random_transform(
-                self.cropped_atom_array.ref_pos[
-                    self.cropped_atom_array.ref_space_uid == ref_space_uid,
-                ],
-                apply_augmentation=self.ref_pos_augment,
-                centralize=True,
-            )
-            ref_pos.append(res_ref_pos)
-        ref_pos = np.concatenate(ref_pos)
+        ref_pos = self.get_ref_pos(
+            self.cropped_atom_array, ref_pos_augment=self.ref_pos_augment
+        )
 
         ref_features = {}
         ref_features["ref_pos"] = torch.Tensor(ref_pos)
@@ -431,45 +467,36 @@ class Featurizer(object):
         """
         bond_features = {}
         num_tokens = len(self.cropped_token_array)
-        adj_matrix = self.cropped_atom_array.bonds.adjacency_matrix().astype(int)
-
         token_adj_matrix = np.zeros((num_tokens, num_tokens), dtype=int)
-        atom_bond_mask = adj_matrix > 0
-
-        for i in range(num_tokens):
-            atoms_i = self.cropped_token_array[i].atom_indices
-            token_i_mol_type = self.cropped_atom_array.mol_type[atoms_i[0]]
-            token_i_res_name = self.cropped_atom_array.res_name[atoms_i[0]]
-            token_i_ref_space_uid = self.cropped_atom_array.ref_space_uid[atoms_i[0]]
-            unstd_res_token_i = (
-                token_i_res_name not in STD_RESIDUES and token_i_mol_type != "ligand"
-            )
-            is_polymer_i = token_i_mol_type in ["protein", "dna", "rna"]
-
-            for j in range(i + 1, num_tokens):
-                atoms_j = self.cropped_token_array[j].atom_indices
-                token_j_mol_type = self.cropped_atom_array.mol_type[atoms_j[0]]
-                token_j_res_name = self.cropped_atom_array.res_name[atoms_j[0]]
-                token_j_ref_space_uid = self.cropped_atom_array.ref_space_uid[
-                    atoms_j[0]
-                ]
-                unstd_res_token_j = (
-                    token_j_res_name not in STD_RESIDUES
-                    and token_j_mol_type != "ligand"
-                )
-                is_polymer_j = token_j_mol_type in ["protein", "dna", "rna"]
-
-                # The polymer-polymer (std-std, std-unstd, and inter-unstd) bond will not be included in token_bonds.
-                if is_polymer_i and is_polymer_j:
-                    is_same_res = token_i_ref_space_uid == token_j_ref_space_uid
-                    unstd_res_bonds = unstd_res_token_i and unstd_res_token_j
-                    if not (is_same_res and unstd_res_bonds):
-                        continue
-
-                sub_matrix = atom_bond_mask[np.ix_(atoms_i, atoms_j)]
-                if np.any(sub_matrix):
-                    token_adj_matrix[i, j] = 1
-                    token_adj_matrix[j, i] = 1
+
+        atom_to_token_idx = self.cropped_token_array.get_atom_to_token_index(
+            len(self.cropped_atom_array)
+        )
+        token_first_atoms = self.cropped_token_array.get_flat_annotation(
+            "atom_indices"
+        )[self.cropped_token_array.atom_offsets[:-1]]
+        token_mol_type = self.cropped_atom_array.mol_type[token_first_atoms]
+        token_res_name = self.cropped_atom_array.res_name[token_first_atoms]
+        token_ref_space_uid = self.cropped_atom_array.ref_space_uid[token_first_atoms]
+        unstd_res_token = ~np.isin(token_res_name, list(STD_RESIDUES.keys())) & (
+            token_mol_type != "ligand"
+        )
+        is_polymer = np.isin(token_mol_type, ["protein", "dna", "rna"])
+
+        # Map atom bonds to token pairs
+        atom_bonds = self.cropped_atom_array.bonds.as_array()
+        token_i = atom_to_token_idx[atom_bonds[:, 0]]
+        token_j = atom_to_token_idx[atom_bonds[:, 1]]
+        bond_mask = token_i != token_j
+
+        # The polymer-polymer (std-std, std-unstd, and inter-unstd) bond will not be included in token_bonds.
+        is_polymer_pair = is_polymer[token_i] & is_polymer[token_j]
+        is_same_res = token_ref_space_uid[token_i] == token_ref_space_uid[token_j]
+        unstd_res_bonds = unstd_res_token[token_i] & unstd_res_token[token_j]
+        bond_mask &= ~is_polymer_pair | (is_same_res & unstd_res_bonds)
+
+        token_adj_matrix[token_i[bond_mask], token_j[bond_mask]] = 1
+        token_adj_matrix[token_j[bond_mask], token_i[bond_mask]] = 1
         bond_features["token_bonds"] = torch.Tensor(token_adj_matrix)
         return bond_features
 
@@ -481,16 +508,9 @@ class Featurizer(object):
         Returns:
             Dict[str, torch.Tensor]: a dict of extra features.
         """
-        atom_to_token_idx_dict = {}
-        for idx, token in enumerate(self.cropped_token_array.tokens):
-            for atom_idx in token.atom_indices:
-                atom_to_token_idx_dict[atom_idx] = idx
-
-        # Ensure the order of the atom_to_token_idx is the same as the atom_array
-        atom_to_token_idx = [
-            atom_to_token_idx_dict[atom_idx]
-            for atom_idx in range(len(self.cropped_atom_array))
-        ]
+        atom_to_token_idx = self.cropped_token_array.get_atom_to_token_index(
+            len(self.cropped_atom_array)
+        )
 
         extra_features = {}
         extra_features["atom_to_token_idx"] = torch.Tensor(atom_to_token_idx).long()
@@ -17,16 +17,20 @@ import logging
 import time
 import traceback
 import warnings
-from typing import Any, Mapping
+from typing import Any, Mapping, Optional
 
+import numpy as np
 import torch
 from biotite.structure import AtomArray
 from torch.utils.data import DataLoader, Dataset, DistributedSampler
 
+from protenix.data.constants import STD_RESIDUES
 from protenix.data.data_pipeline import DataPipeline
+from protenix.data.featurizer import Featurizer
 from protenix.data.json_to_feature import SampleDictToFeatures
 from protenix.data.msa_featurizer import InferenceMSAFeaturizer
-from protenix.data.utils import data_type_transform, make_dummy_feature
+from protenix.data.tokenizer import AtomArrayTokenizer, TokenArray
+from protenix.data.utils import data_type_transform, int_to_letters, make_dummy_feature
 from protenix.utils.distributed import DIST_WRAPPER
 from protenix.utils.torch_utils import dict_to_tensor
 
@@ -49,6 +53,7 @@ def get_inference_dataloader(configs: Any) -> DataLoader:
         input_json_path=configs.input_json_path,
         dump_dir=configs.dump_dir,
         use_msa=configs.use_msa,
+        use_receptor_template=configs.use_receptor_template,
     )
     sampler = DistributedSampler(
         dataset=inference_dataset,
@@ -66,20 +71,342 @@ def get_inference_dataloader(configs: Any) -> DataLoader:
     return dataloader
 
 
+class ReceptorTemplate(object):
+    """
+    Features of a fixed receptor shared by ligand-swap jobs.
+
+    The receptor is made of all but the last entity of a job. Its AtomArray, TokenArray,
+    features and MSA features are built once. For each job only the ligand entity is built
+    and featurized, and its atoms, tokens, token_bonds and MSA columns are appended to the
+    receptor, which gives the same result as featurizing the whole complex.
+    """
+
+    def __init__(
+        self,
+        receptor_sample_dict: Mapping[str, Any],
+        use_msa: bool = True,
+    ) -> None:
+        """
+        Args:
+            receptor_sample_dict (Mapping[str, Any]): a job dict without the swapped ligand entity.
+            use_msa (bool): Boolean indicating whether to build the MSA features of the receptor.
+        """
+        sample2feat = SampleDictToFeatures(receptor_sample_dict)
+        self.entity_poly_type = sample2feat.entity_poly_type
+        self.feature_dict, self.atom_array, self.token_array = (
+            sample2feat.get_feature_dict()
+        )
+
+        sequences = receptor_sample_dict["sequences"]
+        self.num_entities = len(sequences)
+        self.num_chains = sum(
+            entity["count"]
+            for entity_dict in sequences
+            for entity in entity_dict.values()
+        )
+        self.num_smiles_ligands = sum(
+            not entity_dict["ligand"]["ligand"].startswith("CCD_")
+            for entity_dict in sequences
+            if "ligand" in entity_dict
+        )
+
+        self.msa_features = (
+            InferenceMSAFeaturizer.make_msa_feature(
+                bioassembly=sequences,
+                entity_to_asym_id=DataPipeline.get_label_entity_id_to_asym_id_int(
+                    self.atom_array
+                ),
+                token_array=self.token_array,
+                atom_array=self.atom_array,
+            )
+            if use_msa
+            else {}
+        )
+
+    @staticmethod
+    def split_sample_dict(
+        single_sample_dict: Mapping[str, Any],
+    ) -> Optional[tuple[dict[str, Any], dict[str, Any]]]:
+        """
+        Split a job into the receptor and the ligand entity to be swapped.
+        A job can be split if its last entity is a ligand or an ion which is not
+        covalently bonded to any entity.
+
+        Args:
+            single_sample_dict (Mapping[str, Any]): a job dict from the input JSON.
+
+        Returns:
+            Optional[tuple[dict[str, Any], dict[str, Any]]]: the receptor job dict and the
+                ligand entity dict, or None if the job can not be split.
+        """
+        sequences = single_sample_dict["sequences"]
+        if len(sequences) < 2 or not (
+            "ligand" in sequences[-1] or "ion" in sequences[-1]
+        ):
+            return None
+
+        ligand_entity_id = len(sequences)
+        covalent_bonds = single_sample_dict.get("covalent_bonds", None)
+        for bond_info_dict in covalent_bonds or []:
+            for idx, i in enumerate(["left", "right"]):
+                entity_id = bond_info_dict.get(
+                    f"{i}_entity", bond_info_dict.get(f"entity{idx+1}")
+                )
+                if int(entity_id) == ligand_entity_id:
+                    return None
+
+        receptor_sample_dict = {"sequences": sequences[:-1]}
+        if covalent_bonds is not None:
+            receptor_sample_dict["covalent_bonds"] = covalent_bonds
+        return receptor_sample_dict, sequences[-1]
+
+    def get_ligand_atom_array(self, ligand_entity: Mapping[str, Any]) -> AtomArray:
+        """
+        Build the AtomArray of the ligand entity as it would be in the whole complex.
+        Chain ids, entity ids, SMILES residue names and the integer ids which count
+        chains, molecules and reference conformers continue from the receptor.
+
+        Args:
+            ligand_entity (Mapping[str, Any]): the ligand or ion entity dict.
+
+        Returns:
+            AtomArray: Biotite AtomArray of the ligand with attributes added.
+        """
+        sample2feat = SampleDictToFeatures({"sequences": [ligand_entity]})
+        atom_array = sample2feat.build_full_atom_array()
+
+        asym_id_strs = np.array(
+            [
+                int_to_letters(self.num_chains + copy_id)
+                for copy_id in range(1, atom_array.copy_id.max() + 1)
+            ]
+        )
+        chain_id = asym_id_strs[atom_array.copy_id - 1]
+        atom_array.set_annotation("label_asym_id", chain_id)
+        atom_array.set_annotation("auth_asym_id", chain_id)
+        atom_array.set_annotation("chain_id", chain_id)
+        atom_array.set_annotation(
+            "label_entity_id", [str(self.num_entities + 1)] * len(atom_array)
+        )
+        if "ligand" in ligand_entity and not ligand_entity["ligand"][
+            "ligand"
+        ].startswith("CCD_"):
+            assert self.num_smiles_ligands < 99, "too many smiles ligands"
+            atom_array.res_name[:] = f"l{self.num_smiles_ligands + 1:02d}"
+
+        atom_array = sample2feat.mse_to_met(atom_array)
+        atom_array = sample2feat.add_atom_array_attributes(
+            atom_array, sample2feat.entity_poly_type
+        )
+        for key in ["asym_id_int", "mol_id", "entity_mol_id", "ref_space_uid"]:
+            annot = atom_array.get_annotation(key)
+            annot += self.atom_array.get_annotation(key).max() + 1
+        return atom_array
+
+    def get_feature_dict(
+        self, ligand_entity: Mapping[str, Any]
+    ) -> tuple[dict[str, torch.Tensor], AtomArray, TokenArray]:
+        """
+        Generates the feature dictionary of the receptor in complex with a ligand entity.
+        The ligand entity is appended as the last entity, the same as
+        SampleDictToFeatures.get_feature_dict() on the whole job.
+
+        Args:
+            ligand_entity (Mapping[str, Any]): the ligand or ion entity dict.
+
+        Returns:
+            A tuple containing:
+                - A dictionary of features.
+                - An AtomArray object.
+                - A TokenArray object.
+        """
+        lig_atom_array = self.get_ligand_atom_array(ligand_entity)
+        lig_token_array = AtomArrayTokenizer(lig_atom_array).get_token_array()
+
+        num_atoms = len(self.atom_array)
+        num_tokens = len(self.token_array)
+        atom_array = self.atom_array + lig_atom_array
+        # entity_id_int is the rank of label_entity_id among all entities
+        _, entity_id_int = np.unique(atom_array.label_entity_id, return_inverse=True)
+        atom_array.set_annotation("entity_id_int", entity_id_int)
+
+        token_array = TokenArray.from_arrays(
+            values=np.concatenate(
+                [self.token_array.get_values(), lig_token_array.get_values()]
+            ),
+            atom_offsets=np.concatenate(
+                [
+                    self.token_array.atom_offsets,
+                    lig_token_array.atom_offsets[1:]
+                    + self.token_array.atom_offsets[-1],
+                ]
+            ),
+            atom_indices=np.concatenate(
+                [
+                    self.token_array.get_flat_annotation("atom_indices"),
+                    lig_token_array.get_flat_annotation("atom_indices") + num_atoms,
+                ]
+            ),
+            atom_names=np.concatenate(
+                [
+                    self.token_array.get_flat_annotation("atom_names"),
+                    lig_token_array.get_flat_annotation("atom_names"),
+                ]
+            ),
+            centre_atom_index=np.concatenate(
+                [
+                    self.token_array.get_annotation("centre_atom_index"),
+                    lig_token_array.get_annotation("centre_atom_index") + num_atoms,
+                ]
+            ),
+        )
+
+        # The receptor reference conformers are augmented before the ligand ones,
+        # in the same order as featurizing the whole complex.
+        receptor_ref_pos = Featurizer.get_ref_pos(self.atom_array, ref_pos_augment=True)
+        lig_feature_dict = Featurizer(
+            lig_token_array, lig_atom_array
+        ).get_all_input_features()
+
+        feature_dict = {}
+        for key, lig_feat in lig_feature_dict.items():
+            feat = self.feature_dict[key]
+            if key in ["token_bonds", "bond_mask"]:
+                # No bond between the receptor and the ligand
+                feature_dict[key] = torch.block_diag(feat, lig_feat)
+            elif key == "resolution":
+                feature_dict[key] = feat.clone()
+            elif key == "ref_pos":
+                feature_dict[key] = torch.cat(
+                    [torch.Tensor(receptor_ref_pos), lig_feat]
+                )
+            elif key == "atom_to_token_idx":
+                feature_dict[key] = torch.cat([feat, lig_feat + num_tokens])
+            else:
+                feature_dict[key] = torch.cat([feat, lig_feat])
+
+        centre_atom_index = token_array.get_annotation("centre_atom_index")
+        feature_dict["token_index"] = torch.arange(0, len(token_array))
+        feature_dict["entity_id"] = torch.Tensor(
+            atom_array.entity_id_int[centre_atom_index]
+        ).long()
+
+        token_array_with_frame = Featurizer.get_token_frame(
+            token_array=token_array,
+            atom_array=atom_array,
+            ref_pos=feature_dict["ref_pos"],
+            ref_mask=feature_dict["ref_mask"],
+        )
+        feature_dict["has_frame"] = torch.Tensor(
+            token_array_with_frame.get_annotation("has_frame")
+        ).long()
+        feature_dict["frame_atom_index"] = torch.Tensor(
+            token_array_with_frame.get_annotation("frame_atom_index")
+        ).long()
+        return feature_dict, atom_array, token_array
+
+    def get_msa_feature(
+        self, token_array: TokenArray, atom_array: AtomArray
+    ) -> dict[str, np.ndarray]:
+        """
+        Append the MSA columns of the ligand tokens to the receptor MSA features.
+        Like tokenize_msa(), the ligand tokens copy their restype to every MSA row,
+        have no deletion and a one-hot profile.
+
+        Args:
+            token_array (TokenArray): token array of the receptor in complex with the ligand.
+            atom_array (AtomArray): atom array of the receptor in complex with the ligand.
+
+        Returns:
+            dict[str, np.ndarray]: the tokenized MSA features, or an empty dictionary
+                if the receptor has no MSA features.
+        """
+        if len(self.msa_features) == 0:
+            return {}
+
+        lig_centre_atom_index = token_array.get_annotation("centre_atom_index")[
+            len(self.token_array) :
+        ]
+        restypes = np.array(
+            [
+                STD_RESIDUES[res_name]
+                for res_name in atom_array.cano_seq_resname[lig_centre_atom_index]
+            ],
+            dtype=self.msa_features["msa"].dtype,
+        )
+        num_msa_seq = self.msa_features["msa"].shape[0]
+        num_lig_tokens = len(restypes)
+
+        msa_features = {}
+        msa_features["msa"] = np.concatenate(
+            [
+                self.msa_features["msa"],
+                np.repeat(restypes[None, ...], num_msa_seq, axis=0),
+            ],
+            axis=1,
+        )
+        for feat_name in ["has_deletion", "deletion_value"]:
+            feat = self.msa_features[feat_name]
+            msa_features[feat_name] = np.concatenate(
+                [feat, np.zeros((num_msa_seq, num_lig_tokens), dtype=feat.dtype)],
+                axis=1,
+            )
+        msa_features["deletion_mean"] = np.concatenate(
+            [self.msa_features["deletion_mean"], np.zeros((num_lig_tokens,))]
+        )
+        lig_profile = np.zeros((num_lig_tokens, 32))
+        lig_profile[np.arange(num_lig_tokens), restypes] = 1
+        msa_features["profile"] = np.concatenate(
+            [self.msa_features["profile"], lig_profile]
+        )
+        return msa_features
+
+
 class InferenceDataset(Dataset):
     def __init__(
         self,
         input_json_path: str,
         dump_dir: str,
         use_msa: bool = True,
+        use_receptor_template: bool = False,
     ) -> None:
 
         self.input_json_path = input_json_path
         self.dump_dir = dump_dir
         self.use_msa = use_msa
+        self.use_receptor_template = use_receptor_template
+        # (receptor key, ReceptorTemplate) of the latest ligand-swap job
+        self.receptor_template = None
         with open(self.input_json_path, "r") as f:
             self.inputs = json.load(f)
 
+    def get_receptor_template(
+        self, single_sample_dict: Mapping[str, Any]
+    ) -> tuple[Optional[ReceptorTemplate], Optional[dict[str, Any]]]:
+        """
+        Get the receptor template of a ligand-swap job, reusing the one
+        built for the previous job if it has the same receptor.
+
+        Args:
+            single_sample_dict (Mapping[str, Any]): a job dict from the input JSON.
+
+        Returns:
+            tuple[Optional[ReceptorTemplate], Optional[dict[str, Any]]]: the receptor template
+                and the ligand entity dict, or (None, None) if the job can not be split.
+        """
+        split = ReceptorTemplate.split_sample_dict(single_sample_dict)
+        if split is None:
+            return None, None
+        receptor_sample_dict, ligand_entity = split
+
+        receptor_key = json.dumps(receptor_sample_dict, sort_keys=True)
+        if self.receptor_template is None or self.receptor_template[0] != receptor_key:
+            self.receptor_template = (
+                receptor_key,
+                ReceptorTemplate(receptor_sample_dict, use_msa=self.use_msa),
+            )
+        return self.receptor_template[1], ligand_entity
+
     def process_one(
         self,
         single_sample_dict: Mapping[str, Any],
@@ -98,28 +425,42 @@ class InferenceDataset(Dataset):
         """
         # general features
         t0 = time.time()
-        sample2feat = SampleDictToFeatures(
-            single_sample_dict,
+        receptor_template, ligand_entity = (
+            self.get_receptor_template(single_sample_dict)
+            if self.use_receptor_template
+            else (None, None)
         )
-        features_dict, atom_array, token_array = sample2feat.get_feature_dict()
+        if receptor_template is not None:
+            features_dict, atom_array, token_array = receptor_template.get_feature_dict(
+                ligand_entity
+            )
+            entity_poly_type = receptor_template.entity_poly_type
+        else:
+            sample2feat = SampleDictToFeatures(
+                single_sample_dict,
+            )
+            features_dict, atom_array, token_array = sample2feat.get_feature_dict()
+            entity_poly_type = sample2feat.entity_poly_type
         features_dict["distogram_rep_atom_mask"] = torch.Tensor(
             atom_array.distogram_rep_atom_mask
         ).long()
-        entity_poly_type = sample2feat.entity_poly_type
         t1 = time.time()
 
         # Msa features
-        entity_to_asym_id = DataPipeline.get_label_entity_id_to_asym_id_int(atom_array)
-        msa_features = (
-            InferenceMSAFeaturizer.make_msa_feature(
+        if not self.use_msa:
+            msa_features = {}
+        elif receptor_template is not None:
+            msa_features = receptor_template.get_msa_feature(token_array, atom_array)
+        else:
+            entity_to_asym_id = DataPipeline.get_label_entity_id_to_asym_id_int(
+                atom_array
+            )
+            msa_features = InferenceMSAFeaturizer.make_msa_feature(
                 bioassembly=single_sample_dict["sequences"],
                 entity_to_asym_id=entity_to_asym_id,
                 token_array=token_array,
                 atom_array=atom_array,
             )
-            if self.use_msa
-            else {}
-        )
 
         # Make dummy features for not implemented features
         dummy_feats = ["template"]
@@ -14,6 +14,7 @@
 
 import concurrent.futures
 import copy
+import json
 import logging
 import random
 import warnings
@@ -600,13 +601,24 @@ def add_entity_atom_array(single_job_dict: dict) -> dict:
     single_job_dict = copy.deepcopy(single_job_dict)
     sequences = single_job_dict["sequences"]
     smiles_ligand_count = 0
+    # Polymer entities with the same sequence and modifications are built once
+    polymer_atom_infos = {}
     for entity_info in sequences:
-        if info := entity_info.get("proteinChain"):
-            atom_info = build_polymer(entity_info)
-        elif info := entity_info.get("dnaSequence"):
-            atom_info = build_polymer(entity_info)
-        elif info := entity_info.get("rnaSequence"):
-            atom_info = build_polymer(entity_info)
+        if (
+            (info := entity_info.get("proteinChain"))
+            or (info := entity_info.get("dnaSequence"))
+            or (info := entity_info.get("rnaSequence"))
+        ):
+            polymer_key = json.dumps(
+                {
+                    poly_type: {k: v for k, v in poly_info.items() if k != "count"}
+                    for poly_type, poly_info in entity_info.items()
+                },
+                sort_keys=True,
+            )
+            if polymer_key not in polymer_atom_infos:
+                polymer_atom_infos[polymer_key] = build_polymer(entity_info)
+            atom_info = polymer_atom_infos[polymer_key]
         elif info := entity_info.get("ligand"):
             atom_info = build_ligand(entity_info)
             if not info["ligand"].startswith("CCD_"):
@@ -12,9 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import copy
 import logging
 
+import biotite.structure as struc
 import numpy as np
 import torch
 from biotite.structure import AtomArray
@@ -71,9 +71,40 @@ class SampleDictToFeatures:
                     ]
         return entity_poly_type
 
+    @staticmethod
+    def tile_atom_array(atom_array: AtomArray, count: int) -> AtomArray:
+        """
+        Tile an AtomArray into `count` consecutive copies.
+        Annotations and coordinates are repeated, and the bond list of each copy
+        is offset by the number of atoms in the preceding copies.
+
+        Args:
+            atom_array (AtomArray): Biotite Atom array of one copy.
+            count (int): Number of copies.
+
+        Returns:
+            AtomArray: Biotite Atom array of all copies.
+        """
+        num_atoms = len(atom_array)
+        tiled_array = AtomArray(num_atoms * count)
+        tiled_array.coord = np.tile(atom_array.coord, (count, 1))
+        for category in atom_array.get_annotation_categories():
+            annot = atom_array.get_annotation(category)
+            tiled_array.set_annotation(
+                category, np.tile(annot, (count,) + (1,) * (annot.ndim - 1))
+            )
+        if atom_array.bonds is not None:
+            bonds = atom_array.bonds.as_array().astype(np.int64)
+            offsets = np.repeat(np.arange(count) * num_atoms, len(bonds))
+            tiled_bonds = np.tile(bonds, (count, 1))
+            tiled_bonds[:, :2] += offsets[:, None]
+            tiled_array.bonds = struc.BondList(num_atoms * count, tiled_bonds)
+        return tiled_array
+
     def build_full_atom_array(self) -> AtomArray:
         """
         By assembling the AtomArray of each entity, a complete AtomArray is created.
+        The AtomArray of an entity is built once and tiled into its "count" asym chains.
 
         Returns:
             AtomArray: Biotite Atom array.
@@ -83,23 +114,23 @@ class SampleDictToFeatures:
         for idx, type2entity_dict in enumerate(self.input_dict["sequences"]):
             for entity_type, entity in type2entity_dict.items():
                 entity_id = str(idx + 1)
-
-                entity_atom_array = None
-                for asym_chain_count in range(1, entity["count"] + 1):
-                    asym_id_str = int_to_letters(asym_chain_idx + 1)
-                    asym_chain = copy.deepcopy(entity["atom_array"])
-                    chain_id = [asym_id_str] * len(asym_chain)
-                    copy_id = [asym_chain_count] * len(asym_chain)
-                    asym_chain.set_annotation("label_asym_id", chain_id)
-                    asym_chain.set_annotation("auth_asym_id", chain_id)
-                    asym_chain.set_annotation("chain_id", chain_id)
-                    asym_chain.set_annotation("label_seq_id", asym_chain.res_id)
-                    asym_chain.set_annotation("copy_id", copy_id)
-                    if entity_atom_array is None:
-                        entity_atom_array = asym_chain
-                    else:
-                        entity_atom_array += asym_chain
-                    asym_chain_idx += 1
+                count = entity["count"]
+                chain_length = len(entity["atom_array"])
+
+                entity_atom_array = self.tile_atom_array(entity["atom_array"], count)
+                asym_id_strs = [
+                    int_to_letters(asym_chain_idx + i + 1) for i in range(count)
+                ]
+                chain_id = np.repeat(asym_id_strs, chain_length)
+                copy_id = np.repeat(np.arange(1, count + 1), chain_length)
+                entity_atom_array.set_annotation("label_asym_id", chain_id)
+                entity_atom_array.set_annotation("auth_asym_id", chain_id)
+                entity_atom_array.set_annotation("chain_id", chain_id)
+                entity_atom_array.set_annotation(
+                    "label_seq_id", entity_atom_array.res_id
+                )
+                entity_atom_array.set_annotation("copy_id", copy_id)
+                asym_chain_idx += count
 
                 entity_atom_array.set_annotation(
                     "label_entity_id", [entity_id] * len(entity_atom_array)
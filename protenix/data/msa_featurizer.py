@@ -26,6 +26,7 @@ import numpy as np
 import torch
 from biotite.structure import AtomArray
 
+from configs.configs_data import data_configs
 from protenix.data.constants import STD_RESIDUES, rna_order_with_x
 from protenix.data.msa_utils import (
     PROT_TYPE_NAME,
@@ -1067,7 +1068,11 @@ class InferenceMSAFeaturizer(object):
                 msa_info["pairing_db"] = "uniprot"
                 msa_sequences[idx] = (sequence, pairing_db_fpath, non_pairing_db_fpath)
         if len(msa_sequences) > 0:
-            msa_dirs.update(msa_parallel(msa_sequences))
+            msa_dirs.update(
+                msa_parallel(
+                    msa_sequences, cache_dir=data_configs["msa_search_cache_dir"]
+                )
+            )
 
         for idx, (sequence, entity_id_list) in enumerate(sequence_to_entity.items()):
 
@@ -1096,7 +1101,7 @@ class InferenceMSAFeaturizer(object):
                     for fname in os.listdir(dst_dir):
                         if not fname.endswith(".a3m"):
                             os.remove(opjoin(dst_dir, fname))
-                else:
+                elif not data_configs["msa_search_cache_dir"]:
                     shutil.rmtree(msa_dir)
 
         all_chain_features = {
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import logging
 import os
 import shutil
@@ -20,6 +21,7 @@ import subprocess
 import time
 import uuid
 from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from os.path import exists as opexists
 from typing import (
     Any,
@@ -1335,7 +1337,7 @@ def run_msa_tool(
     return result
 
 
-def search_msa(sequence: str, db_fpath: str, res_fpath: str = ""):
+def search_msa(sequence: str, db_fpath: str, res_fpath: str = "", n_cpu: int = 2):
     assert opexists(
         db_fpath
     ), f"Database path for MSA searching does not exists:\n{db_fpath}"
@@ -1345,7 +1347,7 @@ def search_msa(sequence: str, db_fpath: str, res_fpath: str = ""):
     msa_runner = jackhmmer.Jackhmmer(
         binary_path=jackhmmer_binary_path,
         database_path=db_fpath,
-        n_cpu=2,
+        n_cpu=n_cpu,
     )
     if res_fpath == "":
         tmp_dir = f"/tmp/{uuid.uuid4().hex}"
@@ -1380,37 +1382,239 @@ def search_msa(sequence: str, db_fpath: str, res_fpath: str = ""):
         return
 
 
+def jackhmmer_search_paired(
+    sequence: str,
+    pairing_db_fpath: str,
+    non_pairing_db_fpath: str,
+    res_dir: str,
+    n_cpu: int = 2,
+) -> bool:
+    """
+    Search the pairing and non-pairing MSA of a sequence with jackhmmer.
+    This is the default search backend of MSASearchScheduler.
+
+    Args:
+        sequence (str): protein sequence.
+        pairing_db_fpath (str): database for the MSA used in pairing.
+        non_pairing_db_fpath (str): database for the non-pairing MSA.
+        res_dir (str): directory to write "pairing.a3m" and "non_pairing.a3m" to.
+        n_cpu (int): number of CPUs used by jackhmmer.
+
+    Returns:
+        bool: whether both MSAs are found.
+    """
+    for db_fpath, fname in [
+        (pairing_db_fpath, "pairing.a3m"),
+        (non_pairing_db_fpath, "non_pairing.a3m"),
+    ]:
+        res_fpath = os.path.join(res_dir, fname)
+        search_msa(sequence, db_fpath, res_fpath, n_cpu=n_cpu)
+        if not os.path.exists(res_fpath):
+            return False
+    return True
+
+
 def search_msa_paired(
-    sequence: str, pairing_db_fpath: str, non_pairing_db_fpath: str, idx: int = -1
+    sequence: str,
+    pairing_db_fpath: str,
+    non_pairing_db_fpath: str,
+    idx: int = -1,
+    n_cpu: int = 2,
 ) -> tuple[Union[str, None], int]:
     tmp_dir = f"/tmp/{uuid.uuid4().hex}_{str(time.time()).replace('.', '_')}_{DIST_WRAPPER.rank}_{idx}"
     os.makedirs(tmp_dir, exist_ok=True)
-    pairing_file = os.path.join(tmp_dir, "pairing.a3m")
-    search_msa(sequence, pairing_db_fpath, pairing_file)
-    if not os.path.exists(pairing_file):
-        return None, idx
-    non_pairing_file = os.path.join(tmp_dir, "non_pairing.a3m")
-    search_msa(sequence, non_pairing_db_fpath, non_pairing_file)
-    if not os.path.exists(non_pairing_file):
-        return None, idx
-    else:
+    if jackhmmer_search_paired(
+        sequence, pairing_db_fpath, non_pairing_db_fpath, tmp_dir, n_cpu=n_cpu
+    ):
         return tmp_dir, idx
+    return None, idx
+
+
+def get_num_cpus() -> int:
+    """Number of CPUs available to this process."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class MSASearchScheduler(object):
+    """
+    Search the pairing and non-pairing MSAs of a batch of protein sequences.
+
+    Queries are deduplicated over the batch, and if `cache_dir` is given the results are
+    kept in "{cache_dir}/{key}" where key is the sha256 of the sequence and the databases,
+    so a query is searched only once across jobs and runs. The searches run in a thread
+    pool sized to the available CPUs.
+    """
+
+    # Threads used by one search; jackhmmer gains little beyond this
+    MAX_CPUS_PER_SEARCH = 8
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        search_fn: Callable[[str, str, str, str, int], bool] = jackhmmer_search_paired,
+        num_workers: Optional[int] = None,
+        n_cpu: Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            cache_dir (Optional[str]): directory of the persistent result cache.
+                If None, results are written to new temporary directories.
+            search_fn (Callable[[str, str, str, str, int], bool]): search backend called as
+                search_fn(sequence, pairing_db_fpath, non_pairing_db_fpath, res_dir, n_cpu),
+                which writes "pairing.a3m" and "non_pairing.a3m" to res_dir and returns
+                whether it succeeded.
+            num_workers (Optional[int]): number of concurrent searches. Defaults to the
+                available CPUs divided by n_cpu.
+            n_cpu (Optional[int]): number of CPUs used by one search. Defaults to sharing
+                the available CPUs among the searches, at most MAX_CPUS_PER_SEARCH.
+        """
+        self.cache_dir = cache_dir
+        self.search_fn = search_fn
+        self.num_workers = num_workers
+        self.n_cpu = n_cpu
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(sequence: str, pairing_db_fpath: str, non_pairing_db_fpath: str) -> str:
+        """
+        Hash a query to the name of its cache entry.
+
+        Args:
+            sequence (str): protein sequence.
+            pairing_db_fpath (str): database for the MSA used in pairing.
+            non_pairing_db_fpath (str): database for the non-pairing MSA.
+
+        Returns:
+            str: sha256 hex digest of the query.
+        """
+        query = "\n".join(
+            [
+                sequence,
+                os.path.abspath(pairing_db_fpath),
+                os.path.abspath(non_pairing_db_fpath),
+            ]
+        )
+        return hashlib.sha256(query.encode()).hexdigest()
+
+    def get_cached_dir(self, key: str) -> Optional[str]:
+        """
+        Args:
+            key (str): cache key of a query.
+
+        Returns:
+            Optional[str]: the cached result directory of the query, or None if it is not cached.
+        """
+        if not self.cache_dir:
+            return None
+        res_dir = os.path.join(self.cache_dir, key)
+        if all(
+            opexists(os.path.join(res_dir, fname))
+            for fname in ["pairing.a3m", "non_pairing.a3m"]
+        ):
+            return res_dir
+        return None
+
+    def get_num_workers(self, num_queries: int) -> tuple[int, int]:
+        """
+        Size the thread pool and the CPUs of each search to the available CPUs.
+
+        Args:
+            num_queries (int): number of queries to search.
+
+        Returns:
+            tuple[int, int]: number of concurrent searches and CPUs of each search.
+        """
+        num_cpus = get_num_cpus()
+        n_cpu = self.n_cpu or max(
+            1, min(self.MAX_CPUS_PER_SEARCH, num_cpus // max(num_queries, 1))
+        )
+        num_workers = self.num_workers or max(1, num_cpus // n_cpu)
+        return max(1, min(num_workers, num_queries)), n_cpu
+
+    def search_one(
+        self, key: str, query: tuple[str, str, str], n_cpu: int
+    ) -> Optional[str]:
+        """
+        Search a query and commit the result to the cache.
+
+        Args:
+            key (str): cache key of the query.
+            query (tuple[str, str, str]): sequence, pairing and non-pairing database paths.
+            n_cpu (int): number of CPUs used by the search.
+
+        Returns:
+            Optional[str]: the result directory, or None if the search failed.
+        """
+        if not self.cache_dir:
+            res_dir = f"/tmp/{uuid.uuid4().hex}_{key[:16]}_{DIST_WRAPPER.rank}"
+            os.makedirs(res_dir, exist_ok=True)
+            return res_dir if self.search_fn(*query, res_dir, n_cpu) else None
+
+        # Search into a private directory and rename it, so that concurrent
+        # processes sharing the cache never see a partial result.
+        tmp_dir = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            if not self.search_fn(*query, tmp_dir, n_cpu):
+                return None
+            for fname in os.listdir(tmp_dir):
+                if not fname.endswith(".a3m"):
+                    os.remove(os.path.join(tmp_dir, fname))
+            try:
+                os.rename(tmp_dir, os.path.join(self.cache_dir, key))
+            except OSError:
+                # The query has been cached by another process
+                pass
+            return self.get_cached_dir(key)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def search(
+        self, sequences: Mapping[int, tuple[str, str, str]]
+    ) -> dict[int, Optional[str]]:
+        """
+        Search MSAs for a batch of queries.
+
+        Args:
+            sequences (Mapping[int, tuple[str, str, str]]): query index to
+                (sequence, pairing_db_fpath, non_pairing_db_fpath).
+
+        Returns:
+            dict[int, Optional[str]]: query index to the directory containing "pairing.a3m"
+                and "non_pairing.a3m", or None if the search failed.
+                Queries with the same sequence and databases share one directory.
+        """
+        keys = {idx: self.get_key(*query) for idx, query in sequences.items()}
+        key_to_res_dir = {}
+        pending = {}
+        for idx, key in keys.items():
+            if key in key_to_res_dir or key in pending:
+                continue
+            if (res_dir := self.get_cached_dir(key)) is not None:
+                key_to_res_dir[key] = res_dir
+            else:
+                pending[key] = sequences[idx]
+        logger.info(
+            f"Searching MSA for {len(pending)} queries, "
+            f"{len(sequences) - len(pending)} are duplicated or cached"
+        )
 
-
-def msa_parallel(sequences: dict[int, tuple[str, str, str]]) -> dict[int, str]:
-    from concurrent.futures import ThreadPoolExecutor
-
-    num_threads = 4
-    results = []
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        futures = [
-            executor.submit(search_msa_paired, seq[0], seq[1], seq[2], idx)
-            for idx, seq in sequences.items()
-        ]
-        # Wait for all threads to complete
-        for future in futures:
-            results.append(future.result())
-    msa_res = {}
-    for x in results:
-        msa_res[x[1]] = x[0]
-    return msa_res
+        if len(pending) > 0:
+            num_workers, n_cpu = self.get_num_workers(len(pending))
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                futures = {
+                    key: executor.submit(self.search_one, key, query, n_cpu)
+                    for key, query in pending.items()
+                }
+                for key, future in futures.items():
+                    key_to_res_dir[key] = future.result()
+        return {idx: key_to_res_dir[key] for idx, key in keys.items()}
+
+
+def msa_parallel(
+    sequences: dict[int, tuple[str, str, str]], cache_dir: Optional[str] = None
+) -> dict[int, str]:
+    return MSASearchScheduler(cache_dir=cache_dir).search(sequences)
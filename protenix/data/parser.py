@@ -1985,17 +1985,10 @@ class AddAtomArrayAnnot(object):
         """
         # [N_atom, 2]
         chain_res_id = np.vstack((atom_array.asym_id_int, atom_array.res_id)).T
-        unique_id = np.unique(chain_res_id, axis=0)
-
-        mapping_dict = {}
-        for idx, chain_res_id_pair in enumerate(unique_id):
-            asym_id_int, res_id = chain_res_id_pair
-            mapping_dict[(asym_id_int, res_id)] = idx
-
-        ref_space_uid = [
-            mapping_dict[(asym_id_int, res_id)] for asym_id_int, res_id in chain_res_id
-        ]
-        atom_array.set_annotation("ref_space_uid", ref_space_uid)
+        _unique_id, ref_space_uid = np.unique(
+            chain_res_id, axis=0, return_inverse=True
+        )
+        atom_array.set_annotation("ref_space_uid", ref_space_uid.reshape(-1))
         return atom_array
 
     @staticmethod
@@ -2232,15 +2225,21 @@ class AddAtomArrayAnnot(object):
         AtomArray: The AtomArray object with the 'tokatom_idx' annotation added.
         """
         # pre-defined atom name order for tokatom_idx
-        tokatom_idx_list = []
-        for atom in atom_array:
-            atom_name_position = RES_ATOMS_DICT.get(atom.res_name, None)
-            if atom.mol_type == "ligand" or atom_name_position is None:
-                tokatom_idx = 0
-            else:
-                tokatom_idx = atom_name_position[atom.atom_name]
-            tokatom_idx_list.append(tokatom_idx)
-        atom_array.set_annotation("tokatom_idx", tokatom_idx_list)
+        tokatom_idx = np.zeros(len(atom_array), dtype=int)
+        for res_name in np.unique(atom_array.res_name):
+            atom_name_position = RES_ATOMS_DICT.get(res_name, None)
+            if atom_name_position is None:
+                continue
+            res_mask = (atom_array.res_name == res_name) & (
+                atom_array.mol_type != "ligand"
+            )
+            atom_names, inverse = np.unique(
+                atom_array.atom_name[res_mask], return_inverse=True
+            )
+            tokatom_idx[res_mask] = np.array(
+                [atom_name_position[atom_name] for atom_name in atom_names], dtype=int
+            )[inverse]
+        atom_array.set_annotation("tokatom_idx", tokatom_idx)
         return atom_array
 
     @staticmethod
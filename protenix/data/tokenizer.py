@@ -61,98 +61,267 @@ class Token(object):
 
 class TokenArray(object):
     """
-    A group of Token objects used for batch operations.
+    A group of tokens stored column-wise for batch operations.
+
+    Token values and per-token annotations (e.g. centre_atom_index) are kept as
+    NumPy arrays whose first axis is the token axis. The ragged annotations
+    "atom_indices" and "atom_names" are stored flat in CSR style: the atoms of
+    token i are atom_indices[atom_offsets[i]:atom_offsets[i + 1]].
+
+    Indexing with an integer returns a detached Token object, modifying it does
+    not change the TokenArray. Use set_annotation to update annotations.
     """
 
-    def __init__(self, tokens: list[Token]):
-        self.tokens = tokens
+    RAGGED_CATEGORIES = ("atom_indices", "atom_names")
+
+    def __init__(self, tokens: list[Token] = None):
+        tokens = [] if tokens is None else list(tokens)
+        self._values = np.array([token.value for token in tokens], dtype=int)
+        self._atom_offsets = np.zeros(len(tokens) + 1, dtype=int)
+        self._annot = {}
+        self._ragged_annot = {}
+        if len(tokens) == 0:
+            return
+
+        categories = tokens[0]._annot.keys()
+        if "atom_indices" in categories:
+            self._atom_offsets[1:] = np.cumsum(
+                [len(token._annot["atom_indices"]) for token in tokens]
+            )
+        for category in categories:
+            values = [token._annot[category] for token in tokens]
+            if category in self.RAGGED_CATEGORIES:
+                self._ragged_annot[category] = np.concatenate(
+                    [np.asarray(v) for v in values]
+                )
+            else:
+                self._annot[category] = np.array(values)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        values: np.ndarray,
+        atom_offsets: np.ndarray,
+        atom_indices: np.ndarray,
+        atom_names: np.ndarray = None,
+        **annotations,
+    ) -> "TokenArray":
+        """
+        Create a TokenArray directly from columnar data.
+
+        Args:
+            values (np.ndarray): The token values. Size=[N_token]
+            atom_offsets (np.ndarray): CSR offsets into atom_indices. Size=[N_token + 1]
+            atom_indices (np.ndarray): Flat atom indices of all tokens. Size=[N_token_atom]
+            atom_names (np.ndarray, optional): Flat atom names aligned with atom_indices.
+            **annotations: Other per-token annotations, first axis of size N_token.
+
+        Returns:
+            TokenArray: The created TokenArray.
+        """
+        token_array = cls()
+        token_array._values = np.asarray(values, dtype=int)
+        token_array._atom_offsets = np.asarray(atom_offsets, dtype=int)
+        assert len(token_array._atom_offsets) == len(token_array._values) + 1
+        token_array._ragged_annot["atom_indices"] = np.asarray(atom_indices, dtype=int)
+        if atom_names is not None:
+            token_array._ragged_annot["atom_names"] = np.asarray(atom_names)
+        for category, values in annotations.items():
+            token_array.set_annotation(category, values)
+        return token_array
+
+    def __setstate__(self, state):
+        if "tokens" in state:
+            # TokenArray pickled before the columnar layout was introduced
+            state = TokenArray(state["tokens"]).__dict__
+        self.__dict__.update(state)
 
     def __repr__(self):
         repr_str = "TokenArray(\n"
-        for token in self.tokens:
+        for token in self:
             repr_str += f"\t{token}\n"
         repr_str += ")"
         return repr_str
 
     def __len__(self):
-        return len(self.tokens)
+        return len(self._values)
 
     def __iter__(self):
-        for token in self.tokens:
-            yield token
+        for i in range(len(self)):
+            yield self[i]
 
     def __getitem__(self, index):
-        if isinstance(index, int):
-            return self.tokens[index]
-        else:
-            return TokenArray([self.tokens[i] for i in index])
+        if isinstance(index, (int, np.integer)):
+            return self._get_token(int(index))
+        if not isinstance(index, slice):
+            index = np.asarray(index)
+            if index.dtype != bool:
+                index = index.astype(int)
+        token_indices = np.arange(len(self))[index]
+        return self._select(token_indices)
+
+    @property
+    def tokens(self) -> list[Token]:
+        return list(self)
+
+    @property
+    def atom_offsets(self) -> np.ndarray:
+        """
+        CSR offsets of the ragged annotations. Size=[N_token + 1]
+        """
+        return self._atom_offsets
+
+    def _get_token(self, index: int) -> Token:
+        token = Token(self._values[index].item())
+        start, stop = self._atom_offsets[index], self._atom_offsets[index + 1]
+        for category, values in self._ragged_annot.items():
+            token._annot[category] = values[start:stop].tolist()
+        for category, values in self._annot.items():
+            token._annot[category] = values[index].tolist()
+        return token
+
+    def _select(self, token_indices: np.ndarray) -> "TokenArray":
+        atom_nums = self.get_atom_nums()[token_indices]
+        new_offsets = np.zeros(len(token_indices) + 1, dtype=int)
+        new_offsets[1:] = np.cumsum(atom_nums)
+        # Position of each selected atom in the flat ragged arrays
+        flat_indices = np.repeat(
+            self._atom_offsets[token_indices] - new_offsets[:-1], atom_nums
+        ) + np.arange(new_offsets[-1])
+
+        token_array = TokenArray()
+        token_array._values = self._values[token_indices]
+        token_array._atom_offsets = new_offsets
+        token_array._ragged_annot = {
+            k: v[flat_indices] for k, v in self._ragged_annot.items()
+        }
+        token_array._annot = {k: v[token_indices] for k, v in self._annot.items()}
+        return token_array
 
     def get_annotation(self, category):
-        return [token._annot[category] for token in self.tokens]
+        if category in self._ragged_annot:
+            return np.split(self._ragged_annot[category], self._atom_offsets[1:-1])
+        return self._annot[category]
+
+    def get_flat_annotation(self, category) -> np.ndarray:
+        """
+        Get a ragged annotation (atom_indices or atom_names) as one flat array,
+        to be used together with atom_offsets.
+        """
+        return self._ragged_annot[category]
+
+    def set_flat_annotation(self, category, values: np.ndarray):
+        """
+        Set a ragged annotation (atom_indices or atom_names) from one flat array
+        laid out by atom_offsets.
+        """
+        assert (
+            len(values) == self._atom_offsets[-1]
+        ), "Length of values must match the number of token atoms"
+        self._ragged_annot[category] = np.asarray(values)
 
     def set_annotation(self, category, values):
         assert len(values) == len(
-            self.tokens
+            self
         ), "Length of values must match the number of tokens"
-        for token, value in zip(self.tokens, values):
-            token._annot[category] = value
+        if category in self.RAGGED_CATEGORIES:
+            atom_nums = np.array([len(v) for v in values], dtype=int)
+            assert np.array_equal(
+                atom_nums, self.get_atom_nums()
+            ), f"Lengths of {category} must match the atom number of each token"
+            self._ragged_annot[category] = np.concatenate(
+                [np.asarray(v) for v in values]
+            )
+        else:
+            self._annot[category] = np.asarray(values)
 
     def get_values(self):
-        return [token.value for token in self.tokens]
+        return self._values
+
+    def get_atom_nums(self) -> np.ndarray:
+        """
+        Get the number of atoms of each token. Size=[N_token]
+        """
+        return np.diff(self._atom_offsets)
+
+    def get_atom_to_token_index(self, num_atoms: int = None) -> np.ndarray:
+        """
+        Map each atom index covered by the tokens to the index of its token.
+
+        Args:
+            num_atoms (int, optional): Size of the output. Defaults to the number of token atoms.
+
+        Returns:
+            np.ndarray: The token index of each atom, -1 for atoms without a token.
+        """
+        atom_indices = self._ragged_annot["atom_indices"]
+        if num_atoms is None:
+            num_atoms = len(atom_indices)
+        atom_to_token_index = np.full(num_atoms, -1, dtype=int)
+        atom_to_token_index[atom_indices] = np.repeat(
+            np.arange(len(self)), self.get_atom_nums()
+        )
+        return atom_to_token_index
+
+
+def _lookup(mapping: dict, keys: np.ndarray) -> np.ndarray:
+    """
+    Map an array of keys to their values in a dict, looking up each unique key once.
+    """
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    unique_values = np.array([mapping[k] for k in unique_keys], dtype=int)
+    return unique_values[inverse]
 
 
 class AtomArrayTokenizer(object):
     """
-    Tokenize an AtomArray object into a list of Token object.
+    Tokenize an AtomArray object into a TokenArray object.
     """
 
     def __init__(self, atom_array: AtomArray):
         self.atom_array = atom_array
 
-    def tokenize(self) -> list[Token]:
+    def tokenize(self) -> TokenArray:
         """
         Ref: AlphaFold3 SI Chapter 2.6
-        Tokenize an AtomArray object into a list of Token object.
+        Tokenize an AtomArray object into a TokenArray.
+        A standard residue is one token, each atom of a ligand or
+        a non-standard residue is a token on its own.
 
         Returns:
-           list : a list of Token object.
-        """
-        tokens = []
-        total_atom_num = 0
-        for res in struc.residue_iter(self.atom_array):
-            atom_num = len(res)
-            first_atom = res[0]
-            res_name = first_atom.res_name
-            mol_type = first_atom.mol_type
-            res_token = STD_RESIDUES.get(res_name, None)
-            if res_token is not None and mol_type != "ligand":
-                # for std residues
-                token = Token(res_token)
-                atom_indices = [
-                    i for i in range(total_atom_num, total_atom_num + atom_num)
-                ]
-                atom_names = [self.atom_array[i].atom_name for i in atom_indices]
-                token.atom_indices = atom_indices
-                token.atom_names = atom_names
-                tokens.append(token)
-                total_atom_num += atom_num
-            else:
-                # for ligand and non-std residues
-                for atom in res:
-                    atom_elem = atom.element
-                    atom_token = ELEMS.get(atom_elem, None)
-                    if atom_token is None:
-                        raise ValueError(f"Unknown atom element: {atom_elem}")
-                    token = Token(atom_token)
-                    token.atom_indices = [total_atom_num]
-                    token.atom_names = [
-                        self.atom_array[token.atom_indices[0]].atom_name
-                    ]
-                    tokens.append(token)
-                    total_atom_num += 1
-
-        assert total_atom_num == len(self.atom_array)
-        return tokens
+           TokenArray: TokenArray object with atom_indices and atom_names.
+        """
+        num_atoms = len(self.atom_array)
+        res_starts = struc.get_residue_starts(self.atom_array, add_exclusive_stop=True)
+        res_first_atoms = res_starts[:-1]
+        is_std_res = np.isin(
+            self.atom_array.res_name[res_first_atoms], list(STD_RESIDUES.keys())
+        ) & (self.atom_array.mol_type[res_first_atoms] != "ligand")
+        atom_in_std_res = np.repeat(is_std_res, np.diff(res_starts))
+
+        token_start_mask = ~atom_in_std_res
+        token_start_mask[res_first_atoms] = True
+        token_starts = np.flatnonzero(token_start_mask)
+        is_std_token = atom_in_std_res[token_starts]
+
+        values = np.zeros(len(token_starts), dtype=int)
+        # for std residues
+        values[is_std_token] = _lookup(
+            STD_RESIDUES, self.atom_array.res_name[token_starts[is_std_token]]
+        )
+        # for ligand and non-std residues
+        atom_elems = self.atom_array.element[token_starts[~is_std_token]]
+        unknown_elems = atom_elems[~np.isin(atom_elems, list(ELEMS.keys()))]
+        if len(unknown_elems) > 0:
+            raise ValueError(f"Unknown atom element: {unknown_elems[0]}")
+        values[~is_std_token] = _lookup(ELEMS, atom_elems)
+
+        return TokenArray.from_arrays(
+            values=values,
+            atom_offsets=np.append(token_starts, num_atoms),
+            atom_indices=np.arange(num_atoms),
+            atom_names=self.atom_array.atom_name,
+        )
 
     def _set_token_annotations(self, token_array: TokenArray) -> TokenArray:
         """
@@ -190,7 +359,6 @@ class AtomArrayTokenizer(object):
                 Token($token_index,  atom_indices=[global_atom_indexs],
                     centre_atom_index=global_atom_indexs,atom_names=[names])
         """
-        tokens = self.tokenize()
-        token_array = TokenArray(tokens=tokens)
+        token_array = self.tokenize()
         token_array = self._set_token_annotations(token_array=token_array)
         return token_array
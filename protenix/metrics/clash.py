@@ -19,6 +19,7 @@ import torch
 import torch.nn as nn
 
 from protenix.data.constants import rdkit_vdws
+from protenix.utils.geometry import get_neighbor_pairs
 
 RDKIT_VDWS = torch.tensor(rdkit_vdws)
 ID2TYPE = {0: "UNK", 1: "lig", 2: "prot", 3: "dna", 4: "rna"}
@@ -166,6 +167,33 @@ class Clash(nn.Module):
             )
         return clash_atom_pairs
 
+    def get_clash_candidate_pairs(
+        self, pred_coordinate: torch.Tensor, search_radius: torch.Tensor
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """
+        Find the atom pairs closer than the search radius of the first atom with a KD-tree,
+        without the dense [N_atom, N_atom] distances.
+
+        Args:
+            pred_coordinate (torch.Tensor): the coordinates of one sample
+                [N_atom, 3]
+            search_radius (torch.Tensor): the search radius of each atom
+                [N_atom]
+
+        Returns:
+            tuple[torch.Tensor, torch.Tensor]: the indices of the two atoms of each pair,
+                sorted by the first then the second atom.
+                [N_pair], [N_pair]
+        """
+        coordinate = pred_coordinate.detach().cpu().double().numpy()
+        l_index, m_index = get_neighbor_pairs(
+            coordinate, coordinate, search_radius.cpu().double().numpy()
+        )
+        return (
+            torch.from_numpy(l_index).to(pred_coordinate.device),
+            torch.from_numpy(m_index).to(pred_coordinate.device),
+        )
+
     def _check_clash_per_chain_pairs(
         self,
         pred_coordinate,
@@ -178,38 +206,42 @@ class Clash(nn.Module):
         mol_id: Optional[torch.Tensor] = None,
         asym_id_to_mol_id: Optional[torch.Tensor] = None,
     ):
+        """
+        Check the clashes between all pairs of chains. The inter-chain atom pairs under the
+        thresholds are found in one neighbor search per sample, and counted per chain pair.
+        """
         device = pred_coordinate.device
         N_sample = pred_coordinate.shape[0]
 
-        # initialize results
-        if self.compute_af3_clash:
-            has_af3_clash_flag = torch.zeros(
-                N_sample, N_chains, N_chains, device=device, dtype=torch.bool
-            )
-            af3_clash_details = torch.zeros(
-                N_sample, N_chains, N_chains, 2, device=device, dtype=torch.bool
-            )
-        if self.compute_vdw_clash:
-            has_vdw_clash_flag = torch.zeros(
-                N_sample, N_chains, N_chains, device=device, dtype=torch.bool
-            )
-            vdw_clash_details = {}
+        # Chain of each atom
+        atom_asym_id = (
+            torch.stack([asym_id_to_asym_mask[i] for i in range(N_chains)])
+            .int()
+            .argmax(dim=0)[atom_to_token_idx]
+        )
+        N_chain_atom = torch.bincount(atom_asym_id, minlength=N_chains)
 
+        # Chain pairs to check
+        is_known = torch.tensor(
+            [chain_type != "UNK" for chain_type in chain_types], device=device
+        )
+        is_ligand_chain = torch.tensor(
+            [chain_type == "lig" for chain_type in chain_types], device=device
+        )
+        check_pair = is_known[:, None] & is_known[None, :]
+        # AF3 clash only consider polymer chains
+        check_af3_pair = check_pair & ~(
+            is_ligand_chain[:, None] | is_ligand_chain[None, :]
+        )
+        check_vdw_pair = check_pair.clone()
         skipped_pairs = []
-        for sample_id in range(N_sample):
+        if self.compute_vdw_clash:
             for i in range(N_chains):
-                if chain_types[i] == "UNK":
-                    continue
-                atom_chain_mask_i = asym_id_to_asym_mask[i][atom_to_token_idx]
-                N_chain_i = torch.sum(atom_chain_mask_i).item()
                 for j in range(i + 1, N_chains):
-                    if chain_types[j] == "UNK":
-                        continue
                     chain_pair_type = set([chain_types[i], chain_types[j]])
                     # Skip potential bonded ligand to polymers
-                    skip_bonded_ligand = False
                     if (
-                        self.compute_vdw_clash
+                        check_pair[i, j]
                         and "lig" in chain_pair_type
                         and len(chain_pair_type) > 1
                         and asym_id_to_mol_id[i] == asym_id_to_mol_id[j]
@@ -218,52 +250,103 @@ class Clash(nn.Module):
                         logging.warning(
                             f"mol_id {common_mol_id} may contain bonded ligand to polymers"
                         )
-                        skip_bonded_ligand = True
+                        check_vdw_pair[i, j] = check_vdw_pair[j, i] = False
                         skipped_pairs.append((i, j))
-                    atom_chain_mask_j = asym_id_to_asym_mask[j][atom_to_token_idx]
-                    N_chain_j = torch.sum(atom_chain_mask_j).item()
-                    if self.compute_vdw_clash and not skip_bonded_ligand:
-                        vdw_clash_pairs = self.get_chain_pair_violations(
-                            pred_coordinate=pred_coordinate[sample_id, :, :],
-                            violation_type="vdw",
-                            chain_1_mask=atom_chain_mask_i,
-                            chain_2_mask=atom_chain_mask_j,
-                            elements_one_hot=elements_one_hot,
-                        )
-                        if vdw_clash_pairs.shape[0] > 0:
-                            vdw_clash_details[(sample_id, i, j)] = vdw_clash_pairs
-                            has_vdw_clash_flag[sample_id, i, j] = True
-                            has_vdw_clash_flag[sample_id, j, i] = True
-                    if (
-                        chain_types[i] == "lig" or chain_types[j] == "lig"
-                    ):  # AF3 clash only consider polymer chains
-                        continue
-                    if self.compute_af3_clash:
-                        af3_clash_pairs = self.get_chain_pair_violations(
-                            pred_coordinate=pred_coordinate[sample_id, :, :],
-                            violation_type="af3",
-                            chain_1_mask=atom_chain_mask_i,
-                            chain_2_mask=atom_chain_mask_j,
-                        )
-                        total_clash = af3_clash_pairs.shape[0]
-                        relative_clash = total_clash / min(N_chain_i, N_chain_j)
-                        af3_clash_details[sample_id, i, j, 0] = total_clash
-                        af3_clash_details[sample_id, i, j, 1] = relative_clash
-                        has_af3_clash_flag[sample_id, i, j] = (
-                            total_clash > 100 or relative_clash > 0.5
-                        )
-                        af3_clash_details[sample_id, j, i, :] = af3_clash_details[
-                            sample_id, i, j, :
-                        ]
-                        has_af3_clash_flag[sample_id, j, i] = has_af3_clash_flag[
-                            sample_id, i, j
-                        ]
+
+        # Search radius covering both clash criteria
+        search_radius = torch.zeros(atom_asym_id.shape, device=device)
+        if self.compute_af3_clash:
+            search_radius.fill_(self.af3_clash_threshold)
+        if self.compute_vdw_clash:
+            vdw_radii = get_vdw_radii(elements_one_hot)
+            search_radius = torch.maximum(
+                search_radius,
+                self.vdw_clash_threshold * (vdw_radii + vdw_radii.max()),
+            )
+        # The exact criteria are applied to the pairs found, with a margin for rounding
+        search_radius = search_radius + 1e-3
+
+        # initialize results
+        if self.compute_af3_clash:
+            has_af3_clash_flag = torch.zeros(
+                N_sample, N_chains, N_chains, device=device, dtype=torch.bool
+            )
+            af3_clash_details = torch.zeros(
+                N_sample, N_chains, N_chains, 2, device=device, dtype=torch.bool
+            )
+        if self.compute_vdw_clash:
+            has_vdw_clash_flag = torch.zeros(
+                N_sample, N_chains, N_chains, device=device, dtype=torch.bool
+            )
+            vdw_clash_details = {}
+
+        for sample_id in range(N_sample):
+            l_index, m_index = self.get_clash_candidate_pairs(
+                pred_coordinate[sample_id], search_radius
+            )
+            # Inter-chain pairs, the atom of the chain with the smaller index first
+            chain_l, chain_m = atom_asym_id[l_index], atom_asym_id[m_index]
+            is_inter_chain = chain_l < chain_m
+            l_index, m_index = l_index[is_inter_chain], m_index[is_inter_chain]
+            chain_l, chain_m = chain_l[is_inter_chain], chain_m[is_inter_chain]
+            chain_pair_index = chain_l * N_chains + chain_m
+            pred_dist = torch.norm(
+                pred_coordinate[sample_id, l_index]
+                - pred_coordinate[sample_id, m_index],
+                dim=-1,
+            )  # [N_pair]
+
+            if self.compute_vdw_clash:
+                relative_vdw_distance = pred_dist / (
+                    vdw_radii[l_index] + vdw_radii[m_index]
+                )
+                is_clash = (relative_vdw_distance < self.vdw_clash_threshold) & (
+                    check_vdw_pair[chain_l, chain_m]
+                )
+                # Group the clashed pairs by chain pair, keeping the atom order in a group
+                order = torch.argsort(chain_pair_index[is_clash], stable=True)
+                clash_chain_pair_index, counts = torch.unique_consecutive(
+                    chain_pair_index[is_clash][order], return_counts=True
+                )
+                clash_atom_pairs = torch.stack(
+                    (
+                        l_index[is_clash][order],
+                        m_index[is_clash][order],
+                        relative_vdw_distance[is_clash][order],
+                    ),
+                    dim=-1,
+                )
+                for index, vdw_clash_pairs in zip(
+                    clash_chain_pair_index.tolist(),
+                    torch.split(clash_atom_pairs, counts.tolist()),
+                ):
+                    i, j = divmod(index, N_chains)
+                    vdw_clash_details[(sample_id, i, j)] = vdw_clash_pairs
+                    has_vdw_clash_flag[sample_id, i, j] = True
+                    has_vdw_clash_flag[sample_id, j, i] = True
+
+            if self.compute_af3_clash:
+                is_clash = (pred_dist < self.af3_clash_threshold) & (
+                    check_af3_pair[chain_l, chain_m]
+                )
+                total_clash = torch.bincount(
+                    chain_pair_index[is_clash], minlength=N_chains * N_chains
+                ).reshape(N_chains, N_chains)
+                total_clash = total_clash + total_clash.T
+                relative_clash = total_clash / torch.minimum(
+                    N_chain_atom[:, None], N_chain_atom[None, :]
+                ).clamp(min=1)
+                af3_clash_details[sample_id, :, :, 0] = total_clash
+                af3_clash_details[sample_id, :, :, 1] = relative_clash
+                has_af3_clash_flag[sample_id] = check_af3_pair & (
+                    (total_clash > 100) | (relative_clash > 0.5)
+                )
         return {
             "summary": {
                 "af3_clash": has_af3_clash_flag if self.compute_af3_clash else None,
                 "vdw_clash": has_vdw_clash_flag if self.compute_vdw_clash else None,
                 "chain_types": chain_types,
-                "skipped_pairs": skipped_pairs,
+                "skipped_pairs": skipped_pairs * N_sample,
             },
             "details": {
                 "af3_clash": af3_clash_details if self.compute_af3_clash else None,
@@ -67,6 +67,34 @@ class LDDTMetrics(nn.Module):
             "complex_ranker_keys", ["plddt", "gpde", "ranking_score"]
         )
 
+    def get_label_pairs(
+        self, label_dict: dict
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """get the lddt atom pairs and their true distances
+
+        Args:
+            label_dict (Dict): a dictionary containing
+                coordinate: [N_atom, 3]
+                lddt_mask: [N_atom, N_atom]
+                or lddt_pair_indices: [2, N_pair]
+
+        Returns:
+            tuple[torch.Tensor, torch.Tensor, torch.Tensor]: l_index, m_index and true distance
+                [N_pair], [N_pair], [N_pair]
+        """
+        true_coordinate = label_dict["coordinate"]
+        if label_dict.get("lddt_pair_indices") is not None:
+            l_index, m_index = label_dict["lddt_pair_indices"]
+        else:
+            l_index, m_index = torch.nonzero(label_dict["lddt_mask"], as_tuple=True)
+        true_distance = torch.norm(
+            true_coordinate.index_select(-2, l_index)
+            - true_coordinate.index_select(-2, m_index),
+            p=2,
+            dim=-1,
+        )  # [N_pair]
+        return l_index, m_index, true_distance
+
     def compute_lddt(self, pred_dict: dict, label_dict: dict):
         """compute complex-level and chain/interface-level lddt
 
@@ -76,15 +104,18 @@ class LDDTMetrics(nn.Module):
             label_dict (Dict): a dictionary containing
                 coordinate: [N_sample, N_atom, 3]
                 lddt_mask: [N_atom, N_atom]
+                or lddt_pair_indices: [2, N_pair]
         """
 
         out = {}
 
         # Complex-level
-        lddt = self.lddt_base.forward(
+        l_index, m_index, true_distance = self.get_label_pairs(label_dict)
+        lddt = self.lddt_base.forward_pairs(
             pred_coordinate=pred_dict["coordinate"],
-            true_coordinate=label_dict["coordinate"],
-            lddt_mask=label_dict["lddt_mask"],
+            l_index=l_index,
+            m_index=m_index,
+            true_distance=true_distance,
             chunk_size=self.chunk_size,
         )  # [N_sample]
         out["complex"] = lddt
@@ -206,12 +237,46 @@ class LDDT(nn.Module):
         )  # [N_sample, N_pair_sparse]
         return pred_distance_sparse_lm, true_distance_sparse_lm
 
+    def forward_pairs(
+        self,
+        pred_coordinate: torch.Tensor,
+        l_index: torch.Tensor,
+        m_index: torch.Tensor,
+        true_distance: torch.Tensor,
+        chunk_size: Optional[int] = None,
+    ) -> torch.Tensor:
+        """LDDT of given atom pairs whose true distances are known
+
+        Args:
+            pred_coordinate (torch.Tensor): the pred coordinates
+                [N_sample, N_atom, 3]
+            l_index (torch.Tensor): the first atoms of the pairs
+                [N_pair]
+            m_index (torch.Tensor): the second atoms of the pairs
+                [N_pair]
+            true_distance (torch.Tensor): the true distances of the pairs
+                [N_pair]
+            chunk_size (Optional[int]): Chunk size over the N_sample dimension. Defaults to None.
+
+        Returns:
+            torch.Tensor: lddt
+                [N_sample]
+        """
+        pred_distance = torch.norm(
+            pred_coordinate.index_select(-2, l_index)
+            - pred_coordinate.index_select(-2, m_index),
+            p=2,
+            dim=-1,
+        )  # [N_sample, N_pair]
+        return self._chunk_forward(pred_distance, true_distance, chunk_size=chunk_size)
+
     def forward(
         self,
         pred_coordinate: torch.Tensor,
         true_coordinate: torch.Tensor,
-        lddt_mask: torch.Tensor,
+        lddt_mask: Optional[torch.Tensor] = None,
         chunk_size: Optional[int] = None,
+        lddt_pair_indices: Optional[torch.Tensor] = None,
     ) -> dict[str, torch.Tensor]:
         """LDDT: evaluated on complex, chains and interfaces
         sparse implementation, which largely reduce cuda memory when atom num reaches 10^4 +
@@ -224,15 +289,22 @@ class LDDT(nn.Module):
             lddt_mask (torch.Tensor):
                 sparse version of [N_atom, N_atom] atompair mask based on bespoke radius of true distance
                 [N_nonzero_mask, 2]
+            chunk_size (Optional[int]): Chunk size over the N_sample dimension. Defaults to None.
+            lddt_pair_indices (torch.Tensor, optional): the (l, m) indices of the nonzero lddt_mask,
+                used instead of lddt_mask if given.
+                [2, N_pair]
 
         Returns:
             Dict[str, torch.Tensor]:
                 "best": [N_eval]
                 "worst": [N_eval]
         """
-        lddt_indices = torch.nonzero(lddt_mask, as_tuple=True)
-        l_index = lddt_indices[0]
-        m_index = lddt_indices[1]
+        if lddt_pair_indices is not None:
+            l_index, m_index = lddt_pair_indices[0], lddt_pair_indices[1]
+        else:
+            lddt_indices = torch.nonzero(lddt_mask, as_tuple=True)
+            l_index = lddt_indices[0]
+            m_index = lddt_indices[1]
         pred_distance_sparse_lm, true_distance_sparse_lm = self._calc_sparse_dist(
             pred_coordinate, true_coordinate, l_index, m_index
         )
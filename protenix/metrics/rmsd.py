@@ -52,6 +52,36 @@ def rmsd(
     return rmsd
 
 
+def optimal_rotation(
+    H_mat: torch.Tensor, allowing_reflection: bool = False
+) -> torch.Tensor:
+    """Find the optimal rotation (and reflection) from the covariance matrix of two centered poses.
+    Arguments:
+        H_mat: [..., 3, 3] sum of the (weighted) outer products of the pred and true atoms
+        allowing_reflection: whether to allow reflection when finding optimal alignment
+    return:
+        rot: [..., 3, 3] optimal rotation
+    """
+    u, s, v = torch.svd(H_mat)
+    u = u.transpose(-1, -2)
+
+    if not allowing_reflection:
+
+        det = torch.linalg.det(torch.matmul(v, u))
+
+        diagonal = torch.stack(
+            [torch.ones_like(det), torch.ones_like(det), det], dim=-1
+        )
+        rot = torch.matmul(
+            torch.diag_embed(diagonal).to(u.device),
+            u,
+        )
+        rot = torch.matmul(v, rot)
+    else:
+        rot = torch.matmul(v, u)
+    return rot
+
+
 def align_pred_to_true(
     pred_pose: torch.Tensor,
     true_pose: torch.Tensor,
@@ -97,23 +127,7 @@ def align_pred_to_true(
         (pred_pose_centered * weight.unsqueeze(-1)).transpose(-2, -1),
         true_pose_centered * atom_mask.unsqueeze(-1),
     )
-    u, s, v = torch.svd(H_mat)
-    u = u.transpose(-1, -2)
-
-    if not allowing_reflection:
-
-        det = torch.linalg.det(torch.matmul(v, u))
-
-        diagonal = torch.stack(
-            [torch.ones_like(det), torch.ones_like(det), det], dim=-1
-        )
-        rot = torch.matmul(
-            torch.diag_embed(diagonal).to(u.device),
-            u,
-        )
-        rot = torch.matmul(v, rot)
-    else:
-        rot = torch.matmul(v, u)
+    rot = optimal_rotation(H_mat, allowing_reflection=allowing_reflection)
     translate = true_pose_centroid - torch.matmul(
         pred_pose_centroid, rot.transpose(-1, -2)
     )
@@ -125,6 +139,93 @@ def align_pred_to_true(
     return pred_pose_translated, rot, translate
 
 
+def _segment_sum(
+    x: torch.Tensor, segment_ids: torch.Tensor, num_segments: int, dim: int
+) -> torch.Tensor:
+    shape = list(x.shape)
+    shape[dim] = num_segments
+    return x.new_zeros(shape).index_add_(dim, segment_ids, x)
+
+
+def segment_align_pred_to_true(
+    pred_pose: torch.Tensor,
+    true_pose: torch.Tensor,
+    segment_ids: torch.Tensor,
+    num_segments: Optional[int] = None,
+    atom_mask: Optional[torch.Tensor] = None,
+    weight: Optional[torch.Tensor] = None,
+    allowing_reflection: bool = False,
+    eps: float = 0.0,
+):
+    """Align many groups of atoms at once, e.g. chains, anchors or pockets of different sizes.
+    Each group is aligned as align_pred_to_true would align it alone, with one batched SVD.
+    Poses with a single group, batched over the leading dims, use align_pred_to_true directly.
+    Arguments:
+        pred_pose: [..., N, 3] the poses to perform transformation on, the atoms of all groups
+        true_pose: [..., N, 3] the target poses to align pred_pose to
+        segment_ids: [N] the group of each atom, in [0, num_segments)
+        num_segments: the number of groups, defaults to segment_ids.max() + 1
+        atom_mask: [..., N] a mask for atoms
+        weight: [..., N] a weight vector to be applied in the alignment.
+        allowing_reflection: whether to allow reflection when finding optimal alignment
+        eps: add a tolerance to avoid floating number issue in sqrt
+    return:
+        rot: [..., num_segments, 3, 3] optimal rotation of each group
+        translate: [..., num_segments, 1, 3] optimal translation of each group
+        rmsd: [..., num_segments] the rmsd of the masked atoms of each group after alignment
+    """
+    if num_segments is None:
+        num_segments = segment_ids.max().item() + 1
+    batch_shape = torch.broadcast_shapes(pred_pose.shape, true_pose.shape)
+    pred_pose = pred_pose.expand(batch_shape)
+    true_pose = true_pose.expand(batch_shape)
+    if atom_mask is None:
+        atom_mask = torch.ones(batch_shape[:-1], device=pred_pose.device)
+    else:
+        atom_mask = atom_mask.to(pred_pose.dtype).expand(batch_shape[:-1])
+    if weight is None:
+        weight = atom_mask
+    else:
+        weight = weight * atom_mask
+
+    # Weighted centroids of each group
+    weighted_n_atoms = _segment_sum(weight, segment_ids, num_segments, dim=-1)
+    pred_pose_centroid = _segment_sum(
+        pred_pose * weight.unsqueeze(-1), segment_ids, num_segments, dim=-2
+    ) / weighted_n_atoms.unsqueeze(
+        -1
+    )  # [..., num_segments, 3]
+    true_pose_centroid = _segment_sum(
+        true_pose * weight.unsqueeze(-1), segment_ids, num_segments, dim=-2
+    ) / weighted_n_atoms.unsqueeze(-1)
+    pred_pose_centered = pred_pose - pred_pose_centroid[..., segment_ids, :]
+    true_pose_centered = true_pose - true_pose_centroid[..., segment_ids, :]
+
+    # Covariance of each group, the sum of the outer products of its atoms
+    H_mat = _segment_sum(
+        (pred_pose_centered * weight.unsqueeze(-1)).unsqueeze(-1)
+        * (true_pose_centered * atom_mask.unsqueeze(-1)).unsqueeze(-2),
+        segment_ids,
+        num_segments,
+        dim=-3,
+    )  # [..., num_segments, 3, 3]
+    rot = optimal_rotation(H_mat, allowing_reflection=allowing_reflection)
+    translate = true_pose_centroid - torch.matmul(
+        pred_pose_centroid.unsqueeze(-2), rot.transpose(-1, -2)
+    ).squeeze(-2)
+
+    # RMSD of each group after alignment
+    transformed_pose = (
+        torch.matmul(rot[..., segment_ids, :, :], pred_pose.unsqueeze(-1)).squeeze(-1)
+        + translate[..., segment_ids, :]
+    )
+    err_atom = torch.square(transformed_pose - true_pose).sum(dim=-1) * atom_mask
+    err_square = _segment_sum(
+        err_atom, segment_ids, num_segments, dim=-1
+    ) / _segment_sum(atom_mask, segment_ids, num_segments, dim=-1)
+    return rot, translate.unsqueeze(-2), err_square.add(eps).sqrt()
+
+
 def partially_aligned_rmsd(
     pred_pose: torch.Tensor,
     true_pose: torch.Tensor,
@@ -13,8 +13,10 @@
 # limitations under the License.
 
 import logging
+from collections import OrderedDict
 from typing import Any, Optional, Union
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -26,6 +28,7 @@ from protenix.model.modules.frames import (
 )
 from protenix.model.utils import expand_at_dim
 from protenix.openfold_local.utils.checkpointing import get_checkpoint_fn
+from protenix.utils.geometry import get_neighbor_pairs
 from protenix.utils.torch_utils import cdist
 
 
@@ -50,6 +53,141 @@ def loss_reduction(loss: torch.Tensor, method: str = "mean") -> torch.Tensor:
     return getattr(torch, method)(loss)
 
 
+# The number of pair elements ([..., N_sample, N_pair_chunk]) of the temporaries of
+# PairDistanceLossFunction and of the per-frame coordinates in PAELoss.calculate_label,
+# 2^24 elements take 64MB in fp32
+PAIR_CHUNK_NUMEL = 1 << 24
+LDDT_THRESHOLDS = [0.5, 1, 2, 4]
+
+
+def _pair_loss_and_grad(
+    dist_diff: torch.Tensor, loss_type: str, need_grad: bool
+) -> tuple[torch.Tensor, Optional[torch.Tensor]]:
+    # The per-pair loss term of the distance difference and its derivative
+    if loss_type == "smooth_lddt":
+        abs_diff = torch.abs(dist_diff)
+        value = 0
+        grad = 0
+        for threshold in LDDT_THRESHOLDS:
+            sigmoid = torch.sigmoid(threshold - abs_diff)
+            value = value + 0.25 * sigmoid
+            if need_grad:
+                grad = grad - 0.25 * sigmoid * (1 - sigmoid)
+        if need_grad:
+            grad = grad * torch.sign(dist_diff)
+    elif loss_type == "bond":
+        value = dist_diff**2
+        grad = 2 * dist_diff if need_grad else None
+    else:
+        raise ValueError(f"Unknown pair loss type: {loss_type}")
+    return value, (grad if need_grad else None)
+
+
+def _pair_chunks(pred_coordinate: torch.Tensor, N_pair: int) -> list[tuple[int, int]]:
+    N_batch = max(pred_coordinate[..., 0, 0].numel(), 1)
+    chunk_size = max(PAIR_CHUNK_NUMEL // N_batch, 1)
+    return [
+        (start, min(start + chunk_size, N_pair))
+        for start in range(0, N_pair, chunk_size)
+    ]
+
+
+class PairDistanceLossFunction(torch.autograd.Function):
+    """
+    The mean over atom pairs of a loss term of the pair distance error, for all samples at once.
+
+    The pairs are processed in chunks, the backward pass recomputes the distances of each
+    chunk and scatters the coordinate gradients, so neither the [..., N_sample, N_pair, 3]
+    pair coordinates nor the autograd graph of the pair terms are kept.
+    """
+
+    @staticmethod
+    def forward(
+        ctx,
+        pred_coordinate: torch.Tensor,
+        true_distance: torch.Tensor,
+        l_index: torch.Tensor,
+        m_index: torch.Tensor,
+        loss_type: str,
+    ) -> torch.Tensor:
+        ctx.save_for_backward(pred_coordinate, true_distance, l_index, m_index)
+        ctx.loss_type = loss_type
+        loss_sum = pred_coordinate.new_zeros(pred_coordinate.shape[:-2])
+        for start, end in _pair_chunks(pred_coordinate, l_index.numel()):
+            pred_distance = torch.norm(
+                pred_coordinate.index_select(-2, l_index[start:end])
+                - pred_coordinate.index_select(-2, m_index[start:end]),
+                dim=-1,
+            )  # [..., N_sample, N_pair_chunk]
+            value, _ = _pair_loss_and_grad(
+                pred_distance - true_distance[start:end], loss_type, need_grad=False
+            )
+            loss_sum += value.sum(dim=-1)
+        return loss_sum / l_index.numel()  # [..., N_sample]
+
+    @staticmethod
+    def backward(ctx, grad_output: torch.Tensor):
+        pred_coordinate, true_distance, l_index, m_index = ctx.saved_tensors
+        grad_coordinate = torch.zeros_like(pred_coordinate)
+        # d(mean)/d(pair term)
+        grad_output = (grad_output / l_index.numel()).unsqueeze(dim=-1)
+        for start, end in _pair_chunks(pred_coordinate, l_index.numel()):
+            l_index_i, m_index_i = l_index[start:end], m_index[start:end]
+            pred_vector = pred_coordinate.index_select(
+                -2, l_index_i
+            ) - pred_coordinate.index_select(
+                -2, m_index_i
+            )  # [..., N_sample, N_pair_chunk, 3]
+            pred_distance = torch.norm(pred_vector, dim=-1, keepdim=True)
+            _, grad = _pair_loss_and_grad(
+                pred_distance.squeeze(dim=-1) - true_distance[start:end],
+                ctx.loss_type,
+                need_grad=True,
+            )
+            # d(distance)/d(x_l) = (x_l - x_m) / distance, zero for coincident atoms
+            grad_vector = (grad * grad_output).unsqueeze(dim=-1) * (
+                pred_vector / pred_distance.clamp(min=1e-12)
+            )
+            grad_coordinate.index_add_(-2, l_index_i, grad_vector)
+            grad_coordinate.index_add_(-2, m_index_i, -grad_vector)
+        return grad_coordinate, None, None, None, None
+
+
+def pair_distance_loss(
+    pred_coordinate: torch.Tensor,
+    true_coordinate: torch.Tensor,
+    l_index: torch.Tensor,
+    m_index: torch.Tensor,
+    loss_type: str,
+) -> torch.Tensor:
+    """the mean over atom pairs of the smooth lddt or bond loss term, see PairDistanceLossFunction
+
+    Args:
+        pred_coordinate (torch.Tensor): the predicted atom coordinates
+            [..., N_sample, N_atom, 3]
+        true_coordinate (torch.Tensor): the ground truth atom coordinates
+            [N_atom, 3]
+        l_index (torch.Tensor): the first atom of each pair
+            [N_pair]
+        m_index (torch.Tensor): the second atom of each pair
+            [N_pair]
+        loss_type (str): "smooth_lddt" for the smooth lddt of the pair distance error,
+            "bond" for the squared pair distance error.
+
+    Returns:
+        torch.Tensor: the mean of the pair terms
+            [..., N_sample]
+    """
+    true_distance = torch.norm(
+        true_coordinate.index_select(-2, l_index)
+        - true_coordinate.index_select(-2, m_index),
+        dim=-1,
+    ).to(pred_coordinate.dtype)
+    return PairDistanceLossFunction.apply(
+        pred_coordinate, true_distance.detach(), l_index, m_index, loss_type
+    )
+
+
 class SmoothLDDTLoss(nn.Module):
     """
     Implements Algorithm 27 [SmoothLDDTLoss] in AF3
@@ -149,8 +287,10 @@ class SmoothLDDTLoss(nn.Module):
         self,
         pred_coordinate: torch.Tensor,
         true_coordinate: torch.Tensor,
-        lddt_mask: torch.Tensor,
+        lddt_mask: Optional[torch.Tensor] = None,
         diffusion_chunk_size: Optional[int] = None,
+        lddt_pair_indices: Optional[torch.Tensor] = None,
+        fused: bool = False,
     ) -> torch.Tensor:
         """SmoothLDDTLoss sparse implementation
 
@@ -162,12 +302,30 @@ class SmoothLDDTLoss(nn.Module):
             lddt_mask (torch.Tensor, optional): whether true distance is within radius (30A for nuc and 15A for others)
                 [N_atom, N_atom]
             diffusion_chunk_size (Optional[int]): Chunk size over the N_sample dimension. Defaults to None.
+            lddt_pair_indices (torch.Tensor, optional): the (l, m) indices of the nonzero lddt_mask,
+                used instead of lddt_mask if given. See compute_lddt_pair_indices.
+                [2, N_pair]
+            fused (bool): compute all samples at once with PairDistanceLossFunction,
+                diffusion_chunk_size is ignored. Defaults to False.
 
         Returns:
             torch.Tensor: the smooth lddt loss
                 [...] if reduction is None else []
         """
-        lddt_indices = torch.nonzero(lddt_mask, as_tuple=True)
+        if lddt_pair_indices is not None:
+            lddt_indices = (lddt_pair_indices[0], lddt_pair_indices[1])
+        else:
+            lddt_indices = torch.nonzero(lddt_mask, as_tuple=True)
+        if fused:
+            lddt = pair_distance_loss(
+                pred_coordinate,
+                true_coordinate,
+                lddt_indices[0],
+                lddt_indices[1],
+                loss_type="smooth_lddt",
+            )  # [..., N_sample]
+            lddt = lddt.mean(dim=-1)  # [...]
+            return 1 - loss_reduction(lddt, method=self.reduction)
         true_coords_l = true_coordinate.index_select(-2, lddt_indices[0])
         true_coords_m = true_coordinate.index_select(-2, lddt_indices[1])
         true_distance_sparse_lm = torch.norm(true_coords_l - true_coords_m, p=2, dim=-1)
@@ -370,9 +528,11 @@ class BondLoss(nn.Module):
         self,
         pred_coordinate: torch.Tensor,
         true_coordinate: torch.Tensor,
-        distance_mask: torch.Tensor,
+        distance_mask: Optional[torch.Tensor],
         bond_mask: torch.Tensor,
         per_sample_scale: torch.Tensor = None,
+        coordinate_mask: Optional[torch.Tensor] = None,
+        fused: bool = False,
     ) -> torch.Tensor:
         """BondLoss sparse implementation
 
@@ -381,19 +541,46 @@ class BondLoss(nn.Module):
                 [..., N_sample, N_atom, 3]
             true_coordinate (torch.Tensor): the ground truth atom coordinates
                 [..., N_atom, 3]
-            distance_mask (torch.Tensor): whether true coordinates exist.
+            distance_mask (torch.Tensor, optional): whether true coordinates exist.
                 [N_atom, N_atom] or [..., N_atom, N_atom]
             bond_mask (torch.Tensor): bonds considered in this loss
                 [N_atom, N_atom] or [..., N_atom, N_atom]
             per_sample_scale (torch.Tensor, optional): whether to scale the loss by the per-sample noise-level.
                 [..., N_sample]
+            coordinate_mask (torch.Tensor, optional): whether true coordinates exist, used if distance_mask is None.
+                [N_atom]
+            fused (bool): compute the loss with PairDistanceLossFunction. Defaults to False.
         Returns:
             torch.Tensor: the bond loss
                 [...] if reduction is None else []
         """
 
-        bond_mask = bond_mask * distance_mask
-        bond_indices = torch.nonzero(bond_mask, as_tuple=True)
+        if distance_mask is not None:
+            bond_mask = bond_mask * distance_mask
+            bond_indices = torch.nonzero(bond_mask, as_tuple=True)
+        else:
+            bond_indices = torch.nonzero(bond_mask, as_tuple=True)
+            coordinate_mask = coordinate_mask.bool()
+            is_valid = (
+                coordinate_mask[bond_indices[0]] & coordinate_mask[bond_indices[1]]
+            )
+            bond_indices = (bond_indices[0][is_valid], bond_indices[1][is_valid])
+        if fused:
+            # Protecting special data without bonds
+            if bond_indices[0].numel() == 0 or pred_coordinate.size(-3) == 0:
+                return torch.tensor(
+                    0.0, device=pred_coordinate.device, requires_grad=True
+                )
+            bond_loss = pair_distance_loss(
+                pred_coordinate,
+                true_coordinate,
+                bond_indices[0],
+                bond_indices[1],
+                loss_type="bond",
+            )  # [..., N_sample]
+            if per_sample_scale is not None:
+                bond_loss = bond_loss * per_sample_scale
+            return bond_loss.mean(dim=-1)  # [...]
         pred_coords_i = pred_coordinate.index_select(-2, bond_indices[0])
         pred_coords_j = pred_coordinate.index_select(-2, bond_indices[1])
         true_coords_i = true_coordinate.index_select(-2, bond_indices[0])
@@ -458,6 +645,109 @@ def compute_lddt_mask(
     return c_lm
 
 
+def compute_lddt_pair_indices(
+    true_coordinate: torch.Tensor,
+    coordinate_mask: torch.Tensor,
+    is_nucleotide: torch.Tensor,
+    is_nucleotide_threshold: float = 30.0,
+    is_not_nucleotide_threshold: float = 15.0,
+) -> torch.Tensor:
+    """calculate the (l, m) indices of the nonzero atom pair mask of compute_lddt_mask,
+    with a neighbor list instead of the dense [N_atom, N_atom] distances
+
+    Args:
+        true_coordinate (torch.Tensor): the ground truth coordinates
+            [N_atom, 3]
+        coordinate_mask (torch.Tensor): whether true coordinates exist.
+            [N_atom]
+        is_nucleotide (torch.Tensor): Indicator for nucleotide atoms.
+            [N_atom]
+        is_nucleotide_threshold (float): Threshold distance for nucleotide atoms. Defaults to 30.0.
+        is_not_nucleotide_threshold (float): Threshold distance for non-nucleotide atoms. Defaults to 15.0.
+
+    Returns:
+        torch.Tensor: the atom pair indices, sorted by l then m
+            [2, N_pair]
+    """
+    assert true_coordinate.dim() == 2
+    atom_indices = torch.nonzero(coordinate_mask.bool(), as_tuple=True)[0]
+    coordinate = true_coordinate[atom_indices].detach().double().cpu().numpy()
+    # The radius is decided by atom l
+    radius = torch.where(
+        is_nucleotide.bool()[atom_indices],
+        is_nucleotide_threshold,
+        is_not_nucleotide_threshold,
+    )
+    l_index, m_index = get_neighbor_pairs(coordinate, coordinate, radius.cpu().numpy())
+    is_not_diagonal = l_index != m_index
+    pair_indices = torch.from_numpy(
+        np.stack([l_index[is_not_diagonal], m_index[is_not_diagonal]])
+    ).to(atom_indices.device)
+    return atom_indices[pair_indices]
+
+
+def label_checksum(*tensors: torch.Tensor) -> tuple:
+    """a cheap fingerprint of the ground truth tensors, to validate cached labels
+
+    Args:
+        tensors (torch.Tensor): the tensors the labels are computed from
+
+    Returns:
+        tuple: the shapes, the sums and the position-weighted sums of the tensors
+    """
+    shapes, sums = [], []
+    for x in tensors:
+        shapes.append(tuple(x.shape))
+        x = x.detach().reshape(-1).double()
+        weight = torch.arange(1, x.numel() + 1, device=x.device, dtype=x.dtype)
+        sums.extend([x.sum(), (x * weight).sum()])
+    # Only the sums leave the device
+    return tuple(shapes), tuple(torch.stack(sums).tolist())
+
+
+class LDDTPairCache:
+    """LRU cache of the lddt atom pair indices of ground truth structures, in host memory.
+
+    The size of the cache is bounded in bytes, and the indices are kept as int32.
+    An entry is only reused if the checksum of its ground truth is unchanged.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, key: str, checksum: tuple) -> Optional[torch.Tensor]:
+        """get the cached pair indices
+
+        Args:
+            key (str): the key of the structure, e.g. the pdb_id.
+            checksum (tuple): the label_checksum of the ground truth.
+
+        Returns:
+            Optional[torch.Tensor]: the int32 pair indices [2, N_pair] on the host,
+                or None if missing or stale.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != checksum:
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def add(self, key: str, checksum: tuple, pair_indices: torch.Tensor):
+        """add the pair indices [2, N_pair] of a structure, evicting the least recently used"""
+        pair_indices = pair_indices.to(device="cpu", dtype=torch.int32)
+        num_bytes = pair_indices.numel() * pair_indices.element_size()
+        if num_bytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.num_bytes -= self.entries.pop(key)[2]
+        while self.entries and self.num_bytes + num_bytes > self.max_bytes:
+            self.num_bytes -= self.entries.popitem(last=False)[1][2]
+        self.entries[key] = (checksum, pair_indices, num_bytes)
+        self.num_bytes += num_bytes
+
+
 def softmax_cross_entropy(logits: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
     """Softmax cross entropy
 
@@ -478,6 +768,29 @@ def softmax_cross_entropy(logits: torch.Tensor, labels: torch.Tensor) -> torch.T
     return loss
 
 
+def softmax_cross_entropy_from_index(
+    logits: torch.Tensor, labels: torch.Tensor
+) -> torch.Tensor:
+    """Softmax cross entropy with the classes given as indices instead of one-hot labels
+
+    Args:
+        logits (torch.Tensor): classification logits
+            [..., num_class]
+        labels (torch.Tensor): classification labels (value = class index)
+            [...]
+
+    Returns:
+        torch.Tensor: softmax cross entropy
+            [...]
+    """
+    loss = F.cross_entropy(
+        logits.reshape(-1, logits.size(-1)),
+        labels.reshape(-1).long(),
+        reduction="none",
+    )
+    return loss.reshape(labels.shape)
+
+
 class DistogramLoss(nn.Module):
     """
     Implements DistogramLoss in AF3
@@ -650,8 +963,8 @@ class PDELoss(nn.Module):
                 [N_atom]
 
         Returns:
-            true_bins (torch.Tensor): distance error assigned into bins (one-hot).
-                [..., N_sample, N_token, N_token, no_bins]
+            true_bins (torch.Tensor): distance error assigned into bins (bin index).
+                [..., N_sample, N_token, N_token]
             pair_coordinate_mask (torch.Tensor): whether the coordinates of representative atom pairs exist.
                 [N_token, N_token] or [..., N_token, N_token]
         """
@@ -677,9 +990,9 @@ class PDELoss(nn.Module):
         dist_error = torch.abs(pred_dist - gt_dist.unsqueeze(dim=-3))
 
         # Assign distance error to bins
-        true_bins = torch.sum(
-            dist_error.unsqueeze(dim=-1) > boundaries, dim=-1
-        )  # range in [1, no_bins + 1], shape = [..., N_sample, N_token, N_token]
+        true_bins = torch.bucketize(
+            dist_error, boundaries
+        )  # range in [0, no_bins + 1], shape = [..., N_sample, N_token, N_token]
         true_bins = torch.clamp(
             true_bins, min=1, max=self.no_bins
         )  # just in case bin=0 occurs
@@ -688,7 +1001,7 @@ class PDELoss(nn.Module):
         token_mask = coordinate_mask[..., rep_atom_mask]
         pair_mask = token_mask[..., None] * token_mask[..., None, :]
 
-        return F.one_hot(true_bins - 1, self.no_bins).detach(), pair_mask.detach()
+        return (true_bins - 1).detach(), pair_mask.detach()
 
     def forward(
         self,
@@ -725,7 +1038,7 @@ class PDELoss(nn.Module):
                 rep_atom_mask=rep_atom_mask,
             )
 
-        errors = softmax_cross_entropy(
+        errors = softmax_cross_entropy_from_index(
             logits=logits,
             labels=true_bins,
         )  # [..., N_sample, N_token, N_token]
@@ -831,8 +1144,8 @@ class PAELoss(nn.Module):
         Returns:
             squared_pae (torch.Tensor): pairwise alignment error squared
                 [..., N_sample, N_frame, N_token] where N_token = rep_atom_mask.sum()
-            true_bins (torch.Tensor): the true bins
-                [..., N_sample, N_frame, N_token, no_bins]
+            true_bins (torch.Tensor): the true bins (bin index)
+                [..., N_sample, N_frame, N_token]
             frame_token_pair_mask (torch.Tensor): whether frame_i token_j both have true coordinates.
                 [N_frame, N_token]
         """
@@ -867,16 +1180,6 @@ class PAELoss(nn.Module):
             true_frame_coord_mask[..., None] * token_mask[..., None, :]
         )  # [N_frame, N_token]
 
-        squared_pae = (
-            compute_alignment_error_squared(
-                pred_coordinate=pred_coordinate[..., rep_atom_mask, :],
-                true_coordinate=true_coordinate[..., rep_atom_mask, :],
-                pred_frames=pred_frames,
-                true_frames=true_frames,
-            )
-            * frame_token_pair_mask
-        )  # [..., N_sample, N_frame, N_token]
-
         # Compute true bins
         boundaries = torch.linspace(
             start=self.min_bin,
@@ -886,21 +1189,42 @@ class PAELoss(nn.Module):
         )
         boundaries = boundaries**2
 
-        true_bins = torch.sum(
-            squared_pae.unsqueeze(dim=-1) > boundaries, dim=-1
-        )  # range [1, no_bins + 1]
-        true_bins = torch.where(
-            frame_token_pair_mask,
-            true_bins,
-            torch.ones_like(true_bins) * self.no_bins,
-        )
-        true_bins = torch.clamp(
-            true_bins, min=1, max=self.no_bins
-        )  # just in case bin=0 occurs
+        # Stream over blocks of frames, so that the token coordinates expressed in the frames
+        # ([..., N_sample, N_frame_chunk, N_token, 3]) are never built for all frames at once
+        pred_coordinate = pred_coordinate[..., rep_atom_mask, :]
+        true_coordinate = true_coordinate[..., rep_atom_mask, :]
+        frame_chunk_size = max(1, PAIR_CHUNK_NUMEL // pred_coordinate.numel())
+        squared_pae, true_bins = [], []
+        # At least one (possibly empty) block, for complexes without frames
+        for start in range(0, max(frame_atom_index.size(0), 1), frame_chunk_size):
+            end = start + frame_chunk_size
+            pair_mask_i = frame_token_pair_mask[start:end]
+            squared_pae_i = (
+                compute_alignment_error_squared(
+                    pred_coordinate=pred_coordinate,
+                    true_coordinate=true_coordinate,
+                    pred_frames=pred_frames[..., start:end, :, :],
+                    true_frames=true_frames[..., start:end, :, :],
+                )
+                * pair_mask_i
+            )  # [..., N_sample, N_frame_chunk, N_token]
+            true_bins_i = torch.bucketize(
+                squared_pae_i, boundaries
+            )  # range [0, no_bins + 1]
+            true_bins_i = torch.where(
+                pair_mask_i,
+                true_bins_i,
+                torch.ones_like(true_bins_i) * self.no_bins,
+            )
+            true_bins_i = torch.clamp(
+                true_bins_i, min=1, max=self.no_bins
+            )  # just in case bin=0 occurs
+            squared_pae.append(squared_pae_i)
+            true_bins.append(true_bins_i - 1)
 
         return (
-            squared_pae.detach(),
-            F.one_hot(true_bins - 1, self.no_bins).detach(),
+            torch.cat(squared_pae, dim=-2).detach(),
+            torch.cat(true_bins, dim=-2).detach(),
             frame_token_pair_mask.detach(),
         )
 
@@ -943,7 +1267,7 @@ class PAELoss(nn.Module):
         assert len(frame_atom_index.shape) == 2
 
         with torch.no_grad():
-            # true_bins: [..., N_sample, N_frame, N_token, no_bins]
+            # true_bins: [..., N_sample, N_frame, N_token]
             # pair_mask: [N_frame, N_token]
             _, true_bins, pair_mask = self.calculate_label(
                 pred_coordinate=pred_coordinate,
@@ -954,7 +1278,7 @@ class PAELoss(nn.Module):
                 has_frame=has_frame,
             )
 
-        loss = softmax_cross_entropy(
+        loss = softmax_cross_entropy_from_index(
             logits=logits[
                 ..., has_frame, :, :
             ],  # [..., N_sample, N_frame, N_token, no_bins]
@@ -1188,6 +1512,7 @@ class PLDDTLoss(nn.Module):
         eps: float = 1e-6,
         normalize: bool = True,
         reduction: str = "mean",
+        sparse: bool = False,
     ) -> None:
         """PLDDT loss
         This loss are between atoms l and m (has some filters) in the mini-rollout prediction
@@ -1200,8 +1525,11 @@ class PLDDTLoss(nn.Module):
             is_not_nucleotide_threshold (float, optional): threshold for non-nucleotide atoms. Defaults 15.0
             eps (float, optional): small number added to denominator. Defaults to 1e-6.
             reduction (str, optional): reduction method for the batch dims. Defaults to mean.
+            sparse (bool, optional): compute the lddt on a neighbor list of the atom pairs within
+                the radius, instead of the dense [N_atom, N_atom(m)] distances. Defaults to False.
         """
         super(PLDDTLoss, self).__init__()
+        self.sparse = sparse
         self.normalize = normalize
         self.min_bin = min_bin
         self.max_bin = max_bin
@@ -1237,7 +1565,147 @@ class PLDDTLoss(nn.Module):
             torch.Tensor: per-atom lddt
                 [..., N_sample, N_atom]
         """
+        if self.sparse:
+            per_atom_lddt = self.sparse_per_atom_lddt(
+                pred_coordinate=pred_coordinate,
+                true_coordinate=true_coordinate,
+                is_nucleotide=is_nucleotide,
+                is_polymer=is_polymer,
+                rep_atom_mask=rep_atom_mask,
+            )
+        else:
+            per_atom_lddt = self.dense_per_atom_lddt(
+                pred_coordinate=pred_coordinate,
+                true_coordinate=true_coordinate,
+                is_nucleotide=is_nucleotide,
+                is_polymer=is_polymer,
+                rep_atom_mask=rep_atom_mask,
+            )
+        # Distribute into bins
+        boundaries = torch.linspace(
+            start=self.min_bin,
+            end=self.max_bin,
+            steps=self.no_bins + 1,
+            device=true_coordinate.device,
+        )  # [N_bins]
+
+        true_bins = torch.sum(
+            per_atom_lddt > boundaries, dim=-1
+        )  # [...,  N_sample, N_atom], range in [1, no_bins]
+        true_bins = torch.clamp(
+            true_bins, min=1, max=self.no_bins
+        )  # just in case bin=0/no_bins+1 occurs
+        true_bins = F.one_hot(
+            true_bins - 1, self.no_bins
+        )  # [...,  N_sample, N_atom, N_bins]
+
+        return true_bins
+
+    def sparse_per_atom_lddt(
+        self,
+        pred_coordinate: torch.Tensor,
+        true_coordinate: torch.Tensor,
+        is_nucleotide: torch.Tensor,
+        is_polymer: torch.Tensor,
+        rep_atom_mask: torch.Tensor,
+    ) -> torch.Tensor:
+        """per-atom lddt over the atom pairs (l, m) within the radius of m,
+        found with a neighbor list of the true coordinates
+
+        Args:
+            pred_coordinate (torch.Tensor):
+                [..., N_sample, N_atom, 3]
+            true_coordinate (torch.Tensor):
+                [N_atom, 3]
+            is_nucleotide (torch.Tensor):
+                [N_atom]
+            is_polymer (torch.Tensor):
+                [N_atom]
+            rep_atom_mask (torch.Tensor):
+                [N_atom]
+
+        Returns:
+            torch.Tensor: per-atom lddt
+                [..., N_sample, N_atom, 1]
+        """
+        assert true_coordinate.dim() == 2
+        atom_m_index = torch.nonzero(
+            (rep_atom_mask * is_polymer).bool(), as_tuple=True
+        )[
+            0
+        ]  # [N_atom(m)]
+        # The radius is decided by atom m
+        radius = torch.where(
+            is_nucleotide.bool()[atom_m_index],
+            self.is_nucleotide_threshold,
+            self.is_not_nucleotide_threshold,
+        )
+        m_index, l_index = get_neighbor_pairs(
+            true_coordinate[atom_m_index].detach().double().cpu().numpy(),
+            true_coordinate.detach().double().cpu().numpy(),
+            radius.cpu().numpy(),
+        )
+        m_index = atom_m_index[torch.from_numpy(m_index).to(atom_m_index.device)]
+        l_index = torch.from_numpy(l_index).to(m_index.device)
+        # Remove self-distance computation
+        is_not_diagonal = l_index != m_index
+        l_index, m_index = l_index[is_not_diagonal], m_index[is_not_diagonal]
+
+        pred_d_lm = torch.norm(
+            pred_coordinate.index_select(-2, l_index)
+            - pred_coordinate.index_select(-2, m_index),
+            dim=-1,
+        )  # [..., N_sample, N_pair]
+        true_d_lm = torch.norm(
+            true_coordinate[l_index] - true_coordinate[m_index], dim=-1
+        )  # [N_pair]
+        delta_d_lm = torch.abs(pred_d_lm - true_d_lm)  # [..., N_sample, N_pair]
+
+        # Pair-wise lddt
+        thresholds = [0.5, 1, 2, 4]
+        lddt_lm = (
+            torch.stack([delta_d_lm < t for t in thresholds], dim=-1)
+            .to(dtype=delta_d_lm.dtype)
+            .mean(dim=-1)
+        )  # [..., N_sample, N_pair]
 
+        N_atom = true_coordinate.size(-2)
+        per_atom_lddt = lddt_lm.new_zeros(lddt_lm.shape[:-1] + (N_atom,)).index_add_(
+            -1, l_index, lddt_lm
+        )  # [..., N_sample, N_atom]
+        if self.normalize:
+            num_pairs = lddt_lm.new_zeros(N_atom).index_add_(
+                0, l_index, lddt_lm.new_ones(l_index.shape)
+            )  # [N_atom]
+            per_atom_lddt = per_atom_lddt / (num_pairs + self.eps)
+        return per_atom_lddt.unsqueeze(dim=-1)
+
+    def dense_per_atom_lddt(
+        self,
+        pred_coordinate: torch.Tensor,
+        true_coordinate: torch.Tensor,
+        is_nucleotide: torch.Tensor,
+        is_polymer: torch.Tensor,
+        rep_atom_mask: torch.Tensor,
+    ) -> torch.Tensor:
+        """per-atom lddt with the dense [N_atom, N_atom(m)] distances
+
+        Args:
+            pred_coordinate (torch.Tensor):
+                [..., N_sample, N_atom, 3]
+            true_coordinate (torch.Tensor):
+                [..., N_atom, 3]
+            is_nucleotide (torch.Tensor):
+                [N_atom] or [..., N_atom]
+            is_polymer (torch.Tensor):
+                [N_atom]
+            rep_atom_mask (torch.Tensor):
+                [N_atom]
+
+        Returns:
+            torch.Tensor: per-atom lddt
+                [..., N_sample, N_atom, 1]
+        """
         N_atom = true_coordinate.size(-2)
         atom_m_mask = (rep_atom_mask * is_polymer).bool()  # [N_atom]
         # Distance: d_lm
@@ -1289,25 +1757,7 @@ class PLDDTLoss(nn.Module):
                 torch.sum(pair_mask.to(dtype=per_atom_lddt.dtype), dim=-1, keepdim=True)
                 + self.eps
             )
-        # Distribute into bins
-        boundaries = torch.linspace(
-            start=self.min_bin,
-            end=self.max_bin,
-            steps=self.no_bins + 1,
-            device=true_coordinate.device,
-        )  # [N_bins]
-
-        true_bins = torch.sum(
-            per_atom_lddt > boundaries, dim=-1
-        )  # [...,  N_sample, N_atom], range in [1, no_bins]
-        true_bins = torch.clamp(
-            true_bins, min=1, max=self.no_bins
-        )  # just in case bin=0/no_bins+1 occurs
-        true_bins = F.one_hot(
-            true_bins - 1, self.no_bins
-        )  # [...,  N_sample, N_atom, N_bins]
-
-        return true_bins
+        return per_atom_lddt
 
     def forward(
         self,
@@ -1413,7 +1863,11 @@ class ProtenixLoss(nn.Module):
         }
 
         # Loss
-        self.plddt_loss = PLDDTLoss(**configs.loss.plddt, **self.lddt_radius)
+        self.plddt_loss = PLDDTLoss(
+            **configs.loss.plddt,
+            **self.lddt_radius,
+            sparse=configs.loss_metrics_sparse_enable,
+        )
         self.pde_loss = PDELoss(**configs.loss.pde)
         self.resolved_loss = ExperimentallyResolvedLoss(**configs.loss.resolved)
         self.pae_loss = PAELoss(**configs.loss.pae)
@@ -1421,17 +1875,67 @@ class ProtenixLoss(nn.Module):
         self.bond_loss = BondLoss(**configs.loss.diffusion.bond)
         self.smooth_lddt_loss = SmoothLDDTLoss(**configs.loss.diffusion.smooth_lddt)
         self.distogram_loss = DistogramLoss(**configs.loss.distogram)
+        # Lddt pairs of the evaluated ground truth structures, see calculate_label
+        self.lddt_pair_cache = LDDTPairCache(
+            max_bytes=int(configs.loss.get("lddt_pair_cache_gb", 0.0) * 2**30)
+        )
+
+    def get_lddt_pair_indices(
+        self,
+        label_dict: dict[str, Any],
+        is_nucleotide: torch.Tensor,
+        cache_key: Optional[str] = None,
+    ) -> torch.Tensor:
+        """get the lddt atom pairs of the ground truth, from the cache if possible
+
+        Args:
+            label_dict (dict): Label dictionary containing ground truth data.
+            is_nucleotide (torch.Tensor): Indicator for nucleotide atoms.
+                [N_atom]
+            cache_key (str, optional): the key of the ground truth in the cache of lddt pairs.
+                Defaults to None (not cached).
+
+        Returns:
+            torch.Tensor: the atom pair indices, see compute_lddt_pair_indices.
+                [2, N_pair]
+        """
+        use_cache = cache_key is not None and self.lddt_pair_cache.max_bytes > 0
+        if use_cache:
+            checksum = label_checksum(
+                label_dict["coordinate"],
+                label_dict["coordinate_mask"],
+                is_nucleotide,
+            )
+            pair_indices = self.lddt_pair_cache.get(cache_key, checksum)
+            if pair_indices is not None:
+                return pair_indices.to(
+                    label_dict["coordinate"].device, non_blocking=True
+                ).long()
+        pair_indices = compute_lddt_pair_indices(
+            true_coordinate=label_dict["coordinate"],
+            coordinate_mask=label_dict["coordinate_mask"],
+            is_nucleotide=is_nucleotide,
+            **self.lddt_radius,
+        )
+        if use_cache:
+            self.lddt_pair_cache.add(cache_key, checksum, pair_indices)
+        return pair_indices
 
     def calculate_label(
         self,
         feat_dict: dict[str, Any],
         label_dict: dict[str, Any],
+        cache_key: Optional[str] = None,
     ) -> dict[str, Any]:
         """calculate true distance, and atom pair mask
 
         Args:
             feat_dict (dict): Feature dictionary containing additional features.
             label_dict (dict): Label dictionary containing ground truth data.
+            cache_key (str, optional): the key of the ground truth in the cache of lddt pairs,
+                e.g. the pdb_id of an evaluated structure. If given and the sparse metrics
+                are enabled, the pairs are taken from the cache and lddt_mask of the dense
+                smooth lddt loss is scattered from them. Defaults to None (not cached).
 
         Returns:
             label_dict (dict): with the following updates:
@@ -1439,7 +1943,31 @@ class ProtenixLoss(nn.Module):
                     [..., N_atom, N_atom]
                 distance_mask (torch.Tensor): atom-atom mask indicating whether true distance exists.
                     [..., N_atom, N_atom]
+                lddt_mask (torch.Tensor): the atom pair mask of lddt.
+                    [..., N_atom, N_atom]
+                lddt_pair_indices (torch.Tensor): the (l, m) indices of the nonzero lddt_mask,
+                    instead of the dense masks if only sparse losses and metrics are used
+                    or if cache_key is given.
+                    [2, N_pair]
         """
+        is_nucleotide = feat_dict["is_rna"].bool() + feat_dict["is_dna"].bool()
+        if self.configs.loss_metrics_sparse_enable and (
+            cache_key is not None or not self.configs.loss.diffusion_lddt_loss_dense
+        ):
+            # Neighbor list of the true coordinates, the dense [N_atom, N_atom] distances
+            # and masks are not built. Evaluated structures always take this path, so
+            # the lddt metrics reuse the cached pairs whatever the training loss is
+            label_dict["lddt_pair_indices"] = self.get_lddt_pair_indices(
+                label_dict, is_nucleotide, cache_key
+            )
+            if self.configs.loss.diffusion_lddt_loss_dense:
+                # The dense smooth lddt loss takes the pairs as a mask
+                N_atom = label_dict["coordinate"].size(-2)
+                lddt_mask = label_dict["coordinate"].new_zeros(N_atom, N_atom)
+                lddt_mask[tuple(label_dict["lddt_pair_indices"])] = 1
+                label_dict["lddt_mask"] = lddt_mask
+            return label_dict
+
         # Distance mask
         distance_mask = (
             label_dict["coordinate_mask"][..., None]
@@ -1456,7 +1984,7 @@ class ProtenixLoss(nn.Module):
         lddt_mask = compute_lddt_mask(
             true_distance=distance,
             distance_mask=distance_mask,
-            is_nucleotide=feat_dict["is_rna"].bool() + feat_dict["is_dna"].bool(),
+            is_nucleotide=is_nucleotide,
             **self.lddt_radius,
         )
 
@@ -1595,8 +2123,10 @@ class ProtenixLoss(nn.Module):
                         "smooth_lddt_loss": lambda: self.smooth_lddt_loss.sparse_forward(
                             pred_coordinate=pred_dict["coordinate"],
                             true_coordinate=label_dict["coordinate"],
-                            lddt_mask=label_dict["lddt_mask"],
+                            lddt_mask=label_dict.get("lddt_mask"),
                             diffusion_chunk_size=self.configs.loss.diffusion_lddt_chunk_size,
+                            lddt_pair_indices=label_dict.get("lddt_pair_indices"),
+                            fused=self.configs.loss.diffusion_pair_loss_fused,
                         )
                     }
                 )
@@ -1618,9 +2148,11 @@ class ProtenixLoss(nn.Module):
                         self.bond_loss.sparse_forward(
                             pred_coordinate=pred_dict["coordinate"],
                             true_coordinate=label_dict["coordinate"],
-                            distance_mask=label_dict["distance_mask"],
+                            distance_mask=label_dict.get("distance_mask"),
                             bond_mask=feat_dict["bond_mask"],
                             per_sample_scale=diffusion_per_sample_scale,
+                            coordinate_mask=label_dict["coordinate_mask"],
+                            fused=self.configs.loss.diffusion_pair_loss_fused,
                         )
                         if self.configs.loss.diffusion_sparse_loss_enable
                         else self.bond_loss(
@@ -1721,6 +2253,7 @@ class ProtenixLoss(nn.Module):
         pred_dict: dict[str, torch.Tensor],
         label_dict: dict[str, Any],
         mode: str = "train",
+        cache_key: Optional[str] = None,
     ) -> tuple[torch.Tensor, dict[str, torch.Tensor]]:
         """
         Forward pass for calculating the cumulative loss and aggregated metrics.
@@ -1730,6 +2263,8 @@ class ProtenixLoss(nn.Module):
             pred_dict (dict[str, torch.Tensor]): Prediction dictionary containing model outputs.
             label_dict (dict[str, Any]): Label dictionary containing ground truth data.
             mode (str): Mode of operation ('train', 'eval', 'inference'). Defaults to 'train'.
+            cache_key (str, optional): the key of the ground truth in the cache of lddt pairs,
+                e.g. the pdb_id. Defaults to None (not cached).
 
         Returns:
             tuple[torch.Tensor, dict[str, torch.Tensor]]:
@@ -1740,7 +2275,9 @@ class ProtenixLoss(nn.Module):
         assert mode in ["train", "eval", "inference"]
         # Pre-computations
         with torch.no_grad():
-            label_dict = self.calculate_label(feat_dict, label_dict)
+            label_dict = self.calculate_label(
+                feat_dict, label_dict, cache_key=cache_key
+            )
 
         pred_dict = self.calculate_prediction(pred_dict)
 
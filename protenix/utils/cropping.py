@@ -20,6 +20,7 @@ from typing import Any, Optional
 import numpy as np
 import torch
 from biotite.structure import AtomArray
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 
 from protenix.data.tokenizer import TokenArray
@@ -182,24 +183,182 @@ def get_spatial_crop_index(
         .values
     )
 
-    def drop_uncompleted_mol(selected_token_indices):
-        selected_uid = ref_space_uid_token[selected_token_indices]
-        mask = torch.ones_like(ref_space_uid_token, dtype=torch.bool)
-        mask[selected_token_indices] = False
-        unselected_uid = ref_space_uid_token[mask]
+    selected_token_indices = torch.flatten(selected_token_indices)
+    if crop_complete_ligand_unstdRes is True:
+        selected_token_indices = drop_uncompleted_mol(
+            selected_token_indices, ref_space_uid_token
+        )
+    assert (
+        selected_token_indices.shape[0] <= crop_size
+    ), f"Spatial cropping crop {selected_token_indices.shape[0]}, more than {crop_size} tokens!!"
+    return selected_token_indices, reference_token_idx
 
-        # Find overlap elements
-        overlap_uid = torch.Tensor(np.intersect1d(selected_uid, unselected_uid))
 
-        # Remove overlap elements from elements_B
-        remain_indices = selected_token_indices[
-            ~torch.isin(selected_uid, overlap_uid)
-        ].long()
-        return remain_indices
+def drop_uncompleted_mol(
+    selected_token_indices: torch.Tensor, ref_space_uid_token: torch.Tensor
+) -> torch.Tensor:
+    """
+    Remove the selected tokens whose ref_space_uid is only partially selected.
+    Args:
+        selected_token_indices: [N_selected,], indices of the selected tokens
+        ref_space_uid_token: [all_token_length,], ref_space_uid of each token
+    Returns:
+        remain_indices: indices of the tokens in completely selected ref_space_uid
+    """
+    selected_uid = ref_space_uid_token[selected_token_indices]
+    mask = torch.ones_like(ref_space_uid_token, dtype=torch.bool)
+    mask[selected_token_indices] = False
+    unselected_uid = ref_space_uid_token[mask]
 
-    selected_token_indices = torch.flatten(selected_token_indices)
+    # Find overlap elements
+    overlap_uid = torch.Tensor(np.intersect1d(selected_uid, unselected_uid))
+
+    # Remove overlap elements from elements_B
+    remain_indices = selected_token_indices[
+        ~torch.isin(selected_uid, overlap_uid)
+    ].long()
+    return remain_indices
+
+
+def get_interface_token_mask(
+    centre_atom_coords: np.ndarray,
+    chain_id: np.ndarray,
+    token_dist_mask_1d: np.ndarray,
+    interface_minimal_distance: int = 15,
+) -> np.ndarray:
+    """
+    Get tokens in contact with any other chain, the same tokens as `get_interface_token`
+    finds in the reference chains, but using a KD-tree instead of a distance matrix.
+    Args:
+        centre_atom_coords: [all_token_length, 3], coordinates of the token centre atoms
+        chain_id:           [all_token_length, ], chain ID of each token
+        token_dist_mask_1d: [all_token_length, ], whether the token centre atom is resolved
+        interface_minimal_distance: the minimal distance to any other chains
+    Returns:
+        interface_token_mask: [all_token_length, ], whether the token is an interface token
+    """
+    chain_id = np.asarray(chain_id)
+    resolved_token_indices = np.flatnonzero(token_dist_mask_1d)
+    resolved_coords = np.asarray(centre_atom_coords, dtype=np.float64)[
+        resolved_token_indices
+    ]
+    pairs = cKDTree(resolved_coords).query_pairs(
+        r=interface_minimal_distance, output_type="ndarray"
+    )
+    # Distances are compared in float32 like the distance matrix of spatial cropping
+    pair_distance = np.sqrt(
+        np.sum(
+            np.square(resolved_coords[pairs[:, 0]] - resolved_coords[pairs[:, 1]]),
+            axis=-1,
+        )
+    ).astype(np.float32)
+    pairs = resolved_token_indices[pairs]
+    is_interface_pair = (pair_distance < interface_minimal_distance) & (
+        chain_id[pairs[:, 0]] != chain_id[pairs[:, 1]]
+    )
+    interface_token_mask = np.zeros(len(chain_id), dtype=bool)
+    interface_token_mask[pairs[is_interface_pair].ravel()] = True
+    return interface_token_mask
+
+
+def get_spatial_crop_index_by_kdtree(
+    centre_atom_coords: np.ndarray,
+    token_dist_mask_1d: np.ndarray,
+    token_indices_in_ref: np.ndarray,
+    interface_token_mask: np.ndarray,
+    reference_chain_id: torch.Tensor,
+    ref_space_uid_token: torch.Tensor,
+    crop_size: int,
+    crop_complete_ligand_unstdRes: bool = False,
+    interface_crop: bool = False,
+) -> tuple[torch.Tensor, int]:
+    """
+    The same cropping as `get_spatial_crop_index`, with the nearest tokens to the reference
+    token found by a KD-tree over the resolved tokens instead of sorting a distance matrix.
+    The search radius is widened to the k-th smallest distance with the tie-break noise,
+    so the selection is the same as the dense version.
+    The number of resolved tokens should be no less than the crop size.
+    Args:
+        centre_atom_coords:   [all_token_length, 3], coordinates of the token centre atoms
+        token_dist_mask_1d:   [all_token_length, ], whether the token centre atom is resolved
+        token_indices_in_ref: [chain/interface_token_length, ], indices of the tokens in reference chains
+        interface_token_mask: [all_token_length, ], whether the token is an interface token
+        reference_chain_id:  [1] or [2],the reference atom is selected within the reference_chains ID
+        ref_space_uid_token: [all_token_length, ], ref_space_uid of each token
+        crop_size: total crop size of the whole assembly
+        interface_crop: whether use interface tokens as referenced token
+    Returns:
+        selected_token_indices: torch.Tensor, shape=(min(crop_size, all_token_length), )
+        reference_token_idx: index of the reference token in token_indices_in_ref
+    """
+    N_token = len(token_dist_mask_1d)
+    token_dist_mask_1d = np.asarray(token_dist_mask_1d).astype(bool)
+    is_resolved_in_ref = token_dist_mask_1d[token_indices_in_ref]
+    if interface_crop:
+        reference_token_indices = np.flatnonzero(
+            interface_token_mask[token_indices_in_ref] & is_resolved_in_ref
+        )
+        if len(reference_token_indices) < 1 and len(reference_chain_id) == 1:
+            # If a chain does not contain any interfacial atoms, use all resolved tokens.
+            reference_token_indices = np.flatnonzero(is_resolved_in_ref)
+    else:
+        reference_token_indices = np.flatnonzero(is_resolved_in_ref)
+
+    # random select one token from reference_token_indices
+    assert len(reference_token_indices) > 0, "No resolved atoms in reference tokens!"
+
+    random_idx = torch.randint(0, reference_token_indices.shape[0], (1,)).item()
+    reference_token_idx = reference_token_indices[random_idx].item()
+    centre_atom_coords = np.asarray(centre_atom_coords, dtype=np.float64)
+    reference_coord = centre_atom_coords[token_indices_in_ref[reference_token_idx]]
+
+    nearest_k = min(crop_size, N_token)
+    resolved_token_indices = np.flatnonzero(token_dist_mask_1d)
+    assert (
+        len(resolved_token_indices) >= nearest_k
+    ), "Fewer resolved tokens than the crop size"
+    # add noise to break tie
+    noise_break_tie = torch.arange(0, N_token).float() * 1e-3
+
+    kdtree = cKDTree(centre_atom_coords[resolved_token_indices])
+
+    def get_noisy_distance(radius: float) -> tuple[torch.Tensor, torch.Tensor]:
+        # The resolved tokens within radius, and their distances with the noise
+        candidate_indices = resolved_token_indices[
+            np.asarray(kdtree.query_ball_point(reference_coord, r=radius), dtype=int)
+        ]
+        distance_to_reference = torch.Tensor(
+            cdist(
+                reference_coord[None],
+                centre_atom_coords[candidate_indices],
+                "euclidean",
+            )[0]
+        )
+        candidate_indices = torch.from_numpy(candidate_indices)
+        return (
+            candidate_indices,
+            distance_to_reference + noise_break_tie[candidate_indices],
+        )
+
+    # The k nearest tokens are within the k-th nearest distance, so the k-th smallest
+    # noisy distance among them bounds the k-th smallest noisy distance of all tokens.
+    # As the noise is non-negative, the tokens within that bound are all the tokens the
+    # dense version can select, and the selection is the same.
+    kth_distance = kdtree.query(reference_coord, k=[nearest_k])[0][0]
+    _, noisy_distance = get_noisy_distance(kth_distance + 1e-3)
+    noisy_kth_distance = torch.kthvalue(noisy_distance, nearest_k).values.item()
+    candidate_indices, noisy_distance = get_noisy_distance(noisy_kth_distance + 1e-3)
+
+    # find k nearest tokens
+    selected_token_indices = (
+        candidate_indices[torch.topk(noisy_distance, nearest_k, largest=False).indices]
+        .sort()
+        .values
+    )
     if crop_complete_ligand_unstdRes is True:
-        selected_token_indices = drop_uncompleted_mol(selected_token_indices)
+        selected_token_indices = drop_uncompleted_mol(
+            selected_token_indices, ref_space_uid_token
+        )
     assert (
         selected_token_indices.shape[0] <= crop_size
     ), f"Spatial cropping crop {selected_token_indices.shape[0]}, more than {crop_size} tokens!!"
@@ -490,6 +649,50 @@ class CropData(object):
         )
         return partial_token_dist_matrix
 
+    @staticmethod
+    def add_interface_token_annotation(
+        token_array: TokenArray, atom_array: AtomArray
+    ) -> AtomArray:
+        """
+        Precompute the interface tokens for SpatialInterfaceCropping, and save them as the
+        "is_interface_token" annotation of the token centre atoms. The annotation is kept
+        by reordering the tokens, but not by removing chains.
+
+        Args:
+            token_array (TokenArray): The token array.
+            atom_array (AtomArray): The atom array.
+
+        Returns:
+            AtomArray: The atom array with the "is_interface_token" annotation.
+        """
+        centre_atom_indices = token_array.get_annotation("centre_atom_index")
+        centre_atoms = atom_array[centre_atom_indices]
+        is_interface_token = np.zeros(len(atom_array), dtype=bool)
+        is_interface_token[centre_atom_indices] = get_interface_token_mask(
+            centre_atom_coords=centre_atoms.coord,
+            chain_id=centre_atoms.asym_id_int,
+            token_dist_mask_1d=centre_atoms.is_resolved,
+        )
+        atom_array.set_annotation("is_interface_token", is_interface_token)
+        return atom_array
+
+    def get_interface_token_mask(self) -> np.ndarray:
+        """
+        Get the interface tokens, precomputed by `add_interface_token_annotation` if available.
+
+        Returns:
+            numpy.ndarray: Whether each token is an interface token, shape=(len(tokens), ).
+        """
+        centre_atom_indices = self.token_array.get_annotation("centre_atom_index")
+        if "is_interface_token" in self.atom_array.get_annotation_categories():
+            return self.atom_array.is_interface_token[centre_atom_indices]
+        centre_atoms = self.atom_array[centre_atom_indices]
+        return get_interface_token_mask(
+            centre_atom_coords=centre_atoms.coord,
+            chain_id=centre_atoms.asym_id_int,
+            token_dist_mask_1d=centre_atoms.is_resolved,
+        )
+
     def extract_info(
         self,
     ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, list[int]]:
@@ -567,19 +770,18 @@ class CropData(object):
         """
         cropped_token_array = copy.deepcopy(token_array[selected_token_indices])
 
-        cropped_atom_indices = []
-        totol_atom_num = 0
-        for idx, token in enumerate(cropped_token_array):
-            cropped_atom_indices.extend(token.atom_indices)
-            centre_idx_in_token_atoms = token.atom_indices.index(
-                token.centre_atom_index
-            )
-            token_atom_num = len(token.atom_indices)
-            token.atom_indices = list(
-                range(totol_atom_num, totol_atom_num + token_atom_num)
-            )
-            token.centre_atom_index = token.atom_indices[centre_idx_in_token_atoms]
-            totol_atom_num += token_atom_num
+        # Re-index the atoms of the cropped tokens, keeping the order of tokens
+        cropped_atom_indices = cropped_token_array.get_flat_annotation("atom_indices")
+        is_centre_atom = cropped_atom_indices == np.repeat(
+            cropped_token_array.get_annotation("centre_atom_index"),
+            cropped_token_array.get_atom_nums(),
+        )
+        centre_atom_index = np.flatnonzero(is_centre_atom)
+        assert len(centre_atom_index) == len(cropped_token_array)
+        cropped_token_array.set_annotation("centre_atom_index", centre_atom_index)
+        cropped_token_array.set_flat_annotation(
+            "atom_indices", np.arange(len(cropped_atom_indices))
+        )
 
         cropped_atom_array = copy.deepcopy(atom_array[cropped_atom_indices])
         assert len(cropped_token_array) == selected_token_indices.shape[0]
@@ -643,9 +845,7 @@ class CropData(object):
             self.token_array.get_annotation("centre_atom_index")
         ]
 
-        atom_num_in_tokens = []
-        for token in self.token_array:
-            atom_num_in_tokens.append(len(token.atom_indices))
+        atom_num_in_tokens = self.token_array.get_atom_nums()
 
         uid_num_dict = defaultdict(int)
         for idx, uid in enumerate(ref_space_uid_token):
@@ -674,24 +874,44 @@ class CropData(object):
             interface_crop = (
                 True if crop_method == "SpatialInterfaceCropping" else False
             )
-            token_distance = self.get_token_dist_mat(
-                token_indices_in_ref=token_indices_in_ref
-            )
-            token_distance_mask = (
-                token_dist_mask_1d[token_indices_in_ref][:, None]
-                * token_dist_mask_1d[None, :]
-            )
-            selected_token_indices, reference_token_index = get_spatial_crop_index(
-                tokens=tokens,
-                chain_id=chain_id,
-                token_distance=torch.Tensor(token_distance),
-                token_distance_mask=torch.Tensor(token_distance_mask),
-                reference_chain_id=self.ref_chain_indices,
-                ref_space_uid_token=ref_space_uid_token,
-                crop_size=self.crop_size,
-                crop_complete_ligand_unstdRes=self.spatial_crop_complete_lig,
-                interface_crop=interface_crop,
-            )
+            if token_dist_mask_1d.sum() >= min(self.crop_size, len(tokens)):
+                selected_token_indices, reference_token_index = (
+                    get_spatial_crop_index_by_kdtree(
+                        centre_atom_coords=self.atom_array.coord[
+                            self.token_array.get_annotation("centre_atom_index")
+                        ],
+                        token_dist_mask_1d=token_dist_mask_1d.numpy(),
+                        token_indices_in_ref=token_indices_in_ref,
+                        interface_token_mask=(
+                            self.get_interface_token_mask() if interface_crop else None
+                        ),
+                        reference_chain_id=self.ref_chain_indices,
+                        ref_space_uid_token=ref_space_uid_token,
+                        crop_size=self.crop_size,
+                        crop_complete_ligand_unstdRes=self.spatial_crop_complete_lig,
+                        interface_crop=interface_crop,
+                    )
+                )
+            else:
+                # Unresolved tokens are also cropped, in the order of the distance matrix
+                token_distance = self.get_token_dist_mat(
+                    token_indices_in_ref=token_indices_in_ref
+                )
+                token_distance_mask = (
+                    token_dist_mask_1d[token_indices_in_ref][:, None]
+                    * token_dist_mask_1d[None, :]
+                )
+                selected_token_indices, reference_token_index = get_spatial_crop_index(
+                    tokens=tokens,
+                    chain_id=chain_id,
+                    token_distance=torch.Tensor(token_distance),
+                    token_distance_mask=torch.Tensor(token_distance_mask),
+                    reference_chain_id=self.ref_chain_indices,
+                    ref_space_uid_token=ref_space_uid_token,
+                    crop_size=self.crop_size,
+                    crop_complete_ligand_unstdRes=self.spatial_crop_complete_lig,
+                    interface_crop=interface_crop,
+                )
         return (
             selected_token_indices,
             token_indices_in_ref[reference_token_index].item(),
@@ -13,12 +13,14 @@
 # limitations under the License.
 
 import numpy as np
+from scipy.spatial import cKDTree
 from scipy.spatial.transform import Rotation
 
 
 def angle_3p(a, b, c):
     """
-    Calculate the angle between three points in a 2D space.
+    Calculate the angle between three points.
+    The points can be batched, the coordinates are in the last dimension.
 
     Args:
         a (list or array-like): The coordinates of the first point.
@@ -26,7 +28,7 @@ def angle_3p(a, b, c):
         c (list or array-like): The coordinates of the third point.
 
     Returns:
-        float: The angle in degrees (0, 180) between the vectors
+        float or np.ndarray: The angle in degrees (0, 180) between the vectors
                from point a to point b and point b to point c.
     """
     a = np.array(a)
@@ -36,10 +38,10 @@ def angle_3p(a, b, c):
     ab = b - a
     bc = c - b
 
-    dot_product = np.dot(ab, bc)
+    dot_product = np.sum(ab * bc, axis=-1)
 
-    norm_ab = np.linalg.norm(ab)
-    norm_bc = np.linalg.norm(bc)
+    norm_ab = np.linalg.norm(ab, axis=-1)
+    norm_bc = np.linalg.norm(bc, axis=-1)
 
     cos_theta = np.clip(dot_product / (norm_ab * norm_bc + 1e-4), -1, 1)
     theta_radians = np.arccos(cos_theta)
@@ -69,3 +71,40 @@ def random_transform(
     R = Rotation.random().as_matrix()
     transformed_points = np.dot(points + translation, R.T)
     return transformed_points
+
+
+def get_neighbor_pairs(
+    query_points: np.ndarray, key_points: np.ndarray, query_radius: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find all pairs of a query point and a key point closer than the radius of the query point,
+    with KD-trees, so the dense distance matrix is never built.
+
+    Args:
+        query_points (np.ndarray): the query points, shape=(N_query, 3)
+        key_points (np.ndarray): the key points, shape=(N_key, 3)
+        query_radius (np.ndarray): the radius of each query point, shape=(N_query,)
+            Typically a few distinct values, the queries are grouped by radius.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the query and key indices of the pairs with
+            distance < radius, sorted by query index then key index.
+    """
+    key_tree = cKDTree(key_points)
+    query_indices, key_indices = [np.zeros(0, dtype=np.int64)], [
+        np.zeros(0, dtype=np.int64)
+    ]
+    for radius in np.unique(query_radius):
+        query_selected = np.flatnonzero(query_radius == radius)
+        pairs = cKDTree(query_points[query_selected]).sparse_distance_matrix(
+            key_tree, radius, output_type="ndarray"
+        )
+        # The tree query includes pairs at exactly the radius
+        pairs = pairs[pairs["v"] < radius]
+        query_indices.append(query_selected[pairs["i"]])
+        key_indices.append(pairs["j"].astype(np.int64))
+    query_indices = np.concatenate(query_indices)
+    key_indices = np.concatenate(key_indices)
+    # Sort by a single key, faster than np.lexsort
+    order = np.argsort(query_indices * len(key_points) + key_indices)
+    return query_indices[order], key_indices[order]
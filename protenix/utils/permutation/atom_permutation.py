@@ -15,7 +15,7 @@
 import torch
 
 from protenix.metrics.rmsd import rmsd, self_aligned_rmsd
-from protenix.model.utils import expand_at_dim, pad_at_dim
+from protenix.model.utils import expand_at_dim
 from protenix.utils.logger import get_logger
 from protenix.utils.permutation.utils import Checker, save_permutation_error
 
@@ -194,78 +194,6 @@ def collect_residues_with_symmetric_atoms(
     return position_list, coord_list, coord_mask_list, perm_list, N_res
 
 
-def collect_permuted_coords(
-    coord_list: list[torch.Tensor],
-    coord_mask_list: list[torch.Tensor],
-    perm_list: list[torch.Tensor],
-    run_checker: bool = False,
-) -> tuple[torch.Tensor]:
-    """Apply permutations to coordinates and coordinate masks
-
-    Args:
-        coord_list (list[torch.Tensor]): A list of coordinates.
-            Each element is a tensor of shape [N_res_atom, 3]. The value N_res_atom can
-            vary across different residues.
-        coord_mask_list (list[torch.Tensor]): A list of coordinate masks.
-            Each element is a tensor of shape [N_res_atom].
-        perm_list (list[torch.Tensor]): list of permutations.
-            Each element is a long tensor of shape [N_perm, N_res_atom]. The value N_perm
-            can vary across different residues.
-
-    Returns:
-        torch.Tensor:
-            [N_total_perm, MAX_N_res_atom, 3]
-            [N_total_perm, MAX_N_res_atom]
-    """
-
-    MAX_N_res_atom = max(perm.size(-1) for perm in perm_list)
-    perm_coord = []  # [N_total_perm, N_res_atom, 3]
-    perm_coord_mask = []  # [N_total_perm, N_res_atom]
-
-    N_total_perm = 0
-    for perm, res_coord, res_coord_mask in zip(perm_list, coord_list, coord_mask_list):
-
-        # Basic shape checks
-        N_perm, N_res_atom = perm.size()
-        assert res_coord.size(-1) == 3
-        assert res_coord.size(0) == res_coord_mask.size(0) == perm.size(-1)
-
-        # Permute coordinates & masks
-        res_coord_permuted = res_coord[perm]  # [N_perm, N_res_atom, 3]
-        res_coord_mask_permuted = res_coord_mask[perm]  # [N_perm, N_res_atom]
-        assert res_coord_permuted.size() == (N_perm, N_res_atom, 3)
-        assert res_coord_mask_permuted.size() == (N_perm, N_res_atom)
-
-        if run_checker:
-            Checker.are_permutations(perm, dim=-1)
-            Checker.batch_permute(perm, res_coord, res_coord_permuted)
-            Checker.batch_permute(perm, res_coord_mask, res_coord_mask_permuted)
-
-        # Pad to MAX_N_res_atom
-        N_res_atom = perm.size(dim=-1)
-        if N_res_atom < MAX_N_res_atom:
-            pad_length = (0, MAX_N_res_atom - N_res_atom)
-            res_coord_permuted = pad_at_dim(
-                res_coord_permuted, dim=-2, pad_length=pad_length
-            )  # [N_perm, MAX_N_res_atom, 3]
-            res_coord_mask_permuted = pad_at_dim(
-                res_coord_mask_permuted, dim=-1, pad_length=pad_length
-            )
-
-        N_total_perm += N_perm
-        perm_coord.append(res_coord_permuted)
-        perm_coord_mask.append(res_coord_mask_permuted)
-
-    perm_coord = torch.cat(perm_coord, dim=0)
-    perm_coord_mask = torch.cat(perm_coord_mask, dim=0)
-
-    # Shape check
-    assert perm_coord.size() == (N_total_perm, MAX_N_res_atom, 3)
-    assert perm_coord_mask.size() == (N_total_perm, MAX_N_res_atom)
-
-    return perm_coord, perm_coord_mask
-
-
 class AtomPermutation(object):
     def __init__(
         self,
@@ -318,31 +246,24 @@ class AtomPermutation(object):
 
         Args:
             pred_coord (torch.Tensor):
-                [Batch, N_atom, 3] or [N_atom, 3]
-            true_coord (torch.Tensor):
-                [N_atom, 3]
-            true_coord_mask (torch.Tensor):
+                [..., Batch, N_atom, 3] or [N_atom, 3]
+            true_coord (torch.Tensor): broadcastable to pred_coord.
                 [N_atom, 3]
+            true_coord_mask (torch.Tensor): broadcastable to pred_coord.shape[:-1].
+                [N_atom] or [..., 1, N_atom]
 
         Returns:
             aligned_rmsd (torch.Tensor):
-                [Batch] or []
+                [..., Batch] or []
             transformed_pred_coord (torch.Tensor): having the same shape as pred_coord.
-                [Batch, N_atom, 3] or [N_atom, 3]
+                [..., Batch, N_atom, 3] or [N_atom, 3]
         """
 
-        if true_coord.dim() < pred_coord.dim():
-            assert pred_coord.dim() == 3  # [Batch, N_atom, 3]
-            Batch = pred_coord.size(0)
-            expand_func = lambda x: expand_at_dim(x, dim=0, n=Batch)
-        else:
-            expand_func = lambda x: x
-
         with torch.cuda.amp.autocast(enabled=False):
             aligned_rmsd, transformed_pred_coord, _, _ = self_aligned_rmsd(
                 pred_pose=pred_coord.to(torch.float32),
-                true_pose=expand_func(true_coord.to(torch.float32)),
-                atom_mask=expand_func(true_coord_mask),
+                true_pose=true_coord.to(torch.float32).expand(pred_coord.shape),
+                atom_mask=true_coord_mask.expand(pred_coord.shape[:-1]),
                 allowing_reflection=False,
                 reduce=False,
                 eps=eps,
@@ -406,106 +327,83 @@ class AtomPermutation(object):
                 [] or [Batch]
         """
 
-        # Find max number of per-residue atoms
-        per_residue_N_perm = [perm.size(0) for perm in per_residue_perm_list]
-        per_residue_N_atom = [perm.size(1) for perm in per_residue_perm_list]
-        N_max_atom = max(per_residue_N_atom)
-
-        # Permute true coordinates & masks according to the permutations in per_residue_perm_list
-        permuted_coord, permuted_coord_mask = collect_permuted_coords(
-            coord_list=per_residue_coord_list,
-            coord_mask_list=per_residue_coord_mask_list,
-            perm_list=per_residue_perm_list,
-            run_checker=run_checker,
-        )  # [N_total_perm, N_max_atom, 3], [N_total_perm, N_max_atom]
-        assert permuted_coord.size(-2) == permuted_coord_mask.size(-1) == N_max_atom
-        N_total_perm = permuted_coord.size(0)
-
-        # Pad 'pred_coord' to the same shape as 'permuted_coord'
-        per_residue_pred_coord_list = [
-            pad_at_dim(
-                p_coord, dim=-2, pad_length=(0, N_max_atom - p_coord.size(dim=-2))
-            )
-            for p_coord in per_residue_pred_coord_list
-        ]
-        # Repeat N_perm times for each residue
-        pred_coord = torch.stack(
-            sum(
-                [
-                    [p_coord] * N_perm
-                    for N_perm, p_coord in zip(
-                        per_residue_N_perm, per_residue_pred_coord_list
-                    )
-                ],
-                [],
-            ),
-            dim=-3,
-        )  # [N_total_perm, N_max_atom, 3] or [Batch, N_total_perm, N_max_atom, 3]
-        assert pred_coord.shape[-3:] == (N_total_perm, N_max_atom, 3)
-
-        batch_shape = pred_coord.shape[:-3]
-        assert len(batch_shape) in [0, 1]
-        if len(batch_shape) == 1:
-            # expand true coord & mask to have the same batch size as pred coord
-            Batch = pred_coord.size(0)
-            permuted_coord = expand_at_dim(permuted_coord, dim=0, n=Batch)
-            permuted_coord_mask = expand_at_dim(permuted_coord_mask, dim=0, n=Batch)
-
-        # Compute per-residue rmsd
-        with torch.cuda.amp.autocast(enabled=False):
-            per_res_rmsd = rmsd(
-                pred_pose=pred_coord.to(torch.float32),
-                true_pose=permuted_coord.to(torch.float32),
-                mask=permuted_coord_mask,
-                eps=eps,
-                reduce=False,
-            )  # [N_total_perm] or [Batch, N_total_perm]
-            assert per_res_rmsd.size() == batch_shape + (N_total_perm,)
-
-        # Find the best permutation
-        best_permutation_list = []
-        is_permuted_list = []
-        original_rmsd_list = []
-        optimized_rmsd_list = []
-        i = 0
-
-        # Enumerate over all residues (could be improved by scatter)
-        for N_perm, N_res_atom, perm in zip(
-            per_residue_N_perm, per_residue_N_atom, per_residue_perm_list
-        ):
-            cur_res_rmsd = per_res_rmsd[..., i : i + N_perm]  # [batch_shape, N_perm]
-            best_rmsd, best_j = torch.min(cur_res_rmsd, dim=-1)  # [batch_shape]
-            best_perm = perm[best_j]  # [batch_shape, N_res_atom]
-            best_permutation_list.append(best_perm)
-
-            is_permuted_list.append(
-                best_j > 0
-            )  # The first of the perm lists is the identity
-
-            optimized_rmsd_list.append(best_rmsd)
-            original_rmsd_list.append(cur_res_rmsd[..., 0])
-
-            i += N_perm
+        # Residues of the same (N_perm, N_res_atom) are evaluated in one batch, without padding
+        shape_buckets = {}
+        for i, perm in enumerate(per_residue_perm_list):
+            shape_buckets.setdefault(tuple(perm.shape), []).append(i)
+
+        N_res = len(per_residue_perm_list)
+        best_permutation_list = [None] * N_res
+        is_permuted_list = [None] * N_res
+        optimized_rmsd_list = [None] * N_res
+        original_rmsd_list = [None] * N_res
+        for (N_perm, N_res_atom), residue_indices in shape_buckets.items():
+            perm = torch.stack(
+                [per_residue_perm_list[i] for i in residue_indices]
+            )  # [N_bucket, N_perm, N_res_atom]
+            coord = torch.stack(
+                [per_residue_coord_list[i] for i in residue_indices]
+            )  # [N_bucket, N_res_atom, 3]
+            coord_mask = torch.stack(
+                [per_residue_coord_mask_list[i] for i in residue_indices]
+            )  # [N_bucket, N_res_atom]
+            pred_coord = torch.stack(
+                [per_residue_pred_coord_list[i] for i in residue_indices], dim=-3
+            )  # [N_bucket, N_res_atom, 3] or [Batch, N_bucket, N_res_atom, 3]
+            batch_shape = pred_coord.shape[:-3]
+            assert len(batch_shape) in [0, 1]
+
+            # Permute true coordinates & masks by all permutations of each residue at once
+            bucket_index = torch.arange(len(residue_indices), device=perm.device)[
+                :, None, None
+            ]
+            permuted_coord = coord[
+                bucket_index, perm
+            ]  # [N_bucket, N_perm, N_res_atom, 3]
+            permuted_coord_mask = coord_mask[bucket_index, perm]
+            if run_checker:
+                for i in range(len(residue_indices)):
+                    Checker.are_permutations(perm[i], dim=-1)
+                    Checker.batch_permute(perm[i], coord[i], permuted_coord[i])
+
+            # Compute per-residue rmsd
+            with torch.cuda.amp.autocast(enabled=False):
+                per_res_rmsd = rmsd(
+                    pred_pose=pred_coord.unsqueeze(dim=-3)
+                    .expand(batch_shape + permuted_coord.shape)
+                    .to(torch.float32),
+                    true_pose=permuted_coord.expand(
+                        batch_shape + permuted_coord.shape
+                    ).to(torch.float32),
+                    mask=permuted_coord_mask.expand(
+                        batch_shape + permuted_coord_mask.shape
+                    ),
+                    eps=eps,
+                    reduce=False,
+                )  # [N_bucket, N_perm] or [Batch, N_bucket, N_perm]
+
+            # Find the best permutation, the first of the perm lists is the identity
+            best_rmsd, best_j = torch.min(per_res_rmsd, dim=-1)  # [..., N_bucket]
+            best_perm = perm[
+                torch.arange(len(residue_indices), device=perm.device), best_j
+            ]  # [..., N_bucket, N_res_atom]
 
             if run_checker:
-                assert perm.size() == (N_perm, N_res_atom)
-                assert cur_res_rmsd.size() == batch_shape + (N_perm,)
-                assert best_rmsd.size() == batch_shape
-                assert best_j.size() == batch_shape
-                assert best_perm.size() == batch_shape + (N_res_atom,)
+                assert best_perm.size() == batch_shape + (
+                    len(residue_indices),
+                    N_res_atom,
+                )
                 Checker.are_permutations(best_perm, dim=-1)
+                is_identity = (
+                    best_perm == torch.arange(N_res_atom, device=best_perm.device)
+                ).all(dim=-1)
+                assert torch.equal(is_identity, best_j == 0)
 
-                def _check_identity(j_value, perm):
-                    if j_value > 0:
-                        Checker.not_contain_identity(perm)
-                    else:
-                        Checker.contains_identity(perm)
-
-                if best_j.dim() == 0:
-                    _check_identity(best_j, best_perm)
-                else:
-                    for j_value, perm_j in zip(best_j, best_perm):
-                        _check_identity(j_value, perm_j)
+            for k, i in enumerate(residue_indices):
+                best_permutation_list[i] = best_perm[..., k, :]
+                is_permuted_list[i] = best_j[..., k] > 0
+                optimized_rmsd_list[i] = best_rmsd[..., k]
+                original_rmsd_list[i] = per_res_rmsd[..., k, 0]
 
         return (
             best_permutation_list,
@@ -614,81 +512,47 @@ class AtomPermutation(object):
             print("No atom permutation is needed. Return the identity permutation.")
             return (permutation, log_dict)
 
-        # This is for atom permutation, use mask with different strategies
-        _, transformed_pred_coord = self.global_align_pred_to_true(
-            pred_coord,
-            true_coord,
-            alignment_mask,
-            eps=self.eps,
-        )
-        # This is for unpermuted all-atom baseline calculation
-        aligned_rmsd, _ = self.global_align_pred_to_true(
-            pred_coord,
+        # Two alignments in one batched call:
+        # 0. for atom permutation, use mask with different strategies
+        # 1. for unpermuted all-atom baseline calculation
+        masks = torch.stack(
+            [alignment_mask.to(torch.float32), true_coord_mask.to(torch.float32)]
+        ).reshape((2,) + (1,) * (pred_coord.dim() - 2) + (N_atom,))
+        aligned_rmsd, transformed_pred_coord = self.global_align_pred_to_true(
+            pred_coord.expand((2,) + pred_coord.shape),
             true_coord,
-            true_coord_mask,
+            masks,
             eps=self.eps,
         )
-        log_dict["unpermuted_rmsd"] = aligned_rmsd.mean().item()  # [Batch]
+        transformed_pred_coord = transformed_pred_coord[0]
+        log_dict["unpermuted_rmsd"] = aligned_rmsd[1].mean().item()  # [Batch]
 
-        """ 
-        To efficiently optimize the residues parallely, group the residues
-        according to the number of atoms in each residue.
-        """
-        per_residue_N_atom = [coord.size(0) for coord in per_residue_coord_list]
-        res_atom_cutoff = [15, 30, 50, 100, 100000]
-        grouped_indices = {}
-        for i, n in enumerate(per_residue_N_atom):
-            for atom_cutoff in res_atom_cutoff:
-                if n <= atom_cutoff:
-                    break
-            grouped_indices.setdefault(atom_cutoff, []).append(i)
-
-        assert len(sum(list(grouped_indices.values()), [])) == len(
-            per_residue_perm_list
+        # Enumerte permutations within each residue to minimize per-residue RMSD,
+        # residues of the same shape are optimized in one batch
+        if verbose:
+            print(f"{len(per_residue_perm_list)} residues have symmetric atoms.")
+        (
+            residue_best_permutation_list,
+            residue_is_permuted_list,
+            residue_optimized_rmsd_list,
+            residue_original_rmsd_list,
+        ) = self._optimize_per_residue_permutation_by_rmsd(
+            per_residue_pred_coord_list=[
+                transformed_pred_coord[..., pos[0] : pos[1], :]
+                for pos in per_residue_position_list
+            ],
+            per_residue_coord_list=per_residue_coord_list,
+            per_residue_coord_mask_list=per_residue_coord_mask_list,
+            per_residue_perm_list=per_residue_perm_list,
+            eps=self.eps,
+            run_checker=self.run_checker,
         )
 
-        residue_position_list = []
-        residue_best_permutation_list = []
-        residue_is_permuted_list = []
-        residue_optimized_rmsd_list = []
-        residue_original_rmsd_list = []
-        for atom_cutoff, residue_group in grouped_indices.items():
-
-            if verbose:
-                print(f"{len(residue_group)} residues have <={atom_cutoff} atoms.")
-
-            # Enumerte permutations within each residue to minimize per-residue RMSD
-            per_res_pos_list = [per_residue_position_list[i] for i in residue_group]
-            (
-                per_res_best_permutation,
-                per_res_is_permuted,
-                per_res_optimized_rmsd,
-                per_res_ori_rmsd,
-            ) = self._optimize_per_residue_permutation_by_rmsd(
-                per_residue_pred_coord_list=[
-                    transformed_pred_coord[..., pos[0] : pos[1], :]
-                    for pos in per_res_pos_list
-                ],
-                per_residue_coord_list=[
-                    per_residue_coord_list[i] for i in residue_group
-                ],
-                per_residue_coord_mask_list=[
-                    per_residue_coord_mask_list[i] for i in residue_group
-                ],
-                per_residue_perm_list=[per_residue_perm_list[i] for i in residue_group],
-                eps=self.eps,
-                run_checker=self.run_checker,
-            )
-            residue_position_list.extend(per_res_pos_list)
-            residue_best_permutation_list.extend(per_res_best_permutation)
-            residue_is_permuted_list.extend(per_res_is_permuted)
-            residue_optimized_rmsd_list.extend(per_res_optimized_rmsd)
-            residue_original_rmsd_list.extend(per_res_ori_rmsd)
-
         # Aggregate per_residue results
         # 1. Best permutation
         indices_list = [
-            torch.arange(pos[0], pos[1], device=device) for pos in residue_position_list
+            torch.arange(pos[0], pos[1], device=device)
+            for pos in per_residue_position_list
         ]
         residue_atom_indices = torch.cat(indices_list, dim=-1)  # [N_perm_atom]
         residue_best_permutation = torch.cat(
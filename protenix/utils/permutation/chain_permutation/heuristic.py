@@ -15,12 +15,12 @@
 import random
 
 import torch
+from scipy.optimize import linear_sum_assignment
 
-from protenix.metrics.rmsd import rmsd, self_aligned_rmsd
+from protenix.metrics.rmsd import rmsd, segment_align_pred_to_true, self_aligned_rmsd
 from protenix.utils.logger import get_logger
 from protenix.utils.permutation.chain_permutation.utils import (
     apply_transform,
-    get_optimal_transform,
     num_unique_matches,
 )
 from protenix.utils.permutation.utils import Checker
@@ -216,11 +216,28 @@ class MultiChainPermutation(object):
     """
 
     def __init__(
-        self, use_center_rmsd, find_gt_anchor_first, accept_it_as_it_is, *args, **kwargs
+        self,
+        use_center_rmsd,
+        find_gt_anchor_first,
+        accept_it_as_it_is,
+        *args,
+        batched_match: bool = False,
+        match_algorithm: str = "greedy",
+        **kwargs,
     ):
+        """
+        Args:
+            use_center_rmsd (bool): compare the chain centers instead of all tokens in the RMSD of a match.
+            find_gt_anchor_first (bool): sample the GT anchor first and enumerate the pred anchors.
+            accept_it_as_it_is (bool): keep the best match even if it does not improve the aligned RMSD.
+            batched_match (bool): evaluate all candidate anchors at once, see compute_best_match_batched.
+            match_algorithm (str): "greedy" or "hungarian", how chains are matched in batched_match.
+        """
         self.use_center_rmsd = use_center_rmsd
         self.find_gt_anchor_first = find_gt_anchor_first
         self.accept_it_as_it_is = accept_it_as_it_is
+        self.batched_match = batched_match
+        self.match_algorithm = match_algorithm
 
     @staticmethod
     def dict_of_interested_keys(
@@ -563,13 +580,12 @@ class MultiChainPermutation(object):
         assert (out_dict["mol_atom_index"] == mol_atom_index).all()
         return out_dict
 
-    def compute_best_match_heuristic(self):
+    def get_candidate_anchor_pairs(self) -> list[tuple[int, int]]:
         """
-        Compute the best chain permutation between prediction and groundtruth.
-
+        Find the candidate pairs of anchor chains to align.
 
         Returns:
-            dict[int, int]: A dictionary mapping pred chain IDs to those of the groundtruth.
+            list[tuple[int, int]]: (gt_anchor, pred_anchor) asym ids.
         """
 
         # Find anchor asym chain in predictions
@@ -592,32 +608,62 @@ class MultiChainPermutation(object):
                 anchor_entity_id
             ]
 
-        # Find best match
-        best_rmsd = torch.inf
-        best_match = None
-
+        anchor_pairs = []
         for anchor_k in candidate_anchors:
             anchor_k = anchor_k.item()
 
             if self.find_gt_anchor_first:
-                gt_anchor, pred_anchor = anchor_gt_asym_id, anchor_k
+                anchor_pairs.append((anchor_gt_asym_id, anchor_k))
             else:
-                gt_anchor, pred_anchor = anchor_k, anchor_pred_asym_id
+                anchor_pairs.append((anchor_k, anchor_pred_asym_id))
+        return anchor_pairs
+
+    def compute_best_match_heuristic(self):
+        """
+        Compute the best chain permutation between prediction and groundtruth.
+
+
+        Returns:
+            dict[int, int]: A dictionary mapping pred chain IDs to those of the groundtruth.
+        """
+
+        # Find best match
+        best_rmsd = torch.inf
+        best_match = None
+
+        anchor_pairs = []
+        src_atoms, tgt_atoms = [], []
+        for gt_anchor, pred_anchor in self.get_candidate_anchor_pairs():
 
             # Find atoms in GT chain to match atoms in predicted chain (which could be cropped)
             gt_anchor_dict = MultiChainPermutation._select_atoms_by_mol_atom_index(
                 self.label_asym_dict[gt_anchor],
                 mol_atom_index=self.pred_asym_dict[pred_anchor]["mol_atom_index"],
             )
-
-            # Align GT Anchor to Pred Anchor
             mask = gt_anchor_dict["coordinate_mask"].bool()  # use GT coordinate_mask
             if not mask.any():
                 continue
-            rot, trans = get_optimal_transform(
-                gt_anchor_dict["coordinate"][mask],
-                self.pred_asym_dict[pred_anchor]["coordinate"][mask],
-            )
+            anchor_pairs.append((gt_anchor, pred_anchor))
+            src_atoms.append(gt_anchor_dict["coordinate"][mask])
+            tgt_atoms.append(self.pred_asym_dict[pred_anchor]["coordinate"][mask])
+
+        # Align GT Anchors to Pred Anchors, all anchors at once
+        if len(anchor_pairs) > 0:
+            device = src_atoms[0].device
+            with torch.cuda.amp.autocast(enabled=False):
+                anchor_rot, anchor_trans, _ = segment_align_pred_to_true(
+                    pred_pose=torch.cat(src_atoms).to(torch.float32),
+                    true_pose=torch.cat(tgt_atoms).to(torch.float32),
+                    segment_ids=torch.repeat_interleave(
+                        torch.arange(len(anchor_pairs), device=device),
+                        torch.tensor([len(x) for x in src_atoms], device=device),
+                    ),
+                    num_segments=len(anchor_pairs),
+                    allowing_reflection=False,
+                )  # svd alignment does not support BF16
+
+        for anchor_idx, (gt_anchor, pred_anchor) in enumerate(anchor_pairs):
+            rot, trans = anchor_rot[anchor_idx], anchor_trans[anchor_idx]
 
             # Transform all GT coordinates according to the aligment results
             aligned_coordinate = apply_transform(
@@ -665,6 +711,270 @@ class MultiChainPermutation(object):
 
         return best_match
 
+    def _get_chain_pair_token_indices(self) -> dict[tuple[int, int], torch.Tensor]:
+        """
+        Find the gt tokens of each pair of a pred chain and a gt chain of the same entity.
+
+        Returns:
+            dict[tuple[int, int], torch.Tensor]: {(pred_asym_id, gt_asym_id): indices of the
+                gt tokens (in label_token_dict) matching the pred tokens by mol_atom_index,
+                in the order of the pred tokens}
+        """
+        label_mol_id = self.label_token_dict["mol_id"]
+        label_mol_atom_index = self.label_token_dict["mol_atom_index"]
+        pair_token_indices = {}
+        for pred_asym_id, pred_asym_dict in self.pred_asym_dict.items():
+            entity_id = self.pred_token_dict["asym_to_entity"][pred_asym_id]
+            for gt_asym_id in self.label_token_dict["entity_to_asym"][
+                entity_id
+            ].tolist():
+                gt_indices = torch.nonzero(label_mol_id == gt_asym_id, as_tuple=True)[0]
+                gt_indices = gt_indices[
+                    torch.isin(
+                        label_mol_atom_index[gt_indices],
+                        pred_asym_dict["mol_atom_index"],
+                    )
+                ]
+                assert (
+                    label_mol_atom_index[gt_indices] == pred_asym_dict["mol_atom_index"]
+                ).all()
+                pair_token_indices[(pred_asym_id, gt_asym_id)] = gt_indices
+        return pair_token_indices
+
+    def compute_best_match_batched(self):
+        """
+        Compute the best chain permutation between prediction and groundtruth, as
+        compute_best_match_heuristic, with all candidate anchors at once.
+
+        The anchors are aligned with a batched SVD. The chain centers are aligned instead of
+        the chain coordinates, so the distances between pred and gt chain centers form an
+        [N_anchor, N_pred_chain, N_gt_chain] tensor, and the greedy matching of each pred
+        chain is done for all anchors in one step. With match_algorithm="hungarian", the
+        chains of each entity are matched by a linear assignment of the center distances.
+
+        Returns:
+            dict[int, int]: A dictionary mapping pred chain IDs to those of the groundtruth.
+        """
+        pred_asym_ids = list(self.pred_asym_dict)
+        gt_asym_ids = list(self.label_asym_dict)
+        gt_col = {gt_asym_id: j for j, gt_asym_id in enumerate(gt_asym_ids)}
+        N_pred_chain, N_gt_chain = len(pred_asym_ids), len(gt_asym_ids)
+
+        pred_coordinate = self.pred_token_dict["coordinate"].to(torch.float32)
+        label_coordinate = self.label_token_dict["coordinate"].to(torch.float32)
+        label_mask = self.label_token_dict["coordinate_mask"].bool()
+        device = pred_coordinate.device
+        pred_token_indices = [
+            torch.nonzero(
+                self.pred_token_dict["mol_id"] == pred_asym_id, as_tuple=True
+            )[0]
+            for pred_asym_id in pred_asym_ids
+        ]
+        pair_token_indices = self._get_chain_pair_token_indices()
+
+        # Align GT Anchors to Pred Anchors, skipping anchors without resolved atoms
+        anchor_pairs = []
+        src_atoms, tgt_atoms = [], []
+        for gt_anchor, pred_anchor in self.get_candidate_anchor_pairs():
+            gt_indices = pair_token_indices[(pred_anchor, gt_anchor)]
+            mask = label_mask[gt_indices]  # use GT coordinate_mask
+            if not mask.any():
+                continue
+            anchor_pairs.append((gt_anchor, pred_anchor))
+            src_atoms.append(label_coordinate[gt_indices][mask])
+            tgt_atoms.append(
+                pred_coordinate[pred_token_indices[pred_asym_ids.index(pred_anchor)]][
+                    mask
+                ]
+            )
+        assert len(anchor_pairs) > 0
+        N_anchor = len(anchor_pairs)
+        with torch.cuda.amp.autocast(enabled=False):
+            rot, trans, _ = segment_align_pred_to_true(
+                pred_pose=torch.cat(src_atoms),
+                true_pose=torch.cat(tgt_atoms),
+                segment_ids=torch.repeat_interleave(
+                    torch.arange(N_anchor, device=device),
+                    torch.tensor([len(x) for x in src_atoms], device=device),
+                ),
+                num_segments=N_anchor,
+                allowing_reflection=False,
+            )  # [N_anchor, 3, 3], [N_anchor, 1, 3]
+
+        # Distances between the centers of the resolved tokens of pred and aligned GT chains.
+        # The center of the aligned GT chain is the aligned center of the GT chain.
+        pairs = list(pair_token_indices)
+        pred_centers, gt_centers, is_resolved = [], [], []
+        for pred_asym_id, gt_asym_id in pairs:
+            gt_indices = pair_token_indices[(pred_asym_id, gt_asym_id)]
+            mask = label_mask[gt_indices]
+            pred_indices = pred_token_indices[pred_asym_ids.index(pred_asym_id)]
+            pred_centers.append(pred_coordinate[pred_indices][mask].mean(dim=0))
+            gt_centers.append(label_coordinate[gt_indices][mask].mean(dim=0))
+            is_resolved.append(mask.any())
+        aligned_gt_centers = apply_transform(
+            torch.stack(gt_centers), rot, trans
+        )  # [N_anchor, N_pair, 3]
+        pair_distance = torch.norm(
+            aligned_gt_centers - torch.stack(pred_centers), dim=-1
+        )  # [N_anchor, N_pair]
+
+        pair_row = torch.tensor(
+            [pred_asym_ids.index(pred_asym_id) for pred_asym_id, _ in pairs],
+            device=device,
+        )
+        pair_col = torch.tensor(
+            [gt_col[gt_asym_id] for _, gt_asym_id in pairs], device=device
+        )
+        center_distance = torch.full(
+            (N_anchor, N_pred_chain, N_gt_chain), torch.inf, device=device
+        )
+        center_distance[:, pair_row, pair_col] = pair_distance
+        is_same_entity = torch.zeros(
+            (N_pred_chain, N_gt_chain), dtype=torch.bool, device=device
+        )
+        is_same_entity[pair_row, pair_col] = True
+        is_resolved_pair = torch.zeros_like(is_same_entity)
+        is_resolved_pair[pair_row, pair_col] = torch.stack(is_resolved)
+
+        # Match the anchors to each other
+        anchor_index = torch.arange(N_anchor, device=device)
+        anchor_row = torch.tensor(
+            [pred_asym_ids.index(pred_anchor) for _, pred_anchor in anchor_pairs],
+            device=device,
+        )
+        anchor_col = torch.tensor(
+            [gt_col[gt_anchor] for gt_anchor, _ in anchor_pairs], device=device
+        )
+        match = torch.full(
+            (N_anchor, N_pred_chain), -1, dtype=torch.long, device=device
+        )  # GT chain column of each pred chain
+        match[anchor_index, anchor_row] = anchor_col
+        is_used = torch.zeros((N_anchor, N_gt_chain), dtype=torch.bool, device=device)
+        is_used[anchor_index, anchor_col] = True
+
+        # Sort the remaining chains by their length, so that longer chain chooses its match first.
+        match_order = sorted(
+            range(N_pred_chain), key=lambda i: -len(pred_token_indices[i])
+        )
+        if self.match_algorithm == "greedy":
+            for i in match_order:
+                to_be_matched = anchor_row != i  # [N_anchor]
+                is_available = is_same_entity[i] & ~is_used  # [N_anchor, N_gt_chain]
+                assert is_available[to_be_matched].any(dim=-1).all()
+                is_candidate = is_available & is_resolved_pair[i]
+                matched_col = torch.where(
+                    is_candidate, center_distance[:, i], torch.inf
+                ).argmin(dim=-1)
+                # If only unresolved ones remains, take the first one
+                matched_col = torch.where(
+                    is_candidate.any(dim=-1),
+                    matched_col,
+                    is_available.int().argmax(dim=-1),
+                )
+                match[to_be_matched, i] = matched_col[to_be_matched]
+                is_used[anchor_index[to_be_matched], matched_col[to_be_matched]] = True
+        elif self.match_algorithm == "hungarian":
+            # Unresolved GT chains are matched last
+            cost = torch.where(
+                is_resolved_pair, center_distance, center_distance.new_tensor(1e6)
+            ).cpu()
+            for a, (gt_anchor, pred_anchor) in enumerate(anchor_pairs):
+                for entity_id, gt_asyms in self.label_token_dict[
+                    "entity_to_asym"
+                ].items():
+                    rows = [
+                        i
+                        for i, pred_asym_id in enumerate(pred_asym_ids)
+                        if pred_asym_id != pred_anchor
+                        and self.pred_token_dict["asym_to_entity"][pred_asym_id]
+                        == entity_id
+                    ]
+                    cols = [
+                        gt_col[gt_asym_id]
+                        for gt_asym_id in gt_asyms.tolist()
+                        if gt_asym_id != gt_anchor
+                    ]
+                    if not rows:
+                        continue
+                    row_ind, col_ind = linear_sum_assignment(
+                        cost[a][rows][:, cols].numpy()
+                    )
+                    for r, c in zip(row_ind, col_ind):
+                        match[a, rows[r]] = cols[c]
+        else:
+            raise ValueError(f"Unknown match_algorithm: {self.match_algorithm}")
+        assert (match >= 0).all()
+
+        # Calculate RMSD of the matches of all anchors
+        if self.use_center_rmsd:
+            per_chain_rmsd = center_distance.gather(
+                -1, match.unsqueeze(dim=-1)
+            ).squeeze(dim=-1)
+        else:
+            # GT token matching each pred token
+            gt_token_index = torch.zeros(
+                (N_anchor, len(pred_coordinate)), dtype=torch.long, device=device
+            )
+            for i, pred_asym_id in enumerate(pred_asym_ids):
+                gt_cols = torch.nonzero(is_same_entity[i], as_tuple=True)[0]
+                candidate_indices = torch.stack(
+                    [
+                        pair_token_indices[(pred_asym_id, gt_asym_ids[j])]
+                        for j in gt_cols.tolist()
+                    ]
+                )  # [N_candidate, N_chain_token]
+                col_to_candidate = torch.zeros(
+                    N_gt_chain, dtype=torch.long, device=device
+                )
+                col_to_candidate[gt_cols] = torch.arange(len(gt_cols), device=device)
+                gt_token_index[:, pred_token_indices[i]] = candidate_indices[
+                    col_to_candidate[match[:, i]]
+                ]
+            aligned_label_coordinate = apply_transform(
+                label_coordinate, rot, trans
+            )  # [N_anchor, N_label_token, 3]
+            squared_error = torch.sum(
+                (
+                    aligned_label_coordinate.gather(
+                        -2, gt_token_index.unsqueeze(dim=-1).expand(-1, -1, 3)
+                    )
+                    - pred_coordinate
+                )
+                ** 2,
+                dim=-1,
+            )  # [N_anchor, N_pred_token]
+            token_mask = label_mask[gt_token_index].float()
+            pred_token_chain = torch.zeros(
+                len(pred_coordinate), dtype=torch.long, device=device
+            )
+            for i, indices in enumerate(pred_token_indices):
+                pred_token_chain[indices] = i
+            chain_squared_error = squared_error.new_zeros(
+                (N_anchor, N_pred_chain)
+            ).index_add_(-1, pred_token_chain, squared_error * token_mask)
+            chain_n_token = token_mask.new_zeros((N_anchor, N_pred_chain)).index_add_(
+                -1, pred_token_chain, token_mask
+            )
+            per_chain_rmsd = torch.sqrt(
+                chain_squared_error / chain_n_token.clamp(min=1)
+            )
+        per_chain_rmsd = torch.where(
+            is_resolved_pair[
+                torch.arange(N_pred_chain, device=device).expand(N_anchor, -1), match
+            ],
+            per_chain_rmsd,
+            0.0,
+        )  # [N_anchor, N_pred_chain]
+        best_anchor = per_chain_rmsd.mean(dim=-1).argmin().item()
+
+        gt_anchor, pred_anchor = anchor_pairs[best_anchor]
+        best_match = {pred_anchor: gt_anchor}
+        for i in match_order:
+            if pred_asym_ids[i] != pred_anchor:
+                best_match[pred_asym_ids[i]] = gt_asym_ids[match[best_anchor, i]]
+        return best_match
+
     def calculate_rmsd(self, asym_match: dict):
         """
         Calculate the RMSD given a match.
@@ -864,7 +1174,10 @@ class MultiChainPermutation(object):
 
         # Core step: get best mol_id match
 
-        best_match = self.compute_best_match_heuristic()
+        if self.batched_match:
+            best_match = self.compute_best_match_batched()
+        else:
+            best_match = self.compute_best_match_heuristic()
 
         permuted_indices = self.build_permuted_indice(
             pred_dict, label_full_dict, best_match
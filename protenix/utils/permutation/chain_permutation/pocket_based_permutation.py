@@ -14,13 +14,11 @@
 
 import torch
 
-from protenix.metrics.rmsd import rmsd
-from protenix.model.utils import expand_at_dim
+from protenix.metrics.rmsd import rmsd, segment_align_pred_to_true
 from protenix.utils.distributed import traverse_and_aggregate
 from protenix.utils.logger import get_logger
 from protenix.utils.permutation.chain_permutation.utils import (
     apply_transform,
-    get_optimal_transform,
     num_unique_matches,
 )
 
@@ -98,77 +96,82 @@ def permute_pred_to_optimize_pocket_aligned_rmsd(
     log_dict["num_sym_ligand"] = len(candidate_ligands)
     log_dict["has_sym_chain"] = len(candidate_ligands) + len(candidate_pockets) > 2
 
-    # Enumerate over the batch dimension of pred_coord
-    # to find the optimal chain assignment for each sample.
+    # Score all (pocket chain, ligand chain) assignments of all samples at once
+    ordered_poc_asym_ids = list(candidate_pockets)
+    ordered_lig_asym_ids = list(candidate_ligands)
+    pocket_atom_index = torch.stack(
+        [torch.nonzero(m, as_tuple=True)[0] for m in candidate_pockets.values()]
+    )  # [N_pocket, N_pocket_atom]
+    ligand_atom_index = torch.stack(
+        [torch.nonzero(m, as_tuple=True)[0] for m in candidate_ligands.values()]
+    )  # [N_lig, N_lig_atom]
+    N_pocket, N_pocket_atom = pocket_atom_index.shape
 
-    def _find_protein_ligand_chains_for_one_sample(
-        coord: torch.Tensor,
-    ):
-        best_results = {}
-        unpermuted_results = {}
-        for poc_asym_id, pocket_mask in candidate_pockets.items():
-            # Align pocket_i to true pocket
-            rot, trans = get_optimal_transform(
-                src_atoms=coord[pocket_mask].clone(),
-                tgt_atoms=true_coord[true_pocket_mask],
-                mask=true_coord_mask[true_pocket_mask],
-            )
-            # Transform predicted coordinates according to the aligment results
-            aligned_pred_coord = apply_transform(coord.clone(), rot=rot, trans=trans)
+    # Align each candidate pocket to the true pocket
+    true_pocket_coord_mask = true_coord_mask[true_pocket_mask]
+    with torch.cuda.amp.autocast(enabled=False):
+        rot, trans, _ = segment_align_pred_to_true(
+            pred_pose=pred_coord[:, pocket_atom_index.flatten()].to(torch.float32),
+            true_pose=true_coord[true_pocket_mask]
+            .to(torch.float32)
+            .repeat(N_pocket, 1),
+            segment_ids=torch.arange(
+                N_pocket, device=pred_coord.device
+            ).repeat_interleave(N_pocket_atom),
+            num_segments=N_pocket,
+            atom_mask=true_pocket_coord_mask.repeat(N_pocket),
+            allowing_reflection=False,
+        )  # [N_sample, N_pocket, 3, 3], [N_sample, N_pocket, 1, 3]
 
-            # Find the best ligand
-            ordered_lig_asym_ids = [i for i in candidate_ligands]
-            orderd_lig_masks = [candidate_ligands[i] for i in ordered_lig_asym_ids]
-            aligned_lig_coords = torch.stack(
-                [aligned_pred_coord[m] for m in orderd_lig_masks], dim=0
-            )  # [N_lig, N_lig_atom, 3]
+    # Transform the candidate ligands according to the alignment of each pocket
+    aligned_lig_coords = apply_transform(
+        pred_coord[:, None, ligand_atom_index],
+        rot=rot[:, :, None],
+        trans=trans[:, :, None],
+    )  # [N_sample, N_pocket, N_lig, N_lig_atom, 3]
+    true_lig_coord = true_coord[true_ligand_mask]  # [N_lig_atom, 3]
+    mask = true_coord_mask[true_ligand_mask]  # [N_lig_atom]
+    if use_center_rmsd:
+        aligned_lig_center = aligned_lig_coords[..., mask, :].mean(
+            dim=-2, keepdim=True
+        )  # [N_sample, N_pocket, N_lig, 1, 3]
+        true_coord_center = true_lig_coord[mask, :].mean(dim=-2, keepdim=True)  # [1, 3]
+        per_pair_rmsd = rmsd(
+            aligned_lig_center,
+            true_coord_center.expand_as(aligned_lig_center),
+            reduce=False,
+        )  # [N_sample, N_pocket, N_lig]
+    else:
+        per_pair_rmsd = rmsd(
+            aligned_lig_coords,
+            true_lig_coord.expand_as(aligned_lig_coords),
+            mask=mask.expand(aligned_lig_coords.shape[:-1]),
+            reduce=False,
+        )  # [N_sample, N_pocket, N_lig]
 
-            if use_center_rmsd:
-                mask = true_coord_mask[true_ligand_mask].bool()  # [N_lig_atom]
-                aligned_lig_center = aligned_lig_coords[:, mask, :].mean(
-                    dim=-2, keepdim=True
-                )  # [N_lig, 1, 3]
-                true_coord_center = true_coord[true_ligand_mask][mask, :].mean(
-                    dim=-2, keepdim=True
-                )  # [1, 3]
-                per_lig_rmsd = rmsd(
-                    aligned_lig_center,  # [N_lig, 1, 3]
-                    expand_at_dim(
-                        true_coord_center,
-                        dim=0,
-                        n=aligned_lig_coords.size(0),
-                    ),
-                    reduce=False,
-                )  # [N_lig]
-            else:
-                per_lig_rmsd = rmsd(
-                    aligned_lig_coords,
-                    expand_at_dim(
-                        true_coord[true_ligand_mask],
-                        dim=0,
-                        n=aligned_lig_coords.size(0),
-                    ),
-                    mask=true_coord_mask[true_ligand_mask],
-                    reduce=False,
-                )  # [N_lig]
-            lig_rmsd, idx = per_lig_rmsd.min(dim=0)
-            lig_asym_id = ordered_lig_asym_ids[idx]
+    # The first best assignment in the order of pockets then ligands
+    N_sample = pred_coord.size(0)
+    best_rmsd, best_index = per_pair_rmsd.reshape(N_sample, -1).min(dim=-1)
+    best_poc_index = best_index // len(ordered_lig_asym_ids)
+    best_lig_index = best_index % len(ordered_lig_asym_ids)
+    unpermuted_rmsd = per_pair_rmsd[
+        :,
+        ordered_poc_asym_ids.index(pocket_asym_id),
+        ordered_lig_asym_ids.index(ligand_asym_id),
+    ]  # [N_sample]
+    aligned_pred_coord = apply_transform(
+        pred_coord,
+        rot=rot[torch.arange(N_sample), best_poc_index],
+        trans=trans[torch.arange(N_sample), best_poc_index],
+    )  # [N_sample, N_atom, 3]
 
-            if lig_rmsd < best_results.get("rmsd", torch.inf):
-                best_results = {
-                    "rmsd": lig_rmsd,
-                    "pocket_asym_id": poc_asym_id,
-                    "ligand_asym_id": lig_asym_id,
-                    "aligned_pred_coord": aligned_pred_coord,
-                }
-            if poc_asym_id == pocket_asym_id:
-                # record the unpermuted result
-                i = ordered_lig_asym_ids.index(ligand_asym_id)
-                unpermuted_lig_rmsd = per_lig_rmsd[i].item()
-                unpermuted_results = {
-                    "rmsd": unpermuted_lig_rmsd,
-                    "aligned_pred_coord": aligned_pred_coord,
-                }
+    def _find_protein_ligand_chains_for_one_sample(i: int):
+        best_results = {
+            "rmsd": best_rmsd[i],
+            "pocket_asym_id": ordered_poc_asym_ids[best_poc_index[i]],
+            "ligand_asym_id": ordered_lig_asym_ids[best_lig_index[i]],
+        }
+        unpermuted_results = {"rmsd": unpermuted_rmsd[i].item()}
 
         # record stats
         per_sample_log_dict = {
@@ -227,21 +230,19 @@ def permute_pred_to_optimize_pocket_aligned_rmsd(
             atom_indices[ori_indices.tolist()] = new_indices.clone()
             atom_indices[new_indices.tolist()] = ori_indices.clone()
 
-        aligned_pred_coord = best_results.pop("aligned_pred_coord")[atom_indices, :]
         per_sample_log_dict["rmsd"] = best_results["rmsd"].item()
 
-        return atom_indices, aligned_pred_coord, per_sample_log_dict
+        return atom_indices, aligned_pred_coord[i, atom_indices, :], per_sample_log_dict
 
-    N_sample = pred_coord.size(0)
     permute_pred_indices = []
     permuted_aligned_pred_coord = []
     sample_log_dicts = []
     for i in range(N_sample):
-        atom_indices, aligned_pred_coord, per_sample_log_dict = (
-            _find_protein_ligand_chains_for_one_sample(pred_coord[i])
+        atom_indices, aligned_pred_coord_i, per_sample_log_dict = (
+            _find_protein_ligand_chains_for_one_sample(i)
         )
         permute_pred_indices.append(atom_indices)
-        permuted_aligned_pred_coord.append(aligned_pred_coord)
+        permuted_aligned_pred_coord.append(aligned_pred_coord_i)
         sample_log_dicts.append(per_sample_log_dict)
 
     permuted_aligned_pred_coord = torch.stack(permuted_aligned_pred_coord, dim=0)
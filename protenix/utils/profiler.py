@@ -0,0 +1,284 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import resource
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Iterable, Iterator, Optional
+
+import torch
+import torch.nn as nn
+
+
+class _Timer(object):
+    """Time a region with CUDA events, read after the step is synchronized, or wall time on CPU."""
+
+    def __init__(self, use_cuda: bool) -> None:
+        self.use_cuda = use_cuda
+        if use_cuda:
+            self._start = torch.cuda.Event(enable_timing=True)
+            self._end = torch.cuda.Event(enable_timing=True)
+            self._start.record()
+        else:
+            self._start = time.perf_counter()
+
+    def stop(self) -> None:
+        if self.use_cuda:
+            self._end.record()
+        else:
+            self._end = time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        if self.use_cuda:
+            return self._start.elapsed_time(self._end)
+        return (self._end - self._start) * 1000
+
+
+class StepProfiler(object):
+    """
+    Attribute the time and memory of training steps to phases and submodules.
+
+    Submodules are timed by forward hooks, phases (e.g. forward, backward) and other calls
+    by context managers. Each region is also a `torch.profiler.record_function` range, so
+    it shows up in torch.profiler traces. Memory peaks of nested regions are tracked by
+    resetting the CUDA peak at the start of each region and folding it into all open regions.
+
+    When disabled, all methods are no-ops.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        module_names: Optional[list[str]] = None,
+        enabled: bool = True,
+    ) -> None:
+        """
+        Args:
+            model (nn.Module): the model to hook.
+            module_names (Optional[list[str]]): the submodules to time, qualified names
+                (e.g. "pairformer_stack") or class names (e.g. "TriangleAttention", which
+                aggregates all its instances).
+            enabled (bool): whether to profile.
+        """
+        self.enabled = enabled
+        self.use_cuda = torch.cuda.is_available()
+        self._hooks = []
+        # Regions of the current step: (name, timer, record_function while open)
+        self._timers = []
+        # Peaks of the open regions, innermost last: [name, peak_bytes]
+        self._memory_stack = []
+        self._memory_peaks = {}
+        self._step_memory_peak = 0
+        self._data_wait = 0.0
+        self._torch_profiler = None
+        # Submodule forward hooks are only counted in this phase, not in the
+        # recomputation of activation checkpointing during backward
+        self._phase = None
+        if enabled:
+            self._register_hooks(model, module_names or [])
+
+    def _register_hooks(self, model: nn.Module, module_names: list[str]) -> None:
+        names = set(module_names)
+        for qualified_name, module in model.named_modules():
+            # A module can be timed under both its qualified name and its class name
+            for name in (qualified_name, type(module).__name__):
+                if name not in names:
+                    continue
+                self._hooks.append(
+                    module.register_forward_pre_hook(
+                        functools.partial(self._pre_hook, f"module/{name}")
+                    )
+                )
+                self._hooks.append(
+                    module.register_forward_hook(
+                        functools.partial(self._post_hook, f"module/{name}")
+                    )
+                )
+
+    def _pre_hook(self, name: str, *args) -> None:
+        if self._phase == "forward":
+            self._start(name)
+
+    def _post_hook(self, name: str, *args) -> None:
+        if self._phase == "forward":
+            self._stop(name)
+
+    def _fold_memory_peak(self) -> None:
+        if not self.use_cuda:
+            return
+        peak = torch.cuda.max_memory_allocated()
+        for frame in self._memory_stack:
+            frame[1] = max(frame[1], peak)
+        self._step_memory_peak = max(self._step_memory_peak, peak)
+        torch.cuda.reset_peak_memory_stats()
+
+    def _start(self, name: str) -> None:
+        self._fold_memory_peak()
+        self._memory_stack.append([name, 0])
+        record_function = torch.profiler.record_function(name)
+        record_function.__enter__()
+        self._timers.append((name, _Timer(self.use_cuda), record_function))
+
+    def _stop(self, name: str) -> None:
+        # Regions are closed innermost first
+        for i in range(len(self._timers) - 1, -1, -1):
+            timer_name, timer, record_function = self._timers[i]
+            if timer_name == name and record_function is not None:
+                timer.stop()
+                record_function.__exit__(None, None, None)
+                self._timers[i] = (timer_name, timer, None)
+                break
+        self._fold_memory_peak()
+        for i in range(len(self._memory_stack) - 1, -1, -1):
+            if self._memory_stack[i][0] == name:
+                _, peak = self._memory_stack.pop(i)
+                self._memory_peaks[name] = max(self._memory_peaks.get(name, 0), peak)
+                break
+
+    @contextmanager
+    def _region(self, name: str, phase: Optional[str] = None) -> Iterator[None]:
+        last_phase = self._phase
+        if phase is not None:
+            self._phase = phase
+        self._start(name)
+        try:
+            yield
+        finally:
+            self._stop(name)
+            self._phase = last_phase
+
+    def phase(self, name: str) -> Any:
+        """
+        Context manager of a phase of the step, e.g. "forward", "loss", "backward", "optimizer".
+        Submodules are timed in the "forward" phase.
+
+        Args:
+            name (str): the phase name.
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._region(f"phase/{name}", phase=name)
+
+    def wrap_method(self, obj: Any, method_name: str, name: str) -> None:
+        """
+        Time the calls to a method of an object, e.g. the symmetric permutation.
+
+        Args:
+            obj (Any): the object.
+            method_name (str): the method to time.
+            name (str): the name of the region.
+        """
+        if not self.enabled:
+            return
+        method = getattr(obj, method_name)
+
+        @functools.wraps(method)
+        def wrapped(*args, **kwargs):
+            # Only calls within a phase of a training step are timed
+            if self._phase is None:
+                return method(*args, **kwargs)
+            with self._region(f"call/{name}"):
+                return method(*args, **kwargs)
+
+        setattr(obj, method_name, wrapped)
+
+    def start_trace(self, trace_dir: str, num_steps: int, worker_name: str) -> None:
+        """
+        Record a torch.profiler trace of `num_steps` steps after two warm-up steps.
+
+        Args:
+            trace_dir (str): directory of the traces.
+            num_steps (int): the number of steps to trace.
+            worker_name (str): the trace file prefix, e.g. the rank.
+        """
+        if not self.enabled or num_steps <= 0:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.use_cuda:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._torch_profiler = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=1, warmup=1, active=num_steps),
+            on_trace_ready=torch.profiler.tensorboard_trace_handler(
+                trace_dir, worker_name=worker_name
+            ),
+            profile_memory=True,
+        )
+        self._torch_profiler.start()
+        self._trace_steps_left = num_steps + 2
+
+    def iter_data(self, data: Iterable) -> Iterator:
+        """
+        Iterate over a data loader, recording the time waiting for each batch.
+
+        Args:
+            data (Iterable): the data loader.
+        """
+        iterator = iter(data)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            if self.enabled:
+                self._data_wait = time.perf_counter() - start
+            yield batch
+
+    def step_end(self) -> dict[str, float]:
+        """
+        End a step and get its profile.
+
+        Returns:
+            dict[str, float]: time in milliseconds ("time/...") and call counts ("calls/...")
+                of the regions, the data wait time, and memory peaks in MB ("memory/...").
+        """
+        if not self.enabled:
+            return {}
+        if self.use_cuda:
+            torch.cuda.synchronize()
+        self._fold_memory_peak()
+        profile = {"time/data_wait": self._data_wait * 1000}
+        for name, timer, _ in self._timers:
+            profile[f"time/{name}"] = (
+                profile.get(f"time/{name}", 0) + timer.elapsed_ms()
+            )
+            profile[f"calls/{name}"] = profile.get(f"calls/{name}", 0) + 1
+        if self.use_cuda:
+            for name, peak in self._memory_peaks.items():
+                profile[f"memory/{name}_cuda_peak"] = peak / 2**20
+            profile["memory/cuda_peak"] = self._step_memory_peak / 2**20
+        # Max resident set size of the process so far, in KB on Linux
+        profile["memory/cpu_max_rss"] = (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        )
+        self._timers = []
+        self._memory_stack = []
+        self._memory_peaks = {}
+        self._step_memory_peak = 0
+
+        if self._torch_profiler is not None:
+            self._torch_profiler.step()
+            self._trace_steps_left -= 1
+            if self._trace_steps_left <= 0:
+                self._torch_profiler.stop()
+                self._torch_profiler = None
+        return profile
+
+    def remove(self) -> None:
+        """Remove the hooks from the model."""
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
@@ -0,0 +1,349 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import struct
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Optional, Union
+
+import torch
+from safetensors.torch import load_file, save_file
+
+SAFETENSORS_SUFFIX = ".safetensors"
+
+
+class _TensorRef(object):
+    def __init__(self, index: int) -> None:
+        self.index = index
+
+
+def _flatten_tensors(obj: Any, tensors: list[torch.Tensor]) -> Any:
+    # Replace the tensors in nested containers by their indices in the list
+    if isinstance(obj, torch.Tensor):
+        tensors.append(obj.detach())
+        return _TensorRef(len(tensors) - 1)
+    if isinstance(obj, dict):
+        return {k: _flatten_tensors(v, tensors) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_flatten_tensors(v, tensors) for v in obj)
+    return obj
+
+
+def _unflatten_tensors(obj: Any, tensors: list[torch.Tensor]) -> Any:
+    if isinstance(obj, _TensorRef):
+        return tensors[obj.index]
+    if isinstance(obj, dict):
+        return {k: _unflatten_tensors(v, tensors) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_unflatten_tensors(v, tensors) for v in obj)
+    return obj
+
+
+def save_checkpoint_file(checkpoint: dict[str, Any], path: str) -> None:
+    """
+    Write a checkpoint to a temp file and rename it, so a checkpoint path never holds
+    a partially written file.
+
+    Args:
+        checkpoint (dict[str, Any]): the checkpoint.
+        path (str): the checkpoint path.
+    """
+    tmp_path = f"{path}.tmp"
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class AsyncCheckpointWriter(object):
+    """
+    Write checkpoints in a background thread.
+
+    `save` copies the tensors of the checkpoint to host memory and returns, so training
+    goes on while the checkpoint is serialized and written. Each checkpoint name, e.g.
+    "model" or "ema", keeps its pinned host buffers for the next save, and waits for its
+    previous write before they are reused. Files are written to a temp file and renamed,
+    so a checkpoint path never holds a partially written file.
+    """
+
+    def __init__(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # name -> (future of the last write, host buffers)
+        self._pending = {}
+
+    def _snapshot(
+        self, tensors: list[torch.Tensor], buffers: Optional[list[torch.Tensor]]
+    ) -> list[torch.Tensor]:
+        if buffers is None or [(b.shape, b.dtype) for b in buffers] != [
+            (t.shape, t.dtype) for t in tensors
+        ]:
+            buffers = [
+                torch.empty(t.shape, dtype=t.dtype, pin_memory=t.is_cuda)
+                for t in tensors
+            ]
+        for buffer, tensor in zip(buffers, tensors):
+            buffer.copy_(tensor, non_blocking=tensor.is_cuda)
+        if any(t.is_cuda for t in tensors):
+            torch.cuda.synchronize()
+        return buffers
+
+    def save(
+        self, checkpoint: dict[str, Any], path: str, name: str = "model"
+    ) -> Future:
+        """
+        Snapshot a checkpoint to host memory and write it in the background.
+
+        Args:
+            checkpoint (dict[str, Any]): nested containers of tensors and picklable items.
+            path (str): the checkpoint path.
+            name (str): checkpoints of the same name share host buffers.
+
+        Returns:
+            Future: done when the checkpoint is written.
+        """
+        buffers = None
+        if name in self._pending:
+            future, buffers = self._pending.pop(name)
+            future.result()
+        tensors = []
+        structure = _flatten_tensors(checkpoint, tensors)
+        buffers = self._snapshot(tensors, buffers)
+        host_checkpoint = _unflatten_tensors(structure, buffers)
+
+        future = self._executor.submit(save_checkpoint_file, host_checkpoint, path)
+        self._pending[name] = (future, buffers)
+        return future
+
+    def wait(self) -> None:
+        """Wait for all pending checkpoints to be written, raising their errors if any."""
+        pending, self._pending = self._pending, {}
+        for future, _buffers in pending.values():
+            future.result()
+
+
+def get_optimizer_shard_path(path: str, rank: int, num_shards: int) -> str:
+    """
+    Get the path of an optimizer state shard of a checkpoint.
+
+    Args:
+        path (str): the checkpoint path, e.g. "{step}.pt".
+        rank (int): the rank writing the shard.
+        num_shards (int): the number of shards.
+
+    Returns:
+        str: the shard path, e.g. "{step}.optim_1-of-8.pt".
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}.optim_{rank}-of-{num_shards}{ext}"
+
+
+def shard_optimizer_state_dict(
+    state_dict: dict[str, Any], rank: int, num_shards: int
+) -> tuple[dict[str, Any], dict[str, Any]]:
+    """
+    Split an optimizer state dict, replicated on all ranks, into disjoint per-rank shards.
+
+    Args:
+        state_dict (dict[str, Any]): the optimizer state dict.
+        rank (int): the rank of this shard.
+        num_shards (int): the number of shards.
+
+    Returns:
+        tuple[dict[str, Any], dict[str, Any]]: the state dict without the per-param states,
+            kept in the main checkpoint, and the per-param states of this rank.
+    """
+    main = {
+        "param_groups": state_dict["param_groups"],
+        "num_shards": num_shards,
+    }
+    shard = {
+        "state": {
+            param_id: param_state
+            for param_id, param_state in state_dict["state"].items()
+            if param_id % num_shards == rank
+        }
+    }
+    return main, shard
+
+
+def get_missing_optimizer_shards(path: str, num_shards: int) -> list[str]:
+    """
+    Get the optimizer state shards of a checkpoint that are not found.
+
+    Args:
+        path (str): the checkpoint path.
+        num_shards (int): the number of shards.
+
+    Returns:
+        list[str]: the paths of the missing shards.
+    """
+    return [
+        shard_path
+        for rank in range(num_shards)
+        if not os.path.exists(
+            shard_path := get_optimizer_shard_path(path, rank, num_shards)
+        )
+    ]
+
+
+def load_checkpoint(
+    path: str, map_location: Union[str, torch.device] = "cpu"
+) -> dict[str, Any]:
+    """
+    Load a checkpoint, memory-mapping its tensors, so they are read from disk lazily
+    when copied into the model and optimizer.
+    The optimizer state shards of a sharded checkpoint are not read, see
+    load_optimizer_state_dict.
+
+    Args:
+        path (str): the checkpoint path.
+        map_location (Union[str, torch.device]): where to load the tensors.
+
+    Returns:
+        dict[str, Any]: the checkpoint.
+    """
+    return torch.load(path, map_location=map_location, mmap=True)
+
+
+def load_optimizer_state_dict(
+    checkpoint: dict[str, Any],
+    path: str,
+    map_location: Union[str, torch.device] = "cpu",
+) -> dict[str, Any]:
+    """
+    Get the optimizer state dict of a checkpoint loaded by load_checkpoint.
+    The optimizer state of a sharded checkpoint is merged from all its shards.
+
+    Args:
+        checkpoint (dict[str, Any]): the checkpoint.
+        path (str): the checkpoint path.
+        map_location (Union[str, torch.device]): where to load the tensors.
+
+    Returns:
+        dict[str, Any]: the optimizer state dict.
+    """
+    optimizer = checkpoint["optimizer"]
+    if not (isinstance(optimizer, dict) and "num_shards" in optimizer):
+        return optimizer
+    num_shards = optimizer["num_shards"]
+    if missing := get_missing_optimizer_shards(path, num_shards):
+        raise FileNotFoundError(f"Optimizer state shards not found: {missing}")
+    state = {}
+    for rank in range(num_shards):
+        shard_path = get_optimizer_shard_path(path, rank, num_shards)
+        shard = torch.load(shard_path, map_location=map_location, mmap=True)
+        state.update(shard["state"])
+    return {
+        "state": dict(sorted(state.items())),
+        "param_groups": optimizer["param_groups"],
+    }
+
+
+def export_inference_weights(
+    checkpoint_path: str, output_path: str, dtype: Optional[torch.dtype] = None
+) -> None:
+    """
+    Export the model weights of a training checkpoint to a safetensors file for inference.
+    The optimizer and scheduler states are dropped, and the "module." prefix of DDP is removed.
+
+    Args:
+        checkpoint_path (str): the training checkpoint.
+        output_path (str): the safetensors file.
+        dtype (Optional[torch.dtype]): cast the floating point weights to this dtype, e.g. bfloat16.
+    """
+    checkpoint = torch.load(checkpoint_path, map_location="cpu", mmap=True)
+    state_dict = {}
+    for key, value in checkpoint["model"].items():
+        if key.startswith("module."):
+            key = key[len("module.") :]
+        if dtype is not None and value.is_floating_point():
+            value = value.to(dtype)
+        # Copied, safetensors does not store tensors sharing memory, e.g. tied weights
+        state_dict[key] = value.detach().clone().contiguous()
+    tmp_path = f"{output_path}.tmp"
+    save_file(
+        state_dict,
+        tmp_path,
+        metadata={"source": os.path.basename(checkpoint_path), "dtype": str(dtype)},
+    )
+    os.replace(tmp_path, output_path)
+
+
+def read_safetensors_header(path: str) -> dict[str, Any]:
+    """
+    Read and validate the header of a safetensors file, without reading the tensors.
+
+    Args:
+        path (str): the safetensors file.
+
+    Returns:
+        dict[str, Any]: the header, {name: {"dtype", "shape", "data_offsets"}} and "__metadata__".
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        (header_nbytes,) = struct.unpack("<Q", f.read(8))
+        if header_nbytes + 8 > file_size:
+            raise ValueError(f"Truncated safetensors header: {path}")
+        header = json.loads(f.read(header_nbytes))
+    data_nbytes = max(
+        [
+            info["data_offsets"][1]
+            for name, info in header.items()
+            if name != "__metadata__"
+        ],
+        default=0,
+    )
+    if 8 + header_nbytes + data_nbytes != file_size:
+        raise ValueError(
+            f"Safetensors file size {file_size} does not match its header: {path}"
+        )
+    return header
+
+
+def validate_checkpoint(path: str) -> None:
+    """
+    Check that a checkpoint is complete, e.g. after downloading it.
+    The header of a safetensors file is checked, a torch checkpoint is memory-mapped
+    so its tensors are not read.
+
+    Args:
+        path (str): the checkpoint path.
+    """
+    if path.endswith(SAFETENSORS_SUFFIX):
+        read_safetensors_header(path)
+    else:
+        torch.load(path, map_location="cpu", mmap=True)
+
+
+def load_inference_weights(
+    path: str, device: Union[str, torch.device] = "cpu"
+) -> dict[str, torch.Tensor]:
+    """
+    Load the model weights for inference, from a safetensors file written by
+    export_inference_weights, or from a training checkpoint.
+
+    Args:
+        path (str): the safetensors file or the training checkpoint.
+        device (Union[str, torch.device]): where to load the weights of a safetensors file,
+            the weights of a training checkpoint are memory-mapped on CPU.
+
+    Returns:
+        dict[str, torch.Tensor]: the state dict, without the "module." prefix of DDP.
+    """
+    if path.endswith(SAFETENSORS_SUFFIX):
+        return load_file(path, device=str(device))
+    state_dict = torch.load(path, map_location="cpu", mmap=True)["model"]
+    return {
+        (key[len("module.") :] if key.startswith("module.") else key): value
+        for key, value in state_dict.items()
+    }
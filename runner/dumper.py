@@ -14,6 +14,7 @@
 
 import os
 from pathlib import Path
+from typing import Optional
 
 import numpy as np
 import torch
@@ -49,10 +50,16 @@ class DataDumper:
         base_dir,
         need_atom_confidence: bool = False,
         sorted_by_ranking_score: bool = True,
+        top_k_samples: int = -1,
+        save_remaining_npz: bool = False,
     ) -> None:
         self.base_dir = base_dir
         self.need_atom_confidence = need_atom_confidence
         self.sorted_by_ranking_score = sorted_by_ranking_score
+        # Only the top_k_samples samples by ranking score are dumped as CIF/JSON,
+        # non-positive values dump all samples
+        self.top_k_samples = top_k_samples
+        self.save_remaining_npz = save_remaining_npz
 
     def dump(
         self,
@@ -112,12 +119,15 @@ class DataDumper:
         prediction_save_dir = os.path.join(dump_dir, "predictions")
         os.makedirs(prediction_save_dir, exist_ok=True)
 
+        sample_indices, sorted_indices = self._select_samples(data=pred_dict)
+
         # Dump structure
         b_factor = None
         if "full_data" in pred_dict:
             all_atom_plddt = []
             # len(pred_dict["full_data"]) == N_sample
-            for each_sample_dict in pred_dict["full_data"]:
+            for idx in sample_indices:
+                each_sample_dict = pred_dict["full_data"][idx]
                 if "atom_plddt" in each_sample_dict:
                     # atom_plddt.shape == [N_atom]
                     atom_plddt = each_sample_dict["atom_plddt"]
@@ -125,9 +135,8 @@ class DataDumper:
                         atom_plddt = atom_plddt.to(torch.float32)
                     all_atom_plddt.append(atom_plddt.cpu().numpy() * 100.0)
 
-            if len(all_atom_plddt) == len(pred_dict["full_data"]):
+            if len(all_atom_plddt) == len(sample_indices):
                 b_factor = all_atom_plddt
-        sorted_indices = self._get_ranker_indices(data=pred_dict)
         self._save_structure(
             pred_coordinates=pred_dict["coordinate"],
             prediction_save_dir=prediction_save_dir,
@@ -137,6 +146,7 @@ class DataDumper:
             seed=seed,
             sorted_indices=sorted_indices,
             b_factor=b_factor,
+            sample_indices=sample_indices,
         )
         # Dump confidence
         self._save_confidence(
@@ -145,7 +155,16 @@ class DataDumper:
             sample_name=pdb_id,
             seed=seed,
             sorted_indices=sorted_indices,
+            sample_indices=sample_indices,
         )
+        if self.save_remaining_npz:
+            self._save_remaining_samples(
+                data=pred_dict,
+                prediction_save_dir=prediction_save_dir,
+                sample_name=pdb_id,
+                seed=seed,
+                sample_indices=sample_indices,
+            )
 
     def _save_structure(
         self,
@@ -157,19 +176,22 @@ class DataDumper:
         seed: int,
         sorted_indices: None,
         b_factor: torch.Tensor = None,
+        sample_indices: Optional[list[int]] = None,
     ):
         assert atom_array is not None
         N_sample = pred_coordinates.shape[0]
+        if sample_indices is None:
+            sample_indices = range(N_sample)
         if sorted_indices is None:
-            sorted_indices = range(N_sample)  # do not rank the output file
-        for idx, rank in enumerate(sorted_indices):
+            sorted_indices = range(len(sample_indices))  # do not rank the output file
+        for i, (idx, rank) in enumerate(zip(sample_indices, sorted_indices)):
             output_fpath = os.path.join(
                 prediction_save_dir,
                 f"{sample_name}_seed_{seed}_sample_{rank}.cif",
             )
             if b_factor is not None:
-                # b_factor.shape == [N_sample, N_atom]
-                atom_array.set_annotation("b_factor", np.round(b_factor[idx], 2))
+                # b_factor.shape == [len(sample_indices), N_atom]
+                atom_array.set_annotation("b_factor", np.round(b_factor[i], 2))
 
             save_structure_cif(
                 atom_array=atom_array,
@@ -179,15 +201,28 @@ class DataDumper:
                 pdb_id=sample_name,
             )
 
+    @staticmethod
+    def _get_ranking_score(data: dict) -> torch.Tensor:
+        """
+        Stack the ranking scores of all samples without leaving their device.
+
+        Args:
+            data (dict): The prediction dictionary with per-sample summary_confidence.
+
+        Returns:
+            torch.Tensor: The ranking scores. Shape: [N_sample]
+        """
+        return torch.stack(
+            [
+                torch.as_tensor(summary["ranking_score"]).reshape(())
+                for summary in data["summary_confidence"]
+            ]
+        )
+
     def _get_ranker_indices(self, data: dict):
         N_sample = len(data["summary_confidence"])
         if self.sorted_by_ranking_score:
-            value = torch.tensor(
-                [
-                    data["summary_confidence"][i]["ranking_score"]
-                    for i in range(N_sample)
-                ]
-            )
+            value = self._get_ranking_score(data).cpu()
             sorted_indices = [
                 i for i in torch.argsort(torch.argsort(value, descending=True))
             ]
@@ -195,6 +230,82 @@ class DataDumper:
             sorted_indices = [i for i in range(N_sample)]
         return sorted_indices
 
+    def _select_samples(self, data: dict) -> tuple[list[int], list[int]]:
+        """
+        Select the samples to dump as CIF/JSON and the rank used in their file names.
+        With top_k_samples > 0, the samples are ranked on device and only the indices
+        of the top-k samples are moved to the host. The top-k samples are named by rank
+        if sorted_by_ranking_score, otherwise they keep their sample index and order.
+
+        Args:
+            data (dict): The prediction dictionary with per-sample summary_confidence.
+
+        Returns:
+            tuple[list[int], list[int]]:
+                - sample_indices: Indices of the selected samples.
+                - sorted_indices: Rank of each selected sample.
+        """
+        N_sample = len(data["summary_confidence"])
+        if self.top_k_samples <= 0 or self.top_k_samples >= N_sample:
+            return list(range(N_sample)), self._get_ranker_indices(data=data)
+        top_k = torch.topk(self._get_ranking_score(data), k=self.top_k_samples)
+        sample_indices = top_k.indices.tolist()
+        if not self.sorted_by_ranking_score:
+            sample_indices = sorted(sample_indices)
+            return sample_indices, sample_indices
+        return sample_indices, list(range(len(sample_indices)))
+
+    def _save_remaining_samples(
+        self,
+        data: dict,
+        prediction_save_dir: str,
+        sample_name: str,
+        seed: int,
+        sample_indices: list[int],
+    ):
+        """
+        Save the coordinates and summary confidence of the samples that are not dumped
+        as CIF/JSON into one compressed NPZ file, sorted by ranking score.
+        Only the summary confidence scores that are tensors are saved.
+        """
+        N_sample = len(data["summary_confidence"])
+        if len(sample_indices) == N_sample:
+            return
+        selected = set(sample_indices)
+        remaining = [
+            idx
+            for idx in torch.argsort(
+                self._get_ranking_score(data), descending=True
+            ).tolist()
+            if idx not in selected
+        ]
+
+        def to_numpy(x: torch.Tensor) -> np.ndarray:
+            if x.dtype == torch.bfloat16:
+                x = x.float()
+            return x.cpu().numpy()
+
+        arrays = {
+            "sample_index": np.array(remaining),
+            "rank": np.arange(len(sample_indices), N_sample),
+            "coordinate": to_numpy(
+                data["coordinate"][
+                    torch.tensor(remaining, device=data["coordinate"].device)
+                ]
+            ),
+        }
+        for key, value in data["summary_confidence"][0].items():
+            if not isinstance(value, torch.Tensor):
+                continue
+            arrays[key] = to_numpy(
+                torch.stack([data["summary_confidence"][idx][key] for idx in remaining])
+            )
+        output_fpath = os.path.join(
+            prediction_save_dir,
+            f"{sample_name}_seed_{seed}_remaining_samples.npz",
+        )
+        np.savez_compressed(output_fpath, **arrays)
+
     def _save_confidence(
         self,
         data: dict,
@@ -202,16 +313,19 @@ class DataDumper:
         sample_name: str,
         seed: int,
         sorted_indices: None,
+        sample_indices: Optional[list[int]] = None,
     ):
         N_sample = len(data["summary_confidence"])
-        for idx in range(N_sample):
+        if sample_indices is None:
+            sample_indices = range(N_sample)
+        for idx in sample_indices:
             if self.need_atom_confidence:
                 data["full_data"][idx] = get_clean_full_confidence(
                     data["full_data"][idx]
                 )
         if sorted_indices is None:
-            sorted_indices = range(N_sample)
-        for idx, rank in enumerate(sorted_indices):
+            sorted_indices = range(len(sample_indices))
+        for idx, rank in zip(sample_indices, sorted_indices):
             output_fpath = os.path.join(
                 prediction_save_dir,
                 f"{sample_name}_seed_{seed}_summary_confidence_sample_{rank}.json",
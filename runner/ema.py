@@ -29,26 +29,43 @@ class EMAWrapper(object):
         self.model = model
         self.decay = decay
         self.mutable_param_keywords = [
-            s.strip() for s in mutable_param_keywords if s.strip()
+            s.strip() for s in (mutable_param_keywords or []) if s.strip()
         ]
         self.shadow = {}
         self.backup = {}
+        # Resolved by register: the params to update and their shadows
+        self._mutable_params = []
+        self._mutable_shadows = []
+        # State dict key -> shadow name, tied params have several keys
+        self._shadow_names = {}
 
     def register(self):
+        self.shadow = {}
+        self._mutable_params = []
+        self._mutable_shadows = []
         for name, param in self.model.named_parameters():
             self.shadow[name] = param.data.clone()
+            if not self.mutable_param_keywords or any(
+                keyword in name for keyword in self.mutable_param_keywords
+            ):
+                self._mutable_params.append(param)
+                self._mutable_shadows.append(self.shadow[name])
+
+        shadow_name_by_id = {
+            id(param): name for name, param in self.model.named_parameters()
+        }
+        self._shadow_names = {
+            name: shadow_name_by_id[id(param)]
+            for name, param in self.model.named_parameters(remove_duplicate=False)
+        }
 
+    @torch.no_grad()
     def update(self):
-        for name, param in self.model.named_parameters():
-            if self.mutable_param_keywords and not any(
-                [keyword in name for keyword in self.mutable_param_keywords]
-            ):
-                continue
-            assert name in self.shadow
-            new_average = (1.0 - self.decay) * param.data + self.decay * self.shadow[
-                name
-            ]
-            self.shadow[name] = new_average.clone()
+        # shadow = decay * shadow + (1 - decay) * param, in place for all params at once
+        if self._mutable_shadows:
+            torch._foreach_lerp_(
+                self._mutable_shadows, self._mutable_params, 1.0 - self.decay
+            )
 
     def apply_shadow(self):
         for name, param in self.model.named_parameters():
@@ -61,3 +78,19 @@ class EMAWrapper(object):
             assert name in self.backup
             param.data = self.backup[name]
         self.backup = {}
+
+    def state_dict(self) -> dict[str, torch.Tensor]:
+        """
+        The state dict of the model with the shadow weights, without swapping them into the model.
+
+        Returns:
+            dict[str, torch.Tensor]: the state dict, buffers are taken from the model.
+        """
+        return {
+            key: (
+                self.shadow[self._shadow_names[key]]
+                if key in self._shadow_names
+                else value
+            )
+            for key, value in self.model.state_dict().items()
+        }
@@ -26,6 +26,7 @@ import torch.distributed as dist
 from configs.configs_base import configs as configs_base
 from configs.configs_data import data_configs
 from configs.configs_inference import inference_configs
+from runner.checkpoint import load_inference_weights, validate_checkpoint
 from runner.dumper import DataDumper
 
 from protenix.config import parse_configs, parse_sys_args
@@ -49,6 +50,8 @@ class InferenceRunner(object):
         self.init_dumper(
             need_atom_confidence=configs.need_atom_confidence,
             sorted_by_ranking_score=configs.sorted_by_ranking_score,
+            top_k_samples=configs.top_k_samples,
+            save_remaining_npz=configs.save_remaining_npz,
         )
 
     def init_env(self) -> None:
@@ -104,28 +107,48 @@ class InferenceRunner(object):
         self.print(
             f"Loading from {checkpoint_path}, strict: {self.configs.load_strict}"
         )
-        checkpoint = torch.load(checkpoint_path, self.device)
-
-        sample_key = [k for k in checkpoint["model"].keys()][0]
+        state_dict = load_inference_weights(checkpoint_path, self.device)
+        sample_key = [k for k in state_dict.keys()][0]
         self.print(f"Sampled key: {sample_key}")
-        if sample_key.startswith("module."):  # DDP checkpoint has module. prefix
-            checkpoint["model"] = {
-                k[len("module.") :]: v for k, v in checkpoint["model"].items()
-            }
+
+        # Weights already on the device are assigned to the model without a copy,
+        # weights of another dtype, e.g. exported in bf16, are cast to the model's
+        model_state_dict = self.model.state_dict()
+        assign = all(
+            value.device == model_state_dict[key].device
+            for key, value in state_dict.items()
+            if key in model_state_dict
+        )
+        state_dict = {
+            key: (
+                value.to(model_state_dict[key].dtype)
+                if key in model_state_dict
+                and value.dtype != model_state_dict[key].dtype
+                else value
+            )
+            for key, value in state_dict.items()
+        }
         self.model.load_state_dict(
-            state_dict=checkpoint["model"],
+            state_dict=state_dict,
             strict=self.configs.load_strict,
+            assign=assign,
         )
         self.model.eval()
         self.print(f"Finish loading checkpoint.")
 
     def init_dumper(
-        self, need_atom_confidence: bool = False, sorted_by_ranking_score: bool = True
+        self,
+        need_atom_confidence: bool = False,
+        sorted_by_ranking_score: bool = True,
+        top_k_samples: int = -1,
+        save_remaining_npz: bool = False,
     ):
         self.dumper = DataDumper(
             base_dir=self.dump_dir,
             need_atom_confidence=need_atom_confidence,
             sorted_by_ranking_score=sorted_by_ranking_score,
+            top_k_samples=top_k_samples,
+            save_remaining_npz=save_remaining_npz,
         )
 
     # Adapted from runner.train.Trainer.evaluate
@@ -188,8 +211,7 @@ def download_infercence_cache(configs: Any, model_version: str = "v0.2.0") -> No
         )
         urllib.request.urlretrieve(tos_url, checkpoint_path)
         try:
-            ckpt = torch.load(checkpoint_path)
-            del ckpt
+            validate_checkpoint(checkpoint_path)
         except:
             os.remove(checkpoint_path)
             raise RuntimeError(
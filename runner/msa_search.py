@@ -11,10 +11,11 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import hashlib
 import json
 import os
 import uuid
-from typing import Sequence
+from typing import Optional, Sequence
 
 from protenix.utils.logger import get_logger
 from protenix.web_service.colab_request_parser import RequestParser
@@ -54,16 +55,64 @@ def msa_search(seqs: Sequence[str], msa_res_dir: str) -> Sequence[str]:
     return msa_res_subdirs
 
 
-def update_seq_msa(infer_seq: dict, msa_res_dir: str) -> dict:
-    protein_seqs = []
-    for sequence in infer_seq["sequences"]:
-        if "proteinChain" in sequence.keys():
-            protein_seqs.append(sequence["proteinChain"]["sequence"])
+def msa_search_cached(seqs: Sequence[str], msa_res_dir: str) -> dict[str, str]:
+    """
+    do msa search for the unique sequences not searched in msa_res_dir before.
+    the result subdir of each sequence is indexed by its sha256 in msa_res_dir/msa_cache.json,
+    so that later jobs and runs with the same msa_res_dir reuse it.
+    return a dict of sequence to result subdir.
+    """
+    os.makedirs(msa_res_dir, exist_ok=True)
+    index_fpath = os.path.join(msa_res_dir, "msa_cache.json")
+    seq_index = {}
+    if os.path.exists(index_fpath):
+        with open(index_fpath, "r") as f:
+            seq_index = json.load(f)
+
+    def seq_hash(seq: str) -> str:
+        return hashlib.sha256(seq.encode()).hexdigest()
+
+    pending_seqs = sorted(
+        {seq for seq in seqs if not os.path.isdir(seq_index.get(seq_hash(seq), ""))}
+    )
+    logger.info(
+        f"{len(pending_seqs)} of {len(set(seqs))} unique sequences need msa search"
+    )
+    if len(pending_seqs) > 0:
+        # a new batch dir per search, not to overwrite the results of former searches
+        msa_res_subdirs = msa_search(
+            pending_seqs, os.path.join(msa_res_dir, uuid.uuid4().hex)
+        )
+        assert len(msa_res_subdirs) == len(pending_seqs), "msa search failed"
+        for seq, subdir in zip(pending_seqs, msa_res_subdirs):
+            seq_index[seq_hash(seq)] = subdir
+        tmp_index_fpath = f"{index_fpath}.{uuid.uuid4().hex}"
+        with open(tmp_index_fpath, "w") as f:
+            json.dump(seq_index, f, indent=4)
+        os.replace(tmp_index_fpath, index_fpath)
+    return {seq: seq_index[seq_hash(seq)] for seq in seqs}
+
+
+def get_protein_seqs(infer_seq: dict) -> list[str]:
+    return [
+        sequence["proteinChain"]["sequence"]
+        for sequence in infer_seq["sequences"]
+        if "proteinChain" in sequence.keys()
+    ]
+
+
+def update_seq_msa(
+    infer_seq: dict, msa_res_dir: str, protein_msa_res: Optional[dict] = None
+) -> dict:
+    """
+    add precomputed msa dirs to the proteinChains of infer_seq.
+    protein_msa_res maps sequence to msa result subdir, sequences not in it are searched.
+    """
+    protein_seqs = get_protein_seqs(infer_seq)
     if len(protein_seqs) > 0:
-        protein_seqs = sorted(protein_seqs)
-        msa_res_subdirs = msa_search(protein_seqs, msa_res_dir)
-        assert len(msa_res_subdirs) == len(msa_res_subdirs), "msa search failed"
-        protein_msa_res = dict(zip(protein_seqs, msa_res_subdirs))
+        protein_msa_res = dict(protein_msa_res or {})
+        if missing_seqs := [seq for seq in protein_seqs if seq not in protein_msa_res]:
+            protein_msa_res.update(msa_search_cached(missing_seqs, msa_res_dir))
         for sequence in infer_seq["sequences"]:
             if "proteinChain" in sequence.keys():
                 sequence["proteinChain"]["msa"] = {
@@ -90,24 +139,27 @@ def update_infer_json(
     with open(json_file, "r") as f:
         json_data = json.load(f)
 
-    actual_updated = False
-    for seq_idx, infer_data in enumerate(json_data):
-        if need_msa_search(infer_data):
-            actual_updated = True
-            if use_msa_server:
-                seq_name = infer_data.get("name", f"seq_{seq_idx}")
-                logger.info(
-                    f"starting to update msa result for seq {seq_idx} in {json_file}"
-                )
-                update_seq_msa(
-                    infer_data,
-                    os.path.join(out_dir, seq_name, "msa_res" f"msa_seq_{seq_idx}"),
-                )
-            else:
-                raise RuntimeError(
-                    f"infer seq {seq_idx} in `{json_file}` has no msa result, please add first."
-                )
-    if actual_updated:
+    seq_idxs = [
+        seq_idx
+        for seq_idx, infer_data in enumerate(json_data)
+        if need_msa_search(infer_data)
+    ]
+    if len(seq_idxs) > 0 and not use_msa_server:
+        raise RuntimeError(
+            f"infer seq {seq_idxs[0]} in `{json_file}` has no msa result, please add first."
+        )
+    if len(seq_idxs) > 0:
+        # search the sequences of all the infer seqs at once, each unique sequence only once
+        msa_res_dir = os.path.join(out_dir, "msa_res")
+        protein_msa_res = msa_search_cached(
+            [seq for idx in seq_idxs for seq in get_protein_seqs(json_data[idx])],
+            msa_res_dir,
+        )
+        for seq_idx in seq_idxs:
+            logger.info(
+                f"starting to update msa result for seq {seq_idx} in {json_file}"
+            )
+            update_seq_msa(json_data[seq_idx], msa_res_dir, protein_msa_res)
         updated_json = os.path.join(
             os.path.dirname(os.path.abspath(json_file)),
             f"{os.path.splitext(os.path.basename(json_file))[0]}-add-msa.json",
@@ -118,4 +170,4 @@ def update_infer_json(
         return updated_json
     else:
         logger.info(f"do not need to update msa result, so return itself {json_file}")
-        return json_file
\ No newline at end of file
+        return json_file
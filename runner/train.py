@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import datetime
+import json
 import logging
 import os
 import time
@@ -36,9 +37,19 @@ from protenix.utils.distributed import DIST_WRAPPER
 from protenix.utils.lr_scheduler import get_lr_scheduler
 from protenix.utils.metrics import SimpleMetricAggregator
 from protenix.utils.permutation.permutation import SymmetricPermutation
+from protenix.utils.profiler import StepProfiler
 from protenix.utils.seed import seed_everything
 from protenix.utils.torch_utils import autocasting_disable_decorator, to_device
 from protenix.utils.training import get_optimizer, is_loss_nan_check
+from runner.checkpoint import (
+    AsyncCheckpointWriter,
+    get_missing_optimizer_shards,
+    get_optimizer_shard_path,
+    load_checkpoint,
+    load_optimizer_state_dict,
+    save_checkpoint_file,
+    shard_optimizer_state_dict,
+)
 from runner.ema import EMAWrapper
 
 # Disable WANDB's console output capture to reduce unnecessary logging
@@ -55,6 +66,8 @@ class AF3Trainer(object):
         self.init_loss()
         self.init_data()
         self.try_load_checkpoint()
+        self.init_profiler()
+        self.checkpoint_writer = AsyncCheckpointWriter()
 
     def init_basics(self):
         # Step means effective step considering accumulation
@@ -142,6 +155,28 @@ class AF3Trainer(object):
             ), "if use ds4sci, set env as https://www.deepspeed.ai/tutorials/ds4sci_evoformerattention/"
         logging.info("Finished init ENV.")
 
+    def init_profiler(self):
+        profiler_configs = self.configs.get("profiler", {})
+        self.profiler = StepProfiler(
+            self.raw_model,
+            module_names=profiler_configs.get("module_names", []),
+            enabled=profiler_configs.get("enable", False),
+        )
+        for method_name in (
+            "permute_label_to_match_mini_rollout",
+            "permute_diffusion_sample_to_match_label",
+        ):
+            self.profiler.wrap_method(
+                self.symmetric_permutation, method_name, f"permutation/{method_name}"
+            )
+        self.profiler.start_trace(
+            trace_dir=f"{self.run_dir}/profiler",
+            num_steps=profiler_configs.get("trace_steps", 0),
+            worker_name=f"rank{DIST_WRAPPER.rank}",
+        )
+        # Averaged and max over ranks and steps, stragglers show up in the max
+        self.profile_metric_wrapper = SimpleMetricAggregator(["avg", "max"])
+
     def init_loss(self):
         self.loss = ProtenixLoss(self.configs)
         self.symmetric_permutation = SymmetricPermutation(
@@ -190,12 +225,47 @@ class AF3Trainer(object):
             error_dir=self.error_dir,
         )
 
-    def save_checkpoint(self, ema_suffix=""):
+    def save_checkpoint(self):
+        # Snapshotted to host memory and written in the background. The optimizer state,
+        # replicated on all ranks, is first written as one shard per rank, the main
+        # checkpoint keeps the full optimizer state if any shard is missing
+        path = f"{self.checkpoint_dir}/{self.step}.pt"
+        optimizer_state_dict = self.optimizer.state_dict()
+        num_shards = (
+            DIST_WRAPPER.world_size
+            if self.configs.get("shard_optimizer_checkpoint", True)
+            else 1
+        )
+        if num_shards > 1:
+            sharded_state_dict, optimizer_shard = shard_optimizer_state_dict(
+                optimizer_state_dict, DIST_WRAPPER.rank, num_shards
+            )
+            # The shards are written in the foreground, so the main checkpoint only
+            # refers to them once every rank has written its own
+            try:
+                save_checkpoint_file(
+                    optimizer_shard,
+                    get_optimizer_shard_path(path, DIST_WRAPPER.rank, num_shards),
+                )
+                shard_saved = True
+            except Exception as e:
+                logging.warning(f"Failed to save the optimizer state shard: {e}")
+                shard_saved = False
+            shards_saved = all(DIST_WRAPPER.all_gather_object(shard_saved))
+            if DIST_WRAPPER.rank == 0:
+                # Eg: ranks without a filesystem shared with rank 0
+                missing = get_missing_optimizer_shards(path, num_shards)
+                if shards_saved and not missing:
+                    optimizer_state_dict = sharded_state_dict
+                else:
+                    self.print(
+                        f"Optimizer state shards not saved {missing}, "
+                        f"saving the full optimizer state to {path}"
+                    )
         if DIST_WRAPPER.rank == 0:
-            path = f"{self.checkpoint_dir}/{self.step}{ema_suffix}.pt"
             checkpoint = {
                 "model": self.model.state_dict(),
-                "optimizer": self.optimizer.state_dict(),
+                "optimizer": optimizer_state_dict,
                 "scheduler": (
                     self.lr_scheduler.state_dict()
                     if self.lr_scheduler is not None
@@ -203,8 +273,19 @@ class AF3Trainer(object):
                 ),
                 "step": self.step,
             }
-            torch.save(checkpoint, path)
-            self.print(f"Saved checkpoint to {path}")
+            self.checkpoint_writer.save(checkpoint, path, name="model")
+            self.print(f"Saving checkpoint to {path}")
+
+    def save_ema_checkpoint(self):
+        # Written from the shadow weights, the model is not touched
+        if DIST_WRAPPER.rank == 0:
+            path = f"{self.checkpoint_dir}/{self.step}_ema_{self.ema_wrapper.decay}.pt"
+            self.checkpoint_writer.save(
+                {"model": self.ema_wrapper.state_dict(), "step": self.step},
+                path,
+                name="ema",
+            )
+            self.print(f"Saving EMA checkpoint to {path}")
 
     def try_load_checkpoint(self):
 
@@ -220,7 +301,8 @@ class AF3Trainer(object):
             self.print(
                 f"Loading from {checkpoint_path}, strict: {self.configs.load_strict}"
             )
-            checkpoint = torch.load(checkpoint_path, self.device)
+            # Memory-mapped, tensors are read when copied into the model and optimizer
+            checkpoint = load_checkpoint(checkpoint_path)
             sample_key = [k for k in checkpoint["model"].keys()][0]
             self.print(f"Sampled key: {sample_key}")
             if sample_key.startswith("module.") and not self.use_ddp:
@@ -236,7 +318,10 @@ class AF3Trainer(object):
             if not load_params_only:
                 if not skip_load_optimizer:
                     self.print(f"Loading optimizer state")
-                    self.optimizer.load_state_dict(checkpoint["optimizer"])
+                    # The shards of a sharded optimizer state are only read here
+                    self.optimizer.load_state_dict(
+                        load_optimizer_state_dict(checkpoint, checkpoint_path)
+                    )
                 if not skip_load_step:
                     self.print(f"Loading checkpoint step")
                     self.step = checkpoint["step"] + 1
@@ -296,6 +381,8 @@ class AF3Trainer(object):
             pred_dict=batch["pred_dict"],
             label_dict=batch["label_dict"],
             mode=mode,
+            # The ground truth of evaluated structures is not cropped, and is reused
+            cache_key=batch["basic"]["pdb_id"] if mode == "eval" else None,
         )
         return loss, loss_dict, batch
 
@@ -345,6 +432,8 @@ class AF3Trainer(object):
         for test_name, test_dl in self.test_dls.items():
             self.print(f"Testing on {test_name}")
             evaluated_pids = []
+            # Time and MSA depth of each sample, for balancing later evaluations
+            sample_costs = {}
             total_batch_num = len(test_dl)
             for index, batch in enumerate(tqdm(test_dl)):
                 batch = to_device(batch, self.device)
@@ -361,6 +450,8 @@ class AF3Trainer(object):
                         break
                 evaluated_pids.append(pid)
 
+                n_msa = int(batch["basic"]["N_msa"].item())
+                start_time = time.time()
                 simple_metrics = {}
                 with enable_amp:
                     # Model forward
@@ -374,6 +465,12 @@ class AF3Trainer(object):
                         {k: v for k, v in lddt_metrics.items() if "diff" not in k}
                     )
                     simple_metrics.update(loss_dict)
+                if torch.cuda.is_available():
+                    torch.cuda.synchronize()
+                sample_costs[pid] = {
+                    "time": time.time() - start_time,
+                    "N_msa": n_msa,
+                }
 
                 # Metrics
                 for key, value in simple_metrics.items():
@@ -386,11 +483,30 @@ class AF3Trainer(object):
                     # Release some memory periodically
                     torch.cuda.empty_cache()
 
+            self.dump_sample_costs(test_name, sample_costs)
             metrics = simple_metric_wrapper.calc()
             self.print(f"Step {self.step}, eval {test_name}: {metrics}")
             if self.configs.use_wandb and DIST_WRAPPER.rank == 0:
                 wandb.log(metrics, step=self.step)
 
+    def dump_sample_costs(self, test_name: str, sample_costs: dict[str, dict]):
+        """
+        Gather the sample costs of all ranks and dump them to "{dump_dir}/eval_costs/{test_name}.json",
+        which can be used as data.test_sampler.cost_dir of later runs.
+        """
+        if DIST_WRAPPER.world_size > 1:
+            all_sample_costs = DIST_WRAPPER.all_gather_object(sample_costs)
+        else:
+            all_sample_costs = [sample_costs]
+        if DIST_WRAPPER.rank == 0:
+            cost_dir = os.path.join(self.dump_dir, "eval_costs")
+            os.makedirs(cost_dir, exist_ok=True)
+            merged_sample_costs = {}
+            for rank_sample_costs in all_sample_costs:
+                merged_sample_costs.update(rank_sample_costs)
+            with open(os.path.join(cost_dir, f"{test_name}.json"), "w") as f:
+                json.dump(merged_sample_costs, f, indent=4)
+
     def update(self):
         # Clip the gradient
         if self.configs.grad_clip_norm != 0.0:
@@ -420,28 +536,32 @@ class AF3Trainer(object):
         )
 
         with enable_amp:
-            batch, _ = self.model_forward(batch, mode="train")
-            loss, loss_dict, _ = self.get_loss(batch, mode="train")
+            with self.profiler.phase("forward"):
+                batch, _ = self.model_forward(batch, mode="train")
+            with self.profiler.phase("loss"):
+                loss, loss_dict, _ = self.get_loss(batch, mode="train")
 
         if self.configs.dtype in ["bf16", "fp32"]:
             if is_loss_nan_check(loss):
                 self.print(f"Skip iteration with NaN loss: {self.step} steps")
                 loss = torch.tensor(0.0, device=loss.device, requires_grad=True)
-        scaler.scale(loss / self.iters_to_accumulate).backward()
+        with self.profiler.phase("backward"):
+            scaler.scale(loss / self.iters_to_accumulate).backward()
 
         # For simplicity, the global training step is used
         if (self.global_step + 1) % self.iters_to_accumulate == 0:
             self.print(
                 f"self.step {self.step}, self.iters_to_accumulate: {self.iters_to_accumulate}"
             )
-            # Unscales the gradients of optimizer's assigned parameters in-place
-            scaler.unscale_(self.optimizer)
-            # Do grad clip only
-            self.update()
-            scaler.step(self.optimizer)
-            scaler.update()
-            self.optimizer.zero_grad(set_to_none=True)
-            self.lr_scheduler.step()
+            with self.profiler.phase("optimizer"):
+                # Unscales the gradients of optimizer's assigned parameters in-place
+                scaler.unscale_(self.optimizer)
+                # Do grad clip only
+                self.update()
+                scaler.step(self.optimizer)
+                scaler.update()
+                self.optimizer.zero_grad(set_to_none=True)
+                self.lr_scheduler.step()
         for key, value in loss_dict.items():
             if "loss" not in key:
                 continue
@@ -484,7 +604,7 @@ class AF3Trainer(object):
         self.print(f"Using ema: {use_ema}")
 
         while True:
-            for batch in self.train_dl:
+            for batch in self.profiler.iter_data(self.train_dl):
                 is_update_step = (self.global_step + 1) % self.iters_to_accumulate == 0
                 is_last_step = (self.step + 1) == self.configs.max_steps
                 step_need_log = (self.step + 1) % self.configs.log_interval == 0
@@ -503,11 +623,15 @@ class AF3Trainer(object):
                 step_need_eval &= is_update_step
                 step_need_save &= is_update_step
 
-                batch = to_device(batch, self.device)
+                with self.profiler.phase("to_device"):
+                    batch = to_device(batch, self.device)
                 self.progress_bar()
                 self.train_step(batch)
                 if use_ema:
-                    self.ema_wrapper.update()
+                    with self.profiler.phase("ema"):
+                        self.ema_wrapper.update()
+                for key, value in self.profiler.step_end().items():
+                    self.profile_metric_wrapper.add(key, value, namespace="profile")
                 if step_need_log or is_last_step:
                     metrics = self.train_metric_wrapper.calc()
                     self.print(f"Step {self.step} train: {metrics}")
@@ -521,15 +645,16 @@ class AF3Trainer(object):
                         self.print(f"Step {self.step}, lr: {last_lr}")
                     if self.configs.use_wandb and DIST_WRAPPER.rank == 0:
                         wandb.log(metrics, step=self.step)
+                    if self.profiler.enabled:
+                        profile_metrics = self.profile_metric_wrapper.calc()
+                        self.print(f"Step {self.step} profile: {profile_metrics}")
+                        if self.configs.use_wandb and DIST_WRAPPER.rank == 0:
+                            wandb.log(profile_metrics, step=self.step)
 
                 if step_need_save or is_last_step:
                     self.save_checkpoint()
                     if use_ema:
-                        self.ema_wrapper.apply_shadow()
-                        self.save_checkpoint(
-                            ema_suffix=f"_ema_{self.ema_wrapper.decay}"
-                        )
-                        self.ema_wrapper.restore()
+                        self.save_ema_checkpoint()
 
                 if step_need_eval or is_last_step:
                     self.evaluate()
@@ -541,6 +666,7 @@ class AF3Trainer(object):
                     break
             if self.step >= self.configs.max_steps:
                 break
+        self.checkpoint_writer.wait()
 
 
 def main():
@@ -0,0 +1,99 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the dense lddt mask with the neighbor list of atom pairs, in time and memory,
+across atom counts. Atoms are placed uniformly in a box at the atom density of proteins.
+"""
+
+import argparse
+import time
+
+import torch
+
+from protenix.model.loss import compute_lddt_mask, compute_lddt_pair_indices
+
+# Atoms per cubic angstrom in proteins
+ATOM_DENSITY = 0.05
+
+
+def dense_pair_indices(
+    true_coordinate: torch.Tensor,
+    coordinate_mask: torch.Tensor,
+    is_nucleotide: torch.Tensor,
+) -> torch.Tensor:
+    distance_mask = coordinate_mask[:, None] * coordinate_mask[None, :]
+    distance = torch.cdist(true_coordinate, true_coordinate) * distance_mask
+    lddt_mask = compute_lddt_mask(
+        true_distance=distance,
+        distance_mask=distance_mask,
+        is_nucleotide=is_nucleotide,
+    )
+    return torch.nonzero(lddt_mask, as_tuple=False).T
+
+
+def benchmark(fn, device: torch.device, **kwargs) -> tuple[float, float, int]:
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base_memory = torch.cuda.memory_allocated()
+    start = time.perf_counter()
+    pair_indices = fn(**kwargs)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        peak_memory = (torch.cuda.max_memory_allocated() - base_memory) / 2**20
+    else:
+        # Without CUDA, only the size of the output is reported
+        peak_memory = float("nan")
+    return time.perf_counter() - start, peak_memory, pair_indices.shape[-1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        "--num_atoms",
+        type=int,
+        nargs="+",
+        default=[1000, 5000, 10000, 20000],
+        help="Atom counts to benchmark.",
+    )
+    parser.add_argument(
+        "--skip_dense_above",
+        type=int,
+        default=20000,
+        help="Skip the dense mask above this atom count, e.g. to avoid OOM.",
+    )
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"device: {device}")
+    print(
+        f"{'N_atom':>8} {'method':>14} {'time (s)':>10} {'peak (MB)':>10} {'N_pair':>12}"
+    )
+    for N_atom in args.num_atoms:
+        box_size = (N_atom / ATOM_DENSITY) ** (1 / 3)
+        kwargs = {
+            "true_coordinate": torch.rand(N_atom, 3, device=device) * box_size,
+            "coordinate_mask": torch.ones(N_atom, device=device),
+            "is_nucleotide": torch.rand(N_atom, device=device) < 0.1,
+        }
+        methods = {"neighbor_list": compute_lddt_pair_indices}
+        if N_atom <= args.skip_dense_above:
+            methods["dense"] = dense_pair_indices
+        for name, fn in methods.items():
+            elapsed, peak_memory, N_pair = benchmark(fn, device, **kwargs)
+            print(
+                f"{N_atom:>8} {name:>14} {elapsed:>10.3f} {peak_memory:>10.1f} {N_pair:>12}"
+            )
@@ -0,0 +1,96 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the fused smooth lddt loss (PairDistanceLossFunction) with the chunked sparse
+implementation, in forward + backward time and peak memory.
+"""
+
+import argparse
+import time
+
+import torch
+
+from protenix.model.loss import SmoothLDDTLoss, compute_lddt_pair_indices
+
+# Atoms per cubic angstrom in proteins
+ATOM_DENSITY = 0.05
+
+
+def benchmark(
+    loss_fn, pred_coordinate: torch.Tensor, num_steps: int
+) -> tuple[float, float]:
+    device = pred_coordinate.device
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base_memory = torch.cuda.memory_allocated()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        loss_fn(pred_coordinate).backward()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        peak_memory = (torch.cuda.max_memory_allocated() - base_memory) / 2**20
+    else:
+        peak_memory = float("nan")
+    return (time.perf_counter() - start) / num_steps, peak_memory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        "--num_atoms",
+        type=int,
+        nargs="+",
+        default=[2000, 5000, 10000],
+        help="Atom counts to benchmark.",
+    )
+    parser.add_argument("--num_samples", type=int, default=48)
+    parser.add_argument("--diffusion_chunk_size", type=int, default=1)
+    parser.add_argument("--num_steps", type=int, default=3)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    smooth_lddt_loss = SmoothLDDTLoss()
+    print(f"device: {device}")
+    print(
+        f"{'N_atom':>8} {'N_pair':>10} {'method':>8} {'time (s)':>10} {'peak (MB)':>10}"
+    )
+    for N_atom in args.num_atoms:
+        box_size = (N_atom / ATOM_DENSITY) ** (1 / 3)
+        true_coordinate = torch.rand(N_atom, 3, device=device) * box_size
+        pair_indices = compute_lddt_pair_indices(
+            true_coordinate=true_coordinate,
+            coordinate_mask=torch.ones(N_atom, device=device),
+            is_nucleotide=torch.zeros(N_atom, device=device),
+        )
+        pred_coordinate = (
+            true_coordinate + torch.randn(args.num_samples, N_atom, 3, device=device)
+        ).requires_grad_()
+        for method, fused in [("chunked", False), ("fused", True)]:
+            elapsed, peak_memory = benchmark(
+                lambda x: smooth_lddt_loss.sparse_forward(
+                    pred_coordinate=x,
+                    true_coordinate=true_coordinate,
+                    diffusion_chunk_size=args.diffusion_chunk_size,
+                    lddt_pair_indices=pair_indices,
+                    fused=fused,
+                ),
+                pred_coordinate,
+                args.num_steps,
+            )
+            print(
+                f"{N_atom:>8} {pair_indices.shape[-1]:>10} {method:>8} {elapsed:>10.3f} {peak_memory:>10.1f}"
+            )
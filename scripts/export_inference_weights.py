@@ -0,0 +1,64 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import logging
+import os
+
+import torch
+
+from runner.checkpoint import SAFETENSORS_SUFFIX, export_inference_weights
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-c",
+        "--checkpoint_path",
+        type=str,
+        required=True,
+        help="Path to the training checkpoint, e.g. release_data/checkpoint/model_v0.2.0.pt.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        type=str,
+        default=None,
+        help="Path to the safetensors file. Defaults to the checkpoint path with the .safetensors suffix.",
+    )
+    parser.add_argument(
+        "-d",
+        "--dtype",
+        type=str,
+        default=None,
+        choices=list(DTYPES),
+        help="Cast the floating point weights to this dtype. Defaults to keeping the checkpoint dtype.",
+    )
+    args = parser.parse_args()
+
+    output_path = (
+        args.output_path
+        or os.path.splitext(args.checkpoint_path)[0] + SAFETENSORS_SUFFIX
+    )
+    export_inference_weights(
+        args.checkpoint_path,
+        output_path,
+        dtype=DTYPES[args.dtype] if args.dtype is not None else None,
+    )
+    logger.info(f"Exported inference weights to {output_path}")
@@ -21,16 +21,28 @@ import pandas as pd
 from joblib import Parallel, delayed
 from tqdm import tqdm
 
+from protenix.data.bioassembly_store import BioassemblyStoreWriter
 from protenix.data.data_pipeline import DataPipeline
 from protenix.utils.file_io import dump_gzip_pickle
 
+# One store writer per worker process, each writes its own shards
+_STORE_WRITERS = {}
+
+
+def get_store_writer(store_dir: Path) -> BioassemblyStoreWriter:
+    if (writer := _STORE_WRITERS.get(store_dir)) is None:
+        writer = BioassemblyStoreWriter(store_dir)
+        _STORE_WRITERS[store_dir] = writer
+    return writer
+
 
 def gen_a_bioassembly_data(
     mmcif: Path,
     bioassembly_output_dir: Path,
     cluster_file: Optional[Path],
     distillation: bool = False,
-) -> Optional[list[dict]]:
+    bioassembly_format: str = "pkl.gz",
+) -> Optional[tuple[list[dict], Optional[tuple[str, list]]]]:
     """
     Generates bioassembly data from an mmCIF file and saves it to the specified output directory.
 
@@ -39,9 +51,12 @@ def gen_a_bioassembly_data(
         bioassembly_output_dir (Path): Directory where the bioassembly data will be saved.
         cluster_file (Optional[Path]): Path to the cluster file, if available.
         distillation (bool, optional): Flag indicating whether to use the 'Distillation' setting. Defaults to False.
+        bioassembly_format (str, optional): "pkl.gz" for one gzip pickle per PDB,
+            "store" for a columnar BioassemblyStore. Defaults to "pkl.gz".
 
     Returns:
-        Optional[list[dict]]: A list of sample indices if data is successfully generated, otherwise None.
+        Optional[tuple[list[dict], Optional[tuple[str, list]]]]: A list of sample indices and the
+            store index entry (None for "pkl.gz") if data is successfully generated, otherwise None.
     """
     if distillation:
         dataset = "Distillation"
@@ -55,8 +70,11 @@ def gen_a_bioassembly_data(
     if sample_indices_list and bioassembly_dict:
         pdb_id = bioassembly_dict["pdb_id"]
         # save to output dir
+        if bioassembly_format == "store":
+            index_entry = get_store_writer(bioassembly_output_dir).add(bioassembly_dict)
+            return sample_indices_list, index_entry
         dump_gzip_pickle(bioassembly_dict, bioassembly_output_dir / f"{pdb_id}.pkl.gz")
-        return sample_indices_list
+        return sample_indices_list, None
 
 
 def gen_data_from_mmcifs(
@@ -66,6 +84,7 @@ def gen_data_from_mmcifs(
     cluster_file: Optional[Path],
     distillation: bool = False,
     num_workers: int = 1,
+    bioassembly_format: str = "pkl.gz",
 ):
     """
     Generates training data from a list of mmCIF files and saves the results to a CSV file.
@@ -77,14 +96,19 @@ def gen_data_from_mmcifs(
         cluster_file (Optional[Path]): Path to the cluster file. If None, clustering is not performed.
         distillation (bool, optional): Flag indicating whether to use the 'Distillation' setting. Defaults to False.
         num_workers (int, optional): Number of parallel workers to use. Defaults to 1.
+        bioassembly_format (str, optional): "pkl.gz" or "store". Defaults to "pkl.gz".
     """
 
-    all_sample_indices_list = [
+    all_results = [
         r
         for r in tqdm(
             Parallel(n_jobs=num_workers, return_as="generator_unordered")(
                 delayed(gen_a_bioassembly_data)(
-                    mmcif, bioassembly_output_dir, cluster_file, distillation
+                    mmcif,
+                    bioassembly_output_dir,
+                    cluster_file,
+                    distillation,
+                    bioassembly_format,
                 )
                 for mmcif in mmcif_list
             ),
@@ -93,9 +117,18 @@ def gen_data_from_mmcifs(
     ]
 
     merged_results = []
-    for sample_indices_list in all_sample_indices_list:
+    index_entries = {}
+    for result in all_results:
+        if result is None:
+            continue
+        sample_indices_list, index_entry = result
         if sample_indices_list:
             merged_results += sample_indices_list
+        if index_entry is not None:
+            pdb_id, entry = index_entry
+            index_entries[pdb_id] = entry
+    if bioassembly_format == "store":
+        BioassemblyStoreWriter.write_index(bioassembly_output_dir, index_entries)
     df = pd.DataFrame(merged_results)
 
     df.to_csv(output_indices_csv, index=False, quoting=csv.QUOTE_NONNUMERIC)
@@ -108,6 +141,7 @@ def run_gen_data(
     cluster_file: Optional[Path],
     distillation: bool = False,
     num_workers: int = 1,
+    bioassembly_format: str = "pkl.gz",
 ):
     """
     Generates data from MMCIF files and saves the output to specified locations.
@@ -119,6 +153,7 @@ def run_gen_data(
         cluster_file (Optional[str]): Path to the cluster file, if any.
         distillation (bool, optional): Flag indicating whether to use the 'Distillation' setting. Defaults to False.
         num_workers (int, optional): Number of worker processes to use. Defaults to 1.
+        bioassembly_format (str, optional): "pkl.gz" or "store". Defaults to "pkl.gz".
 
     Raises:
         NotImplementedError: If the input path is not a directory or a text file.
@@ -147,6 +182,7 @@ def run_gen_data(
         cluster_file,
         distillation,
         num_workers,
+        bioassembly_format,
     )
 
 
@@ -196,6 +232,15 @@ if __name__ == "__main__":
         help="Number of worker processes to use. Defaults to 1.",
     )
 
+    parser.add_argument(
+        "-f",
+        "--bioassembly_format",
+        type=str,
+        default="pkl.gz",
+        choices=["pkl.gz", "store"],
+        help="Save bioassemblies as gzip pickles per PDB, or as a memory-mapped columnar store.",
+    )
+
     args = parser.parse_args()
 
     run_gen_data(
@@ -205,4 +250,5 @@ if __name__ == "__main__":
         cluster_file=args.cluster_file,
         distillation=args.distillation,
         num_workers=args.n_cpu,
+        bioassembly_format=args.bioassembly_format,
     )
@@ -0,0 +1,131 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+import torch
+
+from protenix.metrics.rmsd import rmsd
+from protenix.utils.permutation.atom_permutation import AtomPermutation
+
+
+def reference_optimize_per_residue_permutation(
+    pred_coord_list, coord_list, coord_mask_list, perm_list
+):
+    # Evaluate the permutations of each residue one by one
+    best_permutation_list = []
+    optimized_rmsd_list = []
+    for pred_coord, coord, coord_mask, perm in zip(
+        pred_coord_list, coord_list, coord_mask_list, perm_list
+    ):
+        per_perm_rmsd = torch.stack(
+            [
+                rmsd(
+                    pred_coord,
+                    coord[p].expand_as(pred_coord),
+                    mask=coord_mask[p].expand(pred_coord.shape[:-1]),
+                    eps=1e-8,
+                    reduce=False,
+                )
+                for p in perm
+            ],
+            dim=-1,
+        )  # [Batch, N_perm]
+        best_rmsd, best_j = torch.min(per_perm_rmsd, dim=-1)
+        best_permutation_list.append(perm[best_j])
+        optimized_rmsd_list.append(best_rmsd)
+    return best_permutation_list, optimized_rmsd_list
+
+
+class TestAtomPermutation(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        torch.manual_seed(0)
+
+    def test_optimize_per_residue_permutation_by_rmsd(self):
+        # Residues of several (N_perm, N_res_atom) shapes
+        pred_coord_list, coord_list, coord_mask_list, perm_list = [], [], [], []
+        for N_res_atom, N_perm in [(5, 2), (8, 3), (5, 2), (12, 4), (8, 3), (8, 2)]:
+            # Distinct permutations, the identity first
+            perm = torch.stack(
+                [torch.arange(N_res_atom).roll(k) for k in range(N_perm)]
+            )
+            coord = torch.randn(N_res_atom, 3)
+            perm_list.append(perm)
+            coord_list.append(coord)
+            coord_mask_list.append((torch.rand(N_res_atom) > 0.2).float())
+            # Close to one of the permutations
+            pred_coord_list.append(
+                coord[perm[torch.randint(N_perm, (4,))]]
+                + 0.1 * torch.randn(4, N_res_atom, 3)
+            )
+
+        (
+            best_permutation_list,
+            is_permuted_list,
+            optimized_rmsd_list,
+            original_rmsd_list,
+        ) = AtomPermutation._optimize_per_residue_permutation_by_rmsd(
+            pred_coord_list,
+            coord_list,
+            coord_mask_list,
+            perm_list,
+            run_checker=True,
+        )
+        expected_permutation_list, expected_rmsd_list = (
+            reference_optimize_per_residue_permutation(
+                pred_coord_list, coord_list, coord_mask_list, perm_list
+            )
+        )
+        for i in range(len(perm_list)):
+            self.assertTrue(
+                torch.equal(best_permutation_list[i], expected_permutation_list[i])
+            )
+            self.assertTrue(
+                torch.allclose(optimized_rmsd_list[i], expected_rmsd_list[i])
+            )
+            self.assertTrue(
+                torch.equal(
+                    is_permuted_list[i],
+                    (best_permutation_list[i] != perm_list[i][0]).any(dim=-1),
+                )
+            )
+            self.assertEqual(original_rmsd_list[i].shape, (4,))
+
+    def test_stacked_global_alignment(self):
+        pred_coord = torch.randn(4, 30, 3)
+        true_coord = torch.randn(30, 3)
+        masks = (torch.rand(2, 30) > 0.3).float()
+        aligned_rmsd, transformed_pred_coord = (
+            AtomPermutation.global_align_pred_to_true(
+                pred_coord.expand(2, -1, -1, -1), true_coord, masks[:, None]
+            )
+        )
+        for i in range(2):
+            expected_rmsd, expected_coord = AtomPermutation.global_align_pred_to_true(
+                pred_coord, true_coord, masks[i]
+            )
+            self.assertTrue(torch.allclose(aligned_rmsd[i], expected_rmsd))
+            self.assertTrue(
+                torch.allclose(transformed_pred_coord[i], expected_coord, atol=1e-6)
+            )
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import tempfile
+import time
+import unittest
+
+import numpy as np
+from biotite.structure import BondList
+
+from protenix.data.bioassembly_store import (
+    BioassemblyStore,
+    BioassemblyStoreWriter,
+)
+from protenix.data.tokenizer import AtomArrayTokenizer
+from tests.test_featurizer import make_atom_array
+
+
+def make_bioassembly_dict(pdb_id: str, n_res: int) -> dict:
+    atom_array, _, _ = make_atom_array(n_res=n_res)
+    atom_array.coord = np.random.randn(len(atom_array), 3).astype(np.float32)
+    atom_array.set_annotation(
+        "label_entity_id", np.array([str(i % 3) for i in range(len(atom_array))])
+    )
+    atom_array.bonds = BondList(
+        len(atom_array), np.array([[0, 1, 1], [1, 2, 1], [5, 9, 2]])
+    )
+    token_array = AtomArrayTokenizer(atom_array).get_token_array()
+    return {
+        "pdb_id": pdb_id,
+        "sequences": {"1": "A" * n_res},
+        "resolution": 2.0,
+        "atom_array": atom_array,
+        "num_tokens": len(token_array),
+        "token_array": token_array,
+        "msa_features": None,
+    }
+
+
+class TestBioassemblyStore(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store_dir = self.tmp_dir.name
+
+    def assert_bioassembly_dict_equal(self, data, expected):
+        self.assertEqual(data.keys(), expected.keys())
+        for key, value in expected.items():
+            if key not in ["atom_array", "token_array"]:
+                self.assertEqual(data[key], value, key)
+
+        atom_array, expected_atom_array = data["atom_array"], expected["atom_array"]
+        self.assertTrue(np.array_equal(atom_array.coord, expected_atom_array.coord))
+        self.assertEqual(
+            sorted(atom_array.get_annotation_categories()),
+            sorted(expected_atom_array.get_annotation_categories()),
+        )
+        for key in expected_atom_array.get_annotation_categories():
+            self.assertTrue(
+                np.array_equal(
+                    atom_array.get_annotation(key),
+                    expected_atom_array.get_annotation(key),
+                ),
+                key,
+            )
+        self.assertEqual(atom_array.bonds, expected_atom_array.bonds)
+
+        token_array, expected_token_array = data["token_array"], expected["token_array"]
+        self.assertEqual(len(token_array), len(expected_token_array))
+        for token, expected_token in zip(token_array, expected_token_array):
+            self.assertEqual(token.value, expected_token.value)
+            self.assertEqual(token.atom_indices, expected_token.atom_indices)
+            self.assertEqual(token.atom_names, expected_token.atom_names)
+            self.assertEqual(token.centre_atom_index, expected_token.centre_atom_index)
+
+    def test_write_and_read(self):
+        expected = {
+            pdb_id: make_bioassembly_dict(pdb_id, n_res)
+            for pdb_id, n_res in [("1abc", 10), ("2xyz", 25), ("3def", 4)]
+        }
+        # A small shard size so entries are split across shards
+        writer = BioassemblyStoreWriter(self.store_dir, max_shard_bytes=1)
+        index_entries = dict(writer.add(v) for v in expected.values())
+        writer.close()
+        BioassemblyStoreWriter.write_index(self.store_dir, index_entries)
+
+        store = BioassemblyStore(self.store_dir)
+        self.assertTrue(BioassemblyStore.is_store(self.store_dir))
+        self.assertEqual(len(store), 3)
+        self.assertEqual(len({entry[0] for entry in store.index.values()}), 3)
+        for pdb_id, bioassembly_dict in expected.items():
+            data = store.get(pdb_id)
+            self.assert_bioassembly_dict_equal(data, bioassembly_dict)
+            # Columns are views of the memory-mapped shard
+            self.assertIsInstance(data["atom_array"].coord.base, np.memmap)
+
+        # Modifying the arrays does not change the store
+        data = store.get("1abc")
+        data["atom_array"].coord[:] = 0
+        store = pickle.loads(pickle.dumps(store))
+        self.assert_bioassembly_dict_equal(store.get("1abc"), expected["1abc"])
+
+        # The index is merged with a later write
+        writer = BioassemblyStoreWriter(self.store_dir)
+        index_entries = dict([writer.add(make_bioassembly_dict("4ghi", 3))])
+        BioassemblyStoreWriter.write_index(self.store_dir, index_entries)
+        store = BioassemblyStore(self.store_dir)
+        self.assertEqual(len(store), 4)
+        self.assertIn("4ghi", store)
+        self.assertEqual(
+            sorted(f for f in os.listdir(self.store_dir) if not f.startswith("shard")),
+            ["index.json"],
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
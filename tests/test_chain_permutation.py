@@ -0,0 +1,207 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import time
+import unittest
+
+import torch
+
+from protenix.metrics.rmsd import rmsd
+from protenix.utils.permutation.chain_permutation.heuristic import (
+    MultiChainPermutation,
+)
+from protenix.utils.permutation.chain_permutation.pocket_based_permutation import (
+    permute_pred_to_optimize_pocket_aligned_rmsd,
+)
+from protenix.utils.permutation.chain_permutation.utils import (
+    apply_transform,
+    get_optimal_transform,
+)
+
+
+def random_complex(generator: torch.Generator):
+    """
+    A complex of homo-oligomers whose predicted chains are permuted within each entity,
+    cropped, and partially unresolved in the groundtruth.
+    """
+    # (entity_id, chain length)
+    chains = [(0, 24), (0, 24), (0, 24), (1, 16), (1, 16), (2, 8)]
+    label = {key: [] for key in ["mol_id", "entity_mol_id", "mol_atom_index"]}
+    label_coordinate, label_mask = [], []
+    for asym_id, (entity_id, length) in enumerate(chains):
+        label["mol_id"].append(torch.full((length,), asym_id))
+        label["entity_mol_id"].append(torch.full((length,), entity_id))
+        label["mol_atom_index"].append(torch.arange(length))
+        center = torch.randn(3, generator=generator) * 20
+        label_coordinate.append(
+            center + torch.randn(length, 3, generator=generator) * 3
+        )
+        label_mask.append(torch.rand(length, generator=generator) > 0.2)
+    # One unresolved chain
+    label_mask[1][:] = False
+
+    # Permute the chains of each entity in the prediction
+    permuted_asym_id = list(range(len(chains)))
+    for entity_id in set(entity_id for entity_id, _ in chains):
+        asym_ids = [i for i, (e, _) in enumerate(chains) if e == entity_id]
+        perm = torch.randperm(len(asym_ids), generator=generator).tolist()
+        for i, j in zip(asym_ids, perm):
+            permuted_asym_id[i] = asym_ids[j]
+
+    # Crop the predicted chains, dropping one copy of the first entity
+    pred = {key: [] for key in label}
+    pred_coordinate = []
+    for asym_id, (entity_id, length) in enumerate(chains):
+        if asym_id == 2:
+            continue
+        start = torch.randint(length // 4, (1,), generator=generator).item()
+        atom_index = torch.arange(start, length)
+        pred["mol_id"].append(torch.full((len(atom_index),), asym_id))
+        pred["entity_mol_id"].append(torch.full((len(atom_index),), entity_id))
+        pred["mol_atom_index"].append(atom_index)
+        pred_coordinate.append(
+            label_coordinate[permuted_asym_id[asym_id]][atom_index]
+            + torch.randn(len(atom_index), 3, generator=generator)
+        )
+
+    def to_feature_dict(features, coordinate):
+        feature_dict = {k: torch.cat(v) for k, v in features.items()}
+        N_atom = feature_dict["mol_id"].size(0)
+        feature_dict.update(
+            {
+                "coordinate": torch.cat(coordinate),
+                "pae_rep_atom_mask": torch.ones(N_atom),
+                "is_ligand": torch.zeros(N_atom),
+            }
+        )
+        return feature_dict
+
+    label_full_dict = to_feature_dict(label, label_coordinate)
+    label_full_dict["coordinate_mask"] = torch.cat(label_mask).float()
+    pred_dict = to_feature_dict(pred, pred_coordinate)
+    return pred_dict, label_full_dict, permuted_asym_id
+
+
+class TestChainPermutation(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+
+    def test_batched_match(self):
+        generator = torch.Generator().manual_seed(0)
+        for _ in range(20):
+            pred_dict, label_full_dict, _ = random_complex(generator)
+            for use_center_rmsd in [True, False]:
+                for find_gt_anchor_first in [True, False]:
+                    permutation = MultiChainPermutation(
+                        use_center_rmsd=use_center_rmsd,
+                        find_gt_anchor_first=find_gt_anchor_first,
+                        accept_it_as_it_is=False,
+                    )
+                    permutation.process_input(pred_dict, label_full_dict)
+                    random.seed(0)
+                    expected = permutation.compute_best_match_heuristic()
+                    random.seed(0)
+                    best_match = permutation.compute_best_match_batched()
+                    self.assertEqual(list(best_match.items()), list(expected.items()))
+
+    def test_hungarian_match(self):
+        generator = torch.Generator().manual_seed(1)
+        for _ in range(5):
+            pred_dict, label_full_dict, permuted_asym_id = random_complex(generator)
+            permutation = MultiChainPermutation(
+                use_center_rmsd=False,
+                find_gt_anchor_first=False,
+                accept_it_as_it_is=False,
+                match_algorithm="hungarian",
+            )
+            permutation.process_input(pred_dict, label_full_dict)
+            best_match = permutation.compute_best_match_batched()
+            # The resolved chains are matched back to their origins
+            for pred_asym_id, gt_asym_id in best_match.items():
+                if permuted_asym_id[pred_asym_id] != 1:
+                    self.assertEqual(gt_asym_id, permuted_asym_id[pred_asym_id])
+
+    def test_pocket_based_permutation(self):
+        generator = torch.Generator().manual_seed(2)
+        # Three copies of a protein and four copies of a ligand
+        chains = [(0, 40)] * 3 + [(1, 10)] * 4
+        atom_asym_id = torch.cat(
+            [torch.full((length,), i) for i, (_, length) in enumerate(chains)]
+        )
+        atom_entity_id = torch.cat([torch.full((length,), e) for e, length in chains])
+        mol_atom_index = torch.cat([torch.arange(length) for _, length in chains])
+        true_coord = torch.randn(len(atom_asym_id), 3, generator=generator) * 10
+        true_coord_mask = torch.rand(len(atom_asym_id), generator=generator) > 0.1
+        true_pocket_mask = (atom_asym_id == 0) & (mol_atom_index < 12)
+        true_ligand_mask = atom_asym_id == 3
+        pred_coord = true_coord + torch.randn(
+            4, len(atom_asym_id), 3, generator=generator
+        )
+        # The pocket and the ligand are predicted on other copies in some samples
+        pred_coord[0, atom_asym_id == 1] = true_coord[atom_asym_id == 0]
+        pred_coord[0, true_ligand_mask] = true_coord[true_ligand_mask]
+        pred_coord[1, atom_asym_id == 0] = true_coord[atom_asym_id == 0]
+        pred_coord[1, atom_asym_id == 5] = true_coord[true_ligand_mask]
+
+        permute_pred_indices, permuted_aligned_pred_coord, log_dict = (
+            permute_pred_to_optimize_pocket_aligned_rmsd(
+                pred_coord=pred_coord,
+                true_coord=true_coord,
+                true_coord_mask=true_coord_mask,
+                true_pocket_mask=true_pocket_mask,
+                true_ligand_mask=true_ligand_mask,
+                atom_entity_id=atom_entity_id,
+                atom_asym_id=atom_asym_id,
+                mol_atom_index=mol_atom_index,
+            )
+        )
+
+        # Enumerate the (pocket, ligand) assignments one by one
+        mask = true_coord_mask[true_ligand_mask]
+        for i, coord in enumerate(pred_coord):
+            best_rmsd = torch.inf
+            for pocket_asym_id in range(3):
+                rot, trans = get_optimal_transform(
+                    coord[(atom_asym_id == pocket_asym_id) & (mol_atom_index < 12)],
+                    true_coord[true_pocket_mask],
+                    mask=true_coord_mask[true_pocket_mask],
+                )
+                aligned_coord = apply_transform(coord, rot, trans)
+                for ligand_asym_id in range(3, 7):
+                    lig_rmsd = rmsd(
+                        aligned_coord[atom_asym_id == ligand_asym_id],
+                        true_coord[true_ligand_mask],
+                        mask=mask,
+                    )
+                    if lig_rmsd < best_rmsd:
+                        best_rmsd = lig_rmsd
+                        best_aligned_coord = aligned_coord
+            self.assertTrue(
+                torch.allclose(
+                    permuted_aligned_pred_coord[i],
+                    best_aligned_coord[permute_pred_indices[i]],
+                    atol=1e-5,
+                )
+            )
+        self.assertEqual(log_dict["is_permuted_pocket"], 0.25)
+        self.assertEqual(log_dict["is_permuted_ligand"], 0.25)
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
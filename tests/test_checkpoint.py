@@ -0,0 +1,166 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import torch
+
+from runner.checkpoint import (
+    AsyncCheckpointWriter,
+    export_inference_weights,
+    get_optimizer_shard_path,
+    load_checkpoint,
+    load_inference_weights,
+    load_optimizer_state_dict,
+    read_safetensors_header,
+    shard_optimizer_state_dict,
+    validate_checkpoint,
+)
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        torch.manual_seed(0)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.model = torch.nn.Sequential(
+            torch.nn.Linear(8, 16), torch.nn.ReLU(), torch.nn.Linear(16, 4)
+        )
+        self.optimizer = torch.optim.Adam(self.model.parameters(), lr=1e-3)
+        for _ in range(2):
+            self.optimizer.zero_grad()
+            self.model(torch.randn(4, 8)).sum().backward()
+            self.optimizer.step()
+
+    def test_sharded_checkpoint(self):
+        path = os.path.join(self.tmp_dir.name, "10.pt")
+        writer = AsyncCheckpointWriter()
+        expected_model = {k: v.clone() for k, v in self.model.state_dict().items()}
+        expected_optimizer = self.optimizer.state_dict()
+        num_shards = 3
+        for rank in range(num_shards):
+            optimizer_state_dict, shard = shard_optimizer_state_dict(
+                expected_optimizer, rank, num_shards
+            )
+            writer.save(
+                shard, get_optimizer_shard_path(path, rank, num_shards), name=str(rank)
+            )
+        writer.save(
+            {"model": self.model.state_dict(), "optimizer": optimizer_state_dict},
+            path,
+            name="model",
+        )
+        # The snapshot is taken before save returns
+        with torch.no_grad():
+            for param in self.model.parameters():
+                param.add_(1.0)
+        writer.wait()
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir.name)),
+            ["10.optim_0-of-3.pt", "10.optim_1-of-3.pt", "10.optim_2-of-3.pt", "10.pt"],
+        )
+
+        checkpoint = load_checkpoint(path)
+        checkpoint["optimizer"] = load_optimizer_state_dict(checkpoint, path)
+        for key, value in expected_model.items():
+            self.assertTrue(torch.equal(checkpoint["model"][key], value))
+        self.assertEqual(
+            checkpoint["optimizer"]["param_groups"], expected_optimizer["param_groups"]
+        )
+        self.assertEqual(
+            list(checkpoint["optimizer"]["state"]), list(expected_optimizer["state"])
+        )
+        for param_id, param_state in expected_optimizer["state"].items():
+            for key, value in param_state.items():
+                self.assertTrue(
+                    torch.equal(checkpoint["optimizer"]["state"][param_id][key], value)
+                )
+        self.optimizer.load_state_dict(checkpoint["optimizer"])
+
+        # A missing shard is an error when the optimizer state is loaded
+        os.remove(get_optimizer_shard_path(path, 1, num_shards))
+        with self.assertRaises(FileNotFoundError):
+            load_optimizer_state_dict(load_checkpoint(path), path)
+
+    def test_load_params_only_without_shards(self):
+        # Fine-tuning from a copied "{step}.pt" needs none of the optimizer shards
+        path = os.path.join(self.tmp_dir.name, "10.pt")
+        num_shards = 2
+        optimizer_state_dict, _shard = shard_optimizer_state_dict(
+            self.optimizer.state_dict(), 0, num_shards
+        )
+        torch.save(
+            {"model": self.model.state_dict(), "optimizer": optimizer_state_dict},
+            path,
+        )
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["10.pt"])
+
+        model = torch.nn.Sequential(
+            torch.nn.Linear(8, 16), torch.nn.ReLU(), torch.nn.Linear(16, 4)
+        )
+        with mock.patch.object(torch, "load", wraps=torch.load) as load:
+            checkpoint = load_checkpoint(path)
+            model.load_state_dict(checkpoint["model"])
+        load.assert_called_once()
+        for key, value in self.model.state_dict().items():
+            self.assertTrue(torch.equal(model.state_dict()[key], value))
+        with self.assertRaises(FileNotFoundError):
+            load_optimizer_state_dict(checkpoint, path)
+
+    def test_export_inference_weights(self):
+        checkpoint_path = os.path.join(self.tmp_dir.name, "model.pt")
+        model_state_dict = {
+            f"module.{k}": v for k, v in self.model.state_dict().items()
+        }
+        torch.save(
+            {"model": model_state_dict, "optimizer": self.optimizer.state_dict()},
+            checkpoint_path,
+        )
+        validate_checkpoint(checkpoint_path)
+        expected = load_inference_weights(checkpoint_path)
+        self.assertEqual(list(expected), list(self.model.state_dict()))
+
+        for dtype in [None, torch.bfloat16]:
+            output_path = os.path.join(self.tmp_dir.name, f"model_{dtype}.safetensors")
+            export_inference_weights(checkpoint_path, output_path, dtype=dtype)
+            header = read_safetensors_header(output_path)
+            self.assertEqual(header["__metadata__"]["dtype"], str(dtype))
+            state_dict = load_inference_weights(output_path)
+            self.assertEqual(sorted(state_dict), sorted(expected))
+            for key, value in expected.items():
+                self.assertEqual(state_dict[key].dtype, dtype or value.dtype)
+                self.assertTrue(
+                    torch.allclose(state_dict[key].float(), value, atol=1e-2)
+                )
+
+        # A truncated file is detected from its header
+        with open(output_path, "rb") as f:
+            data = f.read()
+        with open(output_path, "wb") as f:
+            f.write(data[:-4])
+        with self.assertRaises(ValueError):
+            validate_checkpoint(output_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+import torch
+import torch.nn.functional as F
+
+from protenix.metrics.clash import Clash
+
+
+class TestClash(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        torch.manual_seed(0)
+        # Two protein chains, a ligand bonded to the first one and a free ligand
+        chain_lengths = [60, 50, 6, 8]
+        chain_is_ligand = [0, 0, 1, 1]
+        N_token = sum(chain_lengths)
+        self.asym_id = torch.repeat_interleave(
+            torch.arange(len(chain_lengths)), torch.tensor(chain_lengths)
+        )
+        # Three atoms per token
+        self.atom_to_token_idx = torch.arange(N_token).repeat_interleave(3)
+        atom_asym_id = self.asym_id[self.atom_to_token_idx]
+        self.is_ligand = torch.tensor(chain_is_ligand)[atom_asym_id]
+        self.mol_id = torch.where(atom_asym_id == 2, 0, atom_asym_id)
+        N_atom = atom_asym_id.size(0)
+        self.elements_one_hot = F.one_hot(torch.randint(10, (N_atom,)), 128).float()
+        # Dense enough for clashes in some samples
+        self.pred_coordinate = torch.rand(4, N_atom, 3, dtype=torch.float64) * 14
+        self.pred_coordinate[:2] *= 1.5
+        # The second chain overlaps the first one in the last sample
+        self.pred_coordinate[-1, atom_asym_id == 1] = self.pred_coordinate[
+            -1, :150
+        ] + 0.1 * torch.randn(150, 3, dtype=torch.float64)
+
+    def reference_clash(self, clash):
+        # Dense distances of each pair of chains
+        N_sample, N_chains = self.pred_coordinate.size(0), 4
+        atom_asym_id = self.asym_id[self.atom_to_token_idx]
+        af3_clash = torch.zeros(N_sample, N_chains, N_chains, dtype=torch.bool)
+        vdw_clash = torch.zeros(N_sample, N_chains, N_chains, dtype=torch.bool)
+        vdw_details = {}
+        for sample_id in range(N_sample):
+            for i in range(N_chains):
+                for j in range(i + 1, N_chains):
+                    kwargs = {
+                        "pred_coordinate": self.pred_coordinate[sample_id],
+                        "chain_1_mask": atom_asym_id == i,
+                        "chain_2_mask": atom_asym_id == j,
+                    }
+                    if (i, j) != (0, 2):
+                        pairs = clash.get_chain_pair_violations(
+                            violation_type="vdw",
+                            elements_one_hot=self.elements_one_hot,
+                            **kwargs,
+                        )
+                        if pairs.size(0) > 0:
+                            vdw_details[(sample_id, i, j)] = pairs
+                            vdw_clash[sample_id, i, j] = True
+                    if j < 2:
+                        pairs = clash.get_chain_pair_violations(
+                            violation_type="af3", **kwargs
+                        )
+                        total_clash = pairs.size(0)
+                        af3_clash[sample_id, i, j] = (
+                            total_clash > 100
+                            or total_clash
+                            / min(
+                                kwargs["chain_1_mask"].sum(),
+                                kwargs["chain_2_mask"].sum(),
+                            )
+                            > 0.5
+                        )
+        af3_clash = af3_clash | af3_clash.transpose(-1, -2)
+        vdw_clash = vdw_clash | vdw_clash.transpose(-1, -2)
+        return af3_clash, vdw_clash, vdw_details
+
+    def test_clash(self):
+        clash = Clash()
+        result = clash(
+            pred_coordinate=self.pred_coordinate,
+            asym_id=self.asym_id,
+            atom_to_token_idx=self.atom_to_token_idx,
+            is_ligand=self.is_ligand,
+            is_protein=1 - self.is_ligand,
+            is_dna=torch.zeros_like(self.is_ligand),
+            is_rna=torch.zeros_like(self.is_ligand),
+            mol_id=self.mol_id,
+            elements_one_hot=self.elements_one_hot,
+        )
+        af3_clash, vdw_clash, vdw_details = self.reference_clash(clash)
+        self.assertTrue(af3_clash.any() and not af3_clash.all())
+        self.assertTrue(torch.equal(result["summary"]["af3_clash"], af3_clash))
+        self.assertTrue(torch.equal(result["summary"]["vdw_clash"], vdw_clash))
+        self.assertEqual(result["summary"]["skipped_pairs"], [(0, 2)] * 4)
+        self.assertEqual(list(result["details"]["vdw_clash"]), list(vdw_details))
+        for key, pairs in vdw_details.items():
+            self.assertTrue(torch.allclose(result["details"]["vdw_clash"][key], pairs))
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+import numpy as np
+import torch
+
+from protenix.data.tokenizer import AtomArrayTokenizer
+from protenix.utils.cropping import (
+    CropData,
+    get_interface_token,
+    get_spatial_crop_index,
+)
+from tests.test_featurizer import make_atom_array
+
+
+def make_crop_data(crop_size, ref_chain_indices, n_res=60):
+    atom_array, _, _ = make_atom_array(n_res=n_res)
+    atom_array.coord = np.random.rand(len(atom_array), 3).astype(np.float32) * 40
+    _, asym_id_int = np.unique(atom_array.chain_id, return_inverse=True)
+    atom_array.set_annotation("asym_id_int", asym_id_int)
+    atom_array.set_annotation("is_resolved", np.random.rand(len(atom_array)) > 0.1)
+    atom_array.set_annotation("is_ligand", atom_array.mol_type == "ligand")
+    token_array = AtomArrayTokenizer(atom_array).get_token_array()
+    return CropData(
+        crop_size=crop_size,
+        ref_chain_indices=ref_chain_indices,
+        token_array=token_array,
+        atom_array=atom_array,
+        spatial_crop_complete_lig=True,
+    )
+
+
+def dense_spatial_crop(crop, interface_crop):
+    # Spatial cropping over the full distance matrix
+    tokens, chain_id, token_dist_mask_1d, token_indices_in_ref, _ = crop.extract_info()
+    token_distance = crop.get_token_dist_mat(token_indices_in_ref=token_indices_in_ref)
+    token_distance_mask = (
+        token_dist_mask_1d[token_indices_in_ref][:, None] * token_dist_mask_1d[None, :]
+    )
+    ref_space_uid_token = torch.Tensor(
+        crop.atom_array.ref_space_uid[
+            crop.token_array.get_annotation("centre_atom_index")
+        ]
+    )
+    selected_token_indices, reference_token_index = get_spatial_crop_index(
+        tokens=tokens,
+        chain_id=chain_id,
+        token_distance=torch.Tensor(token_distance),
+        token_distance_mask=torch.Tensor(token_distance_mask),
+        reference_chain_id=crop.ref_chain_indices,
+        ref_space_uid_token=ref_space_uid_token,
+        crop_size=crop.crop_size,
+        crop_complete_ligand_unstdRes=crop.spatial_crop_complete_lig,
+        interface_crop=interface_crop,
+    )
+    return selected_token_indices, token_indices_in_ref[reference_token_index].item()
+
+
+class TestCropping(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        np.random.seed(0)
+
+    def test_get_interface_token_mask(self):
+        crop = make_crop_data(crop_size=32, ref_chain_indices=[0, 1, 2, 3, 4, 5])
+        _, chain_id, token_dist_mask_1d, _, _ = crop.extract_info()
+        # Every token is in the reference chains
+        token_distance = torch.Tensor(crop.get_token_dist_mat(np.arange(len(chain_id))))
+        expected = get_interface_token(
+            chain_id=chain_id,
+            reference_chain_id=torch.unique(chain_id),
+            token_distance=token_distance,
+            token_distance_mask=token_dist_mask_1d[:, None]
+            * token_dist_mask_1d[None, :],
+        )
+        interface_token_mask = crop.get_interface_token_mask()
+        self.assertTrue(0 < interface_token_mask.sum() < len(chain_id))
+        self.assertEqual(
+            np.flatnonzero(interface_token_mask).tolist(), expected.tolist()
+        )
+
+        # The precomputed annotation gives the same tokens
+        CropData.add_interface_token_annotation(crop.token_array, crop.atom_array)
+        self.assertTrue(
+            np.array_equal(crop.get_interface_token_mask(), interface_token_mask)
+        )
+
+    def test_spatial_crop(self):
+        for ref_chain_indices in [[0], [0, 1], [5]]:
+            crop = make_crop_data(crop_size=32, ref_chain_indices=ref_chain_indices)
+            for crop_method in ["SpatialCropping", "SpatialInterfaceCropping"]:
+                for seed in range(5):
+                    torch.manual_seed(seed)
+                    expected = dense_spatial_crop(
+                        crop, interface_crop=crop_method == "SpatialInterfaceCropping"
+                    )
+                    torch.manual_seed(seed)
+                    selected_token_indices, reference_token_index = (
+                        crop.get_crop_indices(crop_method=crop_method)
+                    )
+                    self.assertEqual(
+                        selected_token_indices.tolist(), expected[0].tolist()
+                    )
+                    self.assertEqual(reference_token_index, expected[1])
+
+        # Fewer resolved tokens than the crop size
+        crop = make_crop_data(crop_size=200, ref_chain_indices=[0])
+        torch.manual_seed(0)
+        expected = dense_spatial_crop(crop, interface_crop=False)
+        torch.manual_seed(0)
+        selected_token_indices, _ = crop.get_crop_indices(crop_method="SpatialCropping")
+        self.assertEqual(selected_token_indices.tolist(), expected[0].tolist())
+
+    def test_spatial_crop_many_tokens(self):
+        # With thousands of tokens the tie-break noise of the dense version, up to
+        # N_token * 1e-3 A, moves the crop by more than the spacing of the tokens
+        crop = make_crop_data(crop_size=256, ref_chain_indices=[0, 1], n_res=3000)
+        self.assertGreater(len(crop.token_array), 4000)
+        for crop_method in ["SpatialCropping", "SpatialInterfaceCropping"]:
+            for seed in range(5):
+                torch.manual_seed(seed)
+                expected = dense_spatial_crop(
+                    crop, interface_crop=crop_method == "SpatialInterfaceCropping"
+                )
+                torch.manual_seed(seed)
+                selected_token_indices, reference_token_index = crop.get_crop_indices(
+                    crop_method=crop_method
+                )
+                self.assertEqual(selected_token_indices.tolist(), expected[0].tolist())
+                self.assertEqual(reference_token_index, expected[1])
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import torch
+
+from protenix.data.dataloader import (
+    DistributedWeightedSampler,
+    KeySumBalancedSampler,
+    TokenBalancedDistributedSampler,
+)
+
+
+class TestTokenBalancedDistributedSampler(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        g = torch.Generator()
+        g.manual_seed(0)
+        self.num_datapoints = 500
+        self.weights = torch.rand(self.num_datapoints, generator=g)
+        self.num_tokens = torch.randint(20, 385, (self.num_datapoints,), generator=g)
+        self.num_replicas = 8
+
+    def get_samplers(self, sampler_cls, **kwargs):
+        return [
+            sampler_cls(
+                dataset=list(range(self.num_datapoints)),
+                weights=self.weights,
+                num_samples=1000,
+                num_replicas=self.num_replicas,
+                rank=rank,
+                seed=42,
+                **kwargs,
+            )
+            for rank in range(self.num_replicas)
+        ]
+
+    def test_iter(self):
+        samplers = self.get_samplers(
+            TokenBalancedDistributedSampler, num_tokens=self.num_tokens, window_size=8
+        )
+        base_samplers = self.get_samplers(DistributedWeightedSampler)
+        for epoch in range(2):
+            for sampler in samplers + base_samplers:
+                sampler.set_epoch(epoch)
+            rank_indices = [list(sampler) for sampler in samplers]
+            base_rank_indices = [list(sampler) for sampler in base_samplers]
+
+            # The same samples, regrouped into steps of similar cost
+            self.assertEqual(
+                [len(indices) for indices in rank_indices],
+                [len(sampler) for sampler in base_samplers],
+            )
+            self.assertEqual(
+                Counter(sum(rank_indices, [])), Counter(sum(base_rank_indices, []))
+            )
+
+            stats = samplers[0].imbalance_stats
+            self.assertLess(stats["step_imbalance"], stats["unbalanced_step_imbalance"])
+            self.assertLess(stats["idle_fraction"], stats["unbalanced_idle_fraction"])
+            self.assertLess(stats["rank_imbalance"], 1.1)
+
+            step_costs = self.num_tokens[torch.tensor(rank_indices).T].double() ** 3
+            expected_stats = samplers[0].get_imbalance_stats(step_costs)
+            for key, value in expected_stats.items():
+                self.assertAlmostEqual(stats[key], value)
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+class DummyDataset(object):
+    def __init__(self, indices_list):
+        self.name = "dummy"
+        self.indices_list = indices_list
+
+    def __len__(self):
+        return len(self.indices_list)
+
+
+class TestKeySumBalancedSampler(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        rng = np.random.default_rng(0)
+        self.num_samples = 301
+        self.num_replicas = 16
+        self.indices_list = pd.DataFrame(
+            {
+                "pdb_id": [f"{i:04d}" for i in range(self.num_samples)],
+                "num_tokens": rng.integers(10, 2000, self.num_samples).astype(str),
+            }
+        )
+        self.sample_costs = {
+            pdb_id: {"time": float(rng.random() * 10), "N_msa": int(n_msa)}
+            for pdb_id, n_msa in zip(
+                self.indices_list["pdb_id"][:-1],
+                rng.integers(1, 16384, self.num_samples - 1),
+            )
+        }
+
+    def get_samplers(self, dataset, **kwargs):
+        return [
+            KeySumBalancedSampler(
+                dataset,
+                key="num_tokens",
+                seed=42,
+                num_replicas=self.num_replicas,
+                rank=rank,
+                **kwargs,
+            )
+            for rank in range(self.num_replicas)
+        ]
+
+    def test_balanced_assignments(self):
+        dataset = DummyDataset(self.indices_list)
+        for cost_model in KeySumBalancedSampler.COST_MODELS:
+            samplers = self.get_samplers(
+                dataset, cost_model=cost_model, sample_costs=self.sample_costs
+            )
+            all_indices = sum([list(sampler) for sampler in samplers], [])
+            self.assertEqual(sorted(all_indices), list(range(self.num_samples)))
+
+            # Worker costs match the assignments, and are balanced up to the largest cost
+            costs = samplers[0].get_costs()
+            worker_costs = [costs[sampler.indices].sum() for sampler in samplers]
+            self.assertTrue(np.allclose(worker_costs, samplers[0].worker_costs))
+            self.assertLessEqual(
+                max(worker_costs) - min(worker_costs), costs.max() + 1e-6
+            )
+
+        # The unmeasured sample is estimated from the others
+        samplers = self.get_samplers(
+            dataset, cost_model="timing", sample_costs=self.sample_costs
+        )
+        costs = samplers[0].get_costs()
+        self.assertEqual(costs[0], self.sample_costs["0000"]["time"])
+        self.assertTrue(np.isfinite(costs).all())
+
+        # Grouped indices list, fewer samples than workers
+        dataset = DummyDataset(
+            [df.reset_index() for _, df in self.indices_list[:5].groupby("pdb_id")]
+        )
+        samplers = self.get_samplers(dataset)
+        self.assertTrue(all(len(sampler) == 1 for sampler in samplers))
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
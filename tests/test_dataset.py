@@ -0,0 +1,147 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from protenix.data.constants import EvaluationChainInterface
+from protenix.data.dataset import BaseSingleDataset, GroupedIndices
+from protenix.utils.file_io import read_indices_csv
+
+MOL_TYPES = ["protein", "ligand", "nuc", ""]
+EVAL_TYPES = ["intra_prot", "ligand_prot", "unknown_type"]
+
+
+def reference_read_indices_list(indices_fpath, exclusion_dict, max_n_token, limits):
+    # Row-wise filtering and grouping as a list of DataFrames
+    indices_list = read_indices_csv(indices_fpath)
+    indices_list = indices_list[indices_list["num_tokens"].astype(int) <= max_n_token]
+    for col_name, exclusion_list in exclusion_dict.items():
+        cols = col_name.split("|")
+        exclusion_set = {tuple(excl.split("|")) for excl in exclusion_list}
+
+        def is_valid(row):
+            return tuple(row[col] for col in cols) not in exclusion_set
+
+        valid_mask = indices_list.apply(is_valid, axis=1)
+        indices_list = indices_list[valid_mask].reset_index(drop=True)
+    indices_list = [
+        df.reset_index() for _, df in indices_list.groupby("pdb_id", sort=True)
+    ]
+    indices_list = sorted(
+        indices_list, key=lambda df: int(df["num_tokens"].iloc[0]), reverse=True
+    )
+    indices_list = [
+        df
+        for df in indices_list
+        if len(set(df["eval_type"].to_list()).intersection(EvaluationChainInterface))
+        > 0
+    ]
+    return indices_list[:limits]
+
+
+class TestReadIndicesList(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        num_rows = 400
+        num_tokens = rng.integers(10, 100, 60)
+        pdb_idx = rng.integers(0, 60, num_rows)
+        self.indices_fpath = os.path.join(self.tmp_dir.name, "indices.csv")
+        pd.DataFrame(
+            {
+                "pdb_id": [f"{i:04d}" for i in pdb_idx],
+                "num_tokens": num_tokens[pdb_idx],
+                "type": rng.choice(["chain", "interface"], num_rows),
+                "mol_1_type": rng.choice(MOL_TYPES[:3], num_rows),
+                "mol_2_type": rng.choice(MOL_TYPES, num_rows),
+                "cluster_id": rng.integers(0, 30, num_rows),
+                "eval_type": rng.choice(EVAL_TYPES, num_rows, p=[0.1, 0.1, 0.8]),
+            }
+        ).to_csv(self.indices_fpath, index=False)
+        self.exclusion_dict = {
+            "mol_1_type|mol_2_type": ["protein|ligand", "nuc|protein"],
+            "cluster_id": ["3", "7"],
+        }
+
+    def get_dataset(self, **kwargs):
+        return BaseSingleDataset(
+            mmcif_dir="",
+            bioassembly_dict_dir=None,
+            indices_fpath=self.indices_fpath,
+            cropping_configs={},
+            pdb_list=[],
+            max_n_token=90,
+            exclusion=self.exclusion_dict,
+            limits=20,
+            **kwargs,
+        )
+
+    def test_read_indices_list(self):
+        expected = reference_read_indices_list(
+            self.indices_fpath, self.exclusion_dict, max_n_token=90, limits=20
+        )
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        for _ in range(2):
+            # The second read is from the cache
+            dataset = self.get_dataset(
+                group_by_pdb_id=True,
+                sort_by_n_token=True,
+                find_eval_chain_interface=True,
+                indices_cache_dir=cache_dir,
+            )
+            self.assertIsInstance(dataset.indices_list, GroupedIndices)
+            self.assertEqual(len(dataset), len(expected))
+            for df, expected_df in zip(dataset.indices_list, expected):
+                pd.testing.assert_frame_equal(
+                    df.drop(columns="mol_group_type"), expected_df
+                )
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        frame = dataset.indices_list.frame
+        expected_mol_group_type = frame.apply(
+            lambda row: "_".join(
+                sorted(
+                    [
+                        str(row["mol_1_type"]),
+                        str(row["mol_2_type"]).replace("nan", "intra"),
+                    ]
+                )
+            ),
+            axis=1,
+        )
+        self.assertEqual(
+            frame["mol_group_type"].tolist(), expected_mol_group_type.tolist()
+        )
+        self.assertIn("intra_protein", expected_mol_group_type.tolist())
+
+        # Another filter config has its own cache
+        self.exclusion_dict = {"cluster_id": ["3"]}
+        self.get_dataset(group_by_pdb_id=True, indices_cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
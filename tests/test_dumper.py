@@ -0,0 +1,134 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+
+from protenix.model.sample_confidence import break_down_to_per_sample_dict
+from runner.dumper import DataDumper
+
+
+class TestDataDumper(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        torch.manual_seed(0)
+        N_sample, N_atom = 6, 10
+        self.ranking_score = torch.rand(N_sample)
+        summary_confidence = {
+            "ranking_score": self.ranking_score,
+            "ptm": torch.rand(N_sample),
+            "chain_ptm": torch.rand(N_sample, 2),
+            "num_recycles": torch.tensor(4),
+        }
+        self.pred_dict = {
+            "coordinate": torch.randn(N_sample, N_atom, 3),
+            "summary_confidence": break_down_to_per_sample_dict(
+                summary_confidence, shared_keys=["num_recycles"]
+            ),
+        }
+
+    def dump(self, dumper: DataDumper, dump_dir: str):
+        # Structures are not checked, no atom_array is needed
+        with mock.patch.object(DataDumper, "_save_structure") as save_structure:
+            dumper.dump_predictions(
+                pred_dict=self.pred_dict,
+                dump_dir=dump_dir,
+                pdb_id="test",
+                atom_array=None,
+                entity_poly_type={},
+                seed=101,
+            )
+        return save_structure.call_args.kwargs
+
+    def test_top_k_samples(self):
+        order = torch.argsort(self.ranking_score, descending=True).tolist()
+        with tempfile.TemporaryDirectory() as dump_dir:
+            dumper = DataDumper(dump_dir, top_k_samples=2, save_remaining_npz=True)
+            kwargs = self.dump(dumper, dump_dir)
+            self.assertEqual(kwargs["sample_indices"], order[:2])
+            self.assertEqual(kwargs["sorted_indices"], [0, 1])
+
+            prediction_save_dir = os.path.join(dump_dir, "predictions")
+            self.assertEqual(
+                sorted(os.listdir(prediction_save_dir)),
+                [
+                    "test_seed_101_remaining_samples.npz",
+                    "test_seed_101_summary_confidence_sample_0.json",
+                    "test_seed_101_summary_confidence_sample_1.json",
+                ],
+            )
+            for rank, idx in enumerate(order[:2]):
+                with open(
+                    os.path.join(
+                        prediction_save_dir,
+                        f"test_seed_101_summary_confidence_sample_{rank}.json",
+                    )
+                ) as f:
+                    summary = json.load(f)
+                self.assertAlmostEqual(
+                    summary["ranking_score"], self.ranking_score[idx].item(), places=6
+                )
+
+            remaining = np.load(
+                os.path.join(prediction_save_dir, "test_seed_101_remaining_samples.npz")
+            )
+            self.assertEqual(remaining["sample_index"].tolist(), order[2:])
+            self.assertEqual(remaining["rank"].tolist(), [2, 3, 4, 5])
+            self.assertTrue(
+                np.allclose(
+                    remaining["coordinate"],
+                    self.pred_dict["coordinate"][order[2:]].numpy(),
+                )
+            )
+            self.assertEqual(remaining["chain_ptm"].shape, (4, 2))
+
+    def test_top_k_samples_unsorted(self):
+        order = torch.argsort(self.ranking_score, descending=True).tolist()
+        with tempfile.TemporaryDirectory() as dump_dir:
+            dumper = DataDumper(
+                dump_dir, sorted_by_ranking_score=False, top_k_samples=2
+            )
+            kwargs = self.dump(dumper, dump_dir)
+            self.assertEqual(kwargs["sample_indices"], sorted(order[:2]))
+            self.assertEqual(kwargs["sorted_indices"], sorted(order[:2]))
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(dump_dir, "predictions"))),
+                [
+                    f"test_seed_101_summary_confidence_sample_{idx}.json"
+                    for idx in sorted(order[:2])
+                ],
+            )
+
+    def test_all_samples(self):
+        with tempfile.TemporaryDirectory() as dump_dir:
+            kwargs = self.dump(DataDumper(dump_dir), dump_dir)
+            ranks = torch.argsort(torch.argsort(self.ranking_score, descending=True))
+            self.assertEqual(kwargs["sample_indices"], list(range(6)))
+            self.assertEqual([int(r) for r in kwargs["sorted_indices"]], ranks.tolist())
+            self.assertEqual(len(os.listdir(os.path.join(dump_dir, "predictions"))), 6)
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+import torch
+
+from runner.ema import EMAWrapper
+
+
+class TiedModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.encoder = torch.nn.Linear(8, 8)
+        self.decoder = torch.nn.Linear(8, 8)
+        self.head = self.decoder
+        self.norm = torch.nn.BatchNorm1d(8)
+
+
+class TestEMAWrapper(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        torch.manual_seed(0)
+
+    def test_update(self):
+        model = TiedModel()
+        decay = 0.9
+        ema = EMAWrapper(model, decay, mutable_param_keywords=["encoder", " "])
+        ema.register()
+        expected = {k: v.clone() for k, v in ema.shadow.items()}
+        for _ in range(3):
+            with torch.no_grad():
+                for param in model.parameters():
+                    param.add_(torch.randn_like(param))
+            ema.update()
+            for name, param in model.named_parameters():
+                if "encoder" in name:
+                    expected[name] = decay * expected[name] + (1 - decay) * param.data
+        for name in expected:
+            self.assertTrue(torch.allclose(ema.shadow[name], expected[name]))
+
+        # The state dict matches the one of the model with the shadow weights swapped in
+        live_state_dict = {k: v.clone() for k, v in model.state_dict().items()}
+        ema.apply_shadow()
+        expected_state_dict = {k: v.clone() for k, v in model.state_dict().items()}
+        ema.restore()
+        state_dict = ema.state_dict()
+        self.assertEqual(list(state_dict), list(expected_state_dict))
+        for key, value in expected_state_dict.items():
+            self.assertTrue(torch.equal(state_dict[key], value))
+        for key, value in model.state_dict().items():
+            self.assertTrue(torch.equal(live_state_dict[key], value))
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
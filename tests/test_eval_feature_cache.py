@@ -0,0 +1,153 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import torch
+
+from protenix.data.dataset import BaseSingleDataset
+from protenix.data.eval_feature_cache import EvalFeatureCache
+
+
+def make_sample(n_token):
+    return {
+        "input_feature_dict": {
+            "restype": torch.randn(n_token, 32),
+            "token_index": torch.arange(n_token),
+            "is_protein": torch.rand(n_token) > 0.5,
+            "bf16": torch.randn(3).bfloat16(),
+            "prot_pair_num_alignments": 7,
+        },
+        "label_full_dict": {
+            "coordinate": torch.randn(n_token * 5, 3),
+            "pocket_mask": [torch.rand(n_token) > 0.5, np.arange(4)],
+        },
+        "basic": {"pdb_id": "1abc", "chain_id": ["A", "B"]},
+    }
+
+
+def assert_nested_equal(test_case, x, y):
+    test_case.assertEqual(type(x), type(y))
+    if isinstance(x, dict):
+        test_case.assertEqual(list(x), list(y))
+        for k in x:
+            assert_nested_equal(test_case, x[k], y[k])
+    elif isinstance(x, (list, tuple)):
+        test_case.assertEqual(len(x), len(y))
+        for a, b in zip(x, y):
+            assert_nested_equal(test_case, a, b)
+    elif isinstance(x, torch.Tensor):
+        test_case.assertEqual(x.dtype, y.dtype)
+        test_case.assertTrue(torch.equal(x, y))
+    elif isinstance(x, np.ndarray):
+        test_case.assertTrue(np.array_equal(x, y))
+    else:
+        test_case.assertEqual(x, y)
+
+
+class TestEvalFeatureCache(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        torch.manual_seed(0)
+
+    def test_round_trip(self):
+        cache = EvalFeatureCache(self.tmp_dir.name, max_shard_bytes=1024)
+        samples = {str(i): make_sample(n_token) for i, n_token in enumerate([5, 40, 9])}
+        self.assertIsNone(cache.get("0"))
+        for key, sample in samples.items():
+            cache.add(key, sample, meta=f"pdb_{key}")
+
+        # A reader of another process sees the entries of all shards
+        reader = pickle.loads(pickle.dumps(EvalFeatureCache(self.tmp_dir.name)))
+        for key, sample in samples.items():
+            meta, data = reader.get(key)
+            self.assertEqual(meta, f"pdb_{key}")
+            assert_nested_equal(self, data, sample)
+        self.assertEqual(len(list(reader.store_dir.glob("*.bin"))), 3)
+
+        # Cached tensors are private copies on write
+        _, data = reader.get("1")
+        data["input_feature_dict"]["token_index"] += 1
+        _, data = reader.get("1")
+        self.assertTrue(
+            torch.equal(data["input_feature_dict"]["token_index"], torch.arange(40))
+        )
+
+    def test_dataset_cache_key(self):
+        indices_fpath = os.path.join(self.tmp_dir.name, "indices.csv")
+        pd.DataFrame(
+            {
+                "pdb_id": ["1abc", "2abc"],
+                "num_tokens": [5, 40],
+                "type": "chain",
+                "mol_1_type": "protein",
+                "mol_2_type": "",
+            }
+        ).to_csv(indices_fpath, index=False)
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+
+        def get_item(idx, **kwargs):
+            # A new dataset per evaluation, as in another run
+            dataset = BaseSingleDataset(
+                mmcif_dir="",
+                bioassembly_dict_dir=None,
+                indices_fpath=indices_fpath,
+                cropping_configs={},
+                pdb_list=[],
+                eval_feature_cache_dir=cache_dir,
+                **kwargs,
+            )
+            sample = make_sample(n_token=5)
+            with mock.patch.object(
+                dataset, "process_one", return_value=sample
+            ) as process_one:
+                data = dataset._get_cached_item(idx)
+            return data, process_one.called
+
+        msa_configs = {"msa": {"enable": True}}
+        data, is_processed = get_item(0, eval_feature_configs=msa_configs)
+        self.assertTrue(is_processed)
+        # Nothing changed: served from the cache
+        cached, is_processed = get_item(0, eval_feature_configs=msa_configs)
+        self.assertFalse(is_processed)
+        assert_nested_equal(self, cached, data)
+        # A change of the featurizer, MSA or filter configs misses
+        _, is_processed = get_item(0, eval_feature_configs={"msa": {"enable": False}})
+        self.assertTrue(is_processed)
+        _, is_processed = get_item(0, eval_feature_configs=msa_configs, max_n_token=100)
+        self.assertTrue(is_processed)
+        with mock.patch(
+            "protenix.data.dataset.get_code_version", return_value="new_version"
+        ):
+            _, is_processed = get_item(0, eval_feature_configs=msa_configs)
+        self.assertTrue(is_processed)
+        _, is_processed = get_item(0, eval_feature_configs=msa_configs)
+        self.assertFalse(is_processed)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
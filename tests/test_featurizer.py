@@ -0,0 +1,151 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+import numpy as np
+import torch
+from biotite.structure import Atom, array
+from sklearn.neighbors import KDTree
+
+from protenix.data.constants import STD_RESIDUES
+from protenix.data.featurizer import Featurizer
+from protenix.data.tokenizer import AtomArrayTokenizer
+from protenix.utils.geometry import angle_3p
+
+PROTEIN_ATOMS = ["N", "CA", "C", "O", "CB"]
+DNA_ATOMS = ["P", "C4'", "C3'", "C1'", "N9"]
+
+
+def make_atom(chain_id, res_id, res_name, atom_name, element):
+    return Atom(
+        np.zeros(3),
+        chain_id=chain_id,
+        res_id=res_id,
+        res_name=res_name,
+        atom_name=atom_name,
+        element=element,
+    )
+
+
+def make_atom_array(n_res: int = 20, n_lig: int = 3) -> tuple:
+    atoms = []
+    for res_id in range(n_res):
+        for atom_name in PROTEIN_ATOMS:
+            if res_id == 3 and atom_name == "N":
+                continue  # residue without backbone N has no frame
+            atoms.append(make_atom("A", res_id, "ALA", atom_name, atom_name[0]))
+    for res_id in range(n_res // 2):
+        for atom_name in DNA_ATOMS:
+            atoms.append(make_atom("B", res_id, "DA", atom_name, atom_name[0]))
+    for lig_id in range(n_lig):
+        for atom_idx in range(8):
+            atoms.append(make_atom(f"L{lig_id}", 1, "LIG", f"C{atom_idx}", "C"))
+    # An ion
+    atoms.append(make_atom("M", 1, "ZN", "ZN", "ZN"))
+    atom_array = array(atoms)
+
+    mol_type = np.full(len(atom_array), "ligand", dtype="U7")
+    mol_type[atom_array.res_name == "ALA"] = "protein"
+    mol_type[atom_array.res_name == "DA"] = "dna"
+    atom_array.set_annotation("mol_type", mol_type)
+    _, ref_space_uid = np.unique(
+        np.char.add(atom_array.chain_id, atom_array.res_id.astype(str)),
+        return_inverse=True,
+    )
+    atom_array.set_annotation("ref_space_uid", ref_space_uid)
+    centre_atom_mask = (
+        (atom_array.atom_name == "CA")
+        | (atom_array.atom_name == "C1'")
+        | (atom_array.mol_type == "ligand")
+    )
+    atom_array.set_annotation("centre_atom_mask", centre_atom_mask.astype(int))
+
+    ref_pos = np.random.randn(len(atom_array), 3).astype(np.float32)
+    # A colinear ligand conformer
+    colinear = np.flatnonzero(atom_array.chain_id == "L0")
+    ref_pos[colinear] = np.arange(len(colinear))[:, None] * np.array([1.0, 2.0, 3.0])
+    ref_mask = np.ones(len(atom_array), dtype=int)
+    ref_mask[np.flatnonzero(atom_array.chain_id == "L1")[0]] = 0
+    return atom_array, torch.Tensor(ref_pos), torch.Tensor(ref_mask).long()
+
+
+def reference_token_frame(token, atom_array, ref_pos, ref_mask):
+    # Per-token frame construction the batched version is checked against
+    centre_atom = atom_array[token.centre_atom_index]
+    if centre_atom.mol_type != "ligand" and centre_atom.res_name in STD_RESIDUES:
+        if centre_atom.mol_type == "protein":
+            abc_atom_name = ["N", "CA", "C"]
+        else:
+            abc_atom_name = [r"C1'", r"C3'", r"C4'"]
+        if abc_atom_name[0] not in token.atom_names:
+            return 0, [-1, -1, -1]
+        return 1, [token.atom_indices[token.atom_names.index(i)] for i in abc_atom_name]
+
+    b_idx = token.centre_atom_index
+    atom_ids = np.where(atom_array.ref_space_uid == centre_atom.ref_space_uid)[0]
+    if len(atom_ids) < 3:
+        return 0, [-1, b_idx, -1]
+    kdtree = KDTree(ref_pos[atom_ids], metric="euclidean")
+    _dist, ind = kdtree.query([ref_pos[b_idx]], k=3)
+    frame_atom_index = [atom_ids[ind[0][1]], b_idx, atom_ids[ind[0][2]]]
+    has_frame = all([ref_mask[idx] for idx in frame_atom_index])
+    if has_frame:
+        theta_degrees = angle_3p(*[ref_pos[idx] for idx in frame_atom_index])
+        if theta_degrees <= 25 or theta_degrees >= 155:
+            has_frame = 0
+    return int(has_frame), frame_atom_index
+
+
+class TestFeaturizer(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+
+    def test_get_token_frame(self):
+        atom_array, ref_pos, ref_mask = make_atom_array()
+        token_array = AtomArrayTokenizer(atom_array).get_token_array()
+        token_array_w_frame = Featurizer.get_token_frame(
+            token_array=token_array,
+            atom_array=atom_array,
+            ref_pos=ref_pos,
+            ref_mask=ref_mask,
+        )
+        has_frame = token_array_w_frame.get_annotation("has_frame")
+        frame_atom_index = token_array_w_frame.get_annotation("frame_atom_index")
+        self.assertEqual(frame_atom_index.shape, (len(token_array), 3))
+
+        for i, token in enumerate(token_array):
+            expected_has_frame, expected_frame_atom_index = reference_token_frame(
+                token, atom_array, ref_pos, ref_mask
+            )
+            self.assertEqual(has_frame[i], expected_has_frame)
+            self.assertEqual(frame_atom_index[i].tolist(), expected_frame_atom_index)
+
+        # residue without N, colinear ligand and the ion have no frame
+        self.assertEqual(has_frame[3], 0)
+        centre_chain_id = atom_array.chain_id[
+            token_array.get_annotation("centre_atom_index")
+        ]
+        self.assertFalse(has_frame[centre_chain_id == "L0"].any())
+        self.assertFalse(has_frame[centre_chain_id == "M"].any())
+        self.assertTrue(has_frame[centre_chain_id == "L2"].any())
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,390 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import biotite.structure.io.pdbx as pdbx
+import numpy as np
+import torch
+from biotite.structure.info.ccd import get_ccd
+from rdkit import Chem
+from rdkit.Chem import AllChem
+from rdkit.Geometry import Point3D
+
+from protenix.data import ccd
+from protenix.data.infer_data_pipeline import InferenceDataset, ReceptorTemplate
+from protenix.data.msa_featurizer import tokenize_msa
+
+LIGANDS = {"a": "CCO", "b": "c1ccccc1O", "c": "CC(=O)Nc1ccc(O)cc1", "d": "OCC(O)CO"}
+PROTEINS = ["GASKG", "SKAGSA"]
+BOND_ORDERS = {
+    "SING": Chem.BondType.SINGLE,
+    "DOUB": Chem.BondType.DOUBLE,
+    "TRIP": Chem.BondType.TRIPLE,
+}
+
+
+def write_ccd_components(res_names, components_file):
+    """Write the CCD blocks of res_names from the CCD bundled with biotite.
+
+    The bundled CCD lacks the leaving atom flags, the terminal OXT, HXT and H2
+    of the amino acids are marked as leaving atoms like in components.cif.
+    """
+    ccd_block = get_ccd()
+    cif = pdbx.CIFFile()
+    for res_name in res_names:
+        block = pdbx.CIFBlock()
+        for cat_name, id_field in [
+            ("chem_comp", "id"),
+            ("chem_comp_atom", "comp_id"),
+            ("chem_comp_bond", "comp_id"),
+        ]:
+            category = ccd_block[cat_name]
+            mask = category[id_field].as_array() == res_name
+            if not np.any(mask):
+                # Eg: ions without bonds
+                continue
+            block[cat_name] = pdbx.CIFCategory(
+                {key: category[key].as_array()[mask] for key in category.keys()}
+            )
+        atom_category = block["chem_comp_atom"]
+        atom_ids = atom_category["atom_id"].as_array()
+        atom_category["pdbx_leaving_atom_flag"] = np.where(
+            np.isin(atom_ids, ["OXT", "HXT", "H2"]), "Y", "N"
+        )
+        atom_category["alt_atom_id"] = atom_ids
+        atom_category["pdbx_component_atom_id"] = atom_ids
+        block["chem_comp_atom"] = atom_category
+        cif[res_name] = block
+    cif.write(components_file)
+
+
+def get_ccd_rdkit_mols(res_names):
+    """Build the rdkit mols of res_names like scripts/gen_ccd_cache.py does,
+    with the CCD ideal coordinates as the reference conformer."""
+    ccd_block = get_ccd()
+    atoms, bonds = ccd_block["chem_comp_atom"], ccd_block["chem_comp_bond"]
+    mols = {}
+    for res_name in res_names:
+        atom_mask = atoms["comp_id"].as_array() == res_name
+        atom_names = atoms["atom_id"].as_array()[atom_mask]
+        mol = Chem.RWMol()
+        for element, charge in zip(
+            atoms["type_symbol"].as_array()[atom_mask],
+            atoms["charge"].as_array(int)[atom_mask],
+        ):
+            atom = Chem.Atom(element.capitalize())
+            atom.SetFormalCharge(int(charge))
+            mol.AddAtom(atom)
+        atom_map = {name: idx for idx, name in enumerate(atom_names)}
+        bond_mask = bonds["comp_id"].as_array() == res_name
+        for atom1, atom2, order in zip(
+            bonds["atom_id_1"].as_array()[bond_mask],
+            bonds["atom_id_2"].as_array()[bond_mask],
+            bonds["value_order"].as_array()[bond_mask],
+        ):
+            mol.AddBond(atom_map[atom1], atom_map[atom2], BOND_ORDERS[order.upper()])
+        mol = mol.GetMol()
+        Chem.SanitizeMol(mol)
+        conf = Chem.Conformer(mol.GetNumAtoms())
+        coord = np.stack(
+            [
+                atoms[f"pdbx_model_Cartn_{axis}_ideal"].as_array(float)[atom_mask]
+                for axis in "xyz"
+            ],
+            axis=-1,
+        )
+        for idx, xyz in enumerate(coord):
+            conf.SetAtomPosition(idx, Point3D(*xyz))
+        mol.AddConformer(conf, assignId=True)
+        mol.atom_map = atom_map
+        mol.name = res_name
+        mol.ref_conf_id = 0
+        mol.ref_mask = np.ones(len(atom_names), dtype=bool)
+        mols[res_name] = mol
+    return mols
+
+
+def write_msa(msa_dir, sequence, species):
+    """Write a non_pairing.a3m and a pairing.a3m with one hit per species."""
+    os.makedirs(msa_dir, exist_ok=True)
+    rng = np.random.default_rng(len(sequence))
+    hits = []
+    for idx, taxid in enumerate(species):
+        hit = np.array(list(sequence))
+        hit[rng.random(len(sequence)) < 0.3] = "-"
+        hit[rng.random(len(sequence)) < 0.2] = "L"
+        # Lowercase letters are insertions, counted as deletions of the query
+        hits.append(
+            (f"UniRef100_HIT{idx}_{taxid}/", "".join(hit[:2]) + "kk" + "".join(hit[2:]))
+        )
+    for msa_type, hit_list in [("non_pairing", hits[::-1]), ("pairing", hits)]:
+        with open(os.path.join(msa_dir, f"{msa_type}.a3m"), "w") as f:
+            f.write(f">query\n{sequence}\n")
+            for description, hit in hit_list:
+                f.write(f">{description}\n{hit}\n")
+
+
+def write_ligand_files(tmp_dir):
+    ligand_files = {}
+    for name, smiles in LIGANDS.items():
+        mol = Chem.AddHs(Chem.MolFromSmiles(smiles))
+        AllChem.EmbedMolecule(mol, randomSeed=0)
+        ligand_files[name] = os.path.join(tmp_dir, f"{name}.mol")
+        Chem.MolToMolFile(mol, ligand_files[name])
+    return ligand_files
+
+
+def assert_same_process_one(test, full_dataset, template_dataset, inputs):
+    """Check that the receptor template gives the features of the full pipeline."""
+    # Build the receptor before seeding, the ref_pos augmentation of the receptor
+    # in the template consumes random numbers
+    receptor_template, _ = template_dataset.get_receptor_template(inputs[0])
+    for sample_dict in inputs:
+        np.random.seed(0)
+        expected, expected_atom_array, _ = full_dataset.process_one(sample_dict)
+        np.random.seed(0)
+        data, atom_array, _ = template_dataset.process_one(sample_dict)
+
+        # The receptor is featurized once for all jobs
+        test.assertIs(template_dataset.receptor_template[1], receptor_template)
+
+        test.assertEqual(data.keys(), expected.keys())
+        feat = data["input_feature_dict"]
+        expected_feat = expected["input_feature_dict"]
+        test.assertEqual(feat.keys(), expected_feat.keys())
+        for key, value in expected_feat.items():
+            test.assertEqual(feat[key].dtype, value.dtype, key)
+            test.assertTrue(torch.allclose(feat[key], value, atol=1e-5), key)
+        for key in ["N_token", "N_atom", "N_asym", "N_lig_atom", "N_lig_token"]:
+            test.assertEqual(data[key], expected[key])
+
+        for key in expected_atom_array.get_annotation_categories():
+            test.assertTrue(
+                np.array_equal(
+                    atom_array.get_annotation(key),
+                    expected_atom_array.get_annotation(key),
+                ),
+                key,
+            )
+        test.assertTrue(
+            np.array_equal(
+                atom_array.bonds.as_array(), expected_atom_array.bonds.as_array()
+            )
+        )
+
+
+class TestReceptorTemplate(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+        # Ligands from files have fixed conformers, and need no CCD entry
+        self.ligand_files = write_ligand_files(self.tmp_dir.name)
+        ccd_file = os.path.join(self.tmp_dir.name, "components.cif")
+        with open(ccd_file, "w") as f:
+            f.write("data_EMPTY\n#\n")
+        self.ccd_patch = mock.patch.object(ccd, "COMPONENTS_FILE", ccd_file)
+        self.ccd_patch.start()
+        ccd.biotite_load_ccd_cif.cache_clear()
+
+        receptor = [
+            self.ligand_entity("a", count=2),
+            self.ligand_entity("b", count=1),
+        ]
+        self.inputs = [
+            {
+                "name": f"job_{job[0]}",
+                "sequences": receptor + [self.ligand_entity(*job)],
+            }
+            for job in [("c", 1), ("d", 2)]
+        ]
+        self.input_json_path = os.path.join(self.tmp_dir.name, "inputs.json")
+        with open(self.input_json_path, "w") as f:
+            json.dump(self.inputs, f)
+
+    def ligand_entity(self, name, count=1):
+        return {"ligand": {"ligand": f"FILE_{self.ligand_files[name]}", "count": count}}
+
+    def test_split_sample_dict(self):
+        receptor_sample_dict, ligand_entity = ReceptorTemplate.split_sample_dict(
+            self.inputs[0]
+        )
+        self.assertEqual(
+            receptor_sample_dict["sequences"], self.inputs[0]["sequences"][:-1]
+        )
+        self.assertEqual(ligand_entity, self.inputs[0]["sequences"][-1])
+
+        bonded_sample = dict(
+            self.inputs[0],
+            covalent_bonds=[
+                {"entity1": "2", "position1": "1", "atom1": "C1"}
+                | {"entity2": "3", "position2": "1", "atom2": "C1"}
+            ],
+        )
+        self.assertIsNone(ReceptorTemplate.split_sample_dict(bonded_sample))
+
+    def test_process_one(self):
+        full_dataset = InferenceDataset(
+            self.input_json_path, dump_dir=self.tmp_dir.name, use_msa=False
+        )
+        template_dataset = InferenceDataset(
+            self.input_json_path,
+            dump_dir=self.tmp_dir.name,
+            use_msa=False,
+            use_receptor_template=True,
+        )
+        assert_same_process_one(self, full_dataset, template_dataset, self.inputs)
+
+    def test_get_msa_feature(self):
+        sample_dict = self.inputs[1]
+        receptor_sample_dict, ligand_entity = ReceptorTemplate.split_sample_dict(
+            sample_dict
+        )
+        receptor_template = ReceptorTemplate(receptor_sample_dict, use_msa=False)
+        _, atom_array, token_array = receptor_template.get_feature_dict(ligand_entity)
+
+        # A raw MSA covering every receptor token
+        centre_atoms = receptor_template.atom_array[
+            receptor_template.token_array.get_annotation("centre_atom_index")
+        ]
+        num_msa_seq, num_cols = 5, len(centre_atoms)
+        msa_feats = {
+            "msa": np.random.randint(0, 21, size=(num_msa_seq, num_cols)),
+            "has_deletion": np.random.randint(0, 2, size=(num_msa_seq, num_cols)),
+            "deletion_value": np.random.rand(num_msa_seq, num_cols),
+            "deletion_mean": np.random.rand(num_cols),
+            "profile": np.random.rand(num_cols, 32),
+            "asym_id": centre_atoms.asym_id_int,
+            "residue_index": centre_atoms.res_id,
+        }
+        receptor_template.msa_features = tokenize_msa(
+            msa_feats={k: v.copy() for k, v in msa_feats.items()},
+            token_array=receptor_template.token_array,
+            atom_array=receptor_template.atom_array,
+        )
+        expected = tokenize_msa(
+            msa_feats=msa_feats, token_array=token_array, atom_array=atom_array
+        )
+        msa_features = receptor_template.get_msa_feature(token_array, atom_array)
+        for key, value in msa_features.items():
+            self.assertEqual(value.dtype, expected[key].dtype, key)
+            self.assertTrue(np.array_equal(value, expected[key]), key)
+
+    def tearDown(self):
+        self.ccd_patch.stop()
+        ccd.biotite_load_ccd_cif.cache_clear()
+        ccd.get_one_letter_code.cache_clear()
+        ccd.get_mol_type.cache_clear()
+        self.tmp_dir.cleanup()
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+class TestProteinReceptorTemplate(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.ligand_files = write_ligand_files(self.tmp_dir.name)
+
+        res_names = ["GLY", "ALA", "SER", "LYS"]
+        ccd_file = os.path.join(self.tmp_dir.name, "components.cif")
+        write_ccd_components(res_names, ccd_file)
+        self.ccd_patches = [
+            mock.patch.object(ccd, "COMPONENTS_FILE", ccd_file),
+            mock.patch.object(ccd, "_ccd_rdkit_mols", get_ccd_rdkit_mols(res_names)),
+        ]
+        for patch in self.ccd_patches:
+            patch.start()
+        self.clear_ccd_caches()
+
+        # Two protein entities make a heteromer, whose MSAs are paired
+        receptor = []
+        for entity_id, sequence in enumerate(PROTEINS, start=1):
+            msa_dir = os.path.join(self.tmp_dir.name, "msa", str(entity_id))
+            write_msa(msa_dir, sequence, species=[9606, 10090, 7227][entity_id - 1 :])
+            receptor.append(
+                {
+                    "proteinChain": {
+                        "sequence": sequence,
+                        "count": entity_id,
+                        "msa": {
+                            "precomputed_msa_dir": msa_dir,
+                            "pairing_db": "uniref100",
+                        },
+                    }
+                }
+            )
+        receptor.append(
+            {"ligand": {"ligand": f"FILE_{self.ligand_files['b']}", "count": 1}}
+        )
+        self.inputs = [
+            {
+                "name": f"job_{name}",
+                "sequences": receptor
+                + [
+                    {
+                        "ligand": {
+                            "ligand": f"FILE_{self.ligand_files[name]}",
+                            "count": 1,
+                        }
+                    }
+                ],
+            }
+            for name in ["c", "d"]
+        ]
+        self.input_json_path = os.path.join(self.tmp_dir.name, "inputs.json")
+        with open(self.input_json_path, "w") as f:
+            json.dump(self.inputs, f)
+
+    @staticmethod
+    def clear_ccd_caches():
+        ccd.biotite_load_ccd_cif.cache_clear()
+        ccd.get_component_atom_array.cache_clear()
+        ccd.get_one_letter_code.cache_clear()
+        ccd.get_mol_type.cache_clear()
+        ccd.get_ccd_ref_info.cache_clear()
+
+    def test_process_one(self):
+        full_dataset = InferenceDataset(
+            self.input_json_path, dump_dir=self.tmp_dir.name, use_msa=True
+        )
+        template_dataset = InferenceDataset(
+            self.input_json_path,
+            dump_dir=self.tmp_dir.name,
+            use_msa=True,
+            use_receptor_template=True,
+        )
+        assert_same_process_one(self, full_dataset, template_dataset, self.inputs)
+
+        # The MSA features come from the a3m files, not the dummy features
+        data, _, _ = template_dataset.process_one(self.inputs[0])
+        self.assertGreater(data["N_msa"].item(), 1)
+
+    def tearDown(self):
+        for patch in self.ccd_patches:
+            patch.stop()
+        self.clear_ccd_caches()
+        self.tmp_dir.cleanup()
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,233 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from protenix.data import ccd, json_parser
+from protenix.data.constants import RES_ATOMS_DICT
+from protenix.data.json_to_feature import SampleDictToFeatures
+from protenix.data.parser import AddAtomArrayAnnot
+from protenix.data.utils import int_to_letters
+from tests.test_infer_data_pipeline import (
+    get_ccd_rdkit_mols,
+    write_ccd_components,
+    write_ligand_files,
+)
+
+
+def build_full_atom_array_by_copy(input_dict):
+    """The previous build_full_atom_array(), which copied the entity per asym chain."""
+    atom_array = None
+    asym_chain_idx = 0
+    for idx, type2entity_dict in enumerate(input_dict["sequences"]):
+        for entity_type, entity in type2entity_dict.items():
+            entity_id = str(idx + 1)
+
+            entity_atom_array = None
+            for asym_chain_count in range(1, entity["count"] + 1):
+                asym_id_str = int_to_letters(asym_chain_idx + 1)
+                asym_chain = copy.deepcopy(entity["atom_array"])
+                chain_id = [asym_id_str] * len(asym_chain)
+                copy_id = [asym_chain_count] * len(asym_chain)
+                asym_chain.set_annotation("label_asym_id", chain_id)
+                asym_chain.set_annotation("auth_asym_id", chain_id)
+                asym_chain.set_annotation("chain_id", chain_id)
+                asym_chain.set_annotation("label_seq_id", asym_chain.res_id)
+                asym_chain.set_annotation("copy_id", copy_id)
+                if entity_atom_array is None:
+                    entity_atom_array = asym_chain
+                else:
+                    entity_atom_array += asym_chain
+                asym_chain_idx += 1
+
+            entity_atom_array.set_annotation(
+                "label_entity_id", [entity_id] * len(entity_atom_array)
+            )
+
+            if entity_type in ["proteinChain", "dnaSequence", "rnaSequence"]:
+                entity_atom_array.hetero[:] = False
+            else:
+                entity_atom_array.hetero[:] = True
+
+            if atom_array is None:
+                atom_array = entity_atom_array
+            else:
+                atom_array += entity_atom_array
+    return atom_array
+
+
+def get_tokatom_idx_by_atom(atom_array):
+    """The previous per-atom add_tokatom_idx()."""
+    tokatom_idx_list = []
+    for atom in atom_array:
+        atom_name_position = RES_ATOMS_DICT.get(atom.res_name, None)
+        if atom.mol_type == "ligand" or atom_name_position is None:
+            tokatom_idx = 0
+        else:
+            tokatom_idx = atom_name_position[atom.atom_name]
+        tokatom_idx_list.append(tokatom_idx)
+    return np.array(tokatom_idx_list)
+
+
+def get_ref_space_uid_by_atom(atom_array):
+    """The previous per-atom add_ref_space_uid()."""
+    chain_res_id = np.vstack((atom_array.asym_id_int, atom_array.res_id)).T
+    unique_id = np.unique(chain_res_id, axis=0)
+
+    mapping_dict = {}
+    for idx, chain_res_id_pair in enumerate(unique_id):
+        asym_id_int, res_id = chain_res_id_pair
+        mapping_dict[(asym_id_int, res_id)] = idx
+
+    return np.array(
+        [mapping_dict[(asym_id_int, res_id)] for asym_id_int, res_id in chain_res_id]
+    )
+
+
+class TestSampleDictToFeatures(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        ligand_files = write_ligand_files(self.tmp_dir.name)
+
+        res_names = ["GLY", "ALA", "SER", "LYS", "ZN"]
+        ccd_file = os.path.join(self.tmp_dir.name, "components.cif")
+        write_ccd_components(res_names, ccd_file)
+        self.ccd_patches = [
+            mock.patch.object(ccd, "COMPONENTS_FILE", ccd_file),
+            mock.patch.object(ccd, "_ccd_rdkit_mols", get_ccd_rdkit_mols(res_names)),
+        ]
+        for patch in self.ccd_patches:
+            patch.start()
+        self.clear_ccd_caches()
+
+        # Entities 1 and 2 repeat the same sequence under separate entity ids
+        self.sample_dict = {
+            "name": "job",
+            "sequences": [
+                {"proteinChain": {"sequence": "GASKG", "count": 2}},
+                {"proteinChain": {"sequence": "GASKG", "count": 1}},
+                {"proteinChain": {"sequence": "SKAGSA", "count": 3}},
+                {"ligand": {"ligand": f"FILE_{ligand_files['c']}", "count": 2}},
+                {"ion": {"ion": "ZN", "count": 1}},
+            ],
+        }
+
+    @staticmethod
+    def clear_ccd_caches():
+        ccd.biotite_load_ccd_cif.cache_clear()
+        ccd.get_component_atom_array.cache_clear()
+        ccd.get_one_letter_code.cache_clear()
+        ccd.get_mol_type.cache_clear()
+        ccd.get_ccd_ref_info.cache_clear()
+
+    def assert_atom_array_equal(self, atom_array, expected):
+        self.assertEqual(
+            set(atom_array.get_annotation_categories()),
+            set(expected.get_annotation_categories()),
+        )
+        for key in expected.get_annotation_categories():
+            self.assertTrue(
+                np.array_equal(
+                    atom_array.get_annotation(key), expected.get_annotation(key)
+                ),
+                key,
+            )
+        self.assertTrue(np.array_equal(atom_array.coord, expected.coord))
+        self.assertEqual(atom_array.bonds, expected.bonds)
+
+    def test_tile_atom_array(self):
+        sample2feat = SampleDictToFeatures(self.sample_dict)
+        for type2entity_dict in sample2feat.input_dict["sequences"]:
+            for entity in type2entity_dict.values():
+                entity_atom_array = entity["atom_array"]
+                for count in [1, 3]:
+                    expected = copy.deepcopy(entity_atom_array)
+                    for _ in range(count - 1):
+                        expected += copy.deepcopy(entity_atom_array)
+                    self.assert_atom_array_equal(
+                        SampleDictToFeatures.tile_atom_array(entity_atom_array, count),
+                        expected,
+                    )
+
+    def test_build_full_atom_array(self):
+        sample2feat = SampleDictToFeatures(self.sample_dict)
+        self.assert_atom_array_equal(
+            sample2feat.build_full_atom_array(),
+            build_full_atom_array_by_copy(sample2feat.input_dict),
+        )
+
+    def test_add_entity_atom_array(self):
+        with mock.patch.object(
+            json_parser, "build_polymer", wraps=json_parser.build_polymer
+        ) as build_polymer:
+            input_dict = json_parser.add_entity_atom_array(self.sample_dict)
+        # The repeated sequence is built from CCD once
+        self.assertEqual(build_polymer.call_count, 2)
+
+        sequences = input_dict["sequences"]
+        self.assertEqual(
+            [entity["proteinChain"]["count"] for entity in sequences[:3]], [2, 1, 3]
+        )
+        for idx in range(3):
+            entity_dict = copy.deepcopy(self.sample_dict["sequences"][idx])
+            expected = json_parser.build_polymer(entity_dict)
+            self.assert_atom_array_equal(
+                sequences[idx]["proteinChain"]["atom_array"], expected["atom_array"]
+            )
+
+    def test_add_atom_array_annot(self):
+        atom_array = SampleDictToFeatures(self.sample_dict).get_atom_array()
+        self.assertGreater(len(np.unique(atom_array.asym_id_int)), 1)
+
+        # Shuffle the chains to check that the uid does not rely on the atom order
+        chain_starts = np.flatnonzero(
+            np.diff(atom_array.asym_id_int, prepend=-1, append=-1)
+        )
+        chains = [
+            np.arange(start, stop)
+            for start, stop in zip(chain_starts[:-1], chain_starts[1:])
+        ]
+        order = np.random.default_rng(0).permutation(len(chains))
+        for atoms in [
+            atom_array,
+            atom_array[np.concatenate([chains[i] for i in order])],
+        ]:
+            atoms = AddAtomArrayAnnot.add_tokatom_idx(atoms)
+            self.assertTrue(
+                np.array_equal(atoms.tokatom_idx, get_tokatom_idx_by_atom(atoms))
+            )
+            atoms = AddAtomArrayAnnot.add_ref_space_uid(atoms)
+            self.assertTrue(
+                np.array_equal(atoms.ref_space_uid, get_ref_space_uid_by_atom(atoms))
+            )
+
+    def tearDown(self):
+        for patch in self.ccd_patches:
+            patch.stop()
+        self.clear_ccd_caches()
+        self.tmp_dir.cleanup()
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+from unittest import mock
+
+import torch
+
+from configs.configs_base import configs as configs_base
+from configs.configs_data import data_configs
+from protenix.config import parse_configs
+from protenix.metrics.lddt_metrics import LDDT, LDDTMetrics
+from protenix.model import loss
+from protenix.model.loss import LDDTPairCache, ProtenixLoss, label_checksum
+
+
+class TestLDDTMetrics(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        torch.manual_seed(0)
+        configs = parse_configs(
+            {**configs_base, **{"data": data_configs}}, fill_required_with_null=True
+        )
+        configs.loss_metrics_sparse_enable = True
+        configs.loss.diffusion_lddt_loss_dense = False
+        self.protenix_loss = ProtenixLoss(configs)
+        self.lddt_metrics = LDDTMetrics(configs)
+
+    def random_structure(self, N_atom: int = 200):
+        feat_dict = {
+            "is_rna": torch.zeros(N_atom),
+            "is_dna": (torch.arange(N_atom) >= 180).float(),
+        }
+        label_dict = {
+            "coordinate": torch.rand(N_atom, 3) * 30,
+            "coordinate_mask": (torch.rand(N_atom) > 0.1).float(),
+        }
+        return feat_dict, label_dict
+
+    def calculate_label(self, feat_dict, label_dict, cache_key):
+        with mock.patch.object(
+            loss, "compute_lddt_pair_indices", wraps=loss.compute_lddt_pair_indices
+        ) as compute_lddt_pair_indices:
+            label_dict = self.protenix_loss.calculate_label(
+                feat_dict, dict(label_dict), cache_key=cache_key
+            )
+        return label_dict, compute_lddt_pair_indices.called
+
+    def test_cached_label(self):
+        feat_dict, label_dict = self.random_structure()
+        expected, is_computed = self.calculate_label(feat_dict, label_dict, "pdb0")
+        self.assertTrue(is_computed)
+        # The second evaluation of the same ground truth skips the neighbor list
+        cached, is_computed = self.calculate_label(feat_dict, label_dict, "pdb0")
+        self.assertFalse(is_computed)
+        self.assertEqual(cached["lddt_pair_indices"].dtype, torch.long)
+        self.assertTrue(
+            torch.equal(cached["lddt_pair_indices"], expected["lddt_pair_indices"])
+        )
+
+        pred_coordinate = label_dict["coordinate"] + torch.randn(5, 200, 3)
+        lddt = self.lddt_metrics.compute_lddt({"coordinate": pred_coordinate}, cached)
+        self.assertTrue(
+            torch.allclose(
+                lddt["complex"],
+                LDDT(eps=1e-6)(
+                    pred_coordinate,
+                    label_dict["coordinate"],
+                    lddt_pair_indices=expected["lddt_pair_indices"],
+                ),
+            )
+        )
+
+        # A different ground truth under the same key is not served from the cache
+        label_dict["coordinate"] = label_dict["coordinate"] + 1.0
+        _, is_computed = self.calculate_label(feat_dict, label_dict, "pdb0")
+        self.assertTrue(is_computed)
+        # Labels without a key are not cached
+        _, is_computed = self.calculate_label(feat_dict, label_dict, None)
+        self.assertTrue(is_computed)
+
+    def test_cached_label_default_configs(self):
+        # With the default dense smooth lddt loss, evaluation still uses the cache
+        configs = parse_configs(
+            {**configs_base, **{"data": data_configs}}, fill_required_with_null=True
+        )
+        self.assertTrue(configs.loss.diffusion_lddt_loss_dense)
+        self.protenix_loss = ProtenixLoss(configs)
+        feat_dict, label_dict = self.random_structure()
+        expected, is_computed = self.calculate_label(feat_dict, label_dict, "pdb0")
+        self.assertTrue(is_computed)
+        cached, is_computed = self.calculate_label(feat_dict, label_dict, "pdb0")
+        self.assertFalse(is_computed)
+        self.assertTrue(
+            torch.equal(cached["lddt_pair_indices"], expected["lddt_pair_indices"])
+        )
+
+        # The mask of the dense loss is the one built from the dense distances
+        dense, _ = self.calculate_label(feat_dict, label_dict, None)
+        self.assertNotIn("lddt_pair_indices", dense)
+        self.assertEqual(cached["lddt_mask"].dtype, dense["lddt_mask"].dtype)
+        self.assertTrue(torch.equal(cached["lddt_mask"], dense["lddt_mask"]))
+
+    def test_cache_bytes(self):
+        # Room for two entries of 100 int32 pairs
+        cache = LDDTPairCache(max_bytes=1600)
+        pair_indices = {f"pdb{i}": torch.randint(1000, (2, 100)) for i in range(3)}
+        checksum = label_checksum(torch.ones(3))
+        for key, value in pair_indices.items():
+            cache.add(key, checksum, value)
+        self.assertEqual(list(cache.entries), ["pdb1", "pdb2"])
+        self.assertEqual(cache.num_bytes, 1600)
+        self.assertIsNone(cache.get("pdb0", checksum))
+        self.assertIsNone(cache.get("pdb1", label_checksum(torch.zeros(3))))
+        cached = cache.get("pdb1", checksum)
+        self.assertEqual(cached.dtype, torch.int32)
+        self.assertTrue(torch.equal(cached.long(), pair_indices["pdb1"]))
+        # Entries larger than the cache are not kept
+        cache.add("pdb3", checksum, torch.randint(1000, (2, 300)))
+        self.assertEqual(list(cache.entries), ["pdb2", "pdb1"])
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+import torch
+
+from protenix.metrics.lddt_metrics import LDDT
+from protenix.model.loss import (
+    PLDDTLoss,
+    SmoothLDDTLoss,
+    compute_lddt_mask,
+    compute_lddt_pair_indices,
+)
+
+
+class TestLDDTNeighborList(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        torch.manual_seed(0)
+        N_atom, N_sample = 600, 3
+        # The 15A radius covers a fraction of the atoms in the box
+        self.true_coordinate = torch.rand(N_atom, 3, dtype=torch.float64) * 40
+        self.pred_coordinate = self.true_coordinate + torch.randn(N_sample, N_atom, 3)
+        self.coordinate_mask = (torch.rand(N_atom) > 0.1).float()
+        self.is_nucleotide = (torch.arange(N_atom) >= 500).float()
+        self.is_polymer = (torch.arange(N_atom) < 550).float()
+        self.rep_atom_mask = (torch.rand(N_atom) > 0.8).float()
+
+    def get_lddt_mask(self):
+        distance_mask = self.coordinate_mask[:, None] * self.coordinate_mask[None, :]
+        distance = torch.cdist(self.true_coordinate, self.true_coordinate)
+        return compute_lddt_mask(
+            true_distance=distance * distance_mask,
+            distance_mask=distance_mask,
+            is_nucleotide=self.is_nucleotide,
+        )
+
+    def test_pair_indices(self):
+        lddt_mask = self.get_lddt_mask()
+        pair_indices = compute_lddt_pair_indices(
+            true_coordinate=self.true_coordinate,
+            coordinate_mask=self.coordinate_mask,
+            is_nucleotide=self.is_nucleotide,
+        )
+        self.assertTrue(
+            torch.equal(pair_indices, torch.nonzero(lddt_mask, as_tuple=False).T)
+        )
+
+        lddt = LDDT()
+        self.assertTrue(
+            torch.allclose(
+                lddt(self.pred_coordinate, self.true_coordinate, lddt_mask=lddt_mask),
+                lddt(
+                    self.pred_coordinate,
+                    self.true_coordinate,
+                    lddt_pair_indices=pair_indices,
+                ),
+            )
+        )
+        smooth_lddt_loss = SmoothLDDTLoss()
+        self.assertTrue(
+            torch.allclose(
+                smooth_lddt_loss.sparse_forward(
+                    self.pred_coordinate, self.true_coordinate, lddt_mask=lddt_mask
+                ),
+                smooth_lddt_loss.sparse_forward(
+                    self.pred_coordinate,
+                    self.true_coordinate,
+                    lddt_pair_indices=pair_indices,
+                ),
+            )
+        )
+
+    def test_plddt_label(self):
+        coordinate_mask = self.coordinate_mask.bool()
+        kwargs = dict(
+            pred_coordinate=self.pred_coordinate[:, coordinate_mask],
+            true_coordinate=self.true_coordinate[coordinate_mask],
+            is_nucleotide=self.is_nucleotide[coordinate_mask],
+            is_polymer=self.is_polymer[coordinate_mask],
+            rep_atom_mask=self.rep_atom_mask[coordinate_mask],
+        )
+        dense_lddt = PLDDTLoss().dense_per_atom_lddt(**kwargs)
+        sparse_lddt = PLDDTLoss(sparse=True).sparse_per_atom_lddt(**kwargs)
+        self.assertTrue(torch.allclose(dense_lddt, sparse_lddt, atol=1e-5))
+        self.assertTrue(
+            torch.equal(
+                PLDDTLoss().calculate_label(**kwargs),
+                PLDDTLoss(sparse=True).calculate_label(**kwargs),
+            )
+        )
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from protenix.data.msa_utils import MSASearchScheduler
+
+DB_RECORDS = {
+    "hit_1": "MKTAYIAKQRQISFVKSHFSRQ",
+    "hit_2": "MKTAYIAKQRQ",
+    "miss": "GGGGGGGGGG",
+}
+
+
+class StubSearch(object):
+    """A search backend reading hits from a local FASTA database."""
+
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def __call__(
+        self, sequence, pairing_db_fpath, non_pairing_db_fpath, res_dir, n_cpu
+    ):
+        with self.lock:
+            self.queries.append(sequence)
+        if "X" in sequence:
+            return False
+        for db_fpath, fname in [
+            (pairing_db_fpath, "pairing.a3m"),
+            (non_pairing_db_fpath, "non_pairing.a3m"),
+        ]:
+            with open(db_fpath, "r") as f:
+                lines = f.read().split()
+            hits = [
+                f">{name[1:]}\n{seq}\n"
+                for name, seq in zip(lines[::2], lines[1::2])
+                if seq[:5] == sequence[:5]
+            ]
+            with open(os.path.join(res_dir, fname), "w") as f:
+                f.write(f">query\n{sequence}\n" + "".join(hits))
+        # Intermediate files are not kept in the cache
+        with open(os.path.join(res_dir, "query.sto"), "w") as f:
+            f.write(sequence)
+        return True
+
+
+class TestMSASearchScheduler(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_fpath = os.path.join(self.tmp_dir.name, "db.fasta")
+        with open(self.db_fpath, "w") as f:
+            for name, seq in DB_RECORDS.items():
+                f.write(f">{name}\n{seq}\n")
+        self.cache_dir = os.path.join(self.tmp_dir.name, "cache")
+
+    def test_search(self):
+        query_seqs = ["MKTAYIAKQR", "GGGGGG", "MKTAYIAKQR", "MKTXX"]
+        sequences = {
+            idx: (seq, self.db_fpath, self.db_fpath)
+            for idx, seq in enumerate(query_seqs)
+        }
+        backend = StubSearch()
+        scheduler = MSASearchScheduler(cache_dir=self.cache_dir, search_fn=backend)
+        msa_dirs = scheduler.search(sequences)
+
+        # Duplicated queries are searched once and share the result
+        self.assertEqual(sorted(backend.queries), sorted(set(query_seqs)))
+        self.assertEqual(msa_dirs[0], msa_dirs[2])
+        self.assertIsNone(msa_dirs[3])
+        with open(os.path.join(msa_dirs[0], "pairing.a3m"), "r") as f:
+            self.assertEqual(f.read().count(">"), 3)
+        self.assertEqual(
+            sorted(os.listdir(msa_dirs[1])), ["non_pairing.a3m", "pairing.a3m"]
+        )
+        # Only finished results are left in the cache
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+        # A new scheduler reuses the cache, failed queries are searched again
+        backend = StubSearch()
+        scheduler = MSASearchScheduler(cache_dir=self.cache_dir, search_fn=backend)
+        self.assertEqual(scheduler.search(sequences), msa_dirs)
+        self.assertEqual(backend.queries, ["MKTXX"])
+
+    def test_get_num_workers(self):
+        scheduler = MSASearchScheduler(search_fn=StubSearch())
+        num_workers, n_cpu = scheduler.get_num_workers(num_queries=1)
+        self.assertEqual(num_workers, 1)
+        self.assertLessEqual(n_cpu, MSASearchScheduler.MAX_CPUS_PER_SEARCH)
+
+        scheduler = MSASearchScheduler(search_fn=StubSearch(), num_workers=3, n_cpu=2)
+        self.assertEqual(scheduler.get_num_workers(num_queries=10), (3, 2))
+        self.assertEqual(scheduler.get_num_workers(num_queries=2), (2, 2))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
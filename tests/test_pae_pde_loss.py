@@ -0,0 +1,142 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+from unittest import mock
+
+import torch
+import torch.nn.functional as F
+
+from protenix.model import loss
+from protenix.model.loss import (
+    PAELoss,
+    PDELoss,
+    compute_alignment_error_squared,
+    softmax_cross_entropy,
+)
+from protenix.model.modules.frames import gather_frame_atom_by_indices
+
+
+class TestPAEPDELoss(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        torch.manual_seed(0)
+        N_token, N_sample, self.no_bins = 40, 3, 64
+        # Three atoms per token, the second one is the representative atom
+        N_atom = 3 * N_token
+        self.true_coordinate = torch.randn(N_atom, 3) * 10
+        self.pred_coordinate = self.true_coordinate + torch.randn(N_sample, N_atom, 3)
+        self.coordinate_mask = (torch.rand(N_atom) > 0.1).float()
+        self.rep_atom_mask = (torch.arange(N_atom) % 3 == 1).float()
+        self.frame_atom_index = torch.arange(N_atom).reshape(N_token, 3)
+        self.has_frame = (torch.rand(N_token) > 0.3).float()
+        self.logits = torch.randn(
+            N_sample, N_token, N_token, self.no_bins, requires_grad=True
+        )
+
+    def reference_pae_loss(self, pae_loss):
+        # One-hot labels of all frames at once
+        has_frame = self.has_frame.bool()
+        rep_atom_mask = self.rep_atom_mask.bool()
+        frame_atom_index = self.frame_atom_index[has_frame]
+        frame_mask = (
+            gather_frame_atom_by_indices(
+                self.coordinate_mask.bool(), frame_atom_index, dim=-1
+            ).sum(dim=-1)
+            >= 3
+        )
+        pair_mask = frame_mask[:, None] * self.coordinate_mask.bool()[rep_atom_mask]
+        squared_pae = compute_alignment_error_squared(
+            self.pred_coordinate[..., rep_atom_mask, :],
+            self.true_coordinate[rep_atom_mask],
+            gather_frame_atom_by_indices(self.pred_coordinate, frame_atom_index),
+            gather_frame_atom_by_indices(self.true_coordinate, frame_atom_index),
+        )
+        boundaries = torch.linspace(0, 32, self.no_bins + 1) ** 2
+        true_bins = torch.sum(squared_pae.unsqueeze(dim=-1) > boundaries, dim=-1)
+        true_bins = torch.where(pair_mask, true_bins, self.no_bins)
+        true_bins = torch.clamp(true_bins, min=1, max=self.no_bins)
+        errors = softmax_cross_entropy(
+            self.logits[:, has_frame], F.one_hot(true_bins - 1, self.no_bins)
+        )
+        return (
+            (errors * pair_mask).sum(dim=(-1, -2)) / (pae_loss.eps + pair_mask.sum())
+        ).mean()
+
+    def test_pae_loss(self):
+        pae_loss = PAELoss()
+        expected = self.reference_pae_loss(pae_loss)
+        (expected_grad,) = torch.autograd.grad(expected, self.logits)
+        # Several frame blocks
+        with mock.patch.object(loss, "PAIR_CHUNK_NUMEL", 1000):
+            value = pae_loss(
+                logits=self.logits,
+                pred_coordinate=self.pred_coordinate,
+                true_coordinate=self.true_coordinate,
+                coordinate_mask=self.coordinate_mask,
+                frame_atom_index=self.frame_atom_index,
+                rep_atom_mask=self.rep_atom_mask,
+                has_frame=self.has_frame,
+            )
+        (grad,) = torch.autograd.grad(value, self.logits)
+        self.assertTrue(torch.allclose(value, expected))
+        self.assertTrue(torch.allclose(grad, expected_grad))
+
+    def test_pde_loss(self):
+        pde_loss = PDELoss()
+        rep_atom_mask = self.rep_atom_mask.bool()
+        true_bins, pair_mask = pde_loss.calculate_label(
+            pred_coordinate=self.pred_coordinate,
+            true_coordinate=self.true_coordinate,
+            coordinate_mask=self.coordinate_mask,
+            rep_atom_mask=self.rep_atom_mask,
+        )
+        pred_token = self.pred_coordinate[:, rep_atom_mask]
+        true_token = self.true_coordinate[rep_atom_mask]
+        dist_error = torch.abs(
+            torch.cdist(pred_token, pred_token) - torch.cdist(true_token, true_token)
+        )
+        expected_bins = torch.clamp(
+            torch.sum(
+                dist_error.unsqueeze(dim=-1) > torch.linspace(0, 32, self.no_bins + 1),
+                dim=-1,
+            ),
+            min=1,
+            max=self.no_bins,
+        )
+        self.assertTrue(torch.equal(true_bins, expected_bins - 1))
+
+        value = pde_loss(
+            logits=self.logits,
+            pred_coordinate=self.pred_coordinate,
+            true_coordinate=self.true_coordinate,
+            coordinate_mask=self.coordinate_mask,
+            rep_atom_mask=self.rep_atom_mask,
+        )
+        errors = softmax_cross_entropy(
+            self.logits, F.one_hot(expected_bins - 1, self.no_bins)
+        )
+        expected = (
+            (errors * pair_mask).sum(dim=(-1, -2)) / (pde_loss.eps + pair_mask.sum())
+        ).mean()
+        self.assertTrue(torch.allclose(value, expected))
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
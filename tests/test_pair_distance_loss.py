@@ -0,0 +1,92 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+from unittest import mock
+
+import torch
+
+from protenix.model import loss
+from protenix.model.loss import BondLoss, SmoothLDDTLoss, pair_distance_loss
+
+
+class TestPairDistanceLoss(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        torch.manual_seed(0)
+        N_atom, N_sample = 50, 4
+        self.true_coordinate = torch.rand(N_atom, 3, dtype=torch.float64) * 10
+        self.pred_coordinate = (
+            self.true_coordinate + torch.randn(N_sample, N_atom, 3, dtype=torch.float64)
+        ).requires_grad_()
+        self.pair_mask = (torch.rand(N_atom, N_atom) < 0.2).float()
+        self.pair_mask.fill_diagonal_(0)
+        self.per_sample_scale = torch.rand(N_sample, dtype=torch.float64)
+
+    def assert_same_loss_and_grad(self, loss_fn):
+        expected = loss_fn(fused=False)
+        (expected_grad,) = torch.autograd.grad(expected, self.pred_coordinate)
+        # Several pair chunks
+        with mock.patch.object(loss, "PAIR_CHUNK_NUMEL", 100):
+            value = loss_fn(fused=True)
+            (grad,) = torch.autograd.grad(value, self.pred_coordinate)
+        self.assertTrue(torch.allclose(value, expected))
+        self.assertTrue(torch.allclose(grad, expected_grad))
+
+    def test_smooth_lddt_loss(self):
+        smooth_lddt_loss = SmoothLDDTLoss()
+        self.assert_same_loss_and_grad(
+            lambda fused: smooth_lddt_loss.sparse_forward(
+                pred_coordinate=self.pred_coordinate,
+                true_coordinate=self.true_coordinate,
+                lddt_mask=self.pair_mask,
+                diffusion_chunk_size=1,
+                fused=fused,
+            )
+        )
+
+    def test_bond_loss(self):
+        bond_loss = BondLoss()
+        self.assert_same_loss_and_grad(
+            lambda fused: bond_loss.sparse_forward(
+                pred_coordinate=self.pred_coordinate,
+                true_coordinate=self.true_coordinate,
+                distance_mask=None,
+                bond_mask=self.pair_mask,
+                per_sample_scale=self.per_sample_scale,
+                coordinate_mask=torch.ones(self.true_coordinate.size(0)),
+                fused=fused,
+            )
+        )
+
+    def test_gradcheck(self):
+        l_index, m_index = torch.nonzero(self.pair_mask, as_tuple=True)
+        for loss_type in ["smooth_lddt", "bond"]:
+            self.assertTrue(
+                torch.autograd.gradcheck(
+                    lambda x: pair_distance_loss(
+                        x, self.true_coordinate, l_index, m_index, loss_type
+                    ),
+                    (self.pred_coordinate,),
+                )
+            )
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from protenix.utils.profiler import StepProfiler
+
+
+class Block(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.linear = nn.Linear(16, 16)
+
+    def forward(self, x):
+        return torch.relu(self.linear(x))
+
+
+class Model(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.blocks = nn.ModuleList([Block() for _ in range(3)])
+        self.head = nn.Linear(16, 1)
+
+    def forward(self, x):
+        for block in self.blocks:
+            # Recomputed in backward
+            x = checkpoint(block, x, use_reentrant=False)
+        return self.head(x)
+
+
+class Permutation(object):
+    def permute(self, x):
+        time.sleep(0.01)
+        return x
+
+
+class TestStepProfiler(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        torch.manual_seed(0)
+
+    def test_step_profile(self):
+        model = Model()
+        permutation = Permutation()
+        profiler = StepProfiler(model, module_names=["Block", "head", "blocks.0"])
+        profiler.wrap_method(permutation, "permute", "permutation")
+        # Not timed out of a training step
+        permutation.permute(0)
+
+        def data():
+            for _ in range(2):
+                time.sleep(0.02)
+                yield torch.randn(8, 16)
+
+        for x in profiler.iter_data(data()):
+            with profiler.phase("forward"):
+                loss = model(x).sum()
+            with profiler.phase("loss"):
+                permutation.permute(loss)
+            with profiler.phase("backward"):
+                loss.backward()
+            profile = profiler.step_end()
+
+            self.assertGreaterEqual(profile["time/data_wait"], 20)
+            # Block instances are aggregated, recomputation in backward is not counted
+            self.assertEqual(profile["calls/module/Block"], 3)
+            self.assertEqual(profile["calls/module/blocks.0"], 1)
+            self.assertEqual(profile["calls/module/head"], 1)
+            self.assertEqual(profile["calls/call/permutation"], 1)
+            self.assertGreaterEqual(profile["time/call/permutation"], 10)
+            self.assertGreaterEqual(
+                profile["time/phase/loss"], profile["time/call/permutation"]
+            )
+            self.assertGreaterEqual(
+                profile["time/phase/forward"],
+                profile["time/module/Block"] + profile["time/module/head"],
+            )
+            self.assertGreater(profile["memory/cpu_max_rss"], 0)
+
+        profiler.remove()
+        self.assertEqual(sum(len(m._forward_hooks) for m in model.modules()), 0)
+
+        # Disabled, no hooks and no profile
+        profiler = StepProfiler(model, module_names=["Block"], enabled=False)
+        with profiler.phase("forward"):
+            model(torch.randn(8, 16))
+        self.assertEqual(profiler.step_end(), {})
+        self.assertEqual(sum(len(m._forward_hooks) for m in model.modules()), 0)
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
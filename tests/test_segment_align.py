@@ -0,0 +1,107 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+import torch
+
+from protenix.metrics.rmsd import (
+    align_pred_to_true,
+    segment_align_pred_to_true,
+    self_aligned_rmsd,
+)
+from protenix.utils.permutation.chain_permutation.utils import get_optimal_transform
+
+
+class TestSegmentAlign(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        torch.manual_seed(0)
+        # Groups of different sizes, a batch of 3 samples
+        self.segment_sizes = [5, 12, 3, 30, 8]
+        N_atom = sum(self.segment_sizes)
+        self.segment_ids = torch.repeat_interleave(
+            torch.arange(len(self.segment_sizes)), torch.tensor(self.segment_sizes)
+        )
+        self.true_pose = torch.randn(N_atom, 3, dtype=torch.float64) * 5
+        self.pred_pose = torch.randn(3, N_atom, 3, dtype=torch.float64) * 5
+        self.atom_mask = (torch.rand(N_atom) > 0.2).double()
+        # At least three resolved atoms per group
+        segment_ends = torch.cumsum(torch.tensor(self.segment_sizes), dim=0)
+        for offset in [1, 2, 3]:
+            self.atom_mask[segment_ends - offset] = 1
+        self.weight = torch.rand(3, N_atom, dtype=torch.float64)
+
+    def test_parity(self):
+        for allowing_reflection in [False, True]:
+            rot, translate, rmsd = segment_align_pred_to_true(
+                self.pred_pose,
+                self.true_pose,
+                self.segment_ids,
+                atom_mask=self.atom_mask,
+                weight=self.weight,
+                allowing_reflection=allowing_reflection,
+            )
+            _, _, unweighted_rmsd = segment_align_pred_to_true(
+                self.pred_pose,
+                self.true_pose,
+                self.segment_ids,
+                atom_mask=self.atom_mask,
+                allowing_reflection=allowing_reflection,
+            )
+            self.assertEqual(rot.shape, (3, len(self.segment_sizes), 3, 3))
+            self.assertEqual(translate.shape, (3, len(self.segment_sizes), 1, 3))
+            for k in range(len(self.segment_sizes)):
+                is_segment = self.segment_ids == k
+                _, expected_rot, expected_translate = align_pred_to_true(
+                    self.pred_pose[:, is_segment],
+                    self.true_pose[is_segment],
+                    atom_mask=self.atom_mask[is_segment],
+                    weight=self.weight[:, is_segment],
+                    allowing_reflection=allowing_reflection,
+                )
+                self.assertTrue(torch.allclose(rot[:, k], expected_rot))
+                self.assertTrue(torch.allclose(translate[:, k], expected_translate))
+
+                expected_rmsd, _, _, _ = self_aligned_rmsd(
+                    self.pred_pose[:, is_segment],
+                    self.true_pose[is_segment].expand(3, -1, -1),
+                    atom_mask=self.atom_mask[is_segment].expand(3, -1),
+                    reduce=False,
+                    allowing_reflection=allowing_reflection,
+                )
+                self.assertTrue(torch.allclose(unweighted_rmsd[:, k], expected_rmsd))
+
+    def test_optimal_transform(self):
+        rot, translate, _ = segment_align_pred_to_true(
+            self.pred_pose[0].float(),
+            self.true_pose.float(),
+            self.segment_ids,
+        )
+        for k in range(len(self.segment_sizes)):
+            is_segment = self.segment_ids == k
+            expected_rot, expected_translate = get_optimal_transform(
+                self.pred_pose[0, is_segment], self.true_pose[is_segment]
+            )
+            self.assertTrue(torch.allclose(rot[k], expected_rot, atol=1e-5))
+            self.assertTrue(torch.allclose(translate[k], expected_translate, atol=1e-4))
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+import time
+import unittest
+
+import numpy as np
+import torch
+from biotite.structure import Atom, array
+
+from protenix.data.constants import ELEMS, STD_RESIDUES
+from protenix.data.tokenizer import AtomArrayTokenizer, Token, TokenArray
+from protenix.utils.cropping import CropData
+
+
+def make_atom_array():
+    atoms = []
+    for res_id, res_name in [(1, "ALA"), (2, "GLY")]:
+        for atom_name, element in [("N", "N"), ("CA", "C"), ("C", "C"), ("O", "O")]:
+            atoms.append(
+                Atom(
+                    np.random.rand(3),
+                    chain_id="A",
+                    res_id=res_id,
+                    res_name=res_name,
+                    atom_name=atom_name,
+                    element=element,
+                )
+            )
+    for atom_name, element in [("C1", "C"), ("N1", "N"), ("O1", "O")]:
+        atoms.append(
+            Atom(
+                np.random.rand(3),
+                chain_id="B",
+                res_id=1,
+                res_name="LIG",
+                atom_name=atom_name,
+                element=element,
+            )
+        )
+    atom_array = array(atoms)
+    atom_array.set_annotation(
+        "mol_type", np.array(["protein"] * 8 + ["ligand"] * 3, dtype="U7")
+    )
+    centre_atom_mask = np.zeros(len(atom_array), dtype=int)
+    centre_atom_mask[[1, 5, 8, 9, 10]] = 1
+    atom_array.set_annotation("centre_atom_mask", centre_atom_mask)
+    return atom_array
+
+
+class TestTokenizer(unittest.TestCase):
+    def setUp(self):
+        self._start_time = time.time()
+        self.atom_array = make_atom_array()
+        self.token_array = AtomArrayTokenizer(self.atom_array).get_token_array()
+
+    def test_tokenize(self):
+        token_array = self.token_array
+        self.assertEqual(len(token_array), 5)
+        self.assertEqual(
+            token_array.get_values().tolist(),
+            [
+                STD_RESIDUES["ALA"],
+                STD_RESIDUES["GLY"],
+                ELEMS["C"],
+                ELEMS["N"],
+                ELEMS["O"],
+            ],
+        )
+        self.assertEqual(token_array.atom_offsets.tolist(), [0, 4, 8, 9, 10, 11])
+        self.assertEqual(
+            token_array.get_annotation("centre_atom_index").tolist(), [1, 5, 8, 9, 10]
+        )
+        token = token_array[1]
+        self.assertEqual(token.atom_indices, [4, 5, 6, 7])
+        self.assertEqual(token.atom_names, ["N", "CA", "C", "O"])
+        self.assertEqual(token.centre_atom_index, 5)
+        self.assertEqual(token_array.get_atom_to_token_index().tolist()[3:6], [0, 1, 1])
+
+    def test_select(self):
+        sub_array = self.token_array[[4, 1]]
+        self.assertEqual(sub_array.atom_offsets.tolist(), [0, 1, 5])
+        self.assertEqual(
+            sub_array.get_flat_annotation("atom_indices").tolist(), [10, 4, 5, 6, 7]
+        )
+        self.assertEqual(
+            sub_array.get_annotation("centre_atom_index").tolist(), [10, 5]
+        )
+
+        cropped_token_array, cropped_atom_array, _, _ = (
+            CropData.select_by_token_indices(
+                token_array=self.token_array,
+                atom_array=self.atom_array,
+                selected_token_indices=torch.tensor([4, 1]),
+            )
+        )
+        self.assertEqual(
+            cropped_token_array.get_flat_annotation("atom_indices").tolist(),
+            [0, 1, 2, 3, 4],
+        )
+        self.assertEqual(
+            cropped_token_array.get_annotation("centre_atom_index").tolist(), [0, 2]
+        )
+        self.assertTrue(
+            np.array_equal(cropped_atom_array.atom_name, ["O1", "N", "CA", "C", "O"])
+        )
+
+    def test_from_tokens(self):
+        tokens = [
+            Token(value, atom_indices=indices, centre_atom_index=indices[0])
+            for value, indices in [(1, [0, 1]), (2, [2]), (3, [3, 4, 5])]
+        ]
+        token_array = TokenArray(tokens)
+        self.assertEqual(token_array.atom_offsets.tolist(), [0, 2, 3, 6])
+        self.assertEqual(token_array[2].atom_indices, [3, 4, 5])
+
+        # Unpickle a TokenArray saved in the per-token layout
+        legacy_array = TokenArray.__new__(TokenArray)
+        legacy_array.__dict__["tokens"] = tokens
+        restored = pickle.loads(pickle.dumps(legacy_array))
+        self.assertEqual(restored.atom_offsets.tolist(), [0, 2, 3, 6])
+        self.assertEqual(restored.get_values().tolist(), [1, 2, 3])
+
+    def tearDown(self):
+        elapsed_time = time.time() - self._start_time
+        print(f"Test {self.id()} took {elapsed_time:.6f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()